@@ -1,30 +1,434 @@
-from flask import Flask, render_template, redirect, url_for, request, send_file
+from flask import (Flask, Response, abort, jsonify, render_template, redirect, url_for,
+                   request, send_file)
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+import hashlib
 import os
+import re
+import sys
+import time
+
+import auth
+import csv_export
+import csv_transcode
+import dataset
+import fault_injection
+import http_cache
+import manifest
+import metrics
+import zip_stream
 
 app = Flask(__name__)
 
+# 圧縮バリアントのディスクキャッシュ先 (未指定ならメモリのみ)
+variant_cache = http_cache.VariantCache(disk_dir=os.environ.get("IEMODE_DL_CACHE_DIR"))
+# ダウンロード対象ファイルのサイズ・行数・SHA-256 (ファイルの版ごとにキャッシュ)
+manifest_cache = manifest.ManifestCache()
+
+# 遅延・帯域制限・切断の注入 (IEMODE_DL_FAULTS / PUT /faults で設定。未設定なら何もしない)
+faults = fault_injection.from_environ().install(app)
+# ルートごとの応答時間・処理中の数・送信バイト数・ステータス件数 (GET /metrics。IEMODE_DL_METRICS=0 で無効)
+request_metrics = metrics.from_environ().install(app)
+# ログインの資格情報チェックとセッション (IEMODE_DL_USERS / IEMODE_DL_SESSION_TTL / IEMODE_DL_MAX_SESSIONS)
+authenticator = auth.from_environ()
+
+# CSV を utf-8 以外で配信するときの変換バッファ (バイト)
+TRANSCODE_BUFFER_SIZE = int(os.environ.get("IEMODE_DL_TRANSCODE_BUFFER",
+                                           csv_transcode.DEFAULT_BUFFER_SIZE))
+
+# 検索結果エクスポート (/download/csv/dataset) の SQLite データソース。
+# IEMODE_DL_DATASET_ROWS 未指定なら投入済みの内容を使う (未投入なら dataset.DEFAULT_ROWS 行を投入)
+dataset_source = dataset.Dataset(
+    os.environ.get("IEMODE_DL_DATASET_DB", os.path.join(app.instance_path, "dataset.sqlite3")),
+    rows=int(os.environ["IEMODE_DL_DATASET_ROWS"]) if os.environ.get("IEMODE_DL_DATASET_ROWS")
+    else None,
+)
+
+# マニフェストに載せる static 配下のファイル名 → 配信するエンドポイント
+DOWNLOAD_FILES = {"sample.csv": "download_csv"}
+
+# ZIP にまとめられるエントリー数の上限と、生成CSVのエントリー名 (generated_<rows>_<seed>.csv)
+BUNDLE_MAX_ENTRIES = 16
+_GENERATED_NAME_RE = re.compile(r"^generated_(\d+)_(\d+)\.csv$")
+
 
 @app.route("/")
 @app.route("/login", methods=["GET"])
 def login_page():
-    return render_template("login.html")
+    return _render_cached("login.html")
 
 
 @app.route("/login", methods=["POST"])
 def login_submit():
-    return redirect(url_for("download_page"))
+    """資格情報を確認してセッション Cookie を発行し、ダウンロードページへリダイレクトする"""
+    session_id = authenticator.login(request.form.get("userid"), request.form.get("password"))
+    if session_id is None:
+        return render_template("login.html",
+                               error="ユーザーIDまたはパスワードが正しくありません"), 401
+    return authenticator.set_cookie(redirect(url_for("download_page")), session_id)
 
 
 @app.route("/download")
+@authenticator.login_required(redirect_to_login=True)
 def download_page():
-    return render_template("download.html")
+    return _render_cached("download.html")
 
 
 @app.route("/download/csv")
+@authenticator.login_required()
 def download_csv():
+    """sample.csv を返す。?encoding=cp932 / utf-8-sig で変換しながら配信する (errors で変換方針)"""
+    csv_encoding, errors = _csv_encoding_args()
     csv_path = os.path.join(app.static_folder, "sample.csv")
-    return send_file(csv_path, as_attachment=True, download_name="sample.csv")
+    entry, hit = variant_cache.entry(csv_path)
+    if csv_transcode.is_passthrough(csv_encoding):
+        return _send_cached(entry, hit, "text/csv", download_name="sample.csv")
+    return _send_transcoded(
+        lambda: csv_transcode.iter_file(csv_path, TRANSCODE_BUFFER_SIZE),
+        length=entry.size, csv_encoding=csv_encoding, errors=errors,
+        etag=entry.etag, download_name="sample.csv", last_modified=entry.last_modified)
+
+
+@app.route("/manifest")
+def download_manifest():
+    """ダウンロード対象ファイルごとの name / url / size / rows / sha256 / mtime"""
+    files = []
+    for name, endpoint in DOWNLOAD_FILES.items():
+        entry = manifest_cache.file_entry(os.path.join(app.static_folder, name))
+        files.append(dict(entry, name=name, url=url_for(endpoint)))
+    return jsonify({"files": files})
+
+
+@app.route("/manifest/csv/generated")
+def generated_manifest():
+    """/download/csv/generated と同じ rows / seed / encoding で生成されるCSVの要約"""
+    rows = _int_arg("rows", 1000)
+    seed = _int_arg("seed", 0)
+    if not 0 <= rows <= csv_export.MAX_GENERATED_ROWS:
+        abort(400)
+    csv_encoding, _ = _csv_encoding_args()
+    entry = manifest_cache.generated_entry(rows, seed, csv_encoding)
+    params = {"rows": rows, "seed": seed}
+    if not csv_transcode.is_passthrough(csv_encoding):
+        params["encoding"] = csv_encoding
+    return jsonify(dict(entry, name=f"generated_{rows}_{seed}.csv",
+                        url=url_for("download_generated_csv", **params)))
+
+
+@app.route("/manifest/bundle")
+def bundle_manifest():
+    """/download/bundle と同じ entry / compression で配信されるZIPの各エントリーの要約"""
+    entries = []
+    for name, compression in _bundle_spec():
+        source = _bundle_source(name)
+        if source[0] == "static":
+            summary = manifest_cache.file_entry(source[1])
+        else:
+            summary = manifest_cache.generated_entry(source[1], source[2])
+        entries.append(dict(summary, name=name, compression=compression))
+    params = {"entry": request.args.getlist("entry")}
+    if "compression" in request.args:
+        params["compression"] = request.args["compression"]
+    return jsonify({"name": "bundle.zip", "url": url_for("download_bundle", **params),
+                    "entries": entries})
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    """ETag / 圧縮バリアントキャッシュのヒット・ミス数"""
+    return jsonify(variant_cache.stats())
+
+
+@app.route("/auth/stats")
+def auth_stats():
+    """資格情報の照合 (キャッシュヒット数) とセッション (有効数・期限切れ・追い出し) の件数"""
+    return jsonify(authenticator.stats())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """リクエスト計測を Prometheus テキスト形式で返す (このプロセス分)"""
+    if not request_metrics.enabled:
+        abort(404)
+    return Response(request_metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/faults", methods=["GET"])
+def get_faults():
+    """注入設定と適用回数 (このプロセス分)"""
+    return jsonify(faults.stats())
+
+
+@app.route("/faults", methods=["PUT", "DELETE"])
+def put_faults():
+    """注入設定を置き換える (DELETE は解除)。複数ワーカー時は受けたプロセスにだけ反映される"""
+    if request.method == "DELETE":
+        faults.configure([])
+    else:
+        try:
+            faults.configure(fault_injection.load_config(request.get_json(force=True)))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(faults.stats())
+
+
+def _render_cached(template_name):
+    """引数なしで描画できるテンプレートを版ごとにキャッシュして返す"""
+    path = os.path.join(app.root_path, app.template_folder, template_name)
+    faults.delay_render()
+    entry, hit = variant_cache.entry(
+        path, render=lambda: render_template(template_name).encode("utf-8"))
+    return _send_cached(entry, hit, "text/html")
+
+
+def _negotiate_encoding(entry):
+    """Accept-Encoding から配信するエンコーディングを決める"""
+    # Range 指定時は元のバイト列に対するオフセットとして扱うため圧縮しない
+    if "Range" in request.headers or not variant_cache.can_compress(entry):
+        return "identity"
+    best = request.accept_encodings.best_match(http_cache.available_encodings())
+    return best or "identity"
+
+
+def _send_cached(entry, hit, mimetype, download_name=None):
+    """
+    CacheEntry を ETag / Last-Modified 付きで返す (304 / Range 対応)
+
+    クライアントが gzip / br を受け付ける場合は圧縮済みバリアントを返す。
+    X-Cache ヘッダーにキャッシュヒット (HIT) / ミス (MISS) を出す。
+    """
+    encoding = _negotiate_encoding(entry)
+    if encoding == "identity" and entry.body is None:
+        # conditional=True で Range / If-Range / 304 を Werkzeug に処理させる
+        response = send_file(entry.path, mimetype=mimetype,
+                             as_attachment=download_name is not None,
+                             download_name=download_name, conditional=True,
+                             etag=entry.etag, last_modified=entry.last_modified)
+    else:
+        if encoding == "identity":
+            body = entry.body
+        else:
+            body, hit = variant_cache.variant(entry, encoding)
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(entry.variant_etag(encoding))
+        response.last_modified = entry.last_modified
+        response.cache_control.no_cache = True
+        if encoding != "identity":
+            response.content_encoding = encoding
+        if download_name is not None:
+            response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+        response = response.make_conditional(
+            request, accept_ranges=encoding == "identity", complete_length=len(body))
+    response.vary.add("Accept-Encoding")
+    response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return response
+
+
+def _csv_encoding_args():
+    """クエリパラメータ encoding / errors を検証して返す。未対応の値は 400 を返す"""
+    csv_encoding = request.args.get("encoding", csv_transcode.SOURCE_ENCODING).lower()
+    errors = request.args.get("errors", csv_transcode.DEFAULT_ERRORS)
+    if csv_encoding not in csv_transcode.ENCODINGS or errors not in csv_transcode.ERROR_POLICIES:
+        abort(400)
+    return csv_encoding, errors
+
+
+def _send_transcoded(source, length, csv_encoding, errors, etag, download_name,
+                     last_modified=None):
+    """
+    UTF-8 の本文 source() を csv_encoding に変換しながら返す (utf-8 なら素通し)
+
+    変換後のバイト位置は元と対応しないため Range・圧縮には対応しない (常に全体を 200 で返す)。
+    変換後のサイズが事前に分からない場合 (cp932、length=None) は
+    Content-Length を付けずにチャンク転送する。
+    """
+    etag = f"{etag}-{csv_encoding}-{errors}"
+    charset = csv_transcode.CHARSETS[csv_encoding]
+    response = Response(content_type=f"text/csv; charset={charset}")
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.accept_ranges = "none"
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    response.response = csv_transcode.transcode(source(), csv_encoding, errors,
+                                                TRANSCODE_BUFFER_SIZE)
+    encoded_length = csv_transcode.encoded_length(csv_encoding, length)
+    if encoded_length is not None:
+        response.content_length = encoded_length
+    return response
+
+
+def _int_arg(name, default):
+    """クエリパラメータを整数で取得する。不正な値は 400 を返す"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+@app.route("/download/csv/generated")
+def download_generated_csv():
+    """rows 行の決定的なCSVをその場で生成してストリーミング配信する (負荷試験用)"""
+    rows = _int_arg("rows", 1000)
+    seed = _int_arg("seed", 0)
+    if not 0 <= rows <= csv_export.MAX_GENERATED_ROWS:
+        abort(400)
+    csv_encoding, errors = _csv_encoding_args()
+    if not csv_transcode.is_passthrough(csv_encoding):
+        return _send_transcoded(
+            lambda: csv_export.generate_csv(rows, seed),
+            length=csv_export.generated_csv_length(rows), csv_encoding=csv_encoding,
+            errors=errors, etag=f"gen-{rows}-{seed}-r{csv_export.ROWS_PER_BLOCK}",
+            download_name=f"generated_{rows}_{seed}.csv")
+
+    return _send_ranged_stream(
+        lambda start, end: csv_export.generate_csv(rows, seed, start, end),
+        length=csv_export.generated_csv_length(rows),
+        etag=f"gen-{rows}-{seed}-r{csv_export.ROWS_PER_BLOCK}",
+        download_name=f"generated_{rows}_{seed}.csv",
+    )
+
+
+@app.route("/download/csv/dataset")
+def download_dataset_csv():
+    """
+    SQLite の社員テーブルを検索してCSVでストリーミング配信する (実システムのエクスポート相当)
+
+    department で部署を絞り込み (索引を使う)、limit で件数を制限する。
+    encoding / errors は /download/csv と同じ。件数は事前に分からないためチャンク転送する。
+    """
+    department = request.args.get("department") or None
+    limit = _int_arg("limit", None)
+    if limit is not None and limit < 0:
+        abort(400)
+    csv_encoding, errors = _csv_encoding_args()
+    dataset_source.ensure_seeded()
+    query_key = hashlib.sha256(f"{department}\0{limit}".encode("utf-8")).hexdigest()[:16]
+    return _send_transcoded(
+        lambda: dataset_source.export(department, limit),
+        length=None, csv_encoding=csv_encoding, errors=errors,
+        etag=f"{dataset_source.etag}-{query_key}", download_name="export.csv")
+
+
+@app.route("/download/bundle")
+@authenticator.login_required()
+def download_bundle():
+    """
+    複数のCSVを1つのZIPにまとめてストリーミング配信する (確認・保存ダイアログを1回で済ませる)
+
+    ?entry=<名前>[:store|deflate] を繰り返し指定する。名前は DOWNLOAD_FILES のファイル名か
+    generated_<rows>_<seed>.csv。圧縮方式を省略したエントリーは ?compression= (既定 deflate)。
+    圧縮後のサイズは事前に分からないため、Content-Length を付けずにチャンク転送する。
+    """
+    entries = []
+    versions = []
+    for name, compression in _bundle_spec():
+        source = _bundle_source(name)
+        if source[0] == "static":
+            path = source[1]
+            version = http_cache.file_version(path)
+            versions.append(version)
+            entries.append(zip_stream.BundleEntry(
+                name, lambda path=path: csv_transcode.iter_file(path), compression,
+                size=version[1], date_time=time.localtime(version[0] / 1e9)[:6]))
+        else:
+            rows, seed = source[1], source[2]
+            entries.append(zip_stream.BundleEntry(
+                name, lambda rows=rows, seed=seed: csv_export.generate_csv(rows, seed),
+                compression, size=csv_export.generated_csv_length(rows)))
+
+    # 出力は指定と元ファイルの版で決まる (生成CSVと圧縮結果は決定的)
+    key = repr(([(e.name, e.compression) for e in entries], versions,
+                csv_export.ROWS_PER_BLOCK))
+    etag = f"bundle-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}"
+    response = Response(mimetype="application/zip")
+    response.set_etag(etag)
+    response.accept_ranges = "none"
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    response.headers["Content-Disposition"] = "attachment; filename=bundle.zip"
+    response.response = zip_stream.iter_zip(entries)
+    return response
+
+
+def _bundle_spec():
+    """?entry= / ?compression= を [(エントリー名, 圧縮方式), ...] にする。不正な指定は 400"""
+    default = request.args.get("compression", zip_stream.DEFAULT_COMPRESSION)
+    values = request.args.getlist("entry")
+    if not 0 < len(values) <= BUNDLE_MAX_ENTRIES or default not in zip_stream.COMPRESSIONS:
+        abort(400)
+    spec = []
+    for value in values:
+        name, _, compression = value.partition(":")
+        compression = compression or default
+        if compression not in zip_stream.COMPRESSIONS:
+            abort(400)
+        spec.append((name, compression))
+    if len({name for name, _ in spec}) != len(spec):
+        abort(400)
+    return spec
+
+
+def _bundle_source(name):
+    """エントリー名 → ("static", パス) / ("generated", rows, seed)。該当しなければ 404"""
+    if name in DOWNLOAD_FILES:
+        return "static", os.path.join(app.static_folder, name)
+    m = _GENERATED_NAME_RE.match(name)
+    if m is None:
+        abort(404)
+    rows, seed = int(m.group(1)), int(m.group(2))
+    if rows > csv_export.MAX_GENERATED_ROWS:
+        abort(400)
+    return "generated", rows, seed
+
+
+def _send_ranged_stream(body_at, length, etag, download_name, mimetype="text/csv"):
+    """
+    任意のバイト位置から生成できるストリームを Range 対応で返す
+
+    body_at(start, end) は [start, end) のバイト列を返すイテラブル。
+    send_file と同じく単一 Range のみ対応し、複数 Range は 416 で拒否する。
+    If-Range が現在の ETag と一致しない場合は全体を 200 で返す。
+    """
+    response = Response(mimetype=mimetype)
+    response.set_etag(etag)
+    response.accept_ranges = "bytes"
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+
+    start, end = 0, length
+    if "Range" in request.headers and length and _if_range_matches(etag):
+        parsed = request.range
+        range_tuple = parsed.range_for_length(length) if parsed else None
+        if range_tuple is None:
+            raise RequestedRangeNotSatisfiable(length)
+        start, end = range_tuple
+        response.status_code = 206
+        response.content_range = ContentRange("bytes", start, end, length)
+
+    response.response = body_at(start, end)
+    response.content_length = end - start
+    return response
+
+
+def _if_range_matches(etag):
+    """If-Range が無い、または強い ETag が一致する場合に True"""
+    if "If-Range" not in request.headers:
+        return True
+    if_range = request.if_range
+    # 生成データには Last-Modified が無いので日付指定は常に不一致として扱う
+    return if_range.etag is not None and if_range.etag == etag
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # 開発サーバー (単一プロセス)。複数ワーカーでの配信は serve.py を使う
+    app.run(host="0.0.0.0", port=5000, debug="--debug" in sys.argv[1:])
@@ -0,0 +1,354 @@
+"""
+ログインの資格情報チェックとセッション管理 (実システムと同じく認証・セッション参照の負荷を含めるため)
+
+- UserStore    : ユーザーID → パスワードハッシュ (PBKDF2-SHA256)。一度照合に成功した
+                 (ユーザーID, パスワード) は HMAC の値だけを件数上限付きの LRU に覚えておき、
+                 次回からは PBKDF2 を計算しない (負荷試験で同じユーザーが何度もログインするため)。
+                 パスワードそのものは保持しない。照合に失敗した組み合わせは覚えない。
+- SessionStore : セッションID → ユーザーID。有効期限 (発行から ttl 秒。参照しても延びない) と
+                 件数上限を持ち、上限を超えたら最も長く使われていないものから捨てる (LRU)。
+                 セッションIDにはユーザーID・発行時刻と署名 (HMAC) を含め、自分の保管場所に無い
+                 ID でも署名が正しく発行から ttl 秒以内なら取り込む (gunicorn の別ワーカーが
+                 発行したセッションを受け付けるため。署名の鍵は fork 前に作るので全ワーカーで同じ)。
+                 期限は発行時刻だけで決まるので、どのワーカーが応答しても同じ時刻に失効する。
+                 上限で追い出した ID は覚えておき、取り込み直さない。
+- Authenticator: Flask への組み込み (ログイン処理・セッション Cookie・login_required)
+
+ユーザーは環境変数 IEMODE_DL_USERS (JSON 文字列または JSON ファイルのパス。
+{"ユーザーID": "パスワード" または "pbkdf2_sha256$回数$salt$hash"}) で指定する。
+未指定なら自動実行スクリプトと同じ testuser / testpass だけを登録する。
+セッションはプロセスごとのメモリに持つ。ワーカーを fork せずに別々に起動する場合
+(gunicorn app:app で --preload なし等) は IEMODE_DL_SESSION_SECRET で署名の鍵を揃えること。
+"""
+
+import base64
+import collections
+import functools
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 200_000
+DEFAULT_USERS = {"testuser": "testpass"}
+DEFAULT_VERIFIED_CACHE_SIZE = 10_000
+
+DEFAULT_SESSION_TTL_SEC = 30 * 60
+DEFAULT_MAX_SESSIONS = 100_000
+SESSION_COOKIE = "iemode_dl_session"
+
+USERS_ENV_VAR = "IEMODE_DL_USERS"
+SESSION_TTL_ENV_VAR = "IEMODE_DL_SESSION_TTL"
+MAX_SESSIONS_ENV_VAR = "IEMODE_DL_MAX_SESSIONS"
+SESSION_SECRET_ENV_VAR = "IEMODE_DL_SESSION_SECRET"
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS, salt=None):
+    """"pbkdf2_sha256$回数$salt$hash" 形式のハッシュを返す"""
+    salt = secrets.token_hex(16) if salt is None else salt
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"),
+                                 iterations)
+    return f"{HASH_ALGORITHM}${iterations}${salt}${digest.hex()}"
+
+
+def check_password(encoded, password):
+    """
+    hash_password の値と password が一致するか (PBKDF2 を計算する)
+
+    encoded の形式が壊れている場合も (例外にせず) False を返す。
+    """
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+        iterations = int(iterations)
+        salt = salt.encode("ascii")
+        expected = expected.encode("ascii")
+    except ValueError:
+        return False
+    if algorithm != HASH_ALGORITHM or iterations <= 0:
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return hmac.compare_digest(digest.hex().encode("ascii"), expected)
+
+
+class UserStore:
+    """ユーザーID → パスワードハッシュ。照合に成功した組み合わせを HMAC で覚えておく"""
+
+    def __init__(self, users=None, iterations=DEFAULT_ITERATIONS,
+                 verified_cache_size=DEFAULT_VERIFIED_CACHE_SIZE):
+        self.iterations = iterations
+        self.verified_cache_size = verified_cache_size
+        self._lock = threading.Lock()
+        self._hashes = {}
+        # プロセスごとの鍵。覚えておく値から元のパスワードを総当たりで探せないようにする
+        self._cache_key = secrets.token_bytes(32)
+        self._verified = collections.OrderedDict()
+        self.counts = {"verified": 0, "cache_hits": 0, "failures": 0}
+        for user_id, password in (users or {}).items():
+            self.add(user_id, password)
+
+    def add(self, user_id, password):
+        """ユーザーを登録する (password は平文か hash_password の値)"""
+        encoded = (password if password.startswith(f"{HASH_ALGORITHM}$")
+                   else hash_password(password, self.iterations))
+        with self._lock:
+            self._hashes[user_id] = encoded
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _token(self, user_id, password, encoded):
+        # ハッシュ (salt を含む) も入れて、パスワード変更後に古い組み合わせが通らないようにする
+        message = "\0".join((user_id, password, encoded)).encode("utf-8")
+        return hmac.new(self._cache_key, message, hashlib.sha256).digest()
+
+    def verify(self, user_id, password):
+        """user_id / password が正しければ True"""
+        encoded = self._hashes.get(user_id)
+        if encoded is None:
+            with self._lock:
+                self.counts["failures"] += 1
+            return False
+        token = self._token(user_id, password, encoded)
+        with self._lock:
+            if self._verified.get(user_id) == token:
+                self._verified.move_to_end(user_id)
+                self.counts["cache_hits"] += 1
+                return True
+        if not check_password(encoded, password):
+            with self._lock:
+                self.counts["failures"] += 1
+            return False
+        with self._lock:
+            self.counts["verified"] += 1
+            self._verified[user_id] = token
+            self._verified.move_to_end(user_id)
+            while len(self._verified) > self.verified_cache_size:
+                self._verified.popitem(last=False)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, users=len(self._hashes), verified_cached=len(self._verified))
+
+
+class _Session:
+    __slots__ = ("user_id", "expires")
+
+    def __init__(self, user_id, expires):
+        self.user_id = user_id
+        self.expires = expires
+
+
+class SessionStore:
+    """
+    有効期限 (発行から ttl 秒) と LRU の件数上限を持つセッションの保管場所
+
+    時刻は clock (既定は time.time) で測る。発行時刻をセッションIDに入れて他のワーカーと
+    共有するので、単調時計ではなく実時刻を使う。
+    """
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL_SEC, max_sessions=DEFAULT_MAX_SESSIONS,
+                 secret=None, clock=time.time):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._secret = secret or secrets.token_bytes(32)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        # 上限で追い出した ID → 失効時刻 (失効までは取り込み直さない。最大 max_sessions 件)
+        self._evicted = collections.OrderedDict()
+        self._next_sweep = 0.0
+        self.counts = {"created": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0,
+                       "adopted": 0, "rejected": 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _sign(self, payload):
+        digest = hmac.new(self._secret, payload.encode("ascii"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:18]).decode("ascii")  # 24文字 (パディングなし)
+
+    def _new_id(self, user_id, issued):
+        """"<乱数>.<発行時刻>.<ユーザーID (base64)>.<署名>" 形式のセッションID"""
+        encoded_user = base64.urlsafe_b64encode(user_id.encode("utf-8")).decode("ascii")
+        encoded_user = encoded_user.rstrip("=")
+        payload = f"{secrets.token_urlsafe(24)}.{int(issued)}.{encoded_user}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def _verified_user(self, session_id, now):
+        """
+        別ワーカーが発行した session_id の署名と発行時刻を確かめ、(ユーザーID, 失効時刻) を返す
+
+        無効なら None。
+        """
+        try:
+            payload, signature = session_id.rsplit(".", 1)
+            _, issued, encoded_user = payload.split(".")
+            if not hmac.compare_digest(self._sign(payload), signature):
+                return None
+            expires = int(issued) + self.ttl
+            if expires <= now:
+                return None
+            padded = encoded_user + "=" * (-len(encoded_user) % 4)
+            return base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"), expires
+        except (ValueError, UnicodeError):
+            return None
+
+    def _insert(self, session_id, user_id, expires, now):
+        self._purge_expired(now)
+        self._sessions[session_id] = _Session(user_id, expires)
+        while len(self._sessions) > self.max_sessions:
+            evicted_id, evicted = self._sessions.popitem(last=False)
+            self.counts["evicted"] += 1
+            self._evicted[evicted_id] = evicted.expires
+            if len(self._evicted) > self.max_sessions:
+                self._evicted.popitem(last=False)
+
+    def _purge_expired(self, now):
+        """
+        期限切れのセッションと、失効した追い出し済み ID の記録を捨てる
+
+        LRU の順 (先頭ほど使われていない) は期限順と一致しないので、先頭から期限切れを
+        捨てるのに加えて、ttl ごとに (最大 60 秒ごとに) 全件を調べる。
+        """
+        sessions = self._sessions
+        while sessions:
+            session_id, session = next(iter(sessions.items()))
+            if session.expires > now:
+                break
+            del sessions[session_id]
+            self.counts["expired"] += 1
+        evicted = self._evicted
+        while evicted and next(iter(evicted.values())) <= now:
+            evicted.popitem(last=False)
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + min(self.ttl, 60)
+        for session_id in [k for k, v in sessions.items() if v.expires <= now]:
+            del sessions[session_id]
+            self.counts["expired"] += 1
+        for session_id in [k for k, v in evicted.items() if v <= now]:
+            del evicted[session_id]
+
+    def create(self, user_id):
+        """新しいセッションを作ってセッションIDを返す"""
+        now = self._clock()
+        session_id = self._new_id(user_id, now)
+        with self._lock:
+            self._insert(session_id, user_id, int(now) + self.ttl, now)
+            self.counts["created"] += 1
+        return session_id
+
+    def get(self, session_id):
+        """有効なセッションのユーザーIDを返す (期限は延ばさない)。無効なら None"""
+        if not session_id:
+            return None
+        now = self._clock()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if session.expires <= now:
+                    del self._sessions[session_id]
+                    self.counts["expired"] += 1
+                    self.counts["misses"] += 1
+                    return None
+                self._sessions.move_to_end(session_id)
+                self.counts["hits"] += 1
+                return session.user_id
+            if session_id in self._evicted:
+                self.counts["rejected"] += 1
+                self.counts["misses"] += 1
+                return None
+        # 保管場所に無い ID は署名を確かめて取り込む (HMAC の計算はロックの外で行う)
+        verified = self._verified_user(session_id, now)
+        with self._lock:
+            if verified is None or session_id in self._evicted:
+                self.counts["misses"] += 1
+                return None
+            user_id, expires = verified
+            self._insert(session_id, user_id, expires, now)
+            self.counts["adopted"] += 1
+            self.counts["hits"] += 1
+        return user_id
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, active=len(self._sessions), max_sessions=self.max_sessions,
+                        ttl=self.ttl)
+
+
+class Authenticator:
+    """UserStore / SessionStore を Flask から使う"""
+
+    def __init__(self, users, sessions):
+        self.users = users
+        self.sessions = sessions
+
+    def login(self, user_id, password):
+        """資格情報が正しければ新しいセッションIDを返す。誤りなら None"""
+        if not user_id or not self.users.verify(user_id, password or ""):
+            return None
+        return self.sessions.create(user_id)
+
+    def set_cookie(self, response, session_id):
+        response.set_cookie(SESSION_COOKIE, session_id, max_age=int(self.sessions.ttl),
+                            httponly=True, samesite="Lax")
+        return response
+
+    def current_user(self):
+        """要求の Cookie のセッションのユーザーID (無効なら None)"""
+        from flask import request
+        return self.sessions.get(request.cookies.get(SESSION_COOKIE))
+
+    def login_required(self, redirect_to_login=False):
+        """
+        有効なセッションが無い要求を拒否するデコレーター
+
+        redirect_to_login=True ならログインページへリダイレクトし (画面用)、
+        False なら 401 を返す (ダウンロード用。保存ダイアログにエラーページを保存させないため)。
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import abort, redirect, url_for
+                if self.current_user() is None:
+                    if redirect_to_login:
+                        return redirect(url_for("login_page"))
+                    abort(401)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {"users": self.users.stats(), "sessions": self.sessions.stats()}
+
+
+def load_users(source):
+    """JSON 文字列・JSON ファイルのパス・dict から {ユーザーID: パスワードまたはハッシュ} を作る"""
+    if isinstance(source, str):
+        if os.path.exists(source):
+            with open(source, encoding="utf-8") as f:
+                source = json.load(f)
+        else:
+            source = json.loads(source)
+    if not isinstance(source, dict):
+        raise ValueError("ユーザーは {\"ユーザーID\": \"パスワード\"} 形式で指定してください")
+    return {str(k): str(v) for k, v in source.items()}
+
+
+def from_environ():
+    """環境変数 (IEMODE_DL_USERS / IEMODE_DL_SESSION_TTL / IEMODE_DL_MAX_SESSIONS /
+    IEMODE_DL_SESSION_SECRET) から作る"""
+    source = os.environ.get(USERS_ENV_VAR)
+    users = UserStore(load_users(source) if source else DEFAULT_USERS)
+    secret = os.environ.get(SESSION_SECRET_ENV_VAR)
+    sessions = SessionStore(
+        ttl=float(os.environ.get(SESSION_TTL_ENV_VAR, DEFAULT_SESSION_TTL_SEC)),
+        max_sessions=int(os.environ.get(MAX_SESSIONS_ENV_VAR, DEFAULT_MAX_SESSIONS)),
+        secret=secret.encode("utf-8") if secret else None,
+    )
+    return Authenticator(users, sessions)
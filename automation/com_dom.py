@@ -0,0 +1,300 @@
+"""
+IWebBrowser2 (COM) の HTML ドキュメントに対する要素検索
+
+COM 経由の DOM 操作はプロパティ参照・メソッド呼び出しの1回ごとにプロセス間の往復になる。
+getElementsByTagName → length → item(i) → getAttribute("href") のようにリンクを1件ずつ
+調べると、リンクが数千件あるページでは数千回の往復になるため、ロケーターを CSS セレクタに
+変換して querySelector / querySelectorAll で1回の呼び出しで解決する。
+
+ロケーターは Selenium と同じ (strategy, value) のタプル (例: ("class name", "txtUserID"))。
+querySelector を持たない古いドキュメントモード (IE7 以前) では、単純なセレクタに限り
+getElementsByTagName で列挙して照合するフォールバックに切り替える。
+
+FakeComDocument は COM 呼び出しの回数を数える疑似ドキュメントで、往復回数の削減を
+Linux 上で確認できる。
+"""
+
+import re
+
+# Selenium の By と同じ文字列
+CLASS_NAME = "class name"
+CSS_SELECTOR = "css selector"
+ID = "id"
+NAME = "name"
+TAG_NAME = "tag name"
+
+_CSS_IDENT_RE = re.compile(r"^-?[A-Za-z_][\w-]*$")
+
+
+def locator_to_css(locator):
+    """(strategy, value) のロケーターを CSS セレクタに変換する"""
+    strategy, value = locator
+    if strategy == CSS_SELECTOR:
+        return value
+    if strategy == TAG_NAME:
+        return value
+    if strategy in (CLASS_NAME, ID):
+        if not _CSS_IDENT_RE.match(value):
+            raise ValueError(f"CSS の識別子として使えない値です: {locator}")
+        return ("." if strategy == CLASS_NAME else "#") + value
+    if strategy == NAME:
+        return f"[name=\"{value}\"]"
+    raise ValueError(f"未対応のロケーター: {locator}")
+
+
+class SimpleSelector:
+    """
+    tag / .class / #id / [attr] / [attr=v] / [attr*=v] / [attr^=v] / [attr$=v] を
+    組み合わせた1要素分の CSS セレクタ (フォールバック照合用)
+    """
+
+    _TOKEN_RE = re.compile(
+        r"(?P<tag>^[A-Za-z][\w-]*|^\*)"
+        r"|\.(?P<cls>[\w-]+)"
+        r"|#(?P<id>[\w-]+)"
+        r"|\[(?P<attr>[\w-]+)\s*(?:(?P<op>[*^$]?=)\s*(?P<q>['\"]?)(?P<val>.*?)(?P=q))?\s*\]")
+
+    def __init__(self, css):
+        self.css = css
+        self.tag = None
+        self.conditions = []
+        pos = 0
+        css = css.strip()
+        while pos < len(css):
+            m = self._TOKEN_RE.match(css, pos)
+            if m is None or m.end() == pos:
+                raise ValueError(f"フォールバックで扱えないセレクタです: {self.css}")
+            if m.group("tag"):
+                self.tag = None if m.group("tag") == "*" else m.group("tag").lower()
+            elif m.group("cls"):
+                self.conditions.append(("className", "~=", m.group("cls")))
+            elif m.group("id"):
+                self.conditions.append(("id", "=", m.group("id")))
+            else:
+                self.conditions.append((m.group("attr"), m.group("op"), m.group("val")))
+            pos = m.end()
+
+    def attributes(self):
+        """照合に必要な属性名 (重複なし・出現順)"""
+        return list(dict.fromkeys(name for name, _, _ in self.conditions))
+
+    def matches(self, attrs):
+        """attrs: 属性名 → 値 (無ければ None) の dict"""
+        for name, op, expected in self.conditions:
+            actual = attrs.get(name)
+            if actual is None:
+                return False
+            actual = str(actual)
+            if op is None:
+                continue
+            if op == "=" and actual != expected:
+                return False
+            if op == "~=" and expected not in actual.split():
+                return False
+            if op == "*=" and expected not in actual:
+                return False
+            if op == "^=" and not actual.startswith(expected):
+                return False
+            if op == "$=" and not actual.endswith(expected):
+                return False
+        return True
+
+
+class _Found:
+    """querySelector の結果 (要素が無い場合の None と「API が無い」を区別する)"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class DomQuery:
+    """
+    ロケーターで要素を探す (COM の往復回数を最小にする)
+
+    com_calls はこのクラスが行った COM 呼び出しの回数 (ログ・比較用)。
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.com_calls = 0
+        self._selectors_api = None
+
+    def _select(self, method, css):
+        """
+        querySelector / querySelectorAll を呼ぶ。使えないドキュメントなら None を返す
+
+        最初の呼び出しが失敗したときだけ「使えない」とみなし、以後はフォールバックする。
+        """
+        if self._selectors_api is False:
+            return None
+        self.com_calls += 1
+        try:
+            result = getattr(self.document, method)(css)
+        except Exception:
+            if self._selectors_api:
+                raise
+            self._selectors_api = False
+            return None
+        self._selectors_api = True
+        return _Found(result)
+
+    def find(self, locator):
+        """最初に一致した要素を返す (無ければ None)"""
+        css = locator_to_css(locator)
+        found = self._select("querySelector", css)
+        if found is not None:
+            return found.value
+        for element in self._scan(css, limit=1):
+            return element
+        return None
+
+    def find_all(self, locator):
+        """一致したすべての要素のリストを返す"""
+        css = locator_to_css(locator)
+        found = self._select("querySelectorAll", css)
+        if found is None:
+            return list(self._scan(css))
+        nodes = found.value
+        self.com_calls += 1
+        count = nodes.length
+        self.com_calls += count
+        return [nodes.item(i) for i in range(count)]
+
+    def find_each(self, *locators):
+        """ロケーターごとに最初の要素を返す (ロケーター1つにつき COM 呼び出し1回)"""
+        return [self.find(locator) for locator in locators]
+
+    def _scan(self, css, limit=None):
+        """querySelector が無い場合のフォールバック。タグで絞り込んでから属性を照合する"""
+        selector = SimpleSelector(css)
+        names = selector.attributes()
+        self.com_calls += 2
+        nodes = self.document.getElementsByTagName(selector.tag or "*")
+        count = nodes.length
+        found = 0
+        for i in range(count):
+            self.com_calls += 1
+            element = nodes.item(i)
+            attrs = {}
+            for name in names:
+                self.com_calls += 1
+                attrs[name] = _read_attribute(element, name)
+            if selector.matches(attrs):
+                yield element
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+
+def _read_attribute(element, name):
+    # className / id は DOM プロパティで取る (古い IE の getAttribute("class") は null を返す)
+    if name in ("className", "id"):
+        return getattr(element, name, None) or None
+    return element.getAttribute(name)
+
+
+# ===== テスト用の疑似 COM ドキュメント =====
+class FakeComElement:
+    """HTML 要素もどき。属性参照・メソッド呼び出しのたびに document.calls を数える"""
+
+    def __init__(self, document, tag, **attrs):
+        object.__setattr__(self, "_document", document)
+        object.__setattr__(self, "tagName", tag.upper())
+        object.__setattr__(self, "_attrs", dict(attrs))
+        object.__setattr__(self, "clicked", 0)
+
+    def _call(self):
+        self._document.calls += 1
+
+    def getAttribute(self, name):
+        self._call()
+        return self._attrs.get(name)
+
+    def click(self):
+        self._call()
+        object.__setattr__(self, "clicked", self.clicked + 1)
+
+    def __getattr__(self, name):
+        attrs = object.__getattribute__(self, "_attrs")
+        if name in ("className", "id", "value", "href", "name"):
+            self._call()
+            key = "class" if name == "className" else name
+            return attrs.get(key, "")
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self._call()
+        key = "class" if name == "className" else name
+        self._attrs[key] = value
+
+    def _plain_attrs(self):
+        attrs = dict(self._attrs)
+        if "class" in attrs:
+            attrs["className"] = attrs["class"]
+        return attrs
+
+
+class _FakeCollection:
+    def __init__(self, document, elements):
+        self._document = document
+        self._elements = elements
+
+    @property
+    def length(self):
+        self._document.calls += 1
+        return len(self._elements)
+
+    def item(self, index):
+        self._document.calls += 1
+        return self._elements[index]
+
+
+class FakeComDocument:
+    """
+    HTMLDocument もどき
+
+    calls に COM 呼び出し回数を数える。selectors_api=False で querySelector を持たない
+    古いドキュメントモードを再現する。
+    """
+
+    def __init__(self, selectors_api=True):
+        self.calls = 0
+        self.selectors_api = selectors_api
+        self.elements = []
+
+    def add(self, tag, **attrs):
+        element = FakeComElement(self, tag, **attrs)
+        self.elements.append(element)
+        return element
+
+    def _select(self, css):
+        selector = SimpleSelector(css)
+        return [e for e in self.elements
+                if (selector.tag is None or e.tagName.lower() == selector.tag)
+                and selector.matches(e._plain_attrs())]
+
+    def _require_selectors(self):
+        if not self.selectors_api:
+            raise AttributeError("querySelector")
+
+    def querySelector(self, css):
+        self._require_selectors()
+        self.calls += 1
+        found = self._select(css)
+        return found[0] if found else None
+
+    def querySelectorAll(self, css):
+        self._require_selectors()
+        self.calls += 1
+        return _FakeCollection(self, self._select(css))
+
+    def getElementsByTagName(self, tag):
+        self.calls += 1
+        tag = tag.lower()
+        return _FakeCollection(self, [e for e in self.elements
+                                      if tag == "*" or e.tagName.lower() == tag])
+
+    def getElementsByClassName(self, name):
+        self.calls += 1
+        return _FakeCollection(self, [e for e in self.elements
+                                      if name in e._attrs.get("class", "").split()])
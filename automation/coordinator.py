@@ -0,0 +1,421 @@
+"""
+シナリオ実行ジョブのコーディネーター (複数の Windows ホストへの配布用)
+
+ジョブ (ランナー種別・接続先・認証情報・期待するファイル) をキューに積み、
+各ホストのワーカーエージェント (worker_agent.py) が HTTP でリースして実行する。
+
+- リース     : ワーカーは lease_sec 秒の期限付きでジョブを借り、heartbeat で期限を延ばす
+- 再試行     : 期限までに heartbeat / 完了報告が無いジョブ (ワーカー喪失) は
+               max_attempts 回までキューに戻す。古いリースからの報告は 409 で拒否する
+- 公平性     : キュー名 (投入元) ごとにラウンドロビンで払い出すので、
+               大量投入されたキューが他のキューを待たせ続けない
+- 成果物     : 実行結果 (status / timings) と保存ファイルなどを受け取り artifact_dir に置く
+
+API (JSON):
+    POST /jobs                       ジョブ投入 {"jobs": [{"runner", "params", "expected", "queue"}]}
+    GET  /jobs[?state=]              ジョブ一覧
+    GET  /jobs/<id>                  ジョブ詳細
+    POST /lease                      {"worker", "runners", "wait"} → 200 ジョブ / 204 なし
+    POST /jobs/<id>/heartbeat        {"lease_id", "progress"}
+    PUT  /jobs/<id>/artifacts/<name>?lease_id=...   (本文がそのまま成果物)
+    POST /jobs/<id>/complete         {"lease_id", "result"}
+    GET  /stats                      キュー・ワーカーごとの集計
+
+使い方:
+    python automation/coordinator.py --bind 0.0.0.0:8500 --lease-sec 30
+"""
+
+import argparse
+import collections
+import itertools
+import os
+import re
+import threading
+import time
+import uuid
+
+from flask import Flask, abort, jsonify, request
+
+import wait_engine
+
+DEFAULT_BIND = "0.0.0.0:8500"
+DEFAULT_LEASE_SEC = 30
+DEFAULT_MAX_ATTEMPTS = 3
+MAX_LEASE_WAIT_SEC = 30
+DEFAULT_QUEUE = "default"
+
+# 成果物名はファイル名として安全なものだけ受け付ける
+_ARTIFACT_NAME_RE = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+
+
+class LeaseError(Exception):
+    """リースが存在しない・期限切れ・別のワーカーに渡り済み"""
+
+
+class JobNotFound(LookupError):
+    """指定した ID のジョブが無い"""
+
+
+class Job:
+    """ジョブ1件分の状態"""
+
+    def __init__(self, seq, runner, params, expected, queue, max_attempts):
+        self.seq = seq
+        self.id = f"job-{seq:06d}"
+        self.runner = runner
+        self.params = dict(params or {})
+        self.expected = dict(expected or {})
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.state = "queued"
+        self.attempts = 0
+        self.lease_id = None
+        self.lease_expires = None
+        self.worker = None
+        self.progress = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.artifacts = {}
+        self.history = []
+
+    def to_dict(self, include_lease=False):
+        d = {
+            "id": self.id,
+            "seq": self.seq,
+            "runner": self.runner,
+            "params": self.params,
+            "expected": self.expected,
+            "queue": self.queue,
+            "state": self.state,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "worker": self.worker,
+            "progress": self.progress,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "artifacts": self.artifacts,
+            "history": self.history,
+        }
+        if include_lease:
+            d["lease_id"] = self.lease_id
+        return d
+
+
+class JobQueue:
+    """
+    リース付きジョブキュー (スレッドセーフ)
+
+    時刻は wait_engine の時刻源 (monotonic) で測るので、FakeClock でリース切れを再現できる。
+    """
+
+    def __init__(self, lease_sec=DEFAULT_LEASE_SEC, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 artifact_dir=None, clock=None):
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.artifact_dir = artifact_dir
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._seq = itertools.count(1)
+        self._jobs = {}
+        self._leased = set()
+        self._queues = collections.OrderedDict()
+        self._rr = 0
+        self._workers = {}
+        self.started = None
+
+    def _now(self):
+        return (self._clock or wait_engine.get_clock()).monotonic()
+
+    def _worker_stats(self, worker):
+        return self._workers.setdefault(worker, {
+            "leased": 0, "done": 0, "failed": 0, "lost": 0, "busy_sec": 0.0,
+            "last_seen": None,
+        })
+
+    # ===== 投入 =====
+
+    def submit(self, runner, params=None, expected=None, queue=DEFAULT_QUEUE,
+               max_attempts=None):
+        if not runner:
+            raise ValueError("runner は必須です")
+        with self._cond:
+            job = Job(next(self._seq), runner, params, expected, queue or DEFAULT_QUEUE,
+                      max_attempts or self.max_attempts)
+            self._jobs[job.id] = job
+            self._queues.setdefault(job.queue, collections.deque()).append(job.id)
+            self._cond.notify_all()
+            return job
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list(self, state=None):
+        with self._cond:
+            return [j.to_dict() for j in self._jobs.values()
+                    if state is None or j.state == state]
+
+    # ===== リース =====
+
+    def _expire_leases(self):
+        """期限切れのリースを回収し、回数が残っていればキューの先頭に戻す"""
+        now = self._now()
+        for job_id in list(self._leased):
+            job = self._jobs[job_id]
+            if job.lease_expires > now:
+                continue
+            self._leased.discard(job_id)
+            stats = self._worker_stats(job.worker)
+            stats["lost"] += 1
+            job.history.append({"attempt": job.attempts, "worker": job.worker,
+                                "outcome": "lost"})
+            job.lease_id = None
+            job.worker = None
+            if job.attempts < job.max_attempts:
+                job.state = "queued"
+                # 再試行は後回しにしない
+                self._queues[job.queue].appendleft(job.id)
+            else:
+                job.state = "lost"
+                job.finished_at = time.time()
+            self._cond.notify_all()
+
+    def reap(self):
+        with self._cond:
+            self._expire_leases()
+
+    def _next_job(self, runners):
+        """キューをラウンドロビンで回り、runners で実行できる最初のジョブを取り出す"""
+        names = list(self._queues)
+        for i in range(len(names)):
+            name = names[(self._rr + i) % len(names)]
+            queue = self._queues[name]
+            for job_id in queue:
+                job = self._jobs[job_id]
+                if runners is None or job.runner in runners:
+                    queue.remove(job_id)
+                    self._rr = (self._rr + i + 1) % len(names)
+                    return job
+        return None
+
+    def lease(self, worker, runners=None, wait=0):
+        """
+        ジョブを1件リースする。無ければ最大 wait 秒待ち、それでも無ければ None
+
+        戻り値の dict には lease_id と lease_sec が入る。
+        """
+        runners = set(runners) if runners else None
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                self._expire_leases()
+                job = self._next_job(runners)
+                if job is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._worker_stats(worker)["last_seen"] = time.time()
+                    return None
+                # 期限切れの回収もしたいので長くは眠らない
+                self._cond.wait(min(remaining, max(self.lease_sec / 4, 0.05)))
+            job.state = "leased"
+            self._leased.add(job.id)
+            job.attempts += 1
+            job.worker = worker
+            job.lease_id = uuid.uuid4().hex
+            job.lease_expires = self._now() + self.lease_sec
+            job.started_at = job.started_at or time.time()
+            job.progress = None
+            stats = self._worker_stats(worker)
+            stats["leased"] += 1
+            stats["last_seen"] = time.time()
+            if self.started is None:
+                self.started = time.time()
+            d = job.to_dict(include_lease=True)
+            d["lease_sec"] = self.lease_sec
+            return d
+
+    def _leased_job(self, job_id, lease_id):
+        self._expire_leases()
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFound(job_id)
+        if job.state != "leased" or job.lease_id != lease_id:
+            raise LeaseError(f"{job_id} のリースは無効です (state={job.state})")
+        return job
+
+    def heartbeat(self, job_id, lease_id, progress=None):
+        """リース期限を延長し、残り秒数を返す"""
+        with self._cond:
+            job = self._leased_job(job_id, lease_id)
+            job.lease_expires = self._now() + self.lease_sec
+            if progress is not None:
+                job.progress = progress
+            self._worker_stats(job.worker)["last_seen"] = time.time()
+            return self.lease_sec
+
+    def add_artifact(self, job_id, lease_id, name, data):
+        if not _ARTIFACT_NAME_RE.match(name):
+            raise ValueError(f"成果物名が不正です: {name}")
+        with self._cond:
+            job = self._leased_job(job_id, lease_id)
+            path = None
+            if self.artifact_dir:
+                directory = os.path.join(self.artifact_dir, job.id, f"attempt-{job.attempts}")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, name)
+                with open(path, "wb") as f:
+                    f.write(data)
+            job.artifacts[name] = {"size": len(data), "path": path, "attempt": job.attempts}
+            return job.artifacts[name]
+
+    def complete(self, job_id, lease_id, result):
+        """実行結果を受け取り、result["ok"] に応じて done / failed にする"""
+        with self._cond:
+            job = self._leased_job(job_id, lease_id)
+            ok = bool(result.get("ok"))
+            job.state = "done" if ok else "failed"
+            job.result = result
+            job.finished_at = time.time()
+            job.history.append({"attempt": job.attempts, "worker": job.worker,
+                                "outcome": job.state})
+            stats = self._worker_stats(job.worker)
+            stats["done" if ok else "failed"] += 1
+            stats["busy_sec"] += float(result.get("wall_sec") or 0.0)
+            stats["last_seen"] = time.time()
+            job.lease_id = None
+            self._leased.discard(job.id)
+            self._cond.notify_all()
+            return job.to_dict()
+
+    # ===== 集計 =====
+
+    def stats(self):
+        with self._cond:
+            self._expire_leases()
+            queues = {}
+            for job in self._jobs.values():
+                q = queues.setdefault(job.queue, collections.Counter())
+                q[job.state] += 1
+            finished = [j for j in self._jobs.values() if j.state in ("done", "failed", "lost")]
+            elapsed = (max(j.finished_at for j in finished) - self.started
+                       if finished and self.started else 0.0)
+            done_counts = [w["done"] + w["failed"] for w in self._workers.values()]
+            return {
+                "jobs": len(self._jobs),
+                "states": dict(collections.Counter(j.state for j in self._jobs.values())),
+                "retries": sum(max(0, j.attempts - 1) for j in self._jobs.values()),
+                "elapsed_sec": elapsed,
+                "jobs_per_min": len(finished) / elapsed * 60 if elapsed else 0.0,
+                "queues": {name: dict(counts) for name, counts in queues.items()},
+                "workers": {name: dict(w) for name, w in self._workers.items()},
+                "worker_fairness": jain_index(done_counts),
+            }
+
+
+def jain_index(values):
+    """Jain の公平性指数 (1.0 で完全に均等、1/n で1人に偏り)"""
+    values = list(values)
+    if not values or not any(values):
+        return None
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def create_app(queue):
+    """JobQueue を HTTP で公開する Flask アプリを作る"""
+    app = Flask(__name__)
+
+    def _body():
+        return request.get_json(silent=True) or {}
+
+    @app.errorhandler(LeaseError)
+    def _lease_error(e):
+        return jsonify(error=str(e)), 409
+
+    @app.errorhandler(JobNotFound)
+    def _unknown_job(e):
+        return jsonify(error=f"ジョブがありません: {e}"), 404
+
+    @app.errorhandler(ValueError)
+    def _bad_request(e):
+        return jsonify(error=str(e)), 400
+
+    @app.route("/jobs", methods=["POST"])
+    def submit_jobs():
+        body = _body()
+        specs = body.get("jobs") if "jobs" in body else [body]
+        ids = []
+        for spec in specs:
+            job = queue.submit(spec.get("runner"), spec.get("params"), spec.get("expected"),
+                               spec.get("queue", DEFAULT_QUEUE), spec.get("max_attempts"))
+            ids.append(job.id)
+        return jsonify(ids=ids), 201
+
+    @app.route("/jobs", methods=["GET"])
+    def list_jobs():
+        return jsonify(jobs=queue.list(request.args.get("state")))
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def get_job(job_id):
+        job = queue.get(job_id)
+        if job is None:
+            abort(404)
+        return jsonify(job)
+
+    @app.route("/lease", methods=["POST"])
+    def lease_job():
+        body = _body()
+        worker = body.get("worker")
+        if not worker:
+            raise ValueError("worker は必須です")
+        wait = min(float(body.get("wait") or 0), MAX_LEASE_WAIT_SEC)
+        job = queue.lease(worker, body.get("runners"), wait)
+        if job is None:
+            return "", 204
+        return jsonify(job)
+
+    @app.route("/jobs/<job_id>/heartbeat", methods=["POST"])
+    def heartbeat(job_id):
+        body = _body()
+        lease_sec = queue.heartbeat(job_id, body.get("lease_id"), body.get("progress"))
+        return jsonify(lease_sec=lease_sec)
+
+    @app.route("/jobs/<job_id>/artifacts/<name>", methods=["PUT"])
+    def put_artifact(job_id, name):
+        info = queue.add_artifact(job_id, request.args.get("lease_id"), name,
+                                  request.get_data())
+        return jsonify(info), 201
+
+    @app.route("/jobs/<job_id>/complete", methods=["POST"])
+    def complete(job_id):
+        body = _body()
+        return jsonify(queue.complete(job_id, body.get("lease_id"), body.get("result") or {}))
+
+    @app.route("/stats")
+    def stats():
+        return jsonify(queue.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="シナリオ実行ジョブのコーディネーター")
+    parser.add_argument("--bind", default=DEFAULT_BIND)
+    parser.add_argument("--lease-sec", type=float, default=DEFAULT_LEASE_SEC,
+                        help="heartbeat が途絶えてからジョブを回収するまでの秒数")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    parser.add_argument("--artifact-dir", help="成果物の保存先 (省略時はサイズのみ記録)")
+    args = parser.parse_args()
+
+    host, _, port = args.bind.rpartition(":")
+    queue = JobQueue(args.lease_sec, args.max_attempts, args.artifact_dir)
+    create_app(queue).run(host=host or "0.0.0.0", port=int(port), threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,616 @@
+"""
+ダイアログ監視サービス (ウィンドウ表示イベント + ルール表)
+
+confirm / 名前を付けて保存 / 上書き確認 などのダイアログを、ダイアログごとの
+Desktop(...).window(...).wait("visible") ポーリングではなく、常駐する1つの監視で処理する。
+
+- イベントソース : トップレベルウィンドウの表示 / 消滅を通知する
+    - wineventhook : SetWinEventHook(EVENT_OBJECT_SHOW / DESTROY) によるイベント駆動 (Windows)
+    - polling      : EnumWindows を1スレッドで一定間隔に実行し、差分を通知する (フォールバック)
+    - fake         : テスト用。open() / close() でウィンドウを手動で出し入れする
+- ルール        : タイトル (完全一致 / 正規表現) とクラス名で一致判定し、一致したら action を実行する
+- 期待 (expect) : ステップ側は操作の前に expect() し、ダイアログ処理の結果 (action の戻り値) を待つ
+
+action はワーカースレッドで実行されるため、複数のダイアログを同時に処理できる。
+action を持たないルールは「表示されたこと」の通知だけを行う (操作はステップ側で行う)。
+
+使い方:
+    watcher = dialog_watcher.get_watcher()
+    with watcher.expect(CONFIRM_RULE) as confirm:
+        link.click()
+        confirm.wait(timeout=15)
+"""
+
+import collections
+import concurrent.futures
+import ctypes
+import re
+import sys
+import threading
+import time
+
+import step_trace
+
+DEFAULT_POLL_INTERVAL = 0.1
+DEFAULT_WORKERS = 4
+# stats() の最大遅延の計算に残す直近の action 開始遅延の件数
+LATENCY_HISTORY = 1024
+
+WindowInfo = collections.namedtuple("WindowInfo", "handle title class_name pid")
+
+
+class WindowEventSource:
+    """ウィンドウ表示イベントの供給元の共通インターフェース"""
+
+    name = "base"
+
+    def start(self, on_show, on_hide):
+        """監視を開始する。表示時に on_show(WindowInfo)、消滅時に on_hide(handle) を呼ぶ"""
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+    def windows(self):
+        """現在表示中のトップレベルウィンドウ (開始前から出ているダイアログの取りこぼし防止用)"""
+        return []
+
+
+class _User32:
+    """EnumWindows などの user32 関数 (Windows のみ)"""
+
+    def __init__(self):
+        self.user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self.WNDENUMPROC = ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.c_void_p, ctypes.c_void_p)
+        self.user32.EnumWindows.argtypes = [self.WNDENUMPROC, ctypes.c_void_p]
+        self.user32.GetWindowTextW.argtypes = [ctypes.c_void_p, ctypes.c_wchar_p, ctypes.c_int]
+        self.user32.GetClassNameW.argtypes = [ctypes.c_void_p, ctypes.c_wchar_p, ctypes.c_int]
+        self.user32.IsWindowVisible.argtypes = [ctypes.c_void_p]
+        self.user32.GetAncestor.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+        self.user32.GetAncestor.restype = ctypes.c_void_p
+        self.user32.GetWindowThreadProcessId.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint32)]
+
+    def info(self, hwnd):
+        title = ctypes.create_unicode_buffer(512)
+        class_name = ctypes.create_unicode_buffer(256)
+        self.user32.GetWindowTextW(hwnd, title, len(title))
+        self.user32.GetClassNameW(hwnd, class_name, len(class_name))
+        pid = ctypes.c_uint32()
+        self.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        return WindowInfo(hwnd, title.value, class_name.value, pid.value)
+
+    def is_top_level(self, hwnd):
+        GA_ROOT = 2
+        return self.user32.GetAncestor(hwnd, GA_ROOT) == hwnd
+
+    def visible_windows(self):
+        handles = []
+
+        def _collect(hwnd, _):
+            if self.user32.IsWindowVisible(hwnd):
+                handles.append(hwnd)
+            return True
+
+        self.user32.EnumWindows(self.WNDENUMPROC(_collect), None)
+        return [self.info(h) for h in handles]
+
+
+class PollingEventSource(WindowEventSource):
+    """
+    1スレッドでトップレベルウィンドウを列挙し、前回との差分を通知する
+
+    ダイアログの数に関係なく列挙は interval ごとに1回で済む。
+    enumerate_windows には WindowInfo のリストを返す関数を渡せる (既定は EnumWindows)。
+    """
+
+    name = "polling"
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL, enumerate_windows=None):
+        self.interval = interval
+        self._enumerate = enumerate_windows or _User32().visible_windows
+        self._stop = threading.Event()
+        self._thread = None
+        self.scans = 0
+
+    def windows(self):
+        return list(self._enumerate())
+
+    def start(self, on_show, on_hide):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(on_show, on_hide),
+                                        name="dialog-watcher-poll", daemon=True)
+        self._thread.start()
+
+    def _loop(self, on_show, on_hide):
+        known = {}
+        while not self._stop.is_set():
+            try:
+                current = {w.handle: w for w in self._enumerate()}
+            except Exception:
+                current = known
+            self.scans += 1
+            for handle, info in current.items():
+                if handle not in known:
+                    on_show(info)
+            for handle in known.keys() - current.keys():
+                on_hide(handle)
+            known = current
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class WinEventSource(WindowEventSource):
+    """SetWinEventHook によるイベント駆動の監視 (フックとメッセージループは専用スレッドで回す)"""
+
+    name = "wineventhook"
+
+    EVENT_OBJECT_DESTROY = 0x8001
+    EVENT_OBJECT_SHOW = 0x8002
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    OBJID_WINDOW = 0
+    WM_QUIT = 0x0012
+
+    def __init__(self):
+        self._api = _User32()
+        user32 = self._api.user32
+        self.WINEVENTPROC = ctypes.WINFUNCTYPE(
+            None, ctypes.c_void_p, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_long,
+            ctypes.c_long, ctypes.c_uint32, ctypes.c_uint32)
+        user32.SetWinEventHook.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p,
+                                           self.WINEVENTPROC, ctypes.c_uint32, ctypes.c_uint32,
+                                           ctypes.c_uint32]
+        user32.SetWinEventHook.restype = ctypes.c_void_p
+        user32.UnhookWinEvent.argtypes = [ctypes.c_void_p]
+        user32.GetMessageW.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint,
+                                       ctypes.c_uint]
+        user32.PostThreadMessageW.argtypes = [ctypes.c_uint32, ctypes.c_uint, ctypes.c_void_p,
+                                              ctypes.c_void_p]
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._thread = None
+        self._thread_id = None
+        self._ready = threading.Event()
+        self._error = None
+
+    def windows(self):
+        return self._api.visible_windows()
+
+    def start(self, on_show, on_hide):
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._loop, args=(on_show, on_hide),
+                                        name="dialog-watcher-hook", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _loop(self, on_show, on_hide):
+        api = self._api
+        user32 = api.user32
+
+        def _callback(hook, event, hwnd, id_object, id_child, thread, ms):
+            if not hwnd or id_object != self.OBJID_WINDOW or id_child != 0:
+                return
+            try:
+                if event == self.EVENT_OBJECT_DESTROY:
+                    on_hide(hwnd)
+                elif api.is_top_level(hwnd):
+                    on_show(api.info(hwnd))
+            except Exception:
+                pass
+
+        proc = self.WINEVENTPROC(_callback)  # フック解除まで参照を保持する
+        self._thread_id = self._kernel32.GetCurrentThreadId()
+        hook = user32.SetWinEventHook(self.EVENT_OBJECT_DESTROY, self.EVENT_OBJECT_SHOW, None,
+                                      proc, 0, 0, self.WINEVENT_OUTOFCONTEXT)
+        if not hook:
+            self._error = ctypes.WinError(ctypes.get_last_error())
+            self._ready.set()
+            return
+        self._ready.set()
+        msg = ctypes.create_string_buffer(48)  # MSG 構造体 (中身は使わない)
+        try:
+            while user32.GetMessageW(msg, None, 0, 0) > 0:
+                pass
+        finally:
+            user32.UnhookWinEvent(hook)
+
+    def stop(self):
+        if self._thread is not None:
+            self._api.user32.PostThreadMessageW(self._thread_id, self.WM_QUIT, None, None)
+            self._thread.join()
+            self._thread = None
+
+
+class FakeWindowEventSource(WindowEventSource):
+    """テスト用のイベントソース。open() / close() でウィンドウの表示 / 消滅を再現する"""
+
+    name = "fake"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._next_handle = 0x10000
+        self._on_show = None
+        self._on_hide = None
+
+    def start(self, on_show, on_hide):
+        self._on_show, self._on_hide = on_show, on_hide
+
+    def stop(self):
+        self._on_show = self._on_hide = None
+
+    def windows(self):
+        with self._lock:
+            return list(self._windows.values())
+
+    def open(self, title, class_name="#32770", pid=0):
+        """ウィンドウを表示し、その WindowInfo を返す"""
+        with self._lock:
+            self._next_handle += 2
+            info = WindowInfo(self._next_handle, title, class_name, pid)
+            self._windows[info.handle] = info
+            on_show = self._on_show
+        if on_show is not None:
+            on_show(info)
+        return info
+
+    def close(self, handle):
+        with self._lock:
+            existed = self._windows.pop(handle, None) is not None
+            on_hide = self._on_hide
+        if existed and on_hide is not None:
+            on_hide(handle)
+
+    def is_open(self, handle):
+        with self._lock:
+            return handle in self._windows
+
+
+def create_event_source(backend="auto", interval=DEFAULT_POLL_INTERVAL):
+    """
+    イベントソースを生成する
+
+    backend: "auto" / "wineventhook" / "polling" / WindowEventSource インスタンス
+    "auto" は Windows ならイベントフック、失敗したら polling にフォールバックする。
+    """
+    if isinstance(backend, WindowEventSource):
+        return backend
+    if backend == "auto":
+        if sys.platform != "win32":
+            raise RuntimeError("ウィンドウ監視は Windows でのみ利用できます (fake を指定してください)")
+        try:
+            return WinEventSource()
+        except (OSError, AttributeError):
+            return PollingEventSource(interval)
+    if backend == "wineventhook":
+        return WinEventSource()
+    if backend == "polling":
+        return PollingEventSource(interval)
+    if backend == "fake":
+        return FakeWindowEventSource()
+    raise ValueError(f"未知のウィンドウ監視バックエンド: {backend}")
+
+
+class DialogRule:
+    """
+    ダイアログの一致条件と処理
+
+    title / title_re / class_name のうち指定したものすべてに一致したウィンドウが対象。
+    action(info) はワーカースレッドで呼ばれ、戻り値が expect() 側に渡る。
+    action が None のルールは通知のみ (expect() には WindowInfo が渡る)。
+    """
+
+    def __init__(self, name, title=None, title_re=None, class_name=None, action=None):
+        self.name = name
+        self.title = title
+        self.title_re = re.compile(title_re) if title_re else None
+        self.class_name = class_name
+        self.action = action
+
+    def matches(self, info):
+        if self.class_name is not None and info.class_name != self.class_name:
+            return False
+        if self.title is not None and info.title != self.title:
+            return False
+        if self.title_re is not None and not self.title_re.match(info.title):
+            return False
+        return True
+
+    def __repr__(self):
+        return f"DialogRule({self.name!r})"
+
+
+class _Dispatch:
+    """1つのウィンドウに対する1つのルールの処理状態"""
+
+    def __init__(self, rule, info, shown_at):
+        self.rule = rule
+        self.info = info
+        self.shown_at = shown_at
+        self.finished = False
+        self.result = None
+        self.error = None
+        self.expectations = []
+
+
+class DialogExpectation:
+    """expect() の戻り値。対象のダイアログが処理されると wait() が結果を返す"""
+
+    def __init__(self, watcher, rule):
+        self._watcher = watcher
+        self.rule = rule
+        self.info = None
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _set(self, dispatch):
+        self.info = dispatch.info
+        self._result = dispatch.result
+        self._error = dispatch.error
+        self._event.set()
+
+    def seen(self):
+        """対象のダイアログが表示されたか (action の完了前でも True)"""
+        return self.info is not None
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """処理結果を返す。action の例外はそのまま送出し、timeout 秒で TimeoutError"""
+        if not self._event.wait(timeout):
+            raise TimeoutError(f"ダイアログが表示されませんでした: {self.rule.name}")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def cancel(self):
+        """まだ一致していなければ待機をやめる (以後のダイアログはルールの action だけで処理される)"""
+        self._watcher._cancel(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cancel()
+        return False
+
+
+class DialogWatcher:
+    """
+    ルール表に従ってダイアログを処理する常駐監視
+
+    - 1つのイベントソースから表示イベントを受け、一致したルールの action をワーカーで実行する
+    - 同じウィンドウに対して同じルールの action は1回だけ実行する
+    - expect() は action を持つルールでは「次に処理されるダイアログ」と1対1で対応付け、
+      通知のみのルールでは表示中のダイアログがあればそれを即座に返す
+    """
+
+    def __init__(self, source=None, workers=DEFAULT_WORKERS, clock=time.monotonic):
+        self.source = source if source is not None else create_event_source()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rules = collections.OrderedDict()
+        self._dispatches = {}
+        self._waiters = collections.defaultdict(collections.deque)
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers,
+                                                           thread_name_prefix="dialog-action")
+        self._running = False
+        self._close_listeners = []
+        self._active = 0
+        self.events = 0
+        self.matched = 0
+        self.errors = 0
+        self.max_concurrent = 0
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)
+
+    # ----- ルール -----
+    def add_rule(self, rule):
+        """ルールを登録する (同名のルールは置き換える)。表示中のウィンドウにも適用する"""
+        with self._lock:
+            self._rules[rule.name] = rule
+            running = self._running
+        if running:
+            for info in self.source.windows():
+                self._on_show(info)
+        return rule
+
+    def remove_rule(self, name):
+        with self._lock:
+            self._rules.pop(name, None)
+
+    def rules(self):
+        with self._lock:
+            return list(self._rules.values())
+
+    def add_close_listener(self, callback):
+        """ウィンドウ消滅時に callback(handle) を呼ぶ (ルールに一致しないウィンドウも含む)"""
+        with self._lock:
+            self._close_listeners.append(callback)
+
+    # ----- 開始 / 終了 -----
+    def start(self):
+        with self._lock:
+            if self._running:
+                return self
+            self._running = True
+        self.source.start(self._on_show, self._on_hide)
+        # 監視開始前から出ているダイアログも処理する
+        for info in self.source.windows():
+            self._on_show(info)
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+        self.source.stop()
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    # ----- 期待 -----
+    def expect(self, rule):
+        """
+        rule (DialogRule またはルール名) に一致するダイアログの処理結果を待つ DialogExpectation を返す
+
+        DialogRule を渡した場合、未登録なら登録する。ダイアログを出す操作の前に呼ぶこと。
+        """
+        if isinstance(rule, DialogRule):
+            with self._lock:
+                registered = self._rules.get(rule.name) is rule
+            if not registered:
+                self.add_rule(rule)
+        else:
+            with self._lock:
+                rule = self._rules[rule]
+        expectation = DialogExpectation(self, rule)
+        with self._lock:
+            dispatch = self._claimable(rule)
+            if dispatch is None:
+                self._waiters[rule.name].append(expectation)
+                return expectation
+            dispatch.expectations.append(expectation)
+            expectation.info = dispatch.info
+            finished = dispatch.finished
+        if finished:
+            expectation._set(dispatch)
+        return expectation
+
+    def _claimable(self, rule):
+        """表示中のウィンドウのうち expect() に渡せる処理 (ロック内で呼ぶ)"""
+        # 同名のルールで置き換えた後も、置き換え前に処理したダイアログを対象にする
+        # (_on_show もウィンドウごとの重複をルール名で判定している)
+        candidates = [d for per_window in self._dispatches.values() for d in per_window
+                      if d.rule.name == rule.name]
+        if rule.action is None:
+            return candidates[-1] if candidates else None
+        for d in candidates:
+            if not d.expectations:
+                return d
+        return None
+
+    def _cancel(self, expectation):
+        with self._lock:
+            waiters = self._waiters.get(expectation.rule.name)
+            if waiters and expectation in waiters:
+                waiters.remove(expectation)
+
+    # ----- イベント処理 -----
+    def _on_show(self, info):
+        now = self._clock()
+        started = []
+        with self._lock:
+            self.events += 1
+            if not self._running:
+                return
+            per_window = self._dispatches.setdefault(info.handle, [])
+            seen = {d.rule.name for d in per_window}
+            for rule in self._rules.values():
+                if rule.name in seen or not rule.matches(info):
+                    continue
+                dispatch = _Dispatch(rule, info, now)
+                waiters = self._waiters.get(rule.name)
+                if waiters:
+                    # action を持つルールは1対1、通知のみのルールは待っている全員に通知する
+                    if rule.action is None:
+                        dispatch.expectations = list(waiters)
+                        waiters.clear()
+                    else:
+                        dispatch.expectations = [waiters.popleft()]
+                    for expectation in dispatch.expectations:
+                        expectation.info = info
+                per_window.append(dispatch)
+                self.matched += 1
+                started.append(dispatch)
+            if not per_window:
+                del self._dispatches[info.handle]
+        for dispatch in started:
+            if dispatch.rule.action is None:
+                self._finish(dispatch, info, None)
+            else:
+                self._pool.submit(self._run_action, dispatch)
+
+    def _on_hide(self, handle):
+        with self._lock:
+            self._dispatches.pop(handle, None)
+            listeners = list(self._close_listeners)
+        for callback in listeners:
+            try:
+                callback(handle)
+            except Exception:
+                pass
+
+    def _run_action(self, dispatch):
+        with self._lock:
+            self._active += 1
+            self.max_concurrent = max(self.max_concurrent, self._active)
+            self.latencies.append(self._clock() - dispatch.shown_at)
+        result = error = None
+        try:
+            with step_trace.span("dialog_watcher.action", rule=dispatch.rule.name):
+                result = dispatch.rule.action(dispatch.info)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                self._active -= 1
+                if error is not None:
+                    self.errors += 1
+        self._finish(dispatch, result, error)
+
+    def _finish(self, dispatch, result, error):
+        with self._lock:
+            dispatch.result = result
+            dispatch.error = error
+            dispatch.finished = True
+            expectations = list(dispatch.expectations)
+        for expectation in expectations:
+            expectation._set(dispatch)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "source": self.source.name,
+                "rules": list(self._rules),
+                "events": self.events,
+                "matched": self.matched,
+                "errors": self.errors,
+                "open": len(self._dispatches),
+                "max_concurrent": self.max_concurrent,
+                "latency_max_sec": latencies[-1] if latencies else None,
+            }
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher():
+    """プロセス共通のダイアログ監視 (初回呼び出し時に生成して開始する)"""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = DialogWatcher().start()
+        return _watcher
+
+
+def set_watcher(watcher):
+    """既定のダイアログ監視を差し替え、元のものを返す"""
+    global _watcher
+    with _watcher_lock:
+        previous = _watcher
+        _watcher = watcher
+        return previous
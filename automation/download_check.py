@@ -0,0 +1,256 @@
+"""
+ダウンロード完了待ちと保存結果の確認 (各ランナー共通)
+
+ブラウザに依存しない処理だけをまとめているので、
+selenium_ie_test.py / http_fast_test.py のどちらからも利用できる。
+"""
+
+import json
+import logging
+import os
+import time
+import urllib.request
+import zipfile
+import zlib
+
+import file_digest
+import step_trace
+import wait_engine
+from file_watch import create_file_watcher
+
+# ダウンロード完了検知のファイル監視方式 ("auto" / "inotify" / "win32" / "polling")
+DOWNLOAD_WATCH_BACKEND = "auto"
+DOWNLOAD_WATCH_RECHECK_SEC = 0.5
+MANIFEST_TIMEOUT_SEC = 10
+
+_logger = logging.getLogger("iemode_dl_test")
+
+
+def log(message, level=logging.INFO):
+    _logger.log(level, message)
+
+
+def _stat_download_target(path):
+    """(exists, mtime, size) を返す。取得途中で消えた場合は exists=True, mtime=None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False, None, None
+    except OSError:
+        return True, None, None
+    return True, st.st_mtime, st.st_size
+
+
+@step_trace.traced()
+def wait_for_download_complete(save_file_path, start_time, timeout=60, stable_sec=3,
+                               digest=None):
+    """partialファイル消滅と本体の更新を待つ（開始時刻以降のもののみ対象）
+
+    保存先ディレクトリの変更通知 (file_watch) で起床し、完了条件を判定する。
+    通知が来なくても「開始から1秒経過」「サイズ/mtime安定」の判定時刻には起床する。
+    digest (file_digest.IncrementalFileDigest) を渡すと、起床のたびに追記分をハッシュする。
+    """
+    clock = wait_engine.get_clock()
+    partial_path = f"{save_file_path}.partial"
+    end = clock.time() + timeout
+    try:
+        start_time_local = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))
+    except Exception:
+        start_time_local = str(start_time)
+    log(
+        f"  [DEBUG] ダウンロード監視: file={save_file_path}, partial={partial_path}, "
+        f"start_time={start_time_local}"
+    )
+    watch_dir = os.path.dirname(save_file_path) or "."
+    watch_names = [os.path.basename(save_file_path), os.path.basename(partial_path)]
+    try:
+        watcher = create_file_watcher(watch_dir, watch_names, backend=DOWNLOAD_WATCH_BACKEND)
+    except OSError as e:
+        log(f"  [WARN] ファイル監視の初期化に失敗。ポーリングで代替: {e}")
+        watcher = create_file_watcher(watch_dir, watch_names, backend="polling")
+    log(f"  [DEBUG] ファイル監視バックエンド: {watcher.name}", logging.DEBUG)
+
+    # 変更通知で起床できるため、変化が無い間は判定時刻 (hint) まで長く眠ってよい
+    backoff = wait_engine.Backoff(initial=DOWNLOAD_WATCH_RECHECK_SEC,
+                                  max_interval=max(timeout, DOWNLOAD_WATCH_RECHECK_SEC),
+                                  jitter=0)
+    poller = wait_engine.Poller(timeout, backoff=backoff, clock=clock, sleeper=watcher.wait)
+    last_size = None
+    last_mtime = None
+    stable_since = None
+    file_mtime = file_size = partial_mtime = None
+    with watcher:
+        while poller.poll():
+            if digest is not None:
+                digest.poll()
+            now = clock.time()
+            partial_exists, partial_mtime, _ = _stat_download_target(partial_path)
+            file_exists, file_mtime, file_size = _stat_download_target(save_file_path)
+            partial_is_new = partial_exists and (partial_mtime is None or partial_mtime >= start_time)
+            file_is_new = file_exists and (file_mtime is None or file_mtime >= start_time)
+
+            elapsed = now - start_time
+            if file_exists and not partial_exists and elapsed >= 1:
+                return True
+            if file_exists and file_is_new and not partial_is_new:
+                return True
+
+            # .partial が残っていても、本体が更新されて安定していれば完了とみなす
+            wake_at = end
+            if file_exists:
+                if file_size == last_size and file_mtime == last_mtime:
+                    if stable_since is None:
+                        stable_since = now
+                    elif now - stable_since >= stable_sec:
+                        return True
+                    wake_at = min(wake_at, stable_since + stable_sec)
+                else:
+                    stable_since = None
+                    # 次回の比較で安定開始を記録できるよう、すぐに再確認する
+                    wake_at = min(wake_at, now + DOWNLOAD_WATCH_RECHECK_SEC)
+                last_size = file_size
+                last_mtime = file_mtime
+                if not partial_exists and elapsed < 1:
+                    wake_at = min(wake_at, start_time + 1)
+
+            poller.observe((partial_exists, partial_mtime, file_exists, file_mtime, file_size))
+            poller.sleep(hint=wake_at - clock.time())
+    raise TimeoutError(
+        f"ダウンロード完了待ちがタイムアウト: {save_file_path} / {partial_path} "
+        f"(file_mtime={file_mtime}, file_size={file_size}, "
+        f"partial_mtime={partial_mtime})"
+    )
+
+
+def verify_saved_file(save_file_path, before_mtime):
+    """
+    保存結果を確認してログ出力する
+
+    戻り値: "created" (新規保存) / "updated" (上書き更新) / "stale" (更新されていない可能性) /
+            "missing" (ファイルなし)
+    """
+    if not os.path.exists(save_file_path):
+        log(f"[WARN] ファイルが見つかりません: {save_file_path}")
+        return "missing"
+    file_size = os.path.getsize(save_file_path)
+    after_mtime = os.path.getmtime(save_file_path)
+    if before_mtime is None:
+        log(f"[OK] ファイル保存確認: {save_file_path} ({file_size} bytes)")
+        return "created"
+    if after_mtime > before_mtime:
+        log(f"[OK] ファイル更新確認: {save_file_path} ({file_size} bytes)")
+        return "updated"
+    log(f"[WARN] ファイルが更新されていない可能性: {save_file_path} ({file_size} bytes)")
+    return "stale"
+
+
+def fetch_manifest(base_url, timeout=MANIFEST_TIMEOUT_SEC):
+    """サーバーの /manifest を取得する"""
+    with urllib.request.urlopen(f"{base_url.rstrip('/')}/manifest", timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def fetch_expected(base_url, url_path):
+    """マニフェストから url_path の項目を返す。取得できなければ警告して None"""
+    try:
+        manifest = fetch_manifest(base_url)
+    except Exception as e:
+        log(f"  [WARN] マニフェストを取得できません。整合性確認を省略: {e}")
+        return None
+    for entry in manifest.get("files", []):
+        if entry.get("url") == url_path:
+            return entry
+    log(f"  [WARN] マニフェストに {url_path} がありません。整合性確認を省略")
+    return None
+
+
+def fetch_bundle_expected(base_url, url_path):
+    """/download/bundle?... の各エントリーの要約 (/manifest/bundle?...) を返す。取得できなければ None"""
+    manifest_path = f"/manifest{url_path[len('/download'):]}"
+    try:
+        with urllib.request.urlopen(f"{base_url.rstrip('/')}{manifest_path}",
+                                    timeout=MANIFEST_TIMEOUT_SEC) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+    except Exception as e:
+        log(f"  [WARN] マニフェストを取得できません。整合性確認を省略: {e}")
+        return None
+
+
+def is_bundle(expected):
+    """expected が ZIP (/manifest/bundle) の要約か"""
+    return expected is not None and "entries" in expected
+
+
+@step_trace.traced()
+def verify_bundle(save_file_path, expected):
+    """
+    保存した ZIP の各エントリーを展開せずに読み、expected["entries"] の要約と照合する
+
+    エントリーはディスクに書き出さず、zipfile から読んだチャンクをそのままハッシュする
+    (zipfile が CRC-32 も確認するので、壊れたエントリーは読み込み中のエラーとして検出される)。
+    戻り値: {"ok": bool, "problems": [...], "entries": [{"name", "ok", "problems",
+             "size", "rows", "sha256"}, ...], "rehashed": False}
+    """
+    problems = []
+    entries = []
+    try:
+        with zipfile.ZipFile(save_file_path) as zf:
+            names = zf.namelist()
+            expected_names = {item["name"] for item in expected["entries"]}
+            for item in expected["entries"]:
+                name = item["name"]
+                if name not in names:
+                    problems.append(f"{name}: エントリーがありません")
+                    continue
+                try:
+                    with zf.open(name) as f:
+                        result = file_digest.digest_stream(f)
+                except (zipfile.BadZipFile, zlib.error, OSError) as e:
+                    problems.append(f"{name}: 読み込みに失敗しました ({e})")
+                    continue
+                entry_problems = [f"{name}: {p}" for p in file_digest.compare(result, item)]
+                problems.extend(entry_problems)
+                entries.append(dict(result.summary(), name=name, ok=not entry_problems,
+                                    problems=entry_problems))
+            problems.extend(f"{name}: 想定外のエントリーです"
+                            for name in names if name not in expected_names)
+    except (zipfile.BadZipFile, OSError) as e:
+        problems.append(f"ZIP を開けません: {e}")
+    if problems:
+        log(f"[WARN] 整合性確認に失敗: {save_file_path} ({'; '.join(problems)})")
+    else:
+        log(f"[OK] 整合性確認: {save_file_path} ({len(entries)} entries, "
+            f"{sum(e['rows'] for e in entries)} rows)")
+    return {"ok": not problems, "problems": problems, "entries": entries, "rehashed": False}
+
+
+@step_trace.traced()
+def verify_integrity(save_file_path, expected, digest=None):
+    """
+    保存ファイルのサイズ・行数・SHA-256 をマニフェストの項目 expected と照合する
+
+    digest (IncrementalFileDigest) を渡した場合はダウンロード中に読んだ続きだけを読む。
+    それで一致しなければ、途中のハッシュが無効だった可能性があるので全体を読み直す。
+    expected が ZIP の要約 (is_bundle) なら verify_bundle でエントリーごとに照合する。
+    戻り値: {"ok": bool, "problems": [...], "size", "rows", "sha256", "rehashed": bool}
+    """
+    if not os.path.exists(save_file_path):
+        return {"ok": False, "problems": ["保存ファイルがありません"], "rehashed": False}
+    if is_bundle(expected):
+        return verify_bundle(save_file_path, expected)
+    if digest is None:
+        digest = file_digest.IncrementalFileDigest(save_file_path)
+    read_early = digest.digest.size
+    result = digest.finish()
+    problems = file_digest.compare(result, expected)
+    if problems and not digest.rehashed and read_early:
+        result = digest.rehash()
+        problems = file_digest.compare(result, expected)
+    checks = dict(result.summary(), ok=not problems, problems=problems,
+                  rehashed=digest.rehashed)
+    if problems:
+        log(f"[WARN] 整合性確認に失敗: {save_file_path} ({'; '.join(problems)})")
+    else:
+        log(f"[OK] 整合性確認: {save_file_path} ({result.size} bytes, {result.rows} rows, "
+            f"sha256={result.sha256[:16]}...)")
+    return checks
@@ -0,0 +1,138 @@
+"""
+保存ファイルの SHA-256 と行数をメモリ一定で求める (サーバーのマニフェストとの照合用)
+
+- digest_file      : 固定サイズのチャンク (または mmap) で1回読み、SHA-256・サイズ・行数を求める
+- IncrementalFileDigest : ダウンロード中の <保存先>.partial を追記分だけ読み進め、
+                     完了時にはほぼ読み終わっている状態にする
+
+SHA-256・サイズ・行数の計算はサーバー側 (manifest.py) と共通の content_digest.StreamingDigest
+(リポジトリ直下) を使う。行数はヘッダー行を除いたデータ行の数。
+
+IncrementalFileDigest は読むたびにファイルを開き直して閉じる
+(開いたままにすると Windows ではブラウザの .partial → 本来の名前へのリネームを妨げるため)。
+追記以外の書き方 (事前確保して後から埋める等) をされると途中のハッシュが合わなくなるが、
+照合に失敗した場合は verify_integrity がファイル全体を読み直して確認する。
+"""
+
+import mmap
+import os
+import sys
+
+# リポジトリ直下の content_digest をサーバーと共有する (automation 側のモジュールを隠さないよう末尾に足す)
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)
+
+from content_digest import StreamingDigest  # noqa: E402
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def digest_stream(fileobj, chunk_size=CHUNK_SIZE, digest=None):
+    """読み込み用のファイルオブジェクト (ZIP のエントリーなど) を末尾まで読んで StreamingDigest を返す"""
+    digest = StreamingDigest() if digest is None else digest
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest
+
+
+def digest_file(path, chunk_size=CHUNK_SIZE, use_mmap=False):
+    """path を chunk_size ずつ読んで StreamingDigest を返す (use_mmap=True ならメモリマップ経由)"""
+    digest = StreamingDigest()
+    with open(path, "rb") as f:
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # スライスはチャンク分だけのコピーなので、ファイルが大きくてもメモリは一定
+                for offset in range(0, len(mm), chunk_size):
+                    digest.update(mm[offset:offset + chunk_size])
+        else:
+            digest_stream(f, chunk_size, digest)
+    return digest
+
+
+class IncrementalFileDigest:
+    """
+    書き込み中のダウンロードを追記分だけハッシュする
+
+    poll() を呼ぶたびに <保存先>.partial (無ければ保存先本体) の前回の続きから末尾まで読む。
+    start_time より古いファイル (上書き前の旧ファイル) は読まない。
+    finish() で残りを読み、本体のサイズと合わなければ先頭から読み直す。
+    """
+
+    def __init__(self, save_file_path, start_time=None, chunk_size=CHUNK_SIZE):
+        self.save_file_path = save_file_path
+        self.partial_path = f"{save_file_path}.partial"
+        self.start_time = start_time
+        self.chunk_size = chunk_size
+        self.digest = StreamingDigest()
+        self.rehashed = False
+
+    def update(self, chunk):
+        """書き込み側が書いたバイト列を直接渡す (ファイルを読み直さずに済む)"""
+        self.digest.update(chunk)
+
+    def _source(self):
+        for path in (self.partial_path, self.save_file_path):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if self.start_time is None or st.st_mtime >= self.start_time:
+                return path, st.st_size
+        return None, None
+
+    def _read_from(self, path, end):
+        try:
+            with open(path, "rb") as f:
+                f.seek(self.digest.size)
+                while self.digest.size < end:
+                    chunk = f.read(min(self.chunk_size, end - self.digest.size))
+                    if not chunk:
+                        break
+                    self.update(chunk)
+        except OSError:
+            # リネーム・書き込みと競合した。次回の poll で続きから読む
+            pass
+
+    def poll(self):
+        """追記された分を読む。読み終えたバイト数を返す"""
+        path, size = self._source()
+        if path is None:
+            return self.digest.size
+        if size < self.digest.size:
+            # 作り直された (先頭から書き直しなど)
+            self.digest = StreamingDigest()
+        self._read_from(path, size)
+        return self.digest.size
+
+    def finish(self):
+        """保存先本体を末尾まで読み、StreamingDigest を返す"""
+        size = os.path.getsize(self.save_file_path)
+        if size < self.digest.size:
+            self.rehash()
+        else:
+            self._read_from(self.save_file_path, size)
+            if self.digest.size != size:
+                self.rehash()
+        return self.digest
+
+    def rehash(self):
+        """先頭から読み直す"""
+        self.digest = digest_file(self.save_file_path, self.chunk_size)
+        self.rehashed = True
+        return self.digest
+
+
+def compare(digest, expected):
+    """StreamingDigest とマニフェストの項目を比べ、不一致の説明のリストを返す"""
+    problems = []
+    if expected.get("size") is not None and digest.size != int(expected["size"]):
+        problems.append(f"サイズが一致しません: {digest.size} != {expected['size']} bytes")
+    if expected.get("rows") is not None and digest.rows != int(expected["rows"]):
+        problems.append(f"行数が一致しません: {digest.rows} != {expected['rows']}")
+    if expected.get("sha256") and digest.sha256 != expected["sha256"].lower():
+        problems.append("sha256 が一致しません")
+    return problems
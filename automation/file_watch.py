@@ -0,0 +1,242 @@
+"""
+ダウンロード完了検知用のファイル監視エンジン
+
+保存先ディレクトリの変更 (作成・リネーム・クローズ・削除) を待機する。
+バックエンドは次のとおり:
+
+- inotify   : Linux の inotify を ctypes で直接利用する
+- win32     : Windows の FindFirstChangeNotificationW を利用する
+- polling   : 一定間隔でスリープするだけのフォールバック
+- fake      : テスト用。イベントを手動で投入する
+
+どのバックエンドも wait(timeout) が「変化があった / タイムアウトした」を返すだけで、
+完了判定そのものは呼び出し側 (wait_for_download_complete) が stat で行う。
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+DEFAULT_POLL_INTERVAL = 0.5
+
+
+class FileWatcher:
+    """ファイル監視バックエンドの共通インターフェース"""
+
+    name = "base"
+
+    def wait(self, timeout):
+        """変化を最大 timeout 秒待つ。変化があれば True、タイムアウトなら False"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class PollingWatcher(FileWatcher):
+    """一定間隔でスリープするだけのフォールバック実装"""
+
+    name = "polling"
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(max(0.0, min(timeout, self.interval)))
+        # 変化の有無は分からないため、常に再チェックを促す
+        return True
+
+
+class InotifyWatcher(FileWatcher):
+    """Linux inotify によるディレクトリ監視"""
+
+    name = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+                  | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, directory, names=None):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._names = {os.fsencode(n) for n in names} if names else None
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 に失敗しました: {os.strerror(err)}")
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            self._fd = -1
+            raise OSError(err, f"inotify_add_watch に失敗しました: {directory}")
+
+    def _drain(self):
+        """溜まっているイベントを読み切り、対象ファイルに関するものがあったか返す"""
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return relevant
+            if not buf:
+                return relevant
+            offset = 0
+            while offset + self._EVENT_HEADER.size <= len(buf):
+                _wd, mask, _cookie, length = self._EVENT_HEADER.unpack_from(buf, offset)
+                offset += self._EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & (self.IN_Q_OVERFLOW | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    relevant = True
+                elif self._names is None or name in self._names:
+                    relevant = True
+
+    def wait(self, timeout):
+        end = time.monotonic() + max(0.0, timeout)
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if readable and self._drain():
+                return True
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class Win32ChangeWatcher(FileWatcher):
+    """Windows の変更通知ハンドル (FindFirstChangeNotificationW) による監視"""
+
+    name = "win32"
+
+    FILE_NOTIFY_CHANGE_FILE_NAME = 0x00000001
+    FILE_NOTIFY_CHANGE_SIZE = 0x00000008
+    FILE_NOTIFY_CHANGE_LAST_WRITE = 0x00000010
+    WAIT_OBJECT_0 = 0x00000000
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+    def __init__(self, directory, names=None):
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._kernel32.FindFirstChangeNotificationW.restype = ctypes.c_void_p
+        self._kernel32.FindFirstChangeNotificationW.argtypes = [
+            ctypes.c_wchar_p, ctypes.c_int, ctypes.c_uint32]
+        self._kernel32.FindNextChangeNotification.argtypes = [ctypes.c_void_p]
+        self._kernel32.FindCloseChangeNotification.argtypes = [ctypes.c_void_p]
+        self._kernel32.WaitForSingleObject.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self._kernel32.WaitForSingleObject.restype = ctypes.c_uint32
+        flags = (self.FILE_NOTIFY_CHANGE_FILE_NAME | self.FILE_NOTIFY_CHANGE_SIZE
+                 | self.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        handle = self._kernel32.FindFirstChangeNotificationW(str(directory), 0, flags)
+        if handle is None or handle == self.INVALID_HANDLE_VALUE:
+            raise ctypes.WinError(ctypes.get_last_error())
+        self._handle = handle
+
+    def wait(self, timeout):
+        ms = int(max(0.0, timeout) * 1000)
+        rc = self._kernel32.WaitForSingleObject(self._handle, ms)
+        if rc != self.WAIT_OBJECT_0:
+            return False
+        # 通知はディレクトリ単位なのでファイル名での絞り込みはしない
+        self._kernel32.FindNextChangeNotification(self._handle)
+        return True
+
+    def close(self):
+        if self._handle is not None:
+            self._kernel32.FindCloseChangeNotification(self._handle)
+            self._handle = None
+
+
+class FakeWatcher(FileWatcher):
+    """
+    テスト用の監視バックエンド
+
+    push() で投入したイベントを wait() が1件ずつ返す。イベントが callable の場合は
+    wait() の中で呼び出すので、ファイル作成やリネームなどの副作用を順番に再現できる。
+    イベントが無いときは timeout 分 (real_sleep=False なら 0 秒) だけ待って False を返す。
+    """
+
+    name = "fake"
+
+    def __init__(self, events=(), real_sleep=True):
+        self._events = collections.deque(events)
+        self._cond = threading.Condition()
+        self.real_sleep = real_sleep
+        self.wait_calls = []
+
+    def push(self, event=None):
+        with self._cond:
+            self._events.append(event)
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        self.wait_calls.append(timeout)
+        with self._cond:
+            if not self._events and self.real_sleep:
+                self._cond.wait(max(0.0, timeout))
+            if not self._events:
+                return False
+            event = self._events.popleft()
+        if callable(event):
+            event()
+        return True
+
+
+def create_file_watcher(directory, names=None, backend="auto",
+                        poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    ディレクトリ監視オブジェクトを生成する
+
+    backend: "auto" / "inotify" / "win32" / "polling" / FileWatcher インスタンス /
+             (directory, names) を受け取るファクトリ関数
+    "auto" は OS ネイティブの監視を試し、使えなければ polling にフォールバックする。
+    """
+    if isinstance(backend, FileWatcher):
+        return backend
+    if callable(backend):
+        return backend(directory, names)
+    if backend == "polling":
+        return PollingWatcher(poll_interval)
+    if backend == "inotify":
+        return InotifyWatcher(directory, names)
+    if backend == "win32":
+        return Win32ChangeWatcher(directory, names)
+    if backend != "auto":
+        raise ValueError(f"未知のファイル監視バックエンド: {backend}")
+
+    try:
+        if sys.platform.startswith("linux"):
+            return InotifyWatcher(directory, names)
+        if sys.platform == "win32":
+            return Win32ChangeWatcher(directory, names)
+    except OSError:
+        pass
+    return PollingWatcher(poll_interval)
@@ -0,0 +1,365 @@
+"""
+ブラウザを使わない HTTP 直接実行ランナー (サーバー側の高速回帰確認用)
+
+IE / Edge / pywinauto を使わず、ブラウザが行うのと同じ HTTP リクエストで
+ログイン → ダウンロードページ → CSV保存 のシナリオを実行する。
+Linux の CI でも動作し、1プロセスで毎分数百回のシナリオ実行ができる。
+
+- 接続は keep-alive で使い回す (HttpSession)
+- ダウンロードはブラウザと同じく <保存先>.partial に書き込み、完了後にリネームする
+- 完了待ち・保存確認は selenium_ie_test.py と同じ download_check を使う
+- シナリオはシナリオエンジン (scenario_engine.run_scenario) で実行する。HttpBackend は
+  COM / Selenium 版と同じロケーターでページを解析して操作する
+
+前提条件:
+- Flaskサーバー (app.py) が起動していること (http://localhost:5000)
+
+使い方:
+    python automation/http_fast_test.py --save-path /tmp/download --runs 100
+"""
+
+import argparse
+import http.client
+import http.cookies
+import logging
+import os
+import time
+import urllib.parse
+from html.parser import HTMLParser
+
+import com_dom
+import scenario_engine
+import step_trace
+from download_check import fetch_bundle_expected, fetch_expected
+
+# ===== 設定 =====
+BASE_URL = "http://localhost:5000"
+SAVE_PATH = r"D:\Git\iemode_dl_test\download"
+SAVE_FILENAME = "sample.csv"
+USER_ID = "testuser"
+PASSWORD = "testpass"
+
+# ===== マニフェストで照合するダウンロードの URL =====
+DOWNLOAD_URL_PATH = "/download/csv"
+# 複数のCSVをまとめたZIP (URL は download.html のリンクと同じ)
+BUNDLE_URL_PATH = "/download/bundle?entry=sample.csv&entry=generated_10000_0.csv"
+
+HTTP_TIMEOUT_SEC = 30
+MAX_REDIRECTS = 5
+DOWNLOAD_READ_SIZE = 256 * 1024
+WAIT_DOWNLOAD_TIMEOUT = 90
+WAIT_STABLE_SEC = 3
+
+_logger = logging.getLogger("iemode_dl_test")
+
+
+def init_logging(level=logging.INFO):
+    """標準出力へのログ出力を設定する (CI 向けにファイル出力はしない)"""
+    if _logger.handlers:
+        return
+    _logger.setLevel(logging.DEBUG)
+    handler = logging.StreamHandler()
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s",
+                                           "%Y-%m-%d %H:%M:%S"))
+    _logger.addHandler(handler)
+    _logger.propagate = False
+
+
+def log(message, level=logging.INFO):
+    _logger.log(level, message)
+
+
+class HttpSession:
+    """
+    keep-alive 接続と Cookie を保持する最小限の HTTP セッション
+
+    1つの接続を使い回し、サーバー側で切断されていた場合は1回だけ再接続して再送する。
+    スレッドセーフではないので、並列実行時はワーカーごとに1つ持つこと。
+    """
+
+    def __init__(self, base_url=BASE_URL, timeout=HTTP_TIMEOUT_SEC):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url.rstrip("/")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.cookies = http.cookies.SimpleCookie()
+        self._conn = None
+        self.requests = 0
+        self.connects = 0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connects += 1
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def clear_cookies(self):
+        self.cookies = http.cookies.SimpleCookie()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _headers(self, extra=None):
+        headers = {"Connection": "keep-alive"}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={m.value}" for k, m in self.cookies.items())
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def request(self, method, path, body=None, headers=None):
+        """リクエストを送信し、未読の HTTPResponse を返す (呼び出し側で読み切ること)"""
+        for attempt in range(2):
+            reused = self._conn is not None
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=self._headers(headers))
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            self.requests += 1
+            for cookie in resp.msg.get_all("Set-Cookie") or []:
+                self.cookies.load(cookie)
+            if resp.will_close:
+                # 本文を読み終えた後に再接続させる
+                self._conn = None
+            return resp
+        raise ConnectionError("HTTP接続の再試行に失敗しました")
+
+    def fetch(self, method, path, body=None, headers=None, follow_redirects=True):
+        """本文まで読み込んで (status, 最終パス, 本文) を返す。リダイレクトは GET で追従する"""
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self.request(method, path, body=body, headers=headers)
+            data = resp.read()
+            if follow_redirects and resp.status in (301, 302, 303, 307, 308):
+                location = resp.getheader("Location")
+                path = urllib.parse.urlsplit(urllib.parse.urljoin(self.base_url + path, location))
+                path = path.path + (f"?{path.query}" if path.query else "")
+                if resp.status in (301, 302, 303):
+                    method, body, headers = "GET", None, None
+                continue
+            return resp.status, path, data
+        raise RuntimeError(f"リダイレクトが{MAX_REDIRECTS}回を超えました: {path}")
+
+
+def step_download(session, href, save_dir=None, save_filename=SAVE_FILENAME, digest=None):
+    """
+    リンク先を <保存先>.partial にストリーミング保存し、完了後に本来の名前へリネームする
+
+    digest (file_digest.IncrementalFileDigest) を渡すと書き込んだチャンクをそのままハッシュする。
+    戻り値は selenium_ie_test.step_handle_save_dialog と同じ
+    (save_file_path, before_mtime, download_start)。
+    """
+    save_dir = SAVE_PATH if save_dir is None else save_dir
+    save_file_path = os.path.join(save_dir, save_filename)
+    partial_path = f"{save_file_path}.partial"
+    before_mtime = os.path.getmtime(save_file_path) if os.path.exists(save_file_path) else None
+    os.makedirs(save_dir, exist_ok=True)
+
+    resp = session.request("GET", href)
+    if resp.status != 200:
+        resp.read()
+        raise RuntimeError(f"ダウンロードに失敗しました: status={resp.status}")
+    expected = resp.getheader("Content-Length")
+    received = 0
+    with open(partial_path, "wb") as f:
+        # ファイルシステムの時刻で開始時刻を取る (time.time() との粒度差で新旧判定を誤らないため)
+        download_start = os.fstat(f.fileno()).st_mtime
+        while True:
+            chunk = resp.read(DOWNLOAD_READ_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            received += len(chunk)
+    if expected is not None and received != int(expected):
+        raise RuntimeError(f"ダウンロードが途中で終了しました: {received}/{expected} bytes")
+    os.replace(partial_path, save_file_path)
+    log(f"  [DEBUG] 保存先: {save_file_path} ({received} bytes)")
+    return save_file_path, before_mtime, download_start
+
+
+class HttpElement:
+    """HttpBackend の要素 (開始タグ1つ分)。form は属するフォームの番号 (フォーム外なら None)"""
+
+    def __init__(self, tag, attrs, form):
+        self.tag = tag
+        self.attrs = attrs
+        self.form = form
+        self.value = attrs.get("value") or ""
+
+
+class _DomParser(HTMLParser):
+    """ページ内の要素を開始タグ単位で列挙する (ロケーターでの検索用)"""
+
+    def __init__(self):
+        super().__init__()
+        self.elements = []
+        self.forms = []
+        self._form = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: v if v is not None else "" for k, v in attrs}
+        if "class" in attrs:
+            attrs["className"] = attrs["class"]
+        if tag == "form":
+            self.forms.append({"action": attrs.get("action") or "",
+                               "method": (attrs.get("method") or "GET").upper()})
+            self._form = len(self.forms) - 1
+        self.elements.append(HttpElement(tag, attrs, self._form))
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._form = None
+
+
+class HttpBackend(scenario_engine.ScenarioBackend):
+    """
+    ブラウザを使わないシナリオエンジン用バックエンド
+
+    ページの HTML を解析してロケーターで要素を探し、フォーム送信・リンク先の取得を
+    HTTP リクエストで行う。confirm ダイアログは出ないので click_with_confirm は
+    リンク先を覚えるだけで、save_as で step_download により保存する。
+    """
+
+    name = "http"
+    wait_download_timeout = WAIT_DOWNLOAD_TIMEOUT
+    wait_stable_sec = WAIT_STABLE_SEC
+
+    def __init__(self, base_url=BASE_URL, session=None):
+        self._owned = session is None
+        self.session = HttpSession(base_url) if session is None else session
+        self.path = None
+        self._page = _DomParser()
+        self._href = None
+
+    def _path_of(self, url):
+        current = self.session.base_url + (self.path or "/")
+        parts = urllib.parse.urlsplit(urllib.parse.urljoin(current, url))
+        return parts.path + (f"?{parts.query}" if parts.query else "")
+
+    def _load(self, method, url, body=None, headers=None):
+        status, final_path, data = self.session.fetch(method, self._path_of(url), body=body,
+                                                      headers=headers)
+        if status != 200:
+            raise RuntimeError(f"ページの取得に失敗しました: status={status}, path={final_path}")
+        self.path = final_path
+        self._page = _DomParser()
+        self._page.feed(data.decode("utf-8"))
+
+    def navigate(self, url):
+        self._load("GET", url)
+
+    def find(self, locator, timeout, interval=None):
+        # 取得済みの HTML から探すので待たない
+        selector = com_dom.SimpleSelector(com_dom.locator_to_css(locator))
+        for element in self._page.elements:
+            if selector.tag in (None, element.tag) and selector.matches(element.attrs):
+                return element
+        raise RuntimeError(f"要素が見つかりません: {locator} (path={self.path})")
+
+    def type(self, element, text):
+        element.value = text
+
+    def submit(self, element):
+        if element.form is None:
+            raise RuntimeError(f"フォーム外の要素では送信できません: <{element.tag}>")
+        form = self._page.forms[element.form]
+        fields = {e.attrs["name"]: e.value for e in self._page.elements
+                  if e.form == element.form and e.attrs.get("name")
+                  and e.tag in ("input", "textarea", "select")}
+        if element.attrs.get("name"):
+            fields[element.attrs["name"]] = element.value
+        body = urllib.parse.urlencode(fields)
+        if form["method"] == "POST":
+            self._load("POST", form["action"] or self.path, body=body,
+                       headers={"Content-Type": "application/x-www-form-urlencoded"})
+        else:
+            self._load("GET", f"{(form['action'] or self.path).split('?')[0]}?{body}")
+        log(f"[OK] フォーム送信 → {self.path} へ遷移")
+
+    def click_with_confirm(self, element):
+        href = element.attrs.get("href")
+        if not href:
+            raise RuntimeError(f"リンク先のない要素です: <{element.tag}>")
+        self._href = self._path_of(href)
+
+    def save_as(self, save_dir, filename):
+        if self._href is None:
+            raise RuntimeError("開始されたダウンロードがありません")
+        href, self._href = self._href, None
+        return step_download(self.session, href, save_dir, filename)
+
+    def close(self):
+        if self._owned:
+            self.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ブラウザを使わない HTTP 直接実行ランナー")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--save-path", default=SAVE_PATH)
+    parser.add_argument("--runs", type=int, default=1, help="シナリオの繰り返し回数")
+    parser.add_argument("--trace-dir", help="ステップ計測結果 (JSONL / Chrome trace) の出力先")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="マニフェスト (/manifest) との整合性確認を行わない")
+    parser.add_argument("--bundle", action="store_true",
+                        help=f"複数のCSVをまとめたZIP ({BUNDLE_URL_PATH}) をダウンロードする")
+    args = parser.parse_args()
+
+    init_logging(logging.INFO if args.runs == 1 else logging.WARNING)
+    # スパンは --trace-dir で出力するときだけ記録する
+    step_trace.tracer.enabled = bool(args.trace_dir)
+    if args.bundle:
+        link_locator = scenario_engine.LOC_BUNDLE_LINK
+        save_filename = scenario_engine.BUNDLE_FILENAME
+        fetch, url_path = fetch_bundle_expected, BUNDLE_URL_PATH
+    else:
+        link_locator, save_filename = scenario_engine.LOC_DOWNLOAD_LINK, SAVE_FILENAME
+        fetch, url_path = fetch_expected, DOWNLOAD_URL_PATH
+    expected = None if args.no_verify else fetch(args.base_url, url_path)
+    failures = 0
+    started = time.perf_counter()
+    with HttpSession(args.base_url) as session:
+        backend = HttpBackend(session=session)
+        for i in range(args.runs):
+            try:
+                # 毎回ログインからやり直す (接続は keep-alive のまま使い回す)
+                session.clear_cookies()
+                result = scenario_engine.run_scenario(backend, args.base_url, args.save_path,
+                                                      save_filename, expected=expected,
+                                                      link_locator=link_locator)
+                if result["status"] in ("missing", "stale", "corrupt"):
+                    failures += 1
+            except Exception as e:
+                failures += 1
+                log(f"\n[ERROR] テスト失敗 (run {i + 1}): {e}", logging.ERROR)
+                if args.runs == 1:
+                    raise
+        elapsed = time.perf_counter() - started
+        print(f"===== テスト完了: {args.runs} 回 / 失敗 {failures} 回 / {elapsed:.2f} 秒 "
+              f"({args.runs / elapsed * 60:.0f} 回/分, 接続 {session.connects} 回) =====")
+    if args.trace_dir:
+        jsonl_path, chrome_path = step_trace.export_run(args.trace_dir)
+        print(f"[OK] トレース出力: {jsonl_path} / {chrome_path}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,69 +10,96 @@ COM直接操作（InternetExplorer.Application）でIEを起動・操作する
 """
 
 import os
-import subprocess
-import threading
 import time
 import comtypes.client
 from pywinauto import Desktop
 
+import com_dom
+import dialog_watcher
+import process_table
+import run_history
+import scenario_engine
+import session_pool
+import step_trace
+import wait_engine
+from download_check import fetch_expected
+
 # ===== 設定 =====
 BASE_URL = "http://localhost:5000"
 SAVE_PATH = r"D:\Git\iemode_dl_test\download"
+TRACE_DIR = r"D:\Git\iemode_dl_test\log"
+SAVE_FILENAME = "sample.csv"
+DOWNLOAD_URL_PATH = "/download/csv"
 USER_ID = "testuser"
 PASSWORD = "testpass"
+IE_PROCESS_NAME = "iexplore.exe"
+INITIAL_URL = f"{BASE_URL}/login"
+# シナリオの繰り返し回数と、使い回す IE セッションの数・使用回数の上限
+SCENARIO_RUNS = 1
+SESSION_POOL_SIZE = 1
+SESSION_MAX_USES = 20
+
+# 条件待ちの上限 (条件が満たされればその時点で次へ進む)
+WAIT_PROCESS_START = 2
+WAIT_PROCESS_EXIT = 1
+WAIT_NAVIGATION_START = 2
+WAIT_FOCUS = 1
+WAIT_MENU = 2
+WAIT_SAVE_START = 5
+# 条件で判定できないキー入力の間隔
+KEYSTROKE_PAUSE_SEC = 0.1
+
+# 要素のロケーター (Selenium 版と同じ (strategy, value) 形式。シナリオエンジンと共通)
+LOC_USER_ID = scenario_engine.LOC_USER_ID
+LOC_PASSWORD = scenario_engine.LOC_PASSWORD
+LOC_LOGIN_BUTTON = scenario_engine.LOC_LOGIN_BUTTON
+LOC_DOWNLOAD_LINK = scenario_engine.LOC_DOWNLOAD_LINK
 
 # このプログラムが起動したプロセスのPIDを記録する
-_tracked_pids = set()
+_tracker = process_table.PidTracker(IE_PROCESS_NAME)
 
 
-def get_pids(process_name):
-    """指定プロセス名の現在のPID一覧を取得する"""
-    result = subprocess.run(
-        ["tasklist", "/FI", f"IMAGENAME eq {process_name}", "/FO", "CSV", "/NH"],
-        capture_output=True, text=True,
-    )
-    pids = set()
-    for line in result.stdout.strip().splitlines():
-        parts = line.replace('"', '').split(',')
-        if len(parts) >= 2 and parts[1].isdigit():
-            pids.add(int(parts[1]))
-    return pids
+@step_trace.traced()
+def get_pids(process_name, max_age=None):
+    """
+    指定プロセス名の現在のPID一覧を取得する
+
+    max_age 秒以内に取得したプロセス一覧があれば使い回す (状態変化を待つときは 0)。
+    """
+    return process_table.get_process_table().pids(name=process_name, max_age=max_age)
 
 
 def kill_pids(pids):
-    """指定したPIDリストのプロセスを強制終了する"""
-    for pid in pids:
-        subprocess.run(
-            ["taskkill", "/F", "/PID", str(pid)],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+    """指定したPIDリストのプロセスをまとめて強制終了する"""
+    process_table.get_process_table().kill(pids)
 
 
-def snapshot_before():
+def snapshot_before(tracker=None):
     """ブラウザ起動前のiexplore.exe PIDを記録する"""
-    return get_pids("iexplore.exe")
+    return (tracker or _tracker).snapshot()
+
 
+def track_new_pids(before_pids, tracker=None):
+    """
+    起動前後を比較し、新しく生まれたPIDを記録する
 
-def track_new_pids(before_pids):
-    """起動前後を比較し、新しく生まれたPIDを記録する"""
-    global _tracked_pids
-    after_pids = get_pids("iexplore.exe")
-    new_pids = after_pids - before_pids
-    _tracked_pids.update(new_pids)
+    tracker を渡すとその実行専用の追跡コンテキストに記録する (並列実行用)。
+    """
+    new_pids = (tracker or _tracker).track_new(before_pids)
     print(f"  [DEBUG] 新規IEプロセスPID: {new_pids if new_pids else 'なし'}")
 
 
-def cleanup_tracked():
+@step_trace.traced()
+def cleanup_tracked(tracker=None):
     """このプログラムが起動したプロセスだけを終了する"""
-    if _tracked_pids:
-        print(f"  [CLEANUP] 終了対象PID: {_tracked_pids}")
-        kill_pids(_tracked_pids)
-    time.sleep(1)
+    tracker = tracker or _tracker
+    if tracker.pids:
+        print(f"  [CLEANUP] 終了対象PID: {tracker.pids}")
+        tracker.cleanup(timeout=WAIT_PROCESS_EXIT)
     print("[OK] プログラム起動分のプロセスをクリーンアップ")
 
 
+@step_trace.traced()
 def create_ie():
     """IWebBrowser2 COMオブジェクトを生成し、ブラウザを表示する"""
     ie = comtypes.client.CreateObject("InternetExplorer.Application")
@@ -80,88 +107,184 @@ def create_ie():
     return ie
 
 
+@step_trace.traced()
 def wait_for_ready(ie, timeout=15):
     """IEのReadyState==4 (READYSTATE_COMPLETE) を待機する"""
-    start = time.time()
-    while time.time() - start < timeout:
-        if ie.ReadyState == 4:
-            return True
-        time.sleep(0.5)
-    raise TimeoutError(f"ページ読み込みが{timeout}秒以内に完了しませんでした")
+    return wait_engine.wait_until(
+        lambda: ie.ReadyState == 4,
+        timeout,
+        f"ページ読み込みが{timeout}秒以内に完了しませんでした",
+    )
+
 
+def wait_for_navigation_start(ie, timeout=WAIT_NAVIGATION_START):
+    """
+    遷移が始まる (Busy になる / ReadyState が完了以外になる) のを待つ
 
+    遷移前の ReadyState==4 を完了と誤認しないため、wait_for_ready の前に呼ぶ。
+    すでに遷移が終わっていた場合も timeout で抜けるだけなので続行してよい。
+    """
+    wait_engine.wait_until(lambda: ie.Busy or ie.ReadyState != 4, timeout,
+                           raise_on_timeout=False)
+
+
+@step_trace.traced()
 def navigate(ie, url):
     """指定URLに遷移し、読み込み完了を待つ"""
     ie.Navigate(url)
-    time.sleep(1)
+    wait_for_navigation_start(ie)
     wait_for_ready(ie)
 
 
-def get_document(ie):
-    """IEのHTMLDocumentオブジェクトを取得する"""
-    return ie.Document
+def _create_tracked_ie(tracker=None):
+    """IE を起動し、そのとき増えた iexplore.exe の PID を追跡対象に加える"""
+    before_pids = snapshot_before(tracker)
+    print(f"  [DEBUG] 起動前のIE PID数: {len(before_pids)}")
+    ie = create_ie()
+    # iexplore.exe が現れるまで待つ (見えなくても追跡処理は続行)
+    wait_engine.wait_until(lambda: get_pids(IE_PROCESS_NAME, max_age=0) - before_pids,
+                           WAIT_PROCESS_START, raise_on_timeout=False)
+    track_new_pids(before_pids, tracker)
+    return ie
 
 
-def step_login(ie):
-    """ログインページでユーザーID・パスワードを入力し、ログインボタンを押す"""
-    navigate(ie, f"{BASE_URL}/login")
+def _probe_ie(ie):
+    """プールから貸し出す前の生存確認 (ReadyState が取れれば生きている)"""
+    return ie.ReadyState is not None
 
-    doc = get_document(ie)
-    # class名で要素を取得
-    userid_inputs = doc.getElementsByClassName("txtUserID")
-    password_inputs = doc.getElementsByClassName("txtPassWord")
 
-    if userid_inputs.length == 0 or password_inputs.length == 0:
-        raise RuntimeError("ログインフォームの要素が見つかりません")
+# HttpOnly でない Cookie を期限切れにする (COM からは Cookie を直接消せないため)
+_CLEAR_COOKIES_SCRIPT = (
+    "var c = document.cookie.split(';');"
+    "for (var i = 0; i < c.length; i++) {"
+    "  var n = c[i].split('=')[0].replace(/^\\s+/, '');"
+    "  if (n) { document.cookie = n + '=; expires=Thu, 01 Jan 1970 00:00:00 GMT; path=/'; }"
+    "}"
+)
 
-    userid_inputs.item(0).value = USER_ID
-    password_inputs.item(0).value = PASSWORD
 
-    # ログインボタンをクリック
-    buttons = doc.getElementsByTagName("button")
-    buttons.item(0).click()
+def _reset_ie(ie):
+    """次のシナリオのために初期URLへ戻し、Cookie を削除する"""
+    navigate(ie, INITIAL_URL)
+    ie.Document.parentWindow.execScript(_CLEAR_COOKIES_SCRIPT)
 
-    # ダウンロードページへの遷移を待機
-    time.sleep(2)
-    wait_for_ready(ie)
-    print("[OK] ログイン完了 → ダウンロードページへ遷移")
+
+def _quit_ie(ie):
+    ie.Quit()
+
+
+def create_session_pool(size=SESSION_POOL_SIZE, max_uses=SESSION_MAX_USES,
+                        factory=_create_tracked_ie):
+    """
+    IE COM セッションのプールを作る (factory を差し替えるとブラウザなしでテストできる)
+
+    IE の COM オブジェクトは作ったスレッドのアパートメント (STA) でしか使えないので、
+    起動もシナリオを実行するスレッドで行う (thread_affine)。
+    """
+    return session_pool.SessionPool(factory, size=size, max_uses=max_uses,
+                                    probe=_probe_ie, reset=_reset_ie, destroy=_quit_ie,
+                                    thread_affine=True)
+
+
+def get_document(ie):
+    """IEのHTMLDocumentオブジェクトを取得する"""
+    return ie.Document
 
 
-def _handle_confirm_dialog_thread():
-    """別スレッドでconfirmダイアログを待機してOKを押す"""
-    desktop = Desktop(backend="win32")
-    dialog = desktop.window(class_name="#32770", title_re=".*Web.*")
-    dialog.wait("visible", timeout=15)
+def _accept_confirm_dialog(info):
+    """confirmダイアログでOKを押す (ダイアログ監視のルールから呼ばれる)"""
+    dialog = Desktop(backend="win32").window(handle=info.handle)
     dialog.set_focus()
     dialog["OK"].click()
     print("[OK] confirmダイアログでOKを選択")
 
 
-def step_click_download_and_confirm(ie):
+def _accept_overwrite_dialog(info):
     """
-    ダウンロードリンクをクリックし、confirmダイアログでOKを押す
+    上書き確認ダイアログで「はい」を押す (ダイアログ監視のルールから呼ばれる)
 
-    COM経由の link.click() は confirm() が閉じるまでブロックするため、
-    ダイアログ処理を別スレッドで先に起動してからクリックする。
+    ダイアログ監視のワーカースレッドは COM を初期化していないので、UIA (comtypes) ではなく
+    win32 バックエンドで操作する。
     """
-    # 先にダイアログ処理スレッドを起動
-    t = threading.Thread(target=_handle_confirm_dialog_thread, daemon=True)
-    t.start()
-
-    # リンクをクリック (confirmダイアログが出てブロックされる → 別スレッドがOKを押す → 戻る)
-    doc = get_document(ie)
-    links = doc.getElementsByTagName("a")
-    for i in range(links.length):
-        link = links.item(i)
-        href = link.getAttribute("href")
-        if href and "/download/csv" in str(href):
-            link.click()
+    confirm_overwrite = Desktop(backend="win32").window(handle=info.handle)
+    confirm_overwrite.child_window(title_re=r"はい\(&?Y\)", class_name="Button").click()
+    print("  [DEBUG] 上書き確認ダイアログで「はい」を選択")
+
+
+CONFIRM_RULE = dialog_watcher.DialogRule("confirm", title_re=".*Web.*", class_name="#32770",
+                                         action=_accept_confirm_dialog)
+OVERWRITE_RULE = dialog_watcher.DialogRule("overwrite", title="名前を付けて保存の確認",
+                                           action=_accept_overwrite_dialog)
+SAVE_DIALOG_RULE = dialog_watcher.DialogRule("save", title="名前を付けて保存")
+
+
+class ComBackend(scenario_engine.ScenarioBackend):
+    """IWebBrowser2 COM で操作するシナリオエンジン用バックエンド (ie は起動済みのもの)"""
+
+    name = "com"
+
+    def __init__(self, ie=None):
+        self._owned = ie is None
+        self.ie = _create_tracked_ie() if ie is None else ie
+
+    def navigate(self, url):
+        navigate(self.ie, url)
+
+    def find(self, locator, timeout, interval=None):
+        # ロケーター1つにつき querySelector 1回で探す (リンクを1件ずつ getAttribute で調べない)
+        return wait_engine.wait_until(
+            lambda: com_dom.DomQuery(get_document(self.ie)).find(locator), timeout,
+            f"要素が見つかりません: {locator}",
+            initial=interval or wait_engine.DEFAULT_INITIAL_INTERVAL)
+
+    def type(self, element, text):
+        element.value = text
+
+    def submit(self, element):
+        element.click()
+        # 遷移先ページの読み込みを待機
+        wait_for_navigation_start(self.ie)
+        wait_for_ready(self.ie)
+
+    def click_with_confirm(self, element):
+        """
+        COM経由の click() は confirm() が閉じるまでブロックするため、
+        ダイアログ監視に confirm の処理を期待として登録してからクリックする。
+        """
+        # クリック (confirmダイアログが出てブロックされる → 監視側がOKを押す → 戻る)
+        with dialog_watcher.get_watcher().expect(CONFIRM_RULE) as confirm:
+            element.click()
             print("[OK] ダウンロードリンクをクリック")
-            t.join(timeout=15)
-            return
-    raise RuntimeError("ダウンロードリンクが見つかりません")
+            confirm.wait(15)
+
+    def save_as(self, save_dir, filename):
+        save_dir = SAVE_PATH if save_dir is None else save_dir
+        path = os.path.join(save_dir, filename)
+        before_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        download_start = time.time()
+        step_handle_download_bar()
+        save_file_path = step_handle_save_dialog(save_dir, filename)
+        return save_file_path, before_mtime, download_start
+
+    def close(self):
+        if self._owned:
+            _quit_ie(self.ie)
+
+
+@step_trace.traced()
+def step_login(ie):
+    """ログインページでユーザーID・パスワードを入力し、ログインボタンを押す"""
+    scenario_engine.step_login(ComBackend(ie), BASE_URL, USER_ID, PASSWORD)
+    print("[OK] ログイン完了 → ダウンロードページへ遷移")
+
+
+@step_trace.traced()
+def step_click_download_and_confirm(ie):
+    """ダウンロードリンクをクリックし、confirmダイアログでOKを押す"""
+    scenario_engine.step_click_download_and_confirm(ComBackend(ie))
 
 
+@step_trace.traced()
 def step_handle_download_bar():
     """
     IEのダウンロード通知バーで「名前を付けて保存」を実行する
@@ -176,7 +299,6 @@ def step_handle_download_bar():
         └── Button '閉じる'
     """
     desktop = Desktop(backend="uia")
-    time.sleep(3)  # ダウンロードバーの表示を待機
 
     # IEウィンドウを検出・最前面化
     ie_window = desktop.window(title_re=".*Internet Explorer.*")
@@ -193,17 +315,19 @@ def step_handle_download_bar():
     save_button.wait("visible", timeout=10)
     dropdown = save_button.child_window(title="6", control_type="SplitButton")
     dropdown.click_input()
-    time.sleep(1)
 
     # 「名前を付けて保存」メニュー項目をクリック
     save_as_item = desktop.window(control_type="Menu").child_window(
         title="名前を付けて保存(A)", control_type="MenuItem"
     )
+    wait_engine.wait_until(lambda: save_as_item.exists(timeout=0), WAIT_MENU,
+                           "ダウンロードバーのメニューが表示されませんでした")
     save_as_item.click_input()
     print("[OK] ダウンロードバーで「名前を付けて保存」を選択")
 
 
-def step_handle_save_dialog():
+@step_trace.traced()
+def step_handle_save_dialog(save_dir=None, filename=SAVE_FILENAME):
     """
     「名前を付けて保存」ダイアログでファイルパスを指定して保存する
 
@@ -215,14 +339,15 @@ def step_handle_save_dialog():
 
     desktop = Desktop(backend="uia")
 
-    save_dialog = desktop.window(title="名前を付けて保存")
-    save_dialog.wait("visible", timeout=15)
+    info = dialog_watcher.get_watcher().expect(SAVE_DIALOG_RULE).wait(15)
+    save_dialog = desktop.window(handle=info.handle)
     save_dialog.set_focus()
-    time.sleep(1)
+    _wait_active(save_dialog)
 
-    # 保存先ファイルパス
-    save_file_path = os.path.join(SAVE_PATH, "sample.csv")
-    os.makedirs(SAVE_PATH, exist_ok=True)
+    # 保存先ファイルパス (並列実行時は実行ごとのディレクトリ)
+    save_dir = SAVE_PATH if save_dir is None else save_dir
+    save_file_path = os.path.join(save_dir, filename)
+    os.makedirs(save_dir, exist_ok=True)
     print(f"  [DEBUG] 保存先: {save_file_path}")
 
     # --- ファイル名入力 ---
@@ -230,6 +355,7 @@ def step_handle_save_dialog():
     # 方法2: title に "ファイル名" を含む ComboBox/Edit を探す
     # 方法3: キーボード操作 (Alt+N でファイル名フィールドにフォーカス)
     file_name_set = False
+    fn_edit = None
 
     # 方法1: FileNameControlHost
     try:
@@ -239,6 +365,7 @@ def step_handle_save_dialog():
         file_name_set = True
         print("  [DEBUG] ファイル名設定: FileNameControlHost経由")
     except Exception as e1:
+        step_trace.retry()
         print(f"  [DEBUG] FileNameControlHost失敗: {e1}")
 
     # 方法2: title_re でファイル名フィールドを探す
@@ -250,32 +377,39 @@ def step_handle_save_dialog():
             file_name_set = True
             print("  [DEBUG] ファイル名設定: title_re経由")
         except Exception as e2:
+            step_trace.retry()
             print(f"  [DEBUG] title_re(Edit)失敗: {e2}")
 
     # 方法3: キーボードで直接入力 (Alt+N → ファイル名欄にフォーカス)
     if not file_name_set:
         try:
             save_dialog.set_focus()
-            time.sleep(0.5)
+            _wait_active(save_dialog)
             kbd.send_keys("%n")  # Alt+N
-            time.sleep(0.5)
+            wait_engine.pause(KEYSTROKE_PAUSE_SEC)
             kbd.send_keys("^a")  # Ctrl+A (全選択)
             kbd.send_keys(save_file_path, with_spaces=True)
             file_name_set = True
             print("  [DEBUG] ファイル名設定: キーボード(Alt+N)経由")
         except Exception as e3:
+            step_trace.retry()
             print(f"  [DEBUG] キーボード入力失敗: {e3}")
 
     if not file_name_set:
         raise RuntimeError("ファイル名フィールドへの入力に失敗しました")
 
-    time.sleep(0.5)
+    # 入力がコントロールに反映されるまで待つ (キーボード入力時は確認できないので上限まで待たない)
+    if fn_edit is not None:
+        wait_engine.wait_until(lambda: fn_edit.window_text() == save_file_path, WAIT_FOCUS,
+                               raise_on_timeout=False, ignore_exceptions=(Exception,))
 
     # --- 保存ボタン押下 ---
     # 方法1: auto_id="1" (標準ダイアログのIDOK)
     # 方法2: title_re で保存ボタンを探す
     # 方法3: Alt+S キーボードショートカット
     # 方法4: Enter キー
+    # 上書き確認はダイアログ監視のルール (OVERWRITE_RULE) が「はい」を押すので、押下前に期待を登録する
+    overwrite = dialog_watcher.get_watcher().expect(OVERWRITE_RULE)
     save_clicked = False
 
     # 方法1: auto_id="1"
@@ -285,6 +419,7 @@ def step_handle_save_dialog():
         save_clicked = True
         print("  [DEBUG] 保存ボタン押下: auto_id=1経由")
     except Exception as e1:
+        step_trace.retry()
         print(f"  [DEBUG] auto_id=1失敗: {e1}")
 
     # 方法2: title_re
@@ -296,17 +431,19 @@ def step_handle_save_dialog():
             save_clicked = True
             print("  [DEBUG] 保存ボタン押下: title_re経由")
         except Exception as e2:
+            step_trace.retry()
             print(f"  [DEBUG] title_re(Button)失敗: {e2}")
 
     # 方法3: Alt+S キーボードショートカット
     if not save_clicked:
         try:
             save_dialog.set_focus()
-            time.sleep(0.3)
+            _wait_active(save_dialog)
             kbd.send_keys("%s")  # Alt+S
             save_clicked = True
             print("  [DEBUG] 保存ボタン押下: Alt+S経由")
         except Exception as e3:
+            step_trace.retry()
             print(f"  [DEBUG] Alt+Sキー送信失敗: {e3}")
 
     # 方法4: Enter キー
@@ -316,75 +453,92 @@ def step_handle_save_dialog():
             save_clicked = True
             print("  [DEBUG] 保存ボタン押下: Enterキー経由")
         except Exception as e4:
+            step_trace.retry()
             print(f"  [DEBUG] Enterキー送信失敗: {e4}")
 
     if not save_clicked:
+        overwrite.cancel()
         raise RuntimeError("保存ボタンの押下に失敗しました")
 
-    time.sleep(2)
-
     # 「上書き確認」ダイアログが出た場合に対応
     try:
-        confirm_overwrite = desktop.window(title="名前を付けて保存の確認")
-        if confirm_overwrite.exists(timeout=2):
-            confirm_overwrite.child_window(title="はい(&Y)",
-                                            control_type="Button").click_input()
-            print("  [DEBUG] 上書き確認ダイアログで「はい」を選択")
-            time.sleep(1)
+        # 上書き確認が出るか、保存ダイアログが閉じる (上書きなし) まで待つ
+        wait_engine.wait_until(lambda: overwrite.seen() or not save_dialog.exists(timeout=0),
+                               WAIT_SAVE_START, raise_on_timeout=False)
+        if overwrite.seen():
+            overwrite.wait(WAIT_SAVE_START)
     except Exception:
         pass  # 上書き確認が出なければスキップ
+    finally:
+        overwrite.cancel()
 
     print("[OK] 「名前を付けて保存」ダイアログで保存を実行")
+    return save_file_path
 
 
-def main():
-    ie = None
+def _wait_active(window):
+    """ウィンドウがアクティブになるまで待つ (判定できなくても続行)"""
+    wait_engine.wait_until(window.is_active, WAIT_FOCUS, raise_on_timeout=False,
+                           ignore_exceptions=(Exception,))
+
+
+def _export_trace():
+    """ステップごとの計測結果を JSONL / Chrome trace 形式で TRACE_DIR に出力する"""
     try:
-        # Step 0: PID記録
-        before_pids = snapshot_before()
-        print(f"  [DEBUG] 起動前のIE PID数: {len(before_pids)}")
+        jsonl_path, chrome_path = step_trace.export_run(TRACE_DIR)
+        print(f"[OK] トレース出力: {jsonl_path} / {chrome_path}")
+    except Exception as e:
+        print(f"  [WARN] トレース出力に失敗: {e}")
 
-        # Step 1: IE起動 (COM経由)
-        print("IE (IWebBrowser2 COM) を起動中...")
-        ie = create_ie()
-        time.sleep(2)
-        track_new_pids(before_pids)
-        print("[OK] IE起動完了")
 
-        # Step 2: ログイン
-        step_login(ie)
+def _enable_history():
+    """実行履歴を TRACE_DIR に記録し、待ちのタイムアウトを履歴から決める (失敗しても固定値で続行)"""
+    path = os.path.join(TRACE_DIR, "history.sqlite3")
+    try:
+        run_history.enable(path)
+        print(f"  [DEBUG] 実行履歴: {path}")
+    except Exception as e:
+        print(f"  [WARN] 実行履歴を開けません。固定のタイムアウトを使用: {e}")
 
-        # Step 3-4: ダウンロードリンククリック + confirmダイアログ処理
-        step_click_download_and_confirm(ie)
 
-        # Step 5: ダウンロードバー処理
-        step_handle_download_bar()
+def run_scenario(ie, save_dir=None, expected=None):
+    """ログイン → ダウンロード → 保存 → 完了待ち → 保存確認 を1回実行する (シナリオエンジン経由)"""
+    result = scenario_engine.run_scenario(ComBackend(ie), BASE_URL, save_dir, SAVE_FILENAME,
+                                          USER_ID, PASSWORD, expected)
+    print(f"[OK] ファイル保存確認: {result['path']} ({result['status']})")
+    return result
 
-        # Step 6: 名前を付けて保存
-        step_handle_save_dialog()
 
-        # Step 7: ファイル存在確認
-        save_file_path = os.path.join(SAVE_PATH, "sample.csv")
-        if os.path.exists(save_file_path):
-            file_size = os.path.getsize(save_file_path)
-            print(f"[OK] ファイル保存確認: {save_file_path} ({file_size} bytes)")
-        else:
-            print(f"[WARN] ファイルが見つかりません: {save_file_path}")
+def main():
+    pool = None
+    _enable_history()
+    try:
+        # Step 0-1: PID記録 + IE起動 (COM経由)。起動済みのセッションを使い回す
+        print("IE (IWebBrowser2 COM) を起動中...")
+        pool = create_session_pool()
+        pool.start()
+        print("[OK] IE起動完了")
+        # 保存ファイルの照合に使うマニフェスト (サイズ・行数・SHA-256)
+        expected = fetch_expected(BASE_URL, DOWNLOAD_URL_PATH)
 
-        print("\n===== テスト完了 =====")
-        time.sleep(2)
+        for run in range(1, SCENARIO_RUNS + 1):
+            with step_trace.span("scenario", run=run), pool.session() as ie:
+                result = run_scenario(ie, expected=expected)
+            if result["status"] == "corrupt":
+                raise RuntimeError(f"保存ファイルがマニフェストと一致しません: "
+                                   f"{result['integrity']['problems']}")
+            print(f"\n===== テスト完了 ({run}/{SCENARIO_RUNS}) =====")
 
     except Exception as e:
         print(f"\n[ERROR] テスト失敗: {e}")
         raise
     finally:
-        if ie:
-            try:
-                ie.Quit()
-            except Exception:
-                pass
+        if pool:
+            print(f"  [DEBUG] セッションプール: {pool.stats()}")
+            pool.close()
         cleanup_tracked()
         print("ブラウザを終了しました")
+        _export_trace()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,361 @@
+"""
+シナリオの並列実行 (実行ごとに独立したダウンロード先と PID 追跡)
+
+K 個のワーカー (スレッドまたはプロセス) がそれぞれ1つのランナーを持ち、
+N 回のシナリオを分担して実行する。各実行には次を割り当てる。
+
+- ダウンロード先 : <save-path>/run-00001 のような実行専用ディレクトリ
+                   (同じファイルへの上書きや上書き確認ダイアログが起きない)
+- PID 追跡       : 実行専用の process_table.PidTracker (ブラウザを起動するランナーのみ)
+
+結果は実行ごとの所要時間・ステップ別時間をまとめた1つのレポート (JSON) にする。
+
+ランナー:
+- http : http_fast_test.HttpBackend でシナリオエンジンを実行 (ワーカーごとに keep-alive の HttpSession を持つ)
+- fake : ブラウザもサーバーも使わない疑似ランナー (Linux でのスケジューリング確認用)
+
+使い方:
+    python automation/parallel_runner.py --runner http --runs 200 --concurrency 8 \\
+        --save-path /tmp/parallel --output report.json
+    python automation/parallel_runner.py --runner fake --runs 1000 --concurrency 16 --mode process
+"""
+
+import argparse
+import concurrent.futures
+import inspect
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+
+import http_fast_test
+import process_table
+import scenario_engine
+import step_trace
+import wait_engine
+from download_check import fetch_expected, verify_saved_file
+
+SAVE_PATH = http_fast_test.SAVE_PATH
+DEFAULT_CONCURRENCY = 4
+OK_STATUSES = ("created", "updated")
+
+
+class RunContext:
+    """1回の実行に割り当てる資源"""
+
+    def __init__(self, run_id, download_dir, pids=None):
+        self.run_id = run_id
+        self.download_dir = download_dir
+        self.pids = pids
+
+
+class HttpScenarioRunner:
+    """HttpBackend でシナリオエンジンを実行するランナー (ワーカーごとに1つ)"""
+
+    name = "http"
+    process_name = None
+
+    def __init__(self, base_url=http_fast_test.BASE_URL, user_id=http_fast_test.USER_ID,
+                 password=http_fast_test.PASSWORD, verify=True):
+        self.base_url = base_url
+        self.session = http_fast_test.HttpSession(base_url)
+        self.backend = http_fast_test.HttpBackend(session=self.session)
+        self.user_id = user_id
+        self.password = password
+        # マニフェストはワーカーごとに1回だけ取得する (サーバー側でもファイル更新までキャッシュ)
+        self.expected = (fetch_expected(base_url, http_fast_test.DOWNLOAD_URL_PATH)
+                         if verify else None)
+
+    def run(self, ctx):
+        # 前回の実行のセッション Cookie を持ち越さず、毎回ログインからやり直す
+        self.session.clear_cookies()
+        return scenario_engine.run_scenario(self.backend, self.base_url, ctx.download_dir,
+                                            user_id=self.user_id, password=self.password,
+                                            expected=self.expected)
+
+    def close(self):
+        self.session.close()
+
+
+class FakeScenarioRunner:
+    """
+    疑似ランナー
+
+    ブラウザ起動 (FakeProcessTable への spawn) → duration 秒の待ち → ファイル保存 を行う。
+    failure_rate の割合で例外を投げ、失敗時の後始末や集計も確認できる。
+    """
+
+    name = "fake"
+    process_name = "fakebrowser.exe"
+    _table = None
+    _table_lock = threading.Lock()
+    # PID の差分取得が他の実行と混ざらないよう、起動区間だけは直列にする
+    _launch_lock = threading.Lock()
+
+    def __init__(self, duration=0.05, failure_rate=0.0, seed=None):
+        self.duration = duration
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        with self._table_lock:
+            if FakeScenarioRunner._table is None:
+                FakeScenarioRunner._table = process_table.FakeProcessTable(ttl=0)
+        self.process_table = FakeScenarioRunner._table
+
+    def run(self, ctx):
+        timings = {}
+        t0 = time.perf_counter()
+        with step_trace.span("fake_launch"), self._launch_lock:
+            before = ctx.pids.snapshot()
+            self.process_table.spawn(self.process_name, f"--run {ctx.run_id}")
+            ctx.pids.track_new(before)
+        timings["fake_launch"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with step_trace.span("fake_download"):
+            wait_engine.pause(self.duration * self._rng.uniform(0.5, 1.5))
+            if self._rng.random() < self.failure_rate:
+                raise RuntimeError(f"疑似ランナーの失敗 (run {ctx.run_id})")
+            path = os.path.join(ctx.download_dir, http_fast_test.SAVE_FILENAME)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"run,{ctx.run_id}\n")
+        timings["fake_download"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        status = verify_saved_file(path, None)
+        timings["verify_saved_file"] = time.perf_counter() - t0
+        return {"status": status, "path": path, "timings": timings}
+
+    def close(self):
+        pass
+
+
+RUNNERS = {
+    HttpScenarioRunner.name: HttpScenarioRunner,
+    FakeScenarioRunner.name: FakeScenarioRunner,
+}
+
+
+def _runner_class(name):
+    try:
+        return RUNNERS[name]
+    except KeyError:
+        raise ValueError(f"未知のランナー: {name}") from None
+
+
+def create_runner(name, **kwargs):
+    return _runner_class(name)(**kwargs)
+
+
+def check_runner_args(name, **kwargs):
+    """
+    ランナーを作らずに名前と引数の誤りを検出する (ValueError / TypeError)
+
+    http ランナーは作るとセッションを開いてマニフェストを取得するので、事前確認では作らない。
+    """
+    inspect.signature(_runner_class(name)).bind(**kwargs)
+
+
+def _pid_tracker(runner):
+    if not getattr(runner, "process_name", None):
+        return None
+    return process_table.PidTracker(runner.process_name,
+                                    getattr(runner, "cmdline_contains", None),
+                                    table=getattr(runner, "process_table", None))
+
+
+def run_one(runner, run_id, base_dir, keep_dirs=False):
+    """1回分のシナリオを実行専用ディレクトリ・PID 追跡付きで実行し、結果の dict を返す"""
+    download_dir = os.path.join(base_dir, f"run-{run_id:05d}")
+    shutil.rmtree(download_dir, ignore_errors=True)
+    os.makedirs(download_dir)
+    ctx = RunContext(run_id, download_dir, _pid_tracker(runner))
+    result = {
+        "run_id": run_id,
+        "worker": f"{os.getpid()}/{threading.current_thread().name}",
+        "download_dir": download_dir,
+        "path": None,
+        "status": None,
+        "ok": False,
+        "error": None,
+        "timings": {},
+        "pids": [],
+    }
+    t0 = time.perf_counter()
+    try:
+        with step_trace.span("scenario", run=run_id):
+            outcome = runner.run(ctx)
+        result["status"] = outcome["status"]
+        result["path"] = outcome.get("path")
+        result["timings"] = outcome.get("timings", {})
+        result["ok"] = outcome["status"] in OK_STATUSES
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        result["wall_sec"] = time.perf_counter() - t0
+        if ctx.pids is not None:
+            result["pids"] = sorted(ctx.pids.cleanup())
+    if result["ok"] and not keep_dirs:
+        shutil.rmtree(download_dir, ignore_errors=True)
+    return result
+
+
+# ===== プロセスプール用 (ワーカープロセスごとに1つのランナー) =====
+_process_runner = None
+
+
+def _init_process_worker(runner_name, runner_kwargs):
+    global _process_runner
+    http_fast_test.init_logging(logging.WARNING)
+    # 子プロセスのスパンは出力されないので記録しない
+    step_trace.tracer.enabled = False
+    _process_runner = create_runner(runner_name, **runner_kwargs)
+
+
+def _run_in_process(run_id, base_dir, keep_dirs):
+    return run_one(_process_runner, run_id, base_dir, keep_dirs)
+
+
+def _run_threads(runner_name, runner_kwargs, run_ids, concurrency, base_dir, keep_dirs):
+    local = threading.local()
+    runners = []
+    runners_lock = threading.Lock()
+
+    def _task(run_id):
+        runner = getattr(local, "runner", None)
+        if runner is None:
+            runner = local.runner = create_runner(runner_name, **runner_kwargs)
+            with runners_lock:
+                runners.append(runner)
+        return run_one(runner, run_id, base_dir, keep_dirs)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(concurrency,
+                                                   thread_name_prefix="worker") as pool:
+            return list(pool.map(_task, run_ids))
+    finally:
+        for runner in runners:
+            runner.close()
+
+
+def _run_processes(runner_name, runner_kwargs, run_ids, concurrency, base_dir, keep_dirs):
+    with concurrent.futures.ProcessPoolExecutor(
+            concurrency, initializer=_init_process_worker,
+            initargs=(runner_name, runner_kwargs)) as pool:
+        futures = [pool.submit(_run_in_process, run_id, base_dir, keep_dirs)
+                   for run_id in run_ids]
+        return [f.result() for f in futures]
+
+
+def percentile(sorted_values, pct):
+    """最近傍順位法によるパーセンタイル (sorted_values は昇順ソート済み)"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": values[-1],
+    }
+
+
+def build_report(results, runner_name, mode, concurrency, wall_sec):
+    results = sorted(results, key=lambda r: r["run_id"])
+    steps = {}
+    for r in results:
+        for name, sec in r["timings"].items():
+            steps.setdefault(name, []).append(sec)
+    ok = sum(1 for r in results if r["ok"])
+    return {
+        "runner": runner_name,
+        "mode": mode,
+        "concurrency": concurrency,
+        "runs": len(results),
+        "ok": ok,
+        "failed": len(results) - ok,
+        "wall_sec": wall_sec,
+        "runs_per_min": len(results) / wall_sec * 60 if wall_sec else 0.0,
+        "run_sec": _summarize([r["wall_sec"] for r in results]),
+        "steps_sec": {name: _summarize(values) for name, values in sorted(steps.items())},
+        "workers": len({r["worker"] for r in results}),
+        "results": results,
+    }
+
+
+def run_parallel(runner_name, runs, concurrency=DEFAULT_CONCURRENCY, base_dir=SAVE_PATH,
+                 mode="thread", runner_kwargs=None, keep_dirs=False):
+    """
+    runs 回のシナリオを concurrency 並列で実行し、レポートの dict を返す
+
+    mode: "thread" (ThreadPoolExecutor) / "process" (ProcessPoolExecutor)
+    成功した実行のダウンロード先は keep_dirs=False なら削除する (失敗分は調査用に残す)。
+    """
+    runner_kwargs = runner_kwargs or {}
+    check_runner_args(runner_name, **runner_kwargs)
+    os.makedirs(base_dir, exist_ok=True)
+    run_ids = range(1, runs + 1)
+    execute = _run_processes if mode == "process" else _run_threads
+    started = time.perf_counter()
+    results = execute(runner_name, runner_kwargs, run_ids, concurrency, base_dir, keep_dirs)
+    return build_report(results, runner_name, mode, concurrency,
+                        time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="シナリオの並列実行")
+    parser.add_argument("--runner", choices=sorted(RUNNERS), default="http")
+    parser.add_argument("--runs", type=int, default=10, help="シナリオの実行回数")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="同時実行数 (ワーカー数)")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--save-path", default=SAVE_PATH, help="実行ごとのダウンロード先の親")
+    parser.add_argument("--keep-dirs", action="store_true",
+                        help="成功した実行のダウンロード先も残す")
+    parser.add_argument("--base-url", default=http_fast_test.BASE_URL, help="http ランナーの接続先")
+    parser.add_argument("--fake-duration", type=float, default=0.05,
+                        help="fake ランナーの1回あたりの平均秒数")
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0)
+    parser.add_argument("--no-verify", action="store_true",
+                        help="http ランナーでマニフェストとの整合性確認を行わない")
+    parser.add_argument("--output", help="レポート JSON の出力先 (省略時は概要のみ標準出力)")
+    parser.add_argument("--trace-dir", help="ステップ計測結果 (JSONL / Chrome trace) の出力先 "
+                                            "(--mode thread のみ)")
+    args = parser.parse_args()
+    if args.trace_dir and args.mode == "process":
+        # スパンは子プロセスに記録され、親のトレーサーには残らない
+        parser.error("--trace-dir は --mode process と併用できません")
+
+    if args.runner == "http":
+        runner_kwargs = {"base_url": args.base_url, "verify": not args.no_verify}
+    else:
+        runner_kwargs = {"duration": args.fake_duration, "failure_rate": args.fake_failure_rate}
+
+    http_fast_test.init_logging(logging.WARNING)
+    # スパンは --trace-dir で出力するときだけ記録する
+    step_trace.tracer.enabled = bool(args.trace_dir)
+    report = run_parallel(args.runner, args.runs, args.concurrency, args.save_path,
+                          args.mode, runner_kwargs, args.keep_dirs)
+    summary = {k: v for k, v in report.items() if k != "results"}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.trace_dir:
+        jsonl_path, chrome_path = step_trace.export_run(args.trace_dir)
+        print(f"[OK] トレース出力: {jsonl_path} / {chrome_path}")
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+PID 追跡用のプロセス一覧 (tasklist / PowerShell の置き換え)
+
+プロセス名とコマンドラインを1回の呼び出しでまとめて列挙し、短い TTL の間は
+スナップショットを使い回す。終了 (kill) も複数 PID を1回の呼び出しで処理する。
+バックエンドは次のとおり:
+
+- win32 : WMI (Win32_Process) をプロセス内で照会し、TerminateProcess で終了する
+- proc  : Linux の /proc を読み、SIGKILL で終了する
+- fake  : テスト用。spawn() / exit() でプロセスの増減を再現する
+
+スナップショットの差分 (起動前後の比較) は呼び出し側 (snapshot_before / track_new_pids など) が行う。
+"""
+
+import collections
+import ctypes
+import os
+import signal
+import sys
+import threading
+
+import wait_engine
+
+DEFAULT_TTL_SEC = 0.5
+DEFAULT_EXIT_TIMEOUT_SEC = 1
+
+ProcessInfo = collections.namedtuple("ProcessInfo", ["pid", "name", "cmdline"])
+
+
+class ProcessTable:
+    """プロセス一覧バックエンドの共通インターフェース"""
+
+    name = "base"
+
+    def __init__(self, ttl=DEFAULT_TTL_SEC, clock=None):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._taken_at = None
+        self.enumerations = 0
+
+    def _enumerate(self):
+        """全プロセスの ProcessInfo を列挙する (バックエンドで実装)"""
+        raise NotImplementedError
+
+    def _kill(self, pids):
+        """pids を終了し、終了できた PID の集合を返す (バックエンドで実装)"""
+        raise NotImplementedError
+
+    def _now(self):
+        return (self._clock or wait_engine.get_clock()).monotonic()
+
+    def snapshot(self, max_age=None):
+        """
+        プロセス一覧を返す。max_age 秒 (省略時は ttl) より新しいスナップショットがあれば使い回す
+
+        状態の変化を待つポーリングでは max_age=0 を指定して毎回列挙し直すこと。
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            now = self._now()
+            if self._snapshot is None or now - self._taken_at >= max_age:
+                self._snapshot = tuple(self._enumerate())
+                self._taken_at = now
+                self.enumerations += 1
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def find(self, name=None, cmdline_contains=None, max_age=None):
+        """プロセス名 (大文字小文字は区別しない) とコマンドラインの部分一致で絞り込む"""
+        name = name.lower() if name else None
+        return [p for p in self.snapshot(max_age)
+                if (name is None or p.name.lower() == name)
+                and (cmdline_contains is None or cmdline_contains in (p.cmdline or ""))]
+
+    def pids(self, name=None, cmdline_contains=None, max_age=None):
+        return {p.pid for p in self.find(name, cmdline_contains, max_age)}
+
+    def kill(self, pids):
+        """複数の PID をまとめて強制終了し、終了できた PID の集合を返す"""
+        pids = set(pids)
+        if not pids:
+            return set()
+        try:
+            return self._kill(pids)
+        finally:
+            self.invalidate()
+
+
+class ProcProcessTable(ProcessTable):
+    """Linux の /proc を直接読むバックエンド"""
+
+    name = "proc"
+
+    def __init__(self, ttl=DEFAULT_TTL_SEC, clock=None, root="/proc"):
+        super().__init__(ttl, clock)
+        self.root = root
+
+    def _enumerate(self):
+        for entry in os.scandir(self.root):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(os.path.join(entry.path, "comm"), "rb") as f:
+                    name = f.read().decode("utf-8", "replace").strip()
+                with open(os.path.join(entry.path, "cmdline"), "rb") as f:
+                    cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "replace").strip()
+            except OSError:
+                # 列挙中に終了したプロセス
+                continue
+            yield ProcessInfo(int(entry.name), name, cmdline)
+
+    def _kill(self, pids):
+        killed = set()
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                killed.add(pid)
+            except (ProcessLookupError, PermissionError):
+                pass
+        return killed
+
+
+class Win32ProcessTable(ProcessTable):
+    """
+    WMI (Win32_Process) による Windows バックエンド
+
+    WMI の COM オブジェクトは作ったスレッドでしか使えないので、照会するスレッドごとに
+    CoInitialize してから作る (セッションプールやランナーのスレッドからも呼ばれるため)。
+    """
+
+    name = "win32"
+
+    PROCESS_TERMINATE = 0x0001
+    QUERY = "SELECT ProcessId, Name, CommandLine FROM Win32_Process"
+
+    def __init__(self, ttl=DEFAULT_TTL_SEC, clock=None):
+        super().__init__(ttl, clock)
+        # pywin32 は pywinauto の依存として入っている
+        import pythoncom
+        import pywintypes
+        import win32com.client
+
+        self._pythoncom = pythoncom
+        self._com_error = pywintypes.com_error
+        self._get_object = win32com.client.GetObject
+        self._local = threading.local()
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._kernel32.OpenProcess.restype = ctypes.c_void_p
+        self._kernel32.OpenProcess.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_uint32]
+        self._kernel32.TerminateProcess.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self._kernel32.CloseHandle.argtypes = [ctypes.c_void_p]
+
+    def _wmi(self):
+        """このスレッド用の WMI サービス (初回にこのスレッドの COM を初期化して作る)"""
+        service = getattr(self._local, "wmi", None)
+        if service is None:
+            try:
+                self._pythoncom.CoInitialize()
+            except self._com_error:
+                pass  # 別の方式 (MTA など) で初期化済みのスレッドはそのまま使う
+            service = self._local.wmi = self._get_object("winmgmts:root\\cimv2")
+        return service
+
+    def _enumerate(self):
+        for p in self._wmi().ExecQuery(self.QUERY):
+            yield ProcessInfo(int(p.ProcessId), p.Name or "", p.CommandLine or "")
+
+    def _kill(self, pids):
+        killed = set()
+        for pid in pids:
+            handle = self._kernel32.OpenProcess(self.PROCESS_TERMINATE, 0, pid)
+            if not handle:
+                continue
+            try:
+                if self._kernel32.TerminateProcess(handle, 1):
+                    killed.add(pid)
+            finally:
+                self._kernel32.CloseHandle(handle)
+        return killed
+
+
+class FakeProcessTable(ProcessTable):
+    """
+    テスト用のプロセス一覧
+
+    spawn() / exit() で起動・終了を再現する。kill() されたプロセスは即座に一覧から消え、
+    killed に記録される (kill_delay を指定すると FakeClock 上でその秒数後に消える)。
+    """
+
+    name = "fake"
+
+    def __init__(self, processes=(), ttl=DEFAULT_TTL_SEC, clock=None, kill_delay=0):
+        super().__init__(ttl, clock)
+        self._procs = {}
+        self._procs_lock = threading.Lock()
+        self._next_pid = 1000
+        self.kill_delay = kill_delay
+        self.kill_calls = []
+        self.killed = []
+        for name, cmdline in processes:
+            self.spawn(name, cmdline)
+
+    def spawn(self, name, cmdline=""):
+        with self._procs_lock:
+            self._next_pid += 4
+            self._procs[self._next_pid] = ProcessInfo(self._next_pid, name, cmdline)
+            return self._next_pid
+
+    def exit(self, pid):
+        with self._procs_lock:
+            self._procs.pop(pid, None)
+
+    def _enumerate(self):
+        with self._procs_lock:
+            return list(self._procs.values())
+
+    def _kill(self, pids):
+        self.kill_calls.append(sorted(pids))
+        with self._procs_lock:
+            killed = {pid for pid in pids if pid in self._procs}
+        self.killed.extend(sorted(killed))
+        for pid in killed:
+            if self.kill_delay:
+                (self._clock or wait_engine.get_clock()).schedule(
+                    self.kill_delay, lambda pid=pid: self.exit(pid))
+            else:
+                self.exit(pid)
+        return killed
+
+
+class PidTracker:
+    """
+    起動前後のスナップショット差分で「自分が起動したプロセス」を記録し、終了時にまとめて片付ける
+
+    実行 (run) ごとに1つ持てば、並列実行時に他の実行の PID と混ざらない。
+    ただし差分を取っている間に同じ名前のプロセスを別の実行が起動すると区別できないため、
+    ブラウザを起動する区間は直列にすること。
+    """
+
+    def __init__(self, name, cmdline_contains=None, table=None):
+        self.name = name
+        self.cmdline_contains = cmdline_contains
+        self._table = table
+        self._lock = threading.Lock()
+        self.pids = set()
+
+    @property
+    def table(self):
+        return self._table or get_process_table()
+
+    def current(self, max_age=0):
+        return self.table.pids(self.name, self.cmdline_contains, max_age=max_age)
+
+    def snapshot(self):
+        """起動前の PID 一覧"""
+        return self.current(max_age=0)
+
+    def track_new(self, before_pids):
+        """before_pids に無かった PID を記録し、今回増えた分を返す"""
+        new_pids = self.current(max_age=0) - set(before_pids)
+        with self._lock:
+            self.pids.update(new_pids)
+        return new_pids
+
+    def cleanup(self, timeout=DEFAULT_EXIT_TIMEOUT_SEC):
+        """記録した PID をまとめて終了し、一覧から消えるまで最大 timeout 秒待つ"""
+        with self._lock:
+            pids, self.pids = self.pids, set()
+        if not pids:
+            return set()
+        self.table.kill(pids)
+        wait_engine.wait_until(lambda: not (self.current(max_age=0) & pids), timeout,
+                               raise_on_timeout=False)
+        return pids
+
+
+def create_process_table(backend="auto", ttl=DEFAULT_TTL_SEC):
+    """
+    プロセス一覧オブジェクトを生成する
+
+    backend: "auto" / "win32" / "proc" / ProcessTable インスタンス / ttl を受け取るファクトリ関数
+    """
+    if isinstance(backend, ProcessTable):
+        return backend
+    if callable(backend):
+        return backend(ttl)
+    if backend == "auto":
+        backend = "win32" if sys.platform == "win32" else "proc"
+    if backend == "win32":
+        return Win32ProcessTable(ttl)
+    if backend == "proc":
+        return ProcProcessTable(ttl)
+    raise ValueError(f"未知のプロセス一覧バックエンド: {backend}")
+
+
+_table = None
+
+
+def get_process_table():
+    """プロセス共通のプロセス一覧 (初回呼び出し時に生成する)"""
+    global _table
+    if _table is None:
+        _table = create_process_table()
+    return _table
+
+
+def set_process_table(table):
+    """既定のプロセス一覧を差し替え、元のものを返す"""
+    global _table
+    previous = _table
+    _table = table
+    return previous
@@ -0,0 +1,375 @@
+"""
+実行履歴 (SQLite) と、履歴から求めるアダプティブなタイムアウト
+
+シナリオ1回ごとに、ステップ (step_login など) と名前付きの待ち (wait_login_page など) の
+所要時間を SQLite に記録する。待ちのタイムアウトは固定値ではなく、直近の成功実行の
+パーセンタイルから次のように決める。
+
+    timeout = clamp(p99 × factor, floor, ceiling)     ceiling = 従来の固定値 (WAIT_* 定数)
+    initial = clamp(p50 / INTERVAL_DIVISOR, MIN_INITIAL_INTERVAL, wait_engine.DEFAULT_MAX_INTERVAL)
+
+サンプルが min_samples 未満の待ちは ceiling (従来どおり) を使う。
+ダウンロードの完了待ちのように対象の大きさで所要時間が変わる待ちは、期待するサイズを
+渡すとサイズの区分ごと (wait_download[<=1MiB] など) に別の履歴として扱う。
+小さいファイルの履歴から大きいファイルのタイムアウトを短くしてしまわないため。
+履歴を有効にしていなければ (enable() を呼ばなければ) 常に従来どおりの値になる。
+
+回帰レポートは、最新ビルドの p50 / p95 を直前の数ビルドと比べ、遅くなったものを挙げる。
+
+使い方:
+    python automation/run_history.py report --db history.sqlite3 --threshold 1.2
+    python automation/run_history.py timeouts --db history.sqlite3
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import step_trace
+import wait_engine
+
+DEFAULT_FACTOR = 2.0
+DEFAULT_PERCENTILE = 99
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_WINDOW = 200
+DEFAULT_FLOOR_SEC = 1.0
+INTERVAL_DIVISOR = 10
+MIN_INITIAL_INTERVAL = 0.01
+DEFAULT_REGRESSION_THRESHOLD = 1.2
+DEFAULT_BASELINE_BUILDS = 3
+# サイズ区分の最小の上限と倍率 (64KiB, 256KiB, 1MiB, 4MiB, ...)
+MIN_SIZE_BUCKET = 64 * 1024
+SIZE_BUCKET_STEP = 4
+OK_STATUSES = ("created", "updated")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    build TEXT,
+    backend TEXT,
+    host TEXT,
+    status TEXT,
+    ok INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    duration_sec REAL NOT NULL,
+    ok INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_name_run ON steps (name, run_id);
+CREATE INDEX IF NOT EXISTS runs_build ON runs (build, id);
+"""
+
+
+def _percentile(sorted_values, pct):
+    """最近傍順位法 (parallel_runner.percentile と同じ)"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _format_bytes(n):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024 or unit == "GiB":
+            return f"{n:g}{unit}"
+        n /= 1024
+
+
+def size_key(name, size):
+    """
+    待ちの名前にサイズの区分を付ける (size が None なら name のまま)
+
+    例: size_key("wait_download", 3_000_000) → "wait_download[<=4MiB]"
+    """
+    if size is None:
+        return name
+    limit = MIN_SIZE_BUCKET
+    while limit < size:
+        limit *= SIZE_BUCKET_STEP
+    return f"{name}[<={_format_bytes(limit)}]"
+
+
+class RunHistory:
+    """実行履歴の SQLite ストア (スレッドセーフ。プロセス間は SQLite のロックに任せる)"""
+
+    def __init__(self, path):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record_run(self, steps, waits=(), status=None, ok=None, build=None, backend=None,
+                   started_at=None):
+        """
+        1回分の実行を記録して run id を返す
+
+        steps: {ステップ名: 秒}、waits: [(待ち名, 秒, 成功したか), ...]
+        """
+        ok = status in OK_STATUSES if ok is None else ok
+        rows = [(name, "step", sec, ok) for name, sec in steps.items()]
+        rows += [(name, "wait", sec, wait_ok and ok) for name, sec, wait_ok in waits]
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO runs (started_at, build, backend, host, status, ok)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (started_at or time.time(), build, backend, socket.gethostname(), status,
+                 int(bool(ok))))
+            run_id = cur.lastrowid
+            self._conn.executemany(
+                "INSERT INTO steps (run_id, name, kind, duration_sec, ok) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, name, kind, float(sec), int(bool(step_ok)))
+                 for name, kind, sec, step_ok in rows])
+        return run_id
+
+    def recent_durations(self, window=DEFAULT_WINDOW, names=None):
+        """名前ごとに直近 window 件の成功サンプルを昇順で返す {name: [秒, ...]}"""
+        sql = ("SELECT name, duration_sec FROM ("
+               " SELECT name, duration_sec,"
+               "  ROW_NUMBER() OVER (PARTITION BY name ORDER BY run_id DESC) AS rn"
+               " FROM steps WHERE ok = 1) WHERE rn <= ?")
+        with self._lock:
+            rows = self._conn.execute(sql, (window,)).fetchall()
+        out = {}
+        for name, sec in rows:
+            if names is None or name in names:
+                out.setdefault(name, []).append(sec)
+        for values in out.values():
+            values.sort()
+        return out
+
+    def builds(self):
+        """ビルド名を最初の実行順に返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT build FROM runs WHERE build IS NOT NULL"
+                " GROUP BY build ORDER BY MIN(id)").fetchall()
+        return [r[0] for r in rows]
+
+    def durations_by_build(self, builds):
+        """指定ビルドの成功サンプルを {name: [秒, ...]} (昇順) で返す"""
+        if not builds:
+            return {}
+        marks = ",".join("?" * len(builds))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.name, s.duration_sec FROM steps s JOIN runs r ON r.id = s.run_id"
+                f" WHERE s.ok = 1 AND r.build IN ({marks})", list(builds)).fetchall()
+        out = {}
+        for name, sec in rows:
+            out.setdefault(name, []).append(sec)
+        for values in out.values():
+            values.sort()
+        return out
+
+    def regression_report(self, build=None, baseline_builds=DEFAULT_BASELINE_BUILDS,
+                          threshold=DEFAULT_REGRESSION_THRESHOLD,
+                          min_samples=DEFAULT_MIN_SAMPLES // 4):
+        """
+        build (省略時は最新) の p50 / p95 を直前 baseline_builds 個のビルドと比べる
+
+        どちらかの比が threshold を超えたステップ・待ちを regressed=True にする。
+        """
+        builds = self.builds()
+        if build is None:
+            build = builds[-1] if builds else None
+        if build not in builds:
+            return {"build": build, "baseline": [], "steps": []}
+        index = builds.index(build)
+        baseline = builds[max(0, index - baseline_builds):index]
+        current = self.durations_by_build([build])
+        before = self.durations_by_build(baseline)
+        steps = []
+        for name in sorted(current):
+            cur, base = current[name], before.get(name, [])
+            if len(cur) < min_samples or len(base) < min_samples:
+                continue
+            item = {"name": name, "samples": len(cur), "baseline_samples": len(base)}
+            regressed = False
+            for pct in (50, 95):
+                now, then = _percentile(cur, pct), _percentile(base, pct)
+                ratio = now / then if then else None
+                item[f"p{pct}"] = now
+                item[f"baseline_p{pct}"] = then
+                item[f"p{pct}_ratio"] = ratio
+                regressed = regressed or (ratio is not None and ratio > threshold)
+            item["regressed"] = regressed
+            steps.append(item)
+        steps.sort(key=lambda s: (not s["regressed"], -(s["p95_ratio"] or 0)))
+        return {"build": build, "baseline": baseline, "threshold": threshold, "steps": steps}
+
+
+class WaitBudget:
+    """AdaptiveTimeouts.wait() が渡す、1回の待ちのタイムアウトと初期ポーリング間隔"""
+
+    def __init__(self, name, timeout, initial):
+        self.name = name
+        self.timeout = timeout
+        self.initial = initial
+
+
+class AdaptiveTimeouts:
+    """
+    履歴のパーセンタイルからタイムアウトと初期ポーリング間隔を決める
+
+    パーセンタイルは生成時 (と refresh()) に1回だけ読み込み、待ちのたびに SQLite は引かない。
+    wait() で囲んだ待ちの所要時間はスレッドごとに溜まり、take_samples() で取り出して記録する。
+    """
+
+    def __init__(self, history=None, factor=DEFAULT_FACTOR, percentile=DEFAULT_PERCENTILE,
+                 min_samples=DEFAULT_MIN_SAMPLES, window=DEFAULT_WINDOW):
+        self.history = history
+        self.factor = factor
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self._samples = {}
+        self._local = threading.local()
+        self.refresh()
+
+    def refresh(self):
+        self._samples = self.history.recent_durations(self.window) if self.history else {}
+
+    def _values(self, name):
+        values = self._samples.get(name, ())
+        return values if len(values) >= self.min_samples else None
+
+    def timeout(self, name, ceiling, floor=DEFAULT_FLOOR_SEC):
+        values = self._values(name)
+        if values is None:
+            return ceiling
+        return min(ceiling, max(floor, _percentile(values, self.percentile) * self.factor))
+
+    def initial_interval(self, name):
+        values = self._values(name)
+        if values is None:
+            return wait_engine.DEFAULT_INITIAL_INTERVAL
+        return min(wait_engine.DEFAULT_MAX_INTERVAL,
+                   max(MIN_INITIAL_INTERVAL, _percentile(values, 50) / INTERVAL_DIVISOR))
+
+    def describe(self, names=None):
+        """名前ごとの現在値 (サンプル数・p50・p99・タイムアウト係数適用後)"""
+        out = {}
+        for name in sorted(names or self._samples):
+            values = self._samples.get(name, [])
+            out[name] = {
+                "samples": len(values),
+                "p50": _percentile(values, 50),
+                f"p{self.percentile}": _percentile(values, self.percentile),
+                "adaptive": self._values(name) is not None,
+                "initial_interval": self.initial_interval(name),
+            }
+        return out
+
+    @contextlib.contextmanager
+    def wait(self, name, ceiling, floor=DEFAULT_FLOOR_SEC, size=None):
+        """
+        名前付きの待ちを囲む
+
+            with timeouts.wait("wait_login_page", WAIT_LOGIN_PAGE) as budget:
+                backend.find(locator, budget.timeout, budget.initial)
+
+        size (バイト) を渡すと、サイズの区分ごとの履歴でタイムアウトを決めて記録する (size_key)。
+        """
+        name = size_key(name, size)
+        budget = WaitBudget(name, self.timeout(name, ceiling, floor), self.initial_interval(name))
+        started = time.perf_counter()
+        ok = False
+        try:
+            with step_trace.span(name, timeout=budget.timeout):
+                yield budget
+            ok = True
+        finally:
+            self._pending().append((name, time.perf_counter() - started, ok))
+
+    def _pending(self):
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def take_samples(self):
+        """このスレッドで wait() した記録を取り出す [(名前, 秒, 成功したか), ...]"""
+        pending = self._pending()
+        self._local.pending = []
+        return pending
+
+
+_history = None
+_timeouts = AdaptiveTimeouts()
+_build = None
+
+
+def get_timeouts():
+    return _timeouts
+
+
+def get_history():
+    return _history
+
+
+def enable(path, build=None, **kwargs):
+    """path の履歴を使うようにする (記録とアダプティブなタイムアウトの両方)"""
+    global _history, _timeouts, _build
+    _history = RunHistory(path)
+    _timeouts = AdaptiveTimeouts(_history, **kwargs)
+    _build = build if build is not None else os.environ.get("IEMODE_DL_BUILD")
+    return _history
+
+
+def disable():
+    global _history, _timeouts
+    if _history is not None:
+        _history.close()
+    _history = None
+    _timeouts = AdaptiveTimeouts()
+
+
+def record(result, waits=(), backend=None):
+    """run_scenario の結果を履歴に記録する (履歴が無効なら何もしない)"""
+    if _history is None:
+        return None
+    return _history.record_run(result.get("timings", {}), waits, status=result.get("status"),
+                               build=_build, backend=backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="実行履歴の回帰レポート / タイムアウト表示")
+    parser.add_argument("command", choices=["report", "timeouts"])
+    parser.add_argument("--db", required=True, help="履歴の SQLite ファイル")
+    parser.add_argument("--build", help="比較するビルド (省略時は最新)")
+    parser.add_argument("--baseline-builds", type=int, default=DEFAULT_BASELINE_BUILDS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="p50 / p95 がこの倍率を超えたら回帰とみなす")
+    args = parser.parse_args()
+
+    history = RunHistory(args.db)
+    try:
+        if args.command == "report":
+            report = history.regression_report(args.build, args.baseline_builds, args.threshold)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            if any(s["regressed"] for s in report["steps"]):
+                raise SystemExit(1)
+        else:
+            print(json.dumps(AdaptiveTimeouts(history).describe(), ensure_ascii=False, indent=2))
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
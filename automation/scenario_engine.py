@@ -0,0 +1,298 @@
+"""
+バックエンド共通のシナリオエンジン
+
+ログイン → ダウンロードリンク (confirm) → 名前を付けて保存 → 完了待ち → 保存確認 の流れを
+1か所にまとめ、ブラウザ操作はバックエンド (ScenarioBackend) に任せる。
+同じシナリオをバックエンドだけ替えて実行できるので、速度の比較や最適化の使い回しができる。
+
+バックエンド:
+- com      : ie_mode_test.ComBackend       (IWebBrowser2 COM + pywinauto, Windows)
+- selenium : selenium_ie_test.SeleniumBackend (IEDriver + pywinauto, Windows)
+- http     : http_fast_test.HttpBackend    (ブラウザなしの HTTP 直接実行)
+- fake     : FakeBackend                   (サーバーもブラウザも使わない。Linux での確認用)
+
+ロケーターは Selenium と同じ (strategy, value) のタプルで、各バックエンドが解釈する。
+"""
+
+import importlib
+import os
+import tempfile
+import time
+
+import com_dom
+import file_digest
+import run_history
+import step_trace
+import wait_engine
+from download_check import (is_bundle, verify_integrity, verify_saved_file,
+                            wait_for_download_complete)
+
+BASE_URL = "http://localhost:5000"
+SAVE_FILENAME = "sample.csv"
+USER_ID = "testuser"
+PASSWORD = "testpass"
+
+LOC_USER_ID = (com_dom.CLASS_NAME, "txtUserID")
+LOC_PASSWORD = (com_dom.CLASS_NAME, "txtPassWord")
+LOC_LOGIN_BUTTON = (com_dom.TAG_NAME, "button")
+LOC_DOWNLOAD_LINK = (com_dom.CSS_SELECTOR, "a[href*='/download/csv']")
+# 複数のCSVを1つのZIPでダウンロードするリンク (保存先は BUNDLE_FILENAME)
+LOC_BUNDLE_LINK = (com_dom.CSS_SELECTOR, "a[href*='/download/bundle']")
+BUNDLE_FILENAME = "bundle.zip"
+
+WAIT_LOGIN_PAGE = 20
+WAIT_POST_LOGIN = 10
+WAIT_DOWNLOAD_TIMEOUT = 90
+WAIT_STABLE_SEC = 3
+
+# 名前 → "モジュール:クラス" (ブラウザ用のモジュールは使うときだけ import する)
+BACKENDS = {
+    "com": "ie_mode_test:ComBackend",
+    "selenium": "selenium_ie_test:SeleniumBackend",
+    "http": "http_fast_test:HttpBackend",
+    "fake": "scenario_engine:FakeBackend",
+}
+
+
+class ScenarioBackend:
+    """
+    シナリオを実行するための操作の集合
+
+    element は各バックエンドの要素 (WebElement / IHTMLElement / 疑似要素) で、
+    find() が返したものをそのまま他の操作に渡す。
+    """
+
+    name = "base"
+    wait_download_timeout = WAIT_DOWNLOAD_TIMEOUT
+    wait_stable_sec = WAIT_STABLE_SEC
+
+    def navigate(self, url):
+        raise NotImplementedError
+
+    def find(self, locator, timeout, interval=None):
+        """
+        locator の要素を timeout 秒まで待って返す。見つからなければ例外を送出する
+
+        interval はポーリングする場合の初期間隔 (None なら wait_engine の既定値)。
+        """
+        raise NotImplementedError
+
+    def type(self, element, text):
+        raise NotImplementedError
+
+    def submit(self, element):
+        """element (送信ボタン) でフォームを送信し、遷移の完了を待つ"""
+        raise NotImplementedError
+
+    def click_with_confirm(self, element):
+        """element をクリックし、表示される confirm ダイアログで OK を押す"""
+        raise NotImplementedError
+
+    def save_as(self, save_dir, filename):
+        """
+        開始したダウンロードを save_dir/filename に保存する
+
+        戻り値: (save_file_path, before_mtime, download_start)
+        """
+        raise NotImplementedError
+
+    def wait_for_download(self, save_file_path, download_start, digest=None, size=None):
+        """
+        保存の完了を待つ
+
+        size (期待するバイト数) を渡すと、タイムアウトをサイズの近い過去の実行から決める。
+        """
+        with run_history.get_timeouts().wait("wait_download", self.wait_download_timeout,
+                                             size=size) as budget:
+            wait_for_download_complete(save_file_path, download_start, timeout=budget.timeout,
+                                       stable_sec=self.wait_stable_sec, digest=digest)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def create_backend(name, **kwargs):
+    """BACKENDS の名前からバックエンドを生成する"""
+    try:
+        target = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"未知のバックエンド: {name}") from None
+    module_name, class_name = target.split(":")
+    return getattr(importlib.import_module(module_name), class_name)(**kwargs)
+
+
+def step_login(backend, base_url=BASE_URL, user_id=USER_ID, password=PASSWORD):
+    """ログインページでユーザーID・パスワードを入力し、ログインボタンで送信する"""
+    backend.navigate(f"{base_url}/login")
+    with run_history.get_timeouts().wait("wait_login_page", WAIT_LOGIN_PAGE) as budget:
+        userid_input = backend.find(LOC_USER_ID, budget.timeout, budget.initial)
+        password_input = backend.find(LOC_PASSWORD, budget.timeout, budget.initial)
+    backend.type(userid_input, user_id)
+    backend.type(password_input, password)
+    backend.submit(backend.find(LOC_LOGIN_BUTTON, WAIT_LOGIN_PAGE))
+
+
+def step_click_download_and_confirm(backend, link_locator=LOC_DOWNLOAD_LINK):
+    """ダウンロードリンク (link_locator) が出るのを待ってクリックし、confirm で OK を押す"""
+    with run_history.get_timeouts().wait("wait_post_login", WAIT_POST_LOGIN) as budget:
+        link = backend.find(link_locator, budget.timeout, budget.initial)
+    backend.click_with_confirm(link)
+
+
+def expected_size(expected):
+    """expected (マニフェストの項目) から保存されるファイルのおおよそのバイト数を返す (不明なら None)"""
+    if expected is None:
+        return None
+    if is_bundle(expected):
+        # ZIP は圧縮前の合計 (圧縮後より大きめに見積もる)
+        return sum(entry.get("size") or 0 for entry in expected["entries"]) or None
+    return expected.get("size")
+
+
+def run_scenario(backend, base_url=BASE_URL, save_dir=None, save_filename=SAVE_FILENAME,
+                 user_id=USER_ID, password=PASSWORD, expected=None,
+                 link_locator=LOC_DOWNLOAD_LINK):
+    """
+    ログイン → ダウンロード → 保存 → 完了待ち → 保存確認 を1回実行する
+
+    expected (マニフェストの項目) を渡すと、完了待ちの間に保存中のファイルをハッシュし、
+    サイズ・行数・SHA-256 を照合する。一致しなければ status を "corrupt" にする。
+    ZIP (link_locator=LOC_BUNDLE_LINK) の場合は expected に /manifest/bundle の要約を渡し、
+    保存後にエントリーごとに照合する。
+
+    run_history.enable() していれば、ステップと名前付きの待ち (失敗した実行も含む) を記録する。
+
+    戻り値: {"status": verify_saved_file の結果, "path": 保存先, "timings": {ステップ名: 秒},
+             "waits": {待ち名: 秒}} (照合した場合は "integrity": verify_integrity の結果 も含む)
+    """
+    timings = {}
+
+    def _timed(name, func, *args):
+        t0 = time.perf_counter()
+        try:
+            with step_trace.span(name, backend=backend.name):
+                return func(*args)
+        finally:
+            timings[name] = time.perf_counter() - t0
+
+    try:
+        _timed("step_login", step_login, backend, base_url, user_id, password)
+        _timed("step_click_download_and_confirm", step_click_download_and_confirm, backend,
+               link_locator)
+        save_file_path, before_mtime, download_start = _timed(
+            "step_save_as", backend.save_as, save_dir, save_filename)
+        # ZIP はエントリー単位で照合するので、保存中のファイル全体はハッシュしない
+        digest = (file_digest.IncrementalFileDigest(save_file_path, download_start)
+                  if expected is not None and not is_bundle(expected) else None)
+        _timed("wait_for_download_complete", backend.wait_for_download,
+               save_file_path, download_start, digest, expected_size(expected))
+        status = _timed("verify_saved_file", verify_saved_file, save_file_path, before_mtime)
+        result = {"status": status, "path": save_file_path, "timings": timings}
+        if expected is not None and status != "missing":
+            integrity = _timed("verify_integrity", verify_integrity, save_file_path, expected,
+                               digest)
+            result["integrity"] = integrity
+            if not integrity["ok"]:
+                result["status"] = "corrupt"
+    except Exception:
+        run_history.record({"status": "error", "timings": timings},
+                           run_history.get_timeouts().take_samples(), backend.name)
+        raise
+    waits = run_history.get_timeouts().take_samples()
+    result["waits"] = {name: sec for name, sec, _ in waits}
+    run_history.record(result, waits, backend.name)
+    return result
+
+
+# ===== 疑似バックエンド =====
+class FakeElement:
+    """FakeBackend の要素"""
+
+    def __init__(self, locator):
+        self.locator = locator
+        self.value = ""
+
+
+class FakeBackend(ScenarioBackend):
+    """
+    ブラウザもサーバーも使わない疑似バックエンド
+
+    latency に {"navigate": 秒, "find": 秒, ...} を渡すと各操作でその時間だけ
+    wait_engine.pause() で待つ (FakeClock を使えば実時間はかからない)。
+    ログインは users の組み合わせだけ成功し、失敗するとダウンロードリンクが見つからない。
+    """
+
+    name = "fake"
+    wait_stable_sec = 0
+
+    def __init__(self, latency=None, users=None, content=b"id,name\n1,fake\n"):
+        self.latency = dict(latency or {})
+        self.users = dict(users or {USER_ID: PASSWORD})
+        self.content = content
+        self.page = None
+        self.calls = {}
+        self._fields = {}
+        self._logged_in = False
+        self._pending_download = False
+
+    def _op(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency.get(name):
+            wait_engine.pause(self.latency[name])
+
+    def navigate(self, url):
+        self._op("navigate")
+        self.page = "download" if self._logged_in and not url.endswith("/login") else "login"
+        self._fields = {}
+
+    def find(self, locator, timeout, interval=None):
+        self._op("find")
+        on_page = {
+            "login": (LOC_USER_ID, LOC_PASSWORD, LOC_LOGIN_BUTTON),
+            "download": (LOC_DOWNLOAD_LINK,),
+        }.get(self.page, ())
+        if locator not in on_page:
+            raise RuntimeError(f"要素が見つかりません: {locator}")
+        return self._fields.setdefault(locator, FakeElement(locator))
+
+    def type(self, element, text):
+        self._op("type")
+        element.value = text
+
+    def submit(self, element):
+        self._op("submit")
+        user = self._fields.get(LOC_USER_ID)
+        password = self._fields.get(LOC_PASSWORD)
+        self._logged_in = bool(user and password
+                               and self.users.get(user.value) == password.value)
+        self.page = "download" if self._logged_in else "login"
+        self._fields = {}
+
+    def click_with_confirm(self, element):
+        self._op("click_with_confirm")
+        self._pending_download = True
+
+    def save_as(self, save_dir, filename):
+        self._op("save_as")
+        if not self._pending_download:
+            raise RuntimeError("開始されたダウンロードがありません")
+        self._pending_download = False
+        if save_dir is None:
+            save_dir = os.path.join(tempfile.gettempdir(), "scenario_fake")
+        save_file_path = os.path.join(save_dir, filename)
+        before_mtime = (os.path.getmtime(save_file_path)
+                        if os.path.exists(save_file_path) else None)
+        os.makedirs(save_dir, exist_ok=True)
+        partial_path = f"{save_file_path}.partial"
+        with open(partial_path, "wb") as f:
+            download_start = os.fstat(f.fileno()).st_mtime
+            f.write(self.content)
+        os.replace(partial_path, save_file_path)
+        return save_file_path, before_mtime, download_start
@@ -10,30 +10,48 @@ Selenium + IEDriver + pywinauto によるIEモードダウンロードテスト
 
 import logging
 import os
-import subprocess
 import threading
 import time
 from datetime import datetime
 from selenium import webdriver
-from selenium.webdriver.common.by import By
 from selenium.webdriver.ie.options import Options
 from selenium.webdriver.ie.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import (NoSuchElementException,
+                                        StaleElementReferenceException, WebDriverException)
 from selenium.webdriver.support import expected_conditions as EC
 from pywinauto import Desktop
 
+import dialog_watcher
+import process_table
+import run_history
+import scenario_engine
+import session_pool
+import step_trace
+import uia_cache
+import wait_engine
+from download_check import fetch_expected
+
 # ===== 設定 =====
 BASE_URL = "http://localhost:5000"
 SAVE_PATH = r"D:\Git\iemode_dl_test\download"
 SAVE_FILENAME = "sample.csv"
+DOWNLOAD_URL_PATH = "/download/csv"
 USER_ID = "testuser"
 PASSWORD = "testpass"
 
 IEDRIVER_PATH = r"G:\git\iemode_dl_test\bin\IEDriverServer.exe"
 EDGE_PATH = r"C:\Program Files (x86)\Microsoft\Edge\Application\msedge.exe"
 STARTUP_TIMEOUT_SEC = 60
+# 履歴から決める起動タイムアウトの下限 (IEDriver の初回起動は遅いことがあるため長めにする)
+STARTUP_TIMEOUT_FLOOR_SEC = 15
+HISTORY_DB_PATH = r"G:\git\iemode_dl_test\log\history.sqlite3"
 IEDRIVER_LOG_PATH = r"G:\git\iemode_dl_test\log\iedriver.log"
 IEDRIVER_LOG_LEVEL = "TRACE"
+INITIAL_BROWSER_URL = f"{BASE_URL}/login"
+# シナリオの繰り返し回数と、使い回す WebDriver セッションの数・使用回数の上限
+SCENARIO_RUNS = 1
+SESSION_POOL_SIZE = 1
+SESSION_MAX_USES = 20
 
 # ===== 画面・要素定義（移植用） =====
 WIN32_CLASS_DIALOG = "#32770"
@@ -41,16 +59,19 @@ TITLE_CONFIRM = "Web ページからのメッセージ"
 TITLE_SAVE_DIALOG = "名前を付けて保存"
 TITLE_OVERWRITE_DIALOG = "名前を付けて保存の確認"
 IE_WINDOW_TITLE_RE = r"^ダウンロード.*"
+EDGE_PROCESS_NAME = "msedge.exe"
+IE_MODE_CMDLINE_MARKER = "--ie-mode-force"
+IEDRIVER_PROCESS_NAME = "IEDriverServer.exe"
 
-LOC_USER_ID = (By.CLASS_NAME, "txtUserID")
-LOC_PASSWORD = (By.CLASS_NAME, "txtPassWord")
-LOC_DOWNLOAD_LINK = (By.CSS_SELECTOR, "a[href*='/download/csv']")
+# シナリオエンジンと共通 (strategy の文字列は By と同じ)
+LOC_USER_ID = scenario_engine.LOC_USER_ID
+LOC_PASSWORD = scenario_engine.LOC_PASSWORD
+LOC_DOWNLOAD_LINK = scenario_engine.LOC_DOWNLOAD_LINK
 
 UIA_NOTIFICATION_BAR_ID = "IENotificationBar"
 SAVE_FILENAME_CONTROL_ID = "FileNameControlHost"
 SAVE_BUTTON_AUTO_ID = "1"
 
-WAIT_LOGIN_PAGE = 20
 WAIT_POST_LOGIN = 10
 WAIT_CONFIRM_DIALOG = 15
 WAIT_DIALOG_CLOSE = 10
@@ -58,8 +79,18 @@ WAIT_SAVE_DIALOG = 20
 WAIT_NOTIFICATION_BAR = 10
 WAIT_DOWNLOAD_TIMEOUT = 90
 WAIT_STABLE_SEC = 3
-
-_tracked_edge_pids = set()
+# 起動直後に新しいプロセスが見えるまで / フォーカス移動などの短い条件待ち
+WAIT_PROCESS_START = 2
+WAIT_PROCESS_EXIT = 1
+WAIT_FOCUS = 0.5
+WAIT_MENU = 2
+# 条件で判定できないキー入力の間隔 (通知バーへのフォーカス移動など)
+KEYSTROKE_PAUSE_SEC = 0.1
+
+_edge_tracker = process_table.PidTracker(EDGE_PROCESS_NAME, IE_MODE_CMDLINE_MARKER)
+_RETRY_BACKOFF = wait_engine.Backoff(initial=0.25, max_interval=1.0)
+# ダイアログ・通知バーなどの検索結果 (ウィンドウが閉じたら捨てる)
+_ui_cache = uia_cache.ElementCache()
 _logger = logging.getLogger("iemode_dl_test")
 
 
@@ -91,11 +122,11 @@ def log(message, level=logging.INFO):
 
 def _kill_iedriver_server():
     """IEDriverServer.exe を強制終了する"""
-    subprocess.run(
-        ["taskkill", "/F", "/IM", "IEDriverServer.exe"],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
+    try:
+        table = process_table.get_process_table()
+        table.kill(table.pids(name=IEDRIVER_PROCESS_NAME, max_age=0))
+    except Exception as e:
+        log(f"  [WARN] IEDriverServer の終了に失敗: {e}")
 
 
 def _kill_existing_ie_mode_edges():
@@ -103,69 +134,100 @@ def _kill_existing_ie_mode_edges():
     pids = _get_ie_mode_edge_pids()
     if not pids:
         return
-    for pid in pids:
-        subprocess.run(
-            ["taskkill", "/F", "/PID", str(pid)],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+    process_table.get_process_table().kill(pids)
     log(f"  [CLEANUP] 既存IEモードEdgeを終了: {', '.join(map(str, pids))}")
 
 
-def _get_ie_mode_edge_pids():
-    """IEモード起動中のmsedge.exe PID一覧を取得する"""
-    cmd = (
-        "Get-CimInstance Win32_Process | "
-        "Where-Object { $_.Name -eq 'msedge.exe' -and $_.CommandLine -match '--ie-mode-force' } | "
-        "Select-Object -ExpandProperty ProcessId"
-    )
+@step_trace.traced()
+def _get_ie_mode_edge_pids(max_age=None):
+    """
+    IEモード起動中のmsedge.exe PID一覧を取得する
+
+    max_age 秒以内に取得したプロセス一覧があれば使い回す (状態変化を待つときは 0)。
+    """
     try:
-        result = subprocess.run(
-            ["powershell", "-Command", cmd],
-            capture_output=True, text=True,
-        )
-        pids = set()
-        for line in result.stdout.strip().splitlines():
-            line = line.strip()
-            if line.isdigit():
-                pids.add(int(line))
-        return pids
+        return process_table.get_process_table().pids(
+            name=EDGE_PROCESS_NAME, cmdline_contains=IE_MODE_CMDLINE_MARKER, max_age=max_age)
     except Exception as e:
         log(f"  [WARN] IEモードEdge PID取得に失敗: {e}")
         return set()
 
 
-def _snapshot_ie_mode_edges():
+def _create_tracked_driver(tracker=None):
+    """WebDriver を起動し、そのとき増えた IEモードEdge の PID を追跡対象に加える"""
+    before_edge_pids = _snapshot_ie_mode_edges(tracker)
+    driver = create_driver()
+    # IEモードの Edge プロセスが現れるまで待つ (見えなくても追跡処理は続行)
+    wait_engine.wait_until(lambda: _get_ie_mode_edge_pids(max_age=0) - before_edge_pids,
+                           WAIT_PROCESS_START, raise_on_timeout=False)
+    _track_new_ie_mode_edges(before_edge_pids, tracker)
+    return driver
+
+
+def _probe_driver(driver):
+    """プールから貸し出す前の生存確認 (readyState が取れれば生きている)"""
+    return driver.execute_script("return document.readyState") is not None
+
+
+def _reset_driver(driver):
+    """次のシナリオのために初期URLへ戻し、Cookie を削除する"""
+    driver.get(INITIAL_BROWSER_URL)
+    driver.delete_all_cookies()
+
+
+def _quit_driver(driver):
+    driver.quit()
+
+
+def create_session_pool(size=SESSION_POOL_SIZE, max_uses=SESSION_MAX_USES,
+                        factory=_create_tracked_driver):
+    """WebDriver セッションのプールを作る (factory に FakeDriverFactory を渡すとテストできる)"""
+    return session_pool.SessionPool(factory, size=size, max_uses=max_uses,
+                                    probe=_probe_driver, reset=_reset_driver,
+                                    destroy=_quit_driver)
+
+
+def _snapshot_ie_mode_edges(tracker=None):
     """起動前のIEモードEdge PIDを記録する"""
-    return _get_ie_mode_edge_pids()
+    try:
+        return (tracker or _edge_tracker).snapshot()
+    except Exception as e:
+        log(f"  [WARN] IEモードEdge PID取得に失敗: {e}")
+        return set()
 
 
-def _track_new_ie_mode_edges(before_pids):
-    """起動前後を比較し、新しく生まれたPIDを記録する"""
-    global _tracked_edge_pids
-    after_pids = _get_ie_mode_edge_pids()
-    new_pids = after_pids - before_pids
-    _tracked_edge_pids.update(new_pids)
+def _track_new_ie_mode_edges(before_pids, tracker=None):
+    """
+    起動前後を比較し、新しく生まれたPIDを記録する
+
+    tracker を渡すとその実行専用の追跡コンテキストに記録する (並列実行用)。
+    """
+    try:
+        new_pids = (tracker or _edge_tracker).track_new(before_pids)
+    except Exception as e:
+        log(f"  [WARN] IEモードEdge PID取得に失敗: {e}")
+        new_pids = set()
     log(f"  [DEBUG] 新規IEモードEdge PID: {new_pids if new_pids else 'なし'}")
 
 
-def _cleanup_tracked_ie_mode_edges():
+@step_trace.traced()
+def _cleanup_tracked_ie_mode_edges(tracker=None):
     """このプログラムが起動したIEモードEdgeだけを終了する"""
-    if not _tracked_edge_pids:
+    tracker = tracker or _edge_tracker
+    if not tracker.pids:
         return
-    log(f"  [CLEANUP] 終了対象IEモードEdge PID: {_tracked_edge_pids}")
-    for pid in _tracked_edge_pids:
-        subprocess.run(
-            ["taskkill", "/F", "/PID", str(pid)],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-    time.sleep(1)
+    log(f"  [CLEANUP] 終了対象IEモードEdge PID: {tracker.pids}")
+    tracker.cleanup(timeout=WAIT_PROCESS_EXIT)
     log("[OK] プログラム起動分のIEモードEdgeをクリーンアップ")
 
 
-def create_driver(timeout_sec=STARTUP_TIMEOUT_SEC):
-    """IEDriver + Edge IEモードでWebDriverを起動する (起動タイムアウト付き)"""
+@step_trace.traced()
+def create_driver(timeout_sec=None):
+    """
+    IEDriver + Edge IEモードでWebDriverを起動する (起動タイムアウト付き)
+
+    timeout_sec を省略すると、起動時間の履歴から決めた値 (最大 STARTUP_TIMEOUT_SEC) を使う。
+    """
     options = Options()
     options.attach_to_edge_chrome = True
     options.edge_executable_path = EDGE_PATH
@@ -175,7 +237,7 @@ def create_driver(timeout_sec=STARTUP_TIMEOUT_SEC):
     options.browser_attach_timeout = 120000
     options.force_create_process_api = True
     options.force_shell_windows_api = False
-    options.initial_browser_url = f"{BASE_URL}/login"
+    options.initial_browser_url = INITIAL_BROWSER_URL
     # ie.browserCommandLineSwitches は環境差が大きく、今回は使用しない
     options.add_additional_option("ie.ignoreprocessmatch", True)
     options.add_additional_option("nativeEvents", False)
@@ -199,60 +261,81 @@ def create_driver(timeout_sec=STARTUP_TIMEOUT_SEC):
             result["error"] = e
 
     t = threading.Thread(target=_worker, daemon=True)
-    t.start()
-    t.join(timeout=timeout_sec)
+    with run_history.get_timeouts().wait("wait_driver_startup", STARTUP_TIMEOUT_SEC,
+                                         floor=STARTUP_TIMEOUT_FLOOR_SEC) as budget:
+        if timeout_sec is None:
+            timeout_sec = budget.timeout
+        t.start()
+        t.join(timeout=timeout_sec)
+
+        # タイムアウト・起動失敗は with の中で送出し、履歴には失敗として記録する
+        if t.is_alive():
+            try:
+                service.stop()
+            except Exception:
+                pass
+            _kill_iedriver_server()
+            raise TimeoutError(
+                f"WebDriver起動が{timeout_sec}秒を超えました。"
+                " IEDriverServerがセッション確立でハングしている可能性があります。"
+            )
 
-    if t.is_alive():
-        try:
-            service.stop()
-        except Exception:
-            pass
-        _kill_iedriver_server()
-        raise TimeoutError(
-            f"WebDriver起動が{timeout_sec}秒を超えました。"
-            " IEDriverServerがセッション確立でハングしている可能性があります。"
-        )
-
-    if result["error"] is not None:
-        raise result["error"]
+        if result["error"] is not None:
+            raise result["error"]
     return result["driver"]
 
 
+@step_trace.traced()
 def wait_for_ready(driver, timeout=15):
     """document.readyState == complete を待機する"""
-    WebDriverWait(driver, timeout).until(
-        lambda d: d.execute_script("return document.readyState") == "complete"
+    wait_engine.wait_until(
+        lambda: driver.execute_script("return document.readyState") == "complete",
+        timeout,
+        f"document.readyState が{timeout}秒以内に complete になりませんでした",
+        ignore_exceptions=(WebDriverException,),
+    )
+
+
+def wait_for_condition(driver, condition, timeout, message=None,
+                       initial=wait_engine.DEFAULT_INITIAL_INTERVAL):
+    """expected_conditions の条件を wait_engine で待って結果を返す"""
+    return wait_engine.wait_until(
+        lambda: condition(driver),
+        timeout,
+        message,
+        ignore_exceptions=(NoSuchElementException, StaleElementReferenceException),
+        initial=initial,
     )
 
 
-def wait_win32_dialog(title, class_name=WIN32_CLASS_DIALOG, timeout=15):
-    """Win32ダイアログを待って返す"""
-    desktop = Desktop(backend="win32")
-    dialog = desktop.window(class_name=class_name, title=title)
-    dialog.wait("visible", timeout=timeout)
-    return dialog
+def _focus_element(element):
+    """要素にフォーカスを移し、アクティブ要素になるまで待つ"""
+    driver = element._parent
+    try:
+        driver.execute_script("arguments[0].focus();", element)
+    except Exception:
+        pass
+    wait_engine.wait_until(lambda: driver.switch_to.active_element == element,
+                           WAIT_FOCUS, raise_on_timeout=False,
+                           ignore_exceptions=(WebDriverException,))
 
 
-def log_dialog_info(dialog, label):
-    """ダイアログのタイトル/テキスト/ボタン一覧をログ出力する"""
+def log_dialog_info(dialog, label, handle=None):
+    """ダイアログのタイトル/テキスト/ボタン一覧をログ出力する (子孫の走査は1回だけ)"""
     try:
         title = dialog.window_text()
     except Exception:
         title = "(unknown)"
     try:
-        texts = [w.window_text() for w in dialog.descendants() if w.window_text()]
+        elements = _ui_cache.descendants(dialog, handle)
     except Exception:
-        texts = []
+        elements = []
+    texts = [e.text for e in elements if e.text]
     log(f"  [DEBUG] {label}検出: title={title}")
     if texts:
         log(f"  [DEBUG] {label}内テキスト: {texts}")
-    try:
-        buttons = [b for b in dialog.descendants()
-                   if b.friendly_class_name() == "Button" and b.window_text()]
-        btn_texts = [b.window_text() for b in buttons]
-    except Exception:
-        buttons = []
-        btn_texts = []
+    buttons = [e.element for e in elements if e.friendly_class_name == "Button" and e.text]
+    btn_texts = [e.text for e in elements if e.friendly_class_name == "Button" and e.text]
     if btn_texts:
         log(f"  [DEBUG] {label}のボタン一覧: {btn_texts}")
     return buttons, btn_texts
@@ -261,64 +344,15 @@ def log_dialog_info(dialog, label):
 def set_value_with_fallback(element, value):
     """入力欄に値を入れる。テスト用にOSレベルのキーボード入力で確実性を優先する。"""
     from pywinauto import keyboard as kbd
-    try:
-        element._parent.execute_script("arguments[0].focus();", element)
-    except Exception:
-        pass
-    time.sleep(0.2)
+    _focus_element(element)
     kbd.send_keys("^a")
     kbd.send_keys(value, with_spaces=True)
 
 
-def step_login(driver):
-    """ログインページでユーザーID・パスワードを入力し、ログインボタンを押す"""
-    driver.get(f"{BASE_URL}/login")
-    wait_for_ready(driver)
-
-    userid_input = WebDriverWait(driver, WAIT_LOGIN_PAGE).until(
-        EC.visibility_of_element_located(LOC_USER_ID)
-    )
-    password_input = WebDriverWait(driver, WAIT_LOGIN_PAGE).until(
-        EC.visibility_of_element_located(LOC_PASSWORD)
-    )
-
-    set_value_with_fallback(userid_input, USER_ID)
-    set_value_with_fallback(password_input, PASSWORD)
-
-    try:
-        uid_val = userid_input.get_attribute("value")
-        if uid_val != USER_ID:
-            raise RuntimeError(f"ユーザーIDが一致しません: '{uid_val}'")
-        log(f"  [DEBUG] ユーザーID確認OK: '{uid_val}'")
-    except Exception as e:
-        log(f"  [WARN] ユーザーIDの確認に失敗: {e}")
-
-    try:
-        pwd_val = password_input.get_attribute("value")
-        if not pwd_val:
-            log("  [WARN] パスワードの値を取得できない/空です")
-    except Exception as e:
-        log(f"  [WARN] パスワードの確認に失敗: {e}")
-
-    # IEモードでは click が失敗しやすいので OSレベルの Enter で送信
-    from pywinauto import keyboard as kbd
-    kbd.send_keys("{ENTER}")
-
-    # 遷移完了待ち（readyState + 要素出現の両方）
-    try:
-        wait_for_ready(driver, timeout=WAIT_POST_LOGIN)
-    except Exception:
-        pass
-    WebDriverWait(driver, WAIT_POST_LOGIN).until(
-        EC.presence_of_element_located(LOC_DOWNLOAD_LINK)
-    )
-    log("[OK] ログイン完了 → ダウンロードページへ遷移")
-
-
-def _handle_confirm_dialog_pywinauto():
-    """confirmダイアログをpywinautoで閉じる"""
-    dialog = wait_win32_dialog(TITLE_CONFIRM, timeout=WAIT_CONFIRM_DIALOG)
-    buttons, btn_texts = log_dialog_info(dialog, "confirmダイアログ")
+def _accept_confirm_dialog(info):
+    """confirmダイアログをpywinautoで閉じる (ダイアログ監視のルールから呼ばれる)"""
+    dialog = Desktop(backend="win32").window(handle=info.handle)
+    buttons, btn_texts = log_dialog_info(dialog, "confirmダイアログ", info.handle)
     dialog.set_focus()
     target = "OK"
     target_btn = None
@@ -337,42 +371,95 @@ def _handle_confirm_dialog_pywinauto():
     log("[OK] confirmダイアログでOKを選択 (pywinauto)")
 
 
-def step_click_download_and_confirm(driver):
-    """
-    ダウンロードリンクをクリックし、confirmダイアログでOKを押す
+CONFIRM_RULE = dialog_watcher.DialogRule("confirm", title=TITLE_CONFIRM,
+                                         class_name=WIN32_CLASS_DIALOG,
+                                         action=_accept_confirm_dialog)
 
-    Selenium Alert API は環境によってハングするため、Win32ダイアログ操作を優先する。
-    """
-    t = threading.Thread(target=_handle_confirm_dialog_pywinauto, daemon=True)
-    t.start()
 
-    link = WebDriverWait(driver, 20).until(
-        EC.visibility_of_element_located(LOC_DOWNLOAD_LINK)
-    )
-    # IEモードでは click が失敗しやすいので Enter でリンクを起動
-    try:
-        link._parent.execute_script("arguments[0].focus();", link)
-    except Exception:
-        pass
-    time.sleep(0.2)
-    from pywinauto import keyboard as kbd
-    kbd.send_keys("{ENTER}")
-    log("[OK] ダウンロードリンクを実行 (Enter)")
-    t.join(timeout=WAIT_CONFIRM_DIALOG + 5)
-    if t.is_alive():
-        raise TimeoutError("confirmダイアログ処理が完了しませんでした")
+class SeleniumBackend(scenario_engine.ScenarioBackend):
+    """IEDriver (Selenium) + pywinauto で操作するシナリオエンジン用バックエンド"""
+
+    name = "selenium"
+    wait_download_timeout = WAIT_DOWNLOAD_TIMEOUT
+    wait_stable_sec = WAIT_STABLE_SEC
+
+    def __init__(self, driver=None):
+        self._owned = driver is None
+        self.driver = _create_tracked_driver() if driver is None else driver
 
+    def navigate(self, url):
+        self.driver.get(url)
+        wait_for_ready(self.driver)
 
+    def find(self, locator, timeout, interval=None):
+        return wait_for_condition(self.driver, EC.visibility_of_element_located(locator),
+                                  timeout, f"要素が表示されませんでした: {locator}",
+                                  initial=interval or wait_engine.DEFAULT_INITIAL_INTERVAL)
+
+    def type(self, element, text):
+        set_value_with_fallback(element, text)
+        try:
+            if not element.get_attribute("value"):
+                log(f"  [WARN] 入力欄の値を取得できない/空です: {element.get_attribute('class')}")
+        except Exception as e:
+            log(f"  [WARN] 入力値の確認に失敗: {e}")
+
+    def submit(self, element):
+        # IEモードでは click が失敗しやすいので OSレベルの Enter で送信
+        from pywinauto import keyboard as kbd
+        _focus_element(element)
+        kbd.send_keys("{ENTER}")
+        try:
+            wait_for_ready(self.driver, timeout=WAIT_POST_LOGIN)
+        except Exception:
+            pass
+
+    def click_with_confirm(self, element):
+        """Selenium Alert API は環境によってハングするため、Win32ダイアログ操作を優先する"""
+        with dialog_watcher.get_watcher().expect(CONFIRM_RULE) as confirm:
+            # IEモードでは click が失敗しやすいので Enter でリンクを起動
+            _focus_element(element)
+            from pywinauto import keyboard as kbd
+            kbd.send_keys("{ENTER}")
+            log("[OK] ダウンロードリンクを実行 (Enter)")
+            try:
+                confirm.wait(WAIT_CONFIRM_DIALOG + 5)
+            except TimeoutError:
+                raise TimeoutError("confirmダイアログ処理が完了しませんでした") from None
+
+    def save_as(self, save_dir, filename):
+        step_handle_download_bar()
+        return step_handle_save_dialog(save_dir, filename)
+
+    def close(self):
+        if self._owned:
+            _quit_driver(self.driver)
+
+
+@step_trace.traced()
+def step_login(driver):
+    """ログインページでユーザーID・パスワードを入力し、ログインボタンを押す"""
+    scenario_engine.step_login(SeleniumBackend(driver), BASE_URL, USER_ID, PASSWORD)
+    log("[OK] ログイン完了 → ダウンロードページへ遷移")
+
+
+@step_trace.traced()
+def step_click_download_and_confirm(driver):
+    """ダウンロードリンクをクリックし、confirmダイアログでOKを押す"""
+    scenario_engine.step_click_download_and_confirm(SeleniumBackend(driver))
+
+
+@step_trace.traced()
 def _find_ie_window(desktop, timeout=15):
     """IEモードのウィンドウを探して返す（先頭が「ダウンロード」）"""
     patterns = [
         IE_WINDOW_TITLE_RE,
     ]
-    end = time.time() + timeout
-    while time.time() < end:
+
+    def _lookup():
         for pattern in patterns:
             try:
-                wins = desktop.windows(title_re=pattern)
+                wins = _ui_cache.windows(desktop, title_re=pattern)
             except Exception:
                 wins = []
             if len(wins) == 1:
@@ -392,10 +479,15 @@ def _find_ie_window(desktop, timeout=15):
                         pass
                 # それでも決められなければ先頭を返す
                 return wins[0]
-        time.sleep(0.5)
-    raise RuntimeError("IEモードのウィンドウが見つかりません")
+        return None
 
+    win = wait_engine.wait_until(_lookup, timeout, raise_on_timeout=False)
+    if win is None:
+        raise RuntimeError("IEモードのウィンドウが見つかりません")
+    return win
 
+
+@step_trace.traced()
 def step_handle_download_bar():
     """
     IEのダウンロード通知バーで「名前を付けて保存」を実行する
@@ -406,6 +498,8 @@ def step_handle_download_bar():
 
     # UIAのCOMError対策として通知バー取得をリトライ
     for retry in range(3):
+        if retry:
+            step_trace.retry()
         try:
             ie_window = _find_ie_window(desktop)
             try:
@@ -419,40 +513,108 @@ def step_handle_download_bar():
             except Exception:
                 ie_spec = ie_window
 
-            notification_bar = ie_spec.child_window(
+            # 通知バーは再試行のたびに探し直さず、生きている間はキャッシュから返す
+            _ui_cache.find(
+                ie_spec,
+                handle=getattr(ie_window, "handle", None),
+                timeout=WAIT_NOTIFICATION_BAR,
                 auto_id=UIA_NOTIFICATION_BAR_ID,
                 control_type="ToolBar",
             )
-            notification_bar.wait("visible", timeout=WAIT_NOTIFICATION_BAR)
 
             # キーボード操作のみで「名前を付けて保存」を選択する
-            save_dialog = desktop.window(title=TITLE_SAVE_DIALOG)
-            for attempt in range(3):
-                kbd.send_keys("%n")
-                time.sleep(0.3)
-                kbd.send_keys("{TAB}")
-                time.sleep(0.3)
-                kbd.send_keys("{DOWN}")
-                time.sleep(0.3)
-                kbd.send_keys("{DOWN}")
-                time.sleep(0.3)
-                kbd.send_keys("{ENTER}")
-                if save_dialog.exists(timeout=WAIT_SAVE_DIALOG):
-                    log("[OK] ダウンロードバーで「名前を付けて保存」を選択 (キーボード)")
-                    return
-                # 反応しなかった場合はメニューを閉じて再試行
-                kbd.send_keys("{ESC}")
-                time.sleep(0.5)
-                log(f"  [WARN] 保存ダイアログ未表示。再試行 {attempt + 1}/3")
+            menu = desktop.window(control_type="Menu")
+            with dialog_watcher.get_watcher().expect(SAVE_DIALOG_RULE) as save_dialog:
+                for attempt in range(3):
+                    if attempt:
+                        step_trace.retry()
+                    kbd.send_keys("%n")
+                    wait_engine.pause(KEYSTROKE_PAUSE_SEC)
+                    kbd.send_keys("{TAB}")
+                    wait_engine.pause(KEYSTROKE_PAUSE_SEC)
+                    kbd.send_keys("{DOWN}")
+                    # 「保存」のドロップダウンメニューが開くのを待つ (検出できなくても続行)
+                    wait_engine.wait_until(lambda: menu.exists(timeout=0), WAIT_MENU,
+                                           raise_on_timeout=False)
+                    kbd.send_keys("{DOWN}")
+                    wait_engine.pause(KEYSTROKE_PAUSE_SEC)
+                    kbd.send_keys("{ENTER}")
+                    if wait_engine.wait_until(save_dialog.seen, WAIT_SAVE_DIALOG,
+                                              raise_on_timeout=False):
+                        log("[OK] ダウンロードバーで「名前を付けて保存」を選択 (キーボード)")
+                        return
+                    # 反応しなかった場合はメニューを閉じて再試行
+                    kbd.send_keys("{ESC}")
+                    wait_engine.wait_until(lambda: not menu.exists(timeout=0), WAIT_MENU,
+                                           raise_on_timeout=False)
+                    log(f"  [WARN] 保存ダイアログ未表示。再試行 {attempt + 1}/3")
             raise RuntimeError("ダウンロードバーで「名前を付けて保存」を起動できませんでした")
         except Exception as e:
             log(f"  [WARN] ダウンロードバー取得に失敗。再試行 {retry + 1}/3: {e}")
-            time.sleep(1.0)
+            wait_engine.pause(_RETRY_BACKOFF.delay(retry))
 
     raise RuntimeError("ダウンロードバーの取得に繰り返し失敗しました")
 
 
-def step_handle_save_dialog():
+def _norm_button_text(s):
+    """ボタン名の比較用に空白系と不可視制御文字を除去する"""
+    out = []
+    for ch in s:
+        if ch.isspace():
+            continue
+        # Unicode category: Cc/Cf を除外
+        if ord(ch) < 32 or ord(ch) == 127 or ch == "\u200e" or ch == "\u200f":
+            continue
+        out.append(ch)
+    return "".join(out)
+
+
+def _accept_overwrite_dialog(info):
+    """
+    上書き確認ダイアログで「はい」を押し、押下した時刻を返す (ダイアログ監視のルールから呼ばれる)
+    """
+    confirm_overwrite = Desktop(backend="win32").window(handle=info.handle)
+    buttons, btn_texts = log_dialog_info(confirm_overwrite, "上書き確認ダイアログ", info.handle)
+
+    targets = ["はい(&Y)", "はい(Y)"]
+    norm_targets = {_norm_button_text(t): t for t in targets}
+    matched = []
+    for t in btn_texts:
+        norm_t = _norm_button_text(t)
+        if norm_t in norm_targets:
+            matched.append(t)
+
+    if len(matched) == 0:
+        raise RuntimeError("上書き確認ダイアログのボタンが見つかりません: はい(&Y) / はい(Y)")
+    if len(matched) > 1:
+        raise RuntimeError(f"上書き確認ダイアログのボタンが複数一致: {matched}")
+    target = matched[0]
+    target_btn = None
+    for b in buttons:
+        if b.window_text() == target:
+            target_btn = b
+            break
+    if target_btn is None:
+        raise RuntimeError(f"上書き確認ダイアログのボタンが取得できません: {target}")
+    try:
+        target_btn.click()
+    except Exception:
+        target_btn.click_input()
+    clicked_at = time.time()
+    log(f"  [DEBUG] 上書き確認ダイアログで「{target}」を選択")
+    confirm_overwrite.wait_not("visible", timeout=WAIT_DIALOG_CLOSE)
+    return clicked_at
+
+
+OVERWRITE_RULE = dialog_watcher.DialogRule("overwrite", title=TITLE_OVERWRITE_DIALOG,
+                                           class_name=WIN32_CLASS_DIALOG,
+                                           action=_accept_overwrite_dialog)
+# 保存ダイアログは表示の通知だけを受け、操作は step_handle_save_dialog で行う
+SAVE_DIALOG_RULE = dialog_watcher.DialogRule("save", title=TITLE_SAVE_DIALOG)
+
+
+@step_trace.traced()
+def step_handle_save_dialog(save_dir=None, filename=SAVE_FILENAME):
     """
     「名前を付けて保存」ダイアログでファイルパスを指定して保存する
     """
@@ -460,14 +622,18 @@ def step_handle_save_dialog():
 
     desktop = Desktop(backend="uia")
 
-    save_dialog = desktop.window(title=TITLE_SAVE_DIALOG)
-    save_dialog.wait("visible", timeout=WAIT_SAVE_DIALOG)
+    with run_history.get_timeouts().wait("wait_save_dialog", WAIT_SAVE_DIALOG) as budget:
+        info = dialog_watcher.get_watcher().expect(SAVE_DIALOG_RULE).wait(budget.timeout)
+    save_dialog = desktop.window(handle=info.handle)
     save_dialog.set_focus()
-    time.sleep(0.5)
+    wait_engine.wait_until(save_dialog.is_active, WAIT_FOCUS, raise_on_timeout=False,
+                           ignore_exceptions=(Exception,))
 
-    save_file_path = os.path.join(SAVE_PATH, SAVE_FILENAME)
+    # 並列実行時は実行ごとのディレクトリに保存する (上書き確認も出なくなる)
+    save_dir = SAVE_PATH if save_dir is None else save_dir
+    save_file_path = os.path.join(save_dir, filename)
     before_mtime = os.path.getmtime(save_file_path) if os.path.exists(save_file_path) else None
-    os.makedirs(SAVE_PATH, exist_ok=True)
+    os.makedirs(save_dir, exist_ok=True)
     log(f"  [DEBUG] 保存先: {save_file_path}")
 
     try:
@@ -478,72 +644,37 @@ def step_handle_save_dialog():
     except Exception as e1:
         raise RuntimeError(f"ファイル名フィールドへの入力に失敗しました: {e1}")
 
-    time.sleep(0.5)
+    # 入力がコントロールに反映されるまで待つ
+    wait_engine.wait_until(lambda: fn_edit.window_text() == save_file_path, WAIT_FOCUS,
+                           raise_on_timeout=False, ignore_exceptions=(Exception,))
 
+    overwrite_clicked = False
+    overwrite = dialog_watcher.get_watcher().expect(OVERWRITE_RULE)
     try:
         save_btn = save_dialog.child_window(auto_id=SAVE_BUTTON_AUTO_ID, control_type="Button")
         download_start = time.time()
         save_btn.click_input()
         log("  [DEBUG] 保存ボタン押下: auto_id=1経由")
     except Exception as e1:
+        overwrite.cancel()
         raise RuntimeError(f"保存ボタンの押下に失敗しました: {e1}")
 
-    # 上書き確認ダイアログの検出と確実なクリック
-    overwrite_clicked = False
+    # 上書き確認はダイアログ監視のルール (OVERWRITE_RULE) が「はい」を押す。
+    # 上書き確認が出るか、保存ダイアログが閉じる (上書きなし) まで待つ
     try:
-        win32 = Desktop(backend="win32")
-        confirm_overwrite = win32.window(class_name=WIN32_CLASS_DIALOG, title=TITLE_OVERWRITE_DIALOG)
-        if confirm_overwrite.exists(timeout=WAIT_DIALOG_CLOSE):
-            buttons, btn_texts = log_dialog_info(confirm_overwrite, "上書き確認ダイアログ")
-
-            def _norm_button_text(s):
-                # すべての空白系と不可視制御を除去
-                out = []
-                for ch in s:
-                    if ch.isspace():
-                        continue
-                    # Unicode category: Cc/Cf を除外
-                    if ord(ch) < 32 or ord(ch) == 127 or ch == "\u200e" or ch == "\u200f":
-                        continue
-                    out.append(ch)
-                return "".join(out)
-
-            targets = ["はい(&Y)", "はい(Y)"]
-            norm_targets = {_norm_button_text(t): t for t in targets}
-            matched = []
-            for t in btn_texts:
-                norm_t = _norm_button_text(t)
-                if norm_t in norm_targets:
-                    matched.append(t)
-
-            if len(matched) == 1:
-                target = matched[0]
-                target_btn = None
-                for b in buttons:
-                    if b.window_text() == target:
-                        target_btn = b
-                        break
-                if target_btn is None:
-                    raise RuntimeError(f"上書き確認ダイアログのボタンが取得できません: {target}")
-                try:
-                    target_btn.click()
-                except Exception:
-                    target_btn.click_input()
-                log(f"  [DEBUG] 上書き確認ダイアログで「{target}」を選択")
-                # 上書き確認の押下後をダウンロード開始時刻とみなす
-                download_start = time.time()
-                overwrite_clicked = True
-            elif len(matched) == 0:
-                raise RuntimeError("上書き確認ダイアログのボタンが見つかりません: はい(&Y) / はい(Y)")
-            else:
-                raise RuntimeError(f"上書き確認ダイアログのボタンが複数一致: {matched}")
-            confirm_overwrite.wait_not("visible", timeout=WAIT_DIALOG_CLOSE)
+        wait_engine.wait_until(lambda: overwrite.seen() or not save_dialog.exists(timeout=0),
+                               WAIT_DIALOG_CLOSE, raise_on_timeout=False)
+        if overwrite.seen():
+            # 上書き確認の押下後をダウンロード開始時刻とみなす
+            download_start = overwrite.wait(WAIT_DIALOG_CLOSE + 5)
+            overwrite_clicked = True
     except Exception as e:
         log(f"  [WARN] 上書き確認処理で例外: {e}")
+    finally:
+        overwrite.cancel()
 
     # ダイアログが閉じるのを待機
     save_dialog.wait_not("visible", timeout=WAIT_DIALOG_CLOSE)
-    time.sleep(0.5)
 
     if download_start is None:
         download_start = time.time()
@@ -553,121 +684,62 @@ def step_handle_save_dialog():
     return save_file_path, before_mtime, download_start
 
 
-def wait_for_download_complete(save_file_path, start_time, timeout=60, stable_sec=3):
-    """partialファイル消滅と本体の更新を待つ（開始時刻以降のもののみ対象）"""
-    partial_path = f"{save_file_path}.partial"
-    end = time.time() + timeout
+def _export_trace():
+    """ステップごとの計測結果を JSONL / Chrome trace 形式でログディレクトリに出力する"""
     try:
-        start_time_local = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))
-    except Exception:
-        start_time_local = str(start_time)
-    log(
-        f"  [DEBUG] ダウンロード監視: file={save_file_path}, partial={partial_path}, "
-        f"start_time={start_time_local}"
-    )
-    last_size = None
-    last_mtime = None
-    stable_since = None
-    while time.time() < end:
-        partial_exists = os.path.exists(partial_path)
-        file_exists = os.path.exists(save_file_path)
-        partial_is_new = False
-        partial_mtime = None
-        if partial_exists:
-            try:
-                partial_mtime = os.path.getmtime(partial_path)
-                partial_is_new = partial_mtime >= start_time
-            except Exception:
-                partial_is_new = True
-        file_is_new = False
-        file_mtime = None
-        file_size = None
-        if file_exists:
-            try:
-                file_mtime = os.path.getmtime(save_file_path)
-                file_size = os.path.getsize(save_file_path)
-                file_is_new = file_mtime >= start_time
-            except Exception:
-                file_is_new = True
-
-        elapsed = time.time() - start_time
-        if file_exists and not partial_exists and elapsed >= 1:
-            return True
-        if file_exists and file_is_new and not partial_is_new:
-            return True
-
-        # .partial が残っていても、本体が更新されて安定していれば完了とみなす
-        if file_exists:
-            if file_size == last_size and file_mtime == last_mtime:
-                if stable_since is None:
-                    stable_since = time.time()
-                elif time.time() - stable_since >= stable_sec:
-                    return True
-            else:
-                stable_since = None
-            last_size = file_size
-            last_mtime = file_mtime
-
-        time.sleep(0.5)
-    raise TimeoutError(
-        f"ダウンロード完了待ちがタイムアウト: {save_file_path} / {partial_path} "
-        f"(file_mtime={file_mtime}, file_size={file_size}, "
-        f"partial_mtime={partial_mtime})"
-    )
+        jsonl_path, chrome_path = step_trace.export_run(os.path.dirname(IEDRIVER_LOG_PATH))
+        log(f"[OK] トレース出力: {jsonl_path} / {chrome_path}")
+    except Exception as e:
+        log(f"  [WARN] トレース出力に失敗: {e}")
+
+
+def run_scenario(driver, save_dir=None, expected=None):
+    """ログイン → ダウンロード → 保存 → 完了待ち → 保存確認 を1回実行する (シナリオエンジン経由)"""
+    result = scenario_engine.run_scenario(SeleniumBackend(driver), BASE_URL, save_dir,
+                                          SAVE_FILENAME, USER_ID, PASSWORD, expected)
+    return result["status"]
+
+
+def _enable_history():
+    """実行履歴を記録し、待ちのタイムアウトを履歴から決める (失敗しても従来の固定値で続行)"""
+    try:
+        run_history.enable(HISTORY_DB_PATH)
+        log(f"  [DEBUG] 実行履歴: {HISTORY_DB_PATH}")
+    except Exception as e:
+        log(f"  [WARN] 実行履歴を開けません。固定のタイムアウトを使用: {e}")
 
 
 def main():
-    driver = None
-    before_edge_pids = set()
+    pool = None
     try:
         init_logging()
+        _enable_history()
         log("IEDriver + Edge IEモードを起動中...")
         _kill_existing_ie_mode_edges()
-        before_edge_pids = _snapshot_ie_mode_edges()
-        driver = create_driver()
-        time.sleep(2)
-        _track_new_ie_mode_edges(before_edge_pids)
+        _ui_cache.attach(dialog_watcher.get_watcher())
+        pool = create_session_pool()
+        pool.start()
         log("[OK] WebDriver起動完了")
-
-        step_login(driver)
-        step_click_download_and_confirm(driver)
-        step_handle_download_bar()
-        save_file_path, before_mtime, download_start = step_handle_save_dialog()
-
-        # ダウンロード完了待ち (.partial が消えるまで)
-        wait_for_download_complete(
-            save_file_path,
-            download_start,
-            timeout=WAIT_DOWNLOAD_TIMEOUT,
-            stable_sec=WAIT_STABLE_SEC,
-        )
-
-        if os.path.exists(save_file_path):
-            file_size = os.path.getsize(save_file_path)
-            after_mtime = os.path.getmtime(save_file_path)
-            if before_mtime is None:
-                log(f"[OK] ファイル保存確認: {save_file_path} ({file_size} bytes)")
-            else:
-                if after_mtime > before_mtime:
-                    log(f"[OK] ファイル更新確認: {save_file_path} ({file_size} bytes)")
-                else:
-                    log(f"[WARN] ファイルが更新されていない可能性: {save_file_path} ({file_size} bytes)")
-        else:
-            log(f"[WARN] ファイルが見つかりません: {save_file_path}")
-
-        log("\n===== テスト完了 =====")
-        time.sleep(2)
+        # 保存ファイルの照合に使うマニフェスト (サイズ・行数・SHA-256)
+        expected = fetch_expected(BASE_URL, DOWNLOAD_URL_PATH)
+
+        for run in range(1, SCENARIO_RUNS + 1):
+            with step_trace.span("scenario", run=run), pool.session() as driver:
+                status = run_scenario(driver, expected=expected)
+            if status == "corrupt":
+                raise RuntimeError("保存ファイルがマニフェストと一致しません")
+            log(f"\n===== テスト完了 ({run}/{SCENARIO_RUNS}) =====")
     except Exception as e:
         log(f"\n[ERROR] テスト失敗: {e}")
         raise
     finally:
-        if driver:
-            try:
-                driver.quit()
-            except Exception:
-                pass
+        if pool:
+            log(f"  [DEBUG] セッションプール: {pool.stats()}")
+            pool.close()
+        log(f"  [DEBUG] UI要素キャッシュ: {_ui_cache.stats()}")
         _cleanup_tracked_ie_mode_edges()
         log("ブラウザを終了しました")
+        _export_trace()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,351 @@
+"""
+ブラウザセッション (WebDriver / IE COM) のウォームプール
+
+create_driver / create_ie の起動コスト (数十秒) をシナリオごとに払わないよう、
+起動済みのセッションを使い回す。
+
+- start()    : size 個のセッションを並列に事前起動する
+- session()  : 空いているセッションを借りる。貸し出し前に probe (readyState の取得など)
+               で生存確認し、応答しなければ作り直す
+- 返却時     : reset (初期URLへの遷移 + Cookie 削除) で状態を戻す。
+               max_uses 回使ったセッション、シナリオが例外で終わったセッション、
+               reset に失敗したセッションは破棄し、バックグラウンドで作り直す
+
+ブラウザ固有の処理 (factory / probe / reset / destroy) は呼び出し側が渡す。
+IE の COM オブジェクトのように作ったスレッド (STA) でしか使えないセッションは
+thread_affine=True にする。起動・作り直しはすべて acquire() / start() を呼んだスレッドで行い、
+別スレッドでの事前起動・補充はしない。
+FakeDriver / FakeDriverFactory を使うと Linux 上でプールの動作を確認できる。
+"""
+
+import contextlib
+import itertools
+import threading
+import time
+
+import step_trace
+import wait_engine
+
+DEFAULT_MAX_USES = 20
+
+
+class PooledSession:
+    """プール内のセッション1つ分 (handle が WebDriver / IE COM オブジェクト)"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, handle):
+        self.id = next(self._ids)
+        self.handle = handle
+        self.uses = 0
+        self.created_at = time.time()
+
+
+class SessionPool:
+    """起動済みブラウザセッションのプール (スレッドセーフ)"""
+
+    def __init__(self, factory, size=1, max_uses=DEFAULT_MAX_USES,
+                 probe=None, reset=None, destroy=None, replenish=True, thread_affine=False):
+        self.factory = factory
+        self.thread_affine = thread_affine
+        # スレッドに縛られるセッションはバックグラウンドで補充できない (次の acquire で起動する)
+        self.replenish = replenish and not thread_affine
+        self.size = size
+        self.max_uses = max_uses
+        self.probe = probe
+        self.reset = reset
+        self.destroy = destroy
+        self._cond = threading.Condition()
+        self._idle = []
+        self._count = 0
+        self._closed = False
+        self._fillers = []
+        self._owner = None
+        self.created = 0
+        self.recycled = 0
+        self.failures = 0
+        self.unhealthy = 0
+        self.borrowed = 0
+
+    def _create(self):
+        with step_trace.span("session_pool.create"):
+            session = PooledSession(self.factory())
+        with self._cond:
+            self.created += 1
+        return session
+
+    def _destroy(self, session):
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+            closed = self._closed
+        if self.destroy is not None:
+            try:
+                self.destroy(session.handle)
+            except Exception:
+                pass
+        if self.replenish and not closed:
+            # 次の貸し出しで起動待ちにならないよう、欠けた分を先に起動しておく
+            t = threading.Thread(target=self._top_up, daemon=True)
+            with self._cond:
+                self._fillers = [f for f in self._fillers if f.is_alive()] + [t]
+            t.start()
+
+    def _top_up(self):
+        try:
+            self.start()
+        except Exception:
+            pass
+
+    def _check_owner(self):
+        """thread_affine のプールを最初に使ったスレッド以外から使おうとしたら例外を送出する"""
+        if not self.thread_affine:
+            return
+        current = threading.get_ident()
+        with self._cond:
+            if self._owner is None:
+                self._owner = current
+            elif self._owner != current:
+                raise RuntimeError("thread_affine のセッションプールは作成したスレッドでのみ使えます")
+
+    def _healthy(self, session):
+        if self.probe is None:
+            return True
+        try:
+            return bool(self.probe(session.handle))
+        except Exception:
+            return False
+
+    @step_trace.traced("session_pool.start")
+    def start(self):
+        """
+        空きが size 個になるまでセッションを起動する。起動に失敗したものは数えない
+
+        通常は並列に起動する。thread_affine なら呼び出したスレッドで1つずつ起動する。
+        """
+        self._check_owner()
+        with self._cond:
+            if self._closed:
+                return 0
+            missing = max(0, self.size - self._count)
+            self._count += missing
+        errors = []
+
+        def _launch():
+            try:
+                session = self._create()
+            except Exception as e:
+                errors.append(e)
+                with self._cond:
+                    self._count -= 1
+                return
+            with self._cond:
+                closed = self._closed
+                if not closed:
+                    self._idle.append(session)
+                    self._cond.notify()
+            if closed:
+                self._destroy(session)
+
+        if self.thread_affine:
+            for _ in range(missing):
+                _launch()
+        else:
+            threads = [threading.Thread(target=_launch, daemon=True) for _ in range(missing)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        if errors and len(errors) == missing:
+            raise errors[0]
+        return len(self._idle)
+
+    def acquire(self, timeout=None):
+        """
+        セッションを1つ借りる
+
+        空きが無く size に達している場合は返却を待つ (timeout 秒で TimeoutError)。
+        新しく起動する場合は、呼び出したスレッドで factory を呼ぶ。
+        """
+        self._check_owner()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("セッションプールは終了しています")
+                    if self._idle:
+                        session = self._idle.pop()
+                        break
+                    if self._count < self.size:
+                        self._count += 1
+                        session = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("空きセッションを取得できませんでした")
+                    self._cond.wait(remaining)
+            if session is None:
+                try:
+                    session = self._create()
+                except Exception:
+                    with self._cond:
+                        self._count -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(session):
+                # 応答しないセッションは捨てて作り直す
+                with self._cond:
+                    self.unhealthy += 1
+                self._destroy(session)
+                continue
+            with self._cond:
+                self.borrowed += 1
+            return session
+
+    def release(self, session, failed=False):
+        """セッションを返却する。失敗時・使用回数超過時・reset 失敗時は破棄する"""
+        session.uses += 1
+        if failed:
+            with self._cond:
+                self.failures += 1
+            self._destroy(session)
+            return
+        if self._closed or session.uses >= self.max_uses:
+            with self._cond:
+                self.recycled += 1
+            self._destroy(session)
+            return
+        if self.reset is not None:
+            try:
+                with step_trace.span("session_pool.reset"):
+                    self.reset(session.handle)
+            except Exception:
+                with self._cond:
+                    self.failures += 1
+                self._destroy(session)
+                return
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        """with pool.session() as driver: の形でセッションを借りる"""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled.handle
+        except BaseException:
+            self.release(pooled, failed=True)
+            raise
+        self.release(pooled)
+
+    def close(self):
+        """
+        空いているセッションをすべて破棄する (貸出中のものは返却時に破棄される)
+
+        補充のために起動中のセッションは、起動を待ってから破棄する。
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            fillers = list(self._fillers)
+        for session in idle:
+            self._destroy(session)
+        for t in fillers:
+            t.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "live": self._count,
+                "idle": len(self._idle),
+                "created": self.created,
+                "borrowed": self.borrowed,
+                "recycled": self.recycled,
+                "failures": self.failures,
+                "unhealthy": self.unhealthy,
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class FakeDriver:
+    """テスト用の WebDriver もどき (readyState / get / Cookie / quit だけを持つ)"""
+
+    def __init__(self, initial_url="about:blank"):
+        self.current_url = initial_url
+        self.cookies = {}
+        self.alive = True
+        self.visits = []
+
+    def execute_script(self, script, *args):
+        if not self.alive:
+            raise ConnectionError("ブラウザが応答しません")
+        if "readyState" in script:
+            return "complete"
+        return None
+
+    def get(self, url):
+        if not self.alive:
+            raise ConnectionError("ブラウザが応答しません")
+        self.current_url = url
+        self.visits.append(url)
+
+    def add_cookie(self, cookie):
+        self.cookies[cookie["name"]] = cookie["value"]
+
+    def delete_all_cookies(self):
+        self.cookies.clear()
+
+    def crash(self):
+        self.alive = False
+
+    def quit(self):
+        self.alive = False
+
+
+class FakeDriverFactory:
+    """
+    FakeDriver を生成するファクトリ
+
+    startup_sec は wait_engine.pause() で待つので、FakeClock を使えば実時間はかからない。
+    fail_next に回数を入れると、その回数だけ起動に失敗する。
+    """
+
+    def __init__(self, startup_sec=0, initial_url="about:blank"):
+        self.startup_sec = startup_sec
+        self.initial_url = initial_url
+        self.fail_next = 0
+        self.drivers = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                raise RuntimeError("ブラウザの起動に失敗しました (fake)")
+        if self.startup_sec:
+            wait_engine.pause(self.startup_sec)
+        driver = FakeDriver(self.initial_url)
+        with self._lock:
+            self.drivers.append(driver)
+        return driver
+
+    @staticmethod
+    def probe(driver):
+        return driver.execute_script("return document.readyState") in ("complete", "interactive")
+
+    def reset(self, driver):
+        driver.get(self.initial_url)
+        driver.delete_all_cookies()
+
+    @staticmethod
+    def destroy(driver):
+        driver.quit()
@@ -0,0 +1,271 @@
+"""
+ステップ単位の計測 (スパン) とトレース出力
+
+各 step_* 関数や待機処理をスパンで囲み、次を記録する。
+
+- wall_sec   : 経過時間
+- sleep_sec  : step_trace.sleep() で眠っていた時間 (入れ子のスパンにも加算)
+- active_sec : wall_sec - sleep_sec (ポーリングや UI 操作に使った時間)
+- polls      : 条件チェックの回数
+- retries    : リトライ回数
+
+出力形式:
+- JSONL                 : 1スパン1行
+- Chrome trace-event    : chrome://tracing / Perfetto でタイムラインとして開ける JSON
+
+使い方:
+    from step_trace import traced, span, sleep, poll, retry, tracer
+
+    @traced()
+    def step_login(driver): ...
+
+    with span("wait_for_ready", timeout=15):
+        ...
+    tracer.export_jsonl("trace.jsonl")
+    tracer.export_chrome_trace("trace.json")
+
+記録したスパンは直近 MAX_SPANS 件だけ保持する (常駐するワーカーで増え続けないように)。
+出力しないプロセスでは tracer.enabled = False にすると記録しない。
+"""
+
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+# 保持するスパンの上限 (超えたら古いものから捨て、dropped に数える)
+MAX_SPANS = 100_000
+
+
+class Span:
+    """計測区間1つ分の記録"""
+
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs)
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start_epoch = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.sleep_sec = 0.0
+        self.polls = 0
+        self.retries = 0
+        self.error = None
+
+    @property
+    def wall_sec(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent else None,
+            "thread": self.thread_name,
+            "start_epoch": self.start_epoch,
+            "start_offset_sec": self.start - origin,
+            "wall_sec": self.wall_sec,
+            "sleep_sec": self.sleep_sec,
+            "active_sec": max(0.0, self.wall_sec - self.sleep_sec),
+            "polls": self.polls,
+            "retries": self.retries,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class Tracer:
+    """
+    スパンを集めてファイルに出力する (スレッドセーフ)
+
+    enabled=False の間は終了したスパンを保持しない (入れ子の sleep_sec の加算などは行う)。
+    """
+
+    def __init__(self, max_spans=MAX_SPANS, enabled=True):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.spans = collections.deque(maxlen=max_spans)
+        self.dropped = 0
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def start_span(self, name, **attrs):
+        stack = self._stack()
+        s = Span(name, stack[-1] if stack else None, attrs)
+        stack.append(s)
+        return s
+
+    def end_span(self, s, error=None):
+        s.end = time.perf_counter()
+        if error is not None:
+            s.error = f"{type(error).__name__}: {error}"
+        stack = self._stack()
+        if s in stack:
+            stack.remove(s)
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self.spans) == self.spans.maxlen:
+                self.dropped += 1
+            self.spans.append(s)
+
+    def span(self, name, **attrs):
+        return _SpanContext(self, name, attrs)
+
+    def sleep(self, seconds):
+        """time.sleep() の代わり。眠った時間を現在のスレッドの全スパンに加算する"""
+        t0 = time.perf_counter()
+        time.sleep(seconds)
+        self.add_sleep(time.perf_counter() - t0)
+
+    def add_sleep(self, seconds):
+        for s in self._stack():
+            s.sleep_sec += seconds
+
+    def poll(self, count=1):
+        s = self.current()
+        if s is not None:
+            s.polls += count
+
+    def retry(self, count=1):
+        s = self.current()
+        if s is not None:
+            s.retries += count
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.dropped = 0
+            self.origin = time.perf_counter()
+
+    def records(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return [s.to_dict(self.origin) for s in spans]
+
+    def summary(self):
+        """スパン名ごとの合計 {name: {count, wall_sec, sleep_sec, polls, retries}}"""
+        out = {}
+        for r in self.records():
+            agg = out.setdefault(r["name"], {"count": 0, "wall_sec": 0.0, "sleep_sec": 0.0,
+                                             "polls": 0, "retries": 0})
+            agg["count"] += 1
+            for key in ("wall_sec", "sleep_sec", "polls", "retries"):
+                agg[key] += r[key]
+        return out
+
+    def export_jsonl(self, path):
+        _ensure_parent(path)
+        with open(path, "w", encoding="utf-8") as f:
+            for r in self.records():
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        return path
+
+    def export_chrome_trace(self, path):
+        """Chrome trace-event 形式 (ph="X" の complete event) で出力する"""
+        pid = os.getpid()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        events = []
+        thread_names = {}
+        for s in spans:
+            thread_names[s.thread_id] = s.thread_name
+            args = dict(s.attrs)
+            args.update(sleep_ms=round(s.sleep_sec * 1000, 3), polls=s.polls,
+                        retries=s.retries)
+            if s.error:
+                args["error"] = s.error
+            events.append({
+                "name": s.name,
+                "cat": "step",
+                "ph": "X",
+                "ts": round((s.start - self.origin) * 1e6, 3),
+                "dur": round(s.wall_sec * 1e6, 3),
+                "pid": pid,
+                "tid": s.thread_id,
+                "args": args,
+            })
+        for tid, name in thread_names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": name}})
+        _ensure_parent(path)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return path
+
+
+class _SpanContext:
+    def __init__(self, tracer_, name, attrs):
+        self._tracer = tracer_
+        self._name = name
+        self._attrs = attrs
+        self.span = None
+
+    def __enter__(self):
+        self.span = self._tracer.start_span(self._name, **self._attrs)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._tracer.end_span(self.span, exc)
+        return False
+
+
+def _ensure_parent(path):
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+
+# プロセス共通のトレーサー
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    return tracer.span(name, **attrs)
+
+
+def sleep(seconds):
+    tracer.sleep(seconds)
+
+
+def poll(count=1):
+    tracer.poll(count)
+
+
+def retry(count=1):
+    tracer.retry(count)
+
+
+def traced(name=None):
+    """関数全体をスパンで囲むデコレーター"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_run(directory, prefix="trace"):
+    """トレーサーの内容を <prefix>_<時刻>.jsonl / .json として directory に出力する"""
+    ts = time.strftime("%Y%m%d%H%M%S")
+    jsonl = tracer.export_jsonl(os.path.join(directory, f"{prefix}_{ts}.jsonl"))
+    chrome = tracer.export_chrome_trace(os.path.join(directory, f"{prefix}_{ts}.json"))
+    return jsonl, chrome
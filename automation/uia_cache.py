@@ -0,0 +1,347 @@
+"""
+UI オートメーション要素のキャッシュ (UIA / win32 のツリー走査を減らす)
+
+負荷の高い VM では descendants() や child_window(...).wait() の1回のツリー走査に
+数百ミリ秒かかる。同じウィンドウに対する同じ検索を、次のようにキャッシュから返す。
+
+- descendants(window) : ウィンドウごとに1回だけ走査し、テキスト・クラス名も要素ごとに1回だけ取得する
+- find(window, **spec): child_window(**spec) の解決結果を (ハンドル, 条件) ごとに保持する
+- windows(desktop, **spec): desktop.windows(**spec) の結果を保持する (見つからなかった結果は保持しない)
+
+ウィンドウハンドルが無効になったら (IsWindow が偽 / ダイアログ監視の消滅イベント)
+そのハンドルのエントリを捨てる。find の結果は返す前に is_visible() で生存確認し、
+失敗したら取り直す。hit / miss などの件数は stats() で取得できる。
+
+FakeElement / FakeDesktop を使うと Linux 上でキャッシュの動作を確認できる。
+"""
+
+import ctypes
+import itertools
+import re
+import sys
+import threading
+
+import step_trace
+import wait_engine
+
+
+def _default_is_alive():
+    """ウィンドウハンドルの生存確認関数 (Windows 以外では常に True)"""
+    if sys.platform != "win32":
+        return lambda handle: True
+    user32 = ctypes.WinDLL("user32", use_last_error=True)
+    user32.IsWindow.argtypes = [ctypes.c_void_p]
+    return lambda handle: bool(user32.IsWindow(handle))
+
+
+class CachedElement:
+    """descendants() の要素1つ分。テキストとクラス名は初回参照時に1回だけ取得する"""
+
+    _MISSING = object()
+
+    def __init__(self, element):
+        self.element = element
+        self._text = self._MISSING
+        self._friendly_class_name = self._MISSING
+
+    @property
+    def text(self):
+        if self._text is self._MISSING:
+            try:
+                self._text = self.element.window_text()
+            except Exception:
+                self._text = ""
+        return self._text
+
+    @property
+    def friendly_class_name(self):
+        if self._friendly_class_name is self._MISSING:
+            try:
+                self._friendly_class_name = self.element.friendly_class_name()
+            except Exception:
+                self._friendly_class_name = ""
+        return self._friendly_class_name
+
+
+def _spec_key(spec):
+    return tuple(sorted((k, str(v)) for k, v in spec.items()))
+
+
+class ElementCache:
+    """ウィンドウハンドルと検索条件をキーにした要素キャッシュ (スレッドセーフ)"""
+
+    def __init__(self, is_alive=None):
+        self._is_alive = is_alive or _default_is_alive()
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._windows = {}
+        self.hits = 0
+        self.misses = 0
+        self.walks = 0
+        self.stale = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _handle_of(window, handle):
+        if handle is not None:
+            return handle
+        try:
+            return window.handle
+        except Exception:
+            return None
+
+    def _get(self, handle, key):
+        """(ハンドル, キー) のエントリを返す。ハンドルが無効ならそのハンドルのエントリを捨てる"""
+        with self._lock:
+            per_window = self._entries.get(handle)
+            value = per_window.get(key) if per_window else None
+        if value is None:
+            return None
+        if not self._is_alive(handle):
+            with self._lock:
+                self.stale += 1
+            self.invalidate(handle)
+            return None
+        return value
+
+    def _put(self, handle, key, value):
+        if not self._is_alive(handle):
+            return
+        with self._lock:
+            self._entries.setdefault(handle, {})[key] = value
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def descendants(self, window, handle=None):
+        """window の全子孫を CachedElement のリストで返す (ツリー走査はハンドルごとに1回)"""
+        handle = self._handle_of(window, handle)
+        cached = self._get(handle, ("descendants",)) if handle is not None else None
+        if cached is not None:
+            self._count(hit=True)
+            return cached
+        self._count(hit=False)
+        with step_trace.span("uia_cache.walk"):
+            elements = [CachedElement(e) for e in window.descendants()]
+        with self._lock:
+            self.walks += 1
+        if handle is not None:
+            self._put(handle, ("descendants",), elements)
+        return elements
+
+    def find(self, window, handle=None, timeout=None, **spec):
+        """
+        window.child_window(**spec) の要素 (wrapper) を返す
+
+        キャッシュに無ければ timeout 秒まで表示を待って解決し、結果を保持する。
+        キャッシュの要素が応答しなければ (閉じた / 作り直された) 取り直す。
+        """
+        handle = self._handle_of(window, handle)
+        key = ("find", _spec_key(spec))
+        cached = self._get(handle, key) if handle is not None else None
+        if cached is not None:
+            try:
+                alive = cached.is_visible()
+            except Exception:
+                alive = False
+            if alive:
+                self._count(hit=True)
+                return cached
+            with self._lock:
+                self.stale += 1
+                per_window = self._entries.get(handle)
+                if per_window:
+                    per_window.pop(key, None)
+        self._count(hit=False)
+        criteria = window.child_window(**spec)
+        with step_trace.span("uia_cache.walk"):
+            if timeout is not None:
+                criteria.wait("visible", timeout=timeout)
+            element = criteria.wrapper_object()
+        with self._lock:
+            self.walks += 1
+        if handle is not None:
+            self._put(handle, key, element)
+        return element
+
+    def windows(self, desktop, **spec):
+        """desktop.windows(**spec) の結果を返す。空の結果はキャッシュしない (出現待ちのため)"""
+        key = _spec_key(spec)
+        with self._lock:
+            cached = self._windows.get(key)
+        if cached and all(self._is_alive(self._handle_of(w, None)) for w in cached):
+            self._count(hit=True)
+            return list(cached)
+        if cached:
+            with self._lock:
+                self.stale += 1
+                self._windows.pop(key, None)
+        self._count(hit=False)
+        with step_trace.span("uia_cache.walk"):
+            found = desktop.windows(**spec)
+        with self._lock:
+            self.walks += 1
+            if found:
+                self._windows[key] = list(found)
+        return found
+
+    def invalidate(self, handle=None):
+        """handle のエントリを捨てる (None ならすべて)"""
+        with self._lock:
+            self.invalidations += 1
+            if handle is None:
+                self._entries.clear()
+                self._windows.clear()
+                return
+            self._entries.pop(handle, None)
+            for key, found in list(self._windows.items()):
+                if any(self._handle_of(w, None) == handle for w in found):
+                    del self._windows[key]
+
+    def attach(self, watcher):
+        """ダイアログ監視 (dialog_watcher.DialogWatcher) の消滅イベントでエントリを捨てる"""
+        watcher.add_close_listener(self.invalidate)
+        return self
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "walks": self.walks,
+                "stale": self.stale,
+                "invalidations": self.invalidations,
+                "windows": len(self._entries),
+            }
+
+
+# ===== テスト用の疑似要素ツリー =====
+class FakeElement:
+    """
+    pywinauto の wrapper / WindowSpecification もどき
+
+    descendants() と child_window(...).wrapper_object() の呼び出しごとに
+    tree.walks を数え、walk_sec だけ wait_engine.pause() で待つ (FakeClock なら実時間は不要)。
+    """
+
+    _handles = itertools.count(0x20000, 2)
+
+    def __init__(self, tree, title="", class_name="", control_type="", auto_id="",
+                 children=()):
+        self.tree = tree
+        self.handle = next(self._handles)
+        self.title = title
+        self.class_name = class_name
+        self.control_type = control_type
+        self.auto_id = auto_id
+        self.children = list(children)
+        self.visible = True
+
+    def add(self, **kwargs):
+        child = FakeElement(self.tree, **kwargs)
+        self.children.append(child)
+        return child
+
+    def window_text(self):
+        self.tree.calls += 1
+        return self.title
+
+    def friendly_class_name(self):
+        self.tree.calls += 1
+        return self.class_name
+
+    def is_visible(self):
+        if not self.visible or not self.tree.is_alive(self.tree.root_handle(self)):
+            raise RuntimeError("要素にアクセスできません")
+        return True
+
+    def _iter(self):
+        for child in self.children:
+            yield child
+            yield from child._iter()
+
+    def descendants(self):
+        self.tree.walk()
+        return list(self._iter())
+
+    def matches(self, title=None, title_re=None, class_name=None, control_type=None,
+                auto_id=None):
+        return ((title is None or self.title == title)
+                and (title_re is None or re.match(title_re, self.title))
+                and (class_name is None or self.class_name == class_name)
+                and (control_type is None or self.control_type == control_type)
+                and (auto_id is None or self.auto_id == auto_id))
+
+    def child_window(self, **spec):
+        return _FakeSpec(self, spec)
+
+
+class _FakeSpec:
+    """child_window(...) の戻り値もどき"""
+
+    def __init__(self, parent, spec):
+        self.parent = parent
+        self.spec = spec
+
+    def _resolve(self):
+        self.parent.tree.walk()
+        for element in self.parent._iter():
+            if element.matches(**self.spec) and element.visible:
+                return element
+        return None
+
+    def wait(self, state, timeout=None):
+        wait_engine.wait_until(lambda: self._resolve() is not None, timeout or 0,
+                               f"要素が表示されませんでした: {self.spec}")
+        return self
+
+    def wrapper_object(self):
+        element = self._resolve()
+        if element is None:
+            raise LookupError(f"要素が見つかりません: {self.spec}")
+        return element
+
+
+class FakeDesktop:
+    """トップレベルウィンドウを持つ疑似デスクトップ (walks / calls を数える)"""
+
+    def __init__(self, walk_sec=0.0):
+        self.walk_sec = walk_sec
+        self.walks = 0
+        self.calls = 0
+        self._top = {}
+
+    def walk(self):
+        self.walks += 1
+        if self.walk_sec:
+            wait_engine.pause(self.walk_sec)
+
+    def open(self, title, class_name="#32770", **kwargs):
+        window = FakeElement(self, title=title, class_name=class_name, **kwargs)
+        self._top[window.handle] = window
+        return window
+
+    def close(self, window):
+        self._top.pop(window.handle, None)
+
+    def root_handle(self, element):
+        for handle, window in self._top.items():
+            if window is element or element in window._iter():
+                return handle
+        return None
+
+    def is_alive(self, handle):
+        return handle in self._top
+
+    def windows(self, **spec):
+        self.walk()
+        return [w for w in self._top.values() if w.matches(**spec)]
+
+    def window(self, handle):
+        return self._top[handle]
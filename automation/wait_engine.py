@@ -0,0 +1,235 @@
+"""
+条件待ちの共通エンジン (固定 sleep の置き換え)
+
+述語 (predicate) を期限付きでポーリングし、待機間隔は指数バックオフ + ジッターで伸ばす。
+状態が変化している間は間隔を初期値に戻す (アダプティブ) ので、
+UI がすぐ準備できた場合は最初の数十ミリ秒で抜け、変化がなければ間隔を広げて負荷を下げる。
+
+- wait_until()  : 述語が真になるまで待つ (通常の用途)
+- Poller        : 待機ループを自前で書く場合の部品 (次回の起床時刻ヒントや
+                  イベント待ち関数を使いたい download_check などで利用)
+- RealClock / FakeClock : 時刻源。FakeClock を set_clock() すると実時間を使わずにテストできる
+
+待機時間は step_trace のスリープとして、述語の評価は poll として計上する。
+"""
+
+import random
+import threading
+import time
+
+import step_trace
+
+DEFAULT_INITIAL_INTERVAL = 0.05
+DEFAULT_MAX_INTERVAL = 0.5
+DEFAULT_FACTOR = 2.0
+DEFAULT_JITTER = 0.1
+
+_UNSET = object()
+
+
+class RealClock:
+    """実時間の時刻源"""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            step_trace.sleep(seconds)
+
+
+class FakeClock:
+    """
+    テスト用の時刻源。sleep() は実際には眠らず時刻を進めるだけ
+
+    schedule(delay, func) で「delay 秒後に状態が変わる」ことを再現できる。
+    """
+
+    def __init__(self, start=1_000_000.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+        self._scheduled = []
+        self.sleeps = []
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += max(0.0, seconds)
+            due = [item for item in self._scheduled if item[0] <= self._now]
+            self._scheduled = [item for item in self._scheduled if item[0] > self._now]
+        for _, func in sorted(due, key=lambda item: item[0]):
+            func()
+
+    def schedule(self, delay, func):
+        with self._lock:
+            self._scheduled.append((self._now + delay, func))
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """既定の時刻源を差し替え、元の時刻源を返す"""
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
+
+class Backoff:
+    """指数バックオフ + ジッターの待機間隔"""
+
+    def __init__(self, initial=DEFAULT_INITIAL_INTERVAL, factor=DEFAULT_FACTOR,
+                 max_interval=DEFAULT_MAX_INTERVAL, jitter=DEFAULT_JITTER, rng=None):
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+        self._current = initial
+
+    def reset(self):
+        self._current = self.initial
+
+    def delay(self, attempt):
+        """attempt 回目 (0 始まり) のリトライ前に待つ秒数。状態は変えない"""
+        return self._apply_jitter(min(self.max_interval, self.initial * self.factor ** attempt))
+
+    def next(self):
+        """次の待機秒数を返し、間隔を伸ばす"""
+        value = self._current
+        self._current = min(self.max_interval, self._current * self.factor)
+        return self._apply_jitter(value)
+
+    def _apply_jitter(self, value):
+        if not self.jitter:
+            return value
+        return max(0.0, value * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+
+class Poller:
+    """
+    期限付きポーリングループの部品
+
+        poller = Poller(timeout)
+        while poller.poll():
+            if done():
+                return
+            poller.sleep()
+        raise TimeoutError(...)
+
+    sleep(hint) の hint は「遅くともこの秒数後には再確認したい」時間。
+    sleeper にはイベント待ち関数 (例: FileWatcher.wait) を渡せる。
+    時刻源が RealClock 以外で、sleeper の呼び出しで時刻が進まなかった場合は
+    待機秒数だけ時刻源の sleep() で進める (FakeClock でも期限が来るようにするため)。
+    """
+
+    def __init__(self, timeout, backoff=None, clock=None, sleeper=None):
+        self.clock = clock or _clock
+        self.backoff = backoff or Backoff()
+        self.sleeper = sleeper
+        self.timeout = timeout
+        self.deadline = self.clock.monotonic() + timeout
+        self.polls = 0
+        self._last_state = _UNSET
+
+    @property
+    def remaining(self):
+        return max(0.0, self.deadline - self.clock.monotonic())
+
+    def poll(self):
+        """期限内なら True を返し、ポーリング回数を数える"""
+        if self.polls and self.clock.monotonic() >= self.deadline:
+            return False
+        self.polls += 1
+        step_trace.poll()
+        return True
+
+    def observe(self, state):
+        """観測した状態が前回から変わっていれば待機間隔を初期値に戻す"""
+        if state != self._last_state:
+            if self._last_state is not _UNSET:
+                self.backoff.reset()
+            self._last_state = state
+
+    def progress(self):
+        self.backoff.reset()
+
+    def sleep(self, hint=None):
+        delay = self.backoff.next()
+        if hint is not None:
+            delay = min(delay, max(0.0, hint))
+        delay = min(delay, self.remaining)
+        if self.sleeper is None:
+            self.clock.sleep(delay)
+            return
+        # イベント待ちの時間もスリープとして計上する
+        started = time.perf_counter()
+        before = self.clock.monotonic()
+        self.sleeper(delay)
+        step_trace.tracer.add_sleep(time.perf_counter() - started)
+        if not isinstance(self.clock, RealClock) and self.clock.monotonic() == before:
+            # FakeClock などでは sleeper が待っても時刻が進まず期限が来ないため、待った分だけ進める
+            self.clock.sleep(delay)
+
+
+def wait_until(predicate, timeout, message=None, *, raise_on_timeout=True,
+               ignore_exceptions=(), observe=None, backoff=None, clock=None,
+               initial=DEFAULT_INITIAL_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+               factor=DEFAULT_FACTOR, jitter=DEFAULT_JITTER):
+    """
+    predicate() が真を返すまで待ち、その値を返す
+
+    - timeout 秒以内に真にならなければ TimeoutError (raise_on_timeout=False なら None を返す)
+    - ignore_exceptions に含まれる例外は「まだ偽」として扱う
+    - observe() を渡すと、その戻り値が変わるたびに待機間隔を初期値に戻す
+    - 最低1回は predicate を評価する (timeout=0 でも即時チェックになる)
+    """
+    if backoff is None:
+        backoff = Backoff(initial=initial, factor=factor, max_interval=max_interval,
+                          jitter=jitter)
+    poller = Poller(timeout, backoff=backoff, clock=clock)
+    last_error = None
+    while poller.poll():
+        try:
+            result = predicate()
+        except ignore_exceptions as e:
+            last_error = e
+            result = None
+        if result:
+            return result
+        if observe is not None:
+            try:
+                poller.observe(observe())
+            except ignore_exceptions:
+                pass
+        poller.sleep()
+    if not raise_on_timeout:
+        return None
+    detail = f" (最後の例外: {last_error})" if last_error is not None else ""
+    raise TimeoutError((message or f"条件が{timeout}秒以内に満たされませんでした") + detail)
+
+
+def pause(seconds, clock=None):
+    """
+    条件で表せない最小限の待ち (キー入力間隔など) に使う
+
+    直接 time.sleep() を呼ばないことで、FakeClock 差し替え時にも実時間を消費しない。
+    """
+    (clock or _clock).sleep(seconds)
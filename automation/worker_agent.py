@@ -0,0 +1,334 @@
+"""
+コーディネーター (coordinator.py) からジョブを受け取って実行するワーカーエージェント
+
+各 Windows ホストで常駐させ、次を繰り返す。
+
+1. POST /lease でジョブを借りる (ジョブが無ければコーディネーター側で最大 lease_wait 秒待つ)
+2. parallel_runner.run_one で実行する (ジョブ専用のダウンロード先と PID 追跡付き)
+   実行中は lease_sec / 3 ごとに heartbeat を送ってリースを延長する
+3. 期待するファイル (名前・最小サイズ・sha256) と照合し、保存ファイルを成果物として送る
+4. POST /complete で status / timings を報告する
+
+heartbeat が 409 (リース喪失) になった場合は結果を報告しない
+(コーディネーターがすでに別のワーカーへ再割り当てしているため)。
+
+使い方:
+    python automation/worker_agent.py --coordinator http://coordinator:8500 --runners http
+    python automation/worker_agent.py --coordinator http://127.0.0.1:8500 --runners fake --slots 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.parse
+
+import file_digest
+import http_fast_test
+import parallel_runner
+import step_trace
+
+DEFAULT_LEASE_WAIT_SEC = 10
+DEFAULT_ARTIFACT_MAX_BYTES = 16 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_logger = logging.getLogger("iemode_dl_test")
+
+
+def log(message, level=logging.INFO):
+    _logger.log(level, message)
+
+
+class CoordinatorClient:
+    """コーディネーター API の薄いクライアント (keep-alive。スレッドごとに1つ持つこと)"""
+
+    def __init__(self, base_url, timeout=DEFAULT_LEASE_WAIT_SEC + 30):
+        self._session = http_fast_test.HttpSession(base_url, timeout=timeout)
+
+    def close(self):
+        self._session.close()
+
+    def _call(self, method, path, payload=None, body=None, headers=None):
+        if payload is not None:
+            body = json.dumps(payload)
+            headers = {"Content-Type": "application/json"}
+        status, _, data = self._session.fetch(method, path, body=body, headers=headers,
+                                              follow_redirects=False)
+        try:
+            return status, (json.loads(data) if data else None)
+        except ValueError:
+            return status, None
+
+    def lease(self, worker, runners, wait):
+        status, job = self._call("POST", "/lease",
+                                 {"worker": worker, "runners": list(runners), "wait": wait})
+        if status == 204:
+            return None
+        if status != 200:
+            raise RuntimeError(f"リースに失敗しました: status={status} {job}")
+        return job
+
+    def heartbeat(self, job_id, lease_id, progress=None):
+        """リースが有効なら True、失われていれば False"""
+        status, _ = self._call("POST", f"/jobs/{job_id}/heartbeat",
+                               {"lease_id": lease_id, "progress": progress})
+        return status == 200
+
+    def put_artifact(self, job_id, lease_id, name, data):
+        query = urllib.parse.urlencode({"lease_id": lease_id})
+        status, info = self._call("PUT", f"/jobs/{job_id}/artifacts/{urllib.parse.quote(name)}"
+                                  f"?{query}", body=data,
+                                  headers={"Content-Type": "application/octet-stream"})
+        return status == 201
+
+    def complete(self, job_id, lease_id, result):
+        status, _ = self._call("POST", f"/jobs/{job_id}/complete",
+                               {"lease_id": lease_id, "result": result})
+        return status == 200
+
+
+def sha256_file(path):
+    return file_digest.digest_file(path, HASH_CHUNK_SIZE).sha256
+
+
+def check_expected(run, expected):
+    """
+    保存ファイルがジョブの期待値と一致するか確認する
+
+    expected: {"filename": 名前, "min_bytes": 最小サイズ, "sha256": 16進ダイジェスト} (すべて任意)
+    """
+    path = run.get("path")
+    checks = {"ok": True, "problems": []}
+    if not expected:
+        return checks
+    if not path or not os.path.exists(path):
+        checks["ok"] = False
+        checks["problems"].append("保存ファイルがありません")
+        return checks
+    size = os.path.getsize(path)
+    checks["size"] = size
+    if expected.get("filename") and os.path.basename(path) != expected["filename"]:
+        checks["problems"].append(f"ファイル名が違います: {os.path.basename(path)}")
+    if expected.get("min_bytes") is not None and size < int(expected["min_bytes"]):
+        checks["problems"].append(f"サイズが小さすぎます: {size} bytes")
+    if expected.get("sha256"):
+        digest = sha256_file(path)
+        checks["sha256"] = digest
+        if digest != expected["sha256"].lower():
+            checks["problems"].append("sha256 が一致しません")
+    checks["ok"] = not checks["problems"]
+    return checks
+
+
+class WorkerAgent:
+    """
+    ジョブをリースして実行するワーカー
+
+    slots 個のスレッドが並列にジョブを実行し、スレッドごとにランナーを使い回す。
+    stop() は実行中のジョブを終えてから止まり、crash() は heartbeat と報告をやめて
+    その場で手放す (ワーカー喪失の再現用)。
+    """
+
+    def __init__(self, coordinator_url, worker_id=None, runners=None, slots=1,
+                 base_dir=None, lease_wait=DEFAULT_LEASE_WAIT_SEC,
+                 artifact_max_bytes=DEFAULT_ARTIFACT_MAX_BYTES):
+        self.coordinator_url = coordinator_url
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.runners = tuple(runners or parallel_runner.RUNNERS)
+        self.slots = slots
+        self.base_dir = base_dir or os.path.join(parallel_runner.SAVE_PATH, "jobs")
+        self.lease_wait = lease_wait
+        self.artifact_max_bytes = artifact_max_bytes
+        self._stop = threading.Event()
+        self._crashed = threading.Event()
+        self._lock = threading.Lock()
+        self._remaining = None
+        self.completed = 0
+        self.abandoned = 0
+
+    def stop(self):
+        self._stop.set()
+
+    def crash(self):
+        self._crashed.set()
+        self._stop.set()
+
+    def _take_slot(self):
+        """max_jobs の残りから1件分を確保する"""
+        with self._lock:
+            if self._remaining is None:
+                return True
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _give_back_slot(self):
+        with self._lock:
+            if self._remaining is not None:
+                self._remaining += 1
+
+    def run(self, max_jobs=None, idle_exit=None):
+        """
+        ジョブを処理し続ける (max_jobs 件で終了 / idle_exit 秒ジョブが無ければ終了)
+        """
+        self._remaining = max_jobs
+        os.makedirs(self.base_dir, exist_ok=True)
+        threads = [threading.Thread(target=self._slot_loop, args=(idle_exit,),
+                                    name=f"{self.worker_id}/slot{i}", daemon=True)
+                   for i in range(self.slots)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def _slot_loop(self, idle_exit):
+        client = CoordinatorClient(self.coordinator_url)
+        runners = {}
+        idle_since = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if not self._take_slot():
+                    return
+                try:
+                    job = client.lease(self.worker_id, self.runners, self.lease_wait)
+                except OSError as e:
+                    self._give_back_slot()
+                    log(f"  [WARN] コーディネーターに接続できません: {e}", logging.WARNING)
+                    self._stop.wait(1)
+                    continue
+                if job is None:
+                    self._give_back_slot()
+                    if idle_exit is not None and time.monotonic() - idle_since >= idle_exit:
+                        return
+                    continue
+                self._execute(client, runners, job)
+                idle_since = time.monotonic()
+        finally:
+            for runner in runners.values():
+                runner.close()
+            client.close()
+
+    def _runner(self, runners, job):
+        key = (job["runner"], json.dumps(job["params"], sort_keys=True))
+        runner = runners.get(key)
+        if runner is None:
+            runner = runners[key] = parallel_runner.create_runner(job["runner"], **job["params"])
+        return runner
+
+    def _heartbeat_loop(self, job, done, lost, started):
+        client = CoordinatorClient(self.coordinator_url)
+        interval = max(float(job["lease_sec"]) / 3, 0.05)
+        try:
+            while not done.wait(interval):
+                if self._crashed.is_set():
+                    return
+                try:
+                    alive = client.heartbeat(job["id"], job["lease_id"],
+                                             {"elapsed_sec": time.monotonic() - started})
+                except OSError:
+                    continue
+                if not alive:
+                    lost.set()
+                    return
+        finally:
+            client.close()
+
+    def _execute(self, client, runners, job):
+        done = threading.Event()
+        lost = threading.Event()
+        started = time.monotonic()
+        heartbeat = threading.Thread(target=self._heartbeat_loop,
+                                     args=(job, done, lost, started), daemon=True)
+        heartbeat.start()
+        try:
+            try:
+                runner = self._runner(runners, job)
+            except Exception as e:
+                run = {"ok": False, "status": None, "error": f"{type(e).__name__}: {e}",
+                       "timings": {}, "wall_sec": 0.0, "path": None, "download_dir": None}
+            else:
+                run = parallel_runner.run_one(runner, job["seq"], self.base_dir, keep_dirs=True)
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if self._crashed.is_set():
+            with self._lock:
+                self.abandoned += 1
+            return
+        if lost.is_set():
+            log(f"  [WARN] {job['id']} のリースを失ったため結果を破棄します", logging.WARNING)
+            self._cleanup(run)
+            return
+
+        expected = check_expected(run, job.get("expected"))
+        result = {
+            "ok": run["ok"] and expected["ok"],
+            "status": run["status"],
+            "error": run["error"],
+            "timings": run["timings"],
+            "wall_sec": run["wall_sec"],
+            "worker": self.worker_id,
+            "attempt": job["attempts"],
+            "expected": expected,
+            "pids": run.get("pids", []),
+        }
+        try:
+            self._upload_artifacts(client, job, run)
+            if client.complete(job["id"], job["lease_id"], result):
+                with self._lock:
+                    self.completed += 1
+        finally:
+            self._cleanup(run)
+
+    def _upload_artifacts(self, client, job, run):
+        directory = run.get("download_dir")
+        if not directory or not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path) or os.path.getsize(path) > self.artifact_max_bytes:
+                continue
+            with open(path, "rb") as f:
+                client.put_artifact(job["id"], job["lease_id"], name, f.read())
+
+    @staticmethod
+    def _cleanup(run):
+        if run.get("download_dir"):
+            shutil.rmtree(run["download_dir"], ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="シナリオ実行ジョブのワーカーエージェント")
+    parser.add_argument("--coordinator", required=True, help="コーディネーターの URL")
+    parser.add_argument("--worker-id", help="省略時は <ホスト名>-<PID>")
+    parser.add_argument("--runners", nargs="+", choices=sorted(parallel_runner.RUNNERS),
+                        help="実行できるランナー (省略時はすべて)")
+    parser.add_argument("--slots", type=int, default=1, help="同時に実行するジョブ数")
+    parser.add_argument("--save-path", help="ジョブごとのダウンロード先の親")
+    parser.add_argument("--lease-wait", type=float, default=DEFAULT_LEASE_WAIT_SEC,
+                        help="ジョブが無いときにコーディネーター側で待つ秒数")
+    parser.add_argument("--max-jobs", type=int, help="この件数を処理したら終了する")
+    parser.add_argument("--idle-exit", type=float, help="この秒数ジョブが無ければ終了する")
+    args = parser.parse_args()
+
+    http_fast_test.init_logging(logging.INFO)
+    # 常駐してトレースを出力しないので、ステップのスパンは記録しない
+    step_trace.tracer.enabled = False
+    agent = WorkerAgent(args.coordinator, args.worker_id, args.runners, args.slots,
+                        args.save_path, args.lease_wait)
+    log(f"ワーカー {agent.worker_id} を開始: runners={list(agent.runners)} slots={agent.slots}")
+    try:
+        agent.run(args.max_jobs, args.idle_exit)
+    except KeyboardInterrupt:
+        agent.stop()
+    log(f"ワーカー {agent.worker_id} を終了: 完了 {agent.completed} 件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+CSV の SHA-256・サイズ・行数をチャンク単位で求める (サーバーとクライアントで共通)
+
+サーバーのマニフェスト (manifest.py) とクライアントの照合 (automation/file_digest.py) が
+同じ実装を使うことで、「行数」の定義が食い違わないようにする。
+
+行数はヘッダー行を除いたデータ行の数 (最終行に改行が無くても1行と数える。空ファイルは0行)。
+"""
+
+import hashlib
+
+
+class StreamingDigest:
+    """SHA-256・サイズ・改行数をチャンク単位で更新する"""
+
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.newlines = 0
+        self._last = b""
+
+    def update(self, chunk):
+        if not chunk:
+            return
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+        self.newlines += chunk.count(b"\n")
+        self._last = chunk[-1:]
+
+    @property
+    def rows(self):
+        lines = self.newlines + (1 if self.size and self._last != b"\n" else 0)
+        return max(lines - 1, 0)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def summary(self):
+        return {"size": self.size, "rows": self.rows, "sha256": self.sha256}
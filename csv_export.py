@@ -0,0 +1,148 @@
+"""
+大容量ダウンロード検証用のCSV生成
+
+static/sample.csv と同じヘッダーを持つ決定的 (seed 固定で毎回同じ内容) なCSVを
+ストリーミングで生成する。各列のバイト長を固定にしているため、
+本体を生成せずに Content-Length を計算できる。
+"""
+
+import random
+
+CSV_HEADER = ("ID", "名前", "メールアドレス", "部署")
+CSV_ENCODING = "utf-8"
+CSV_NEWLINE = "\n"
+
+# 各プールは要素のバイト長を揃えておく (Content-Length 事前計算のため)
+FAMILY_NAMES = ("山田", "鈴木", "田中", "佐藤", "高橋", "伊藤", "渡辺", "中村")
+GIVEN_NAMES = ("太郎", "花子", "一郎", "次郎", "優子", "健太", "美咲", "翔太")
+DEPARTMENTS = ("営業部", "開発部", "総務部", "人事部", "経理部", "企画部", "法務部", "広報部")
+EMAIL_DOMAIN = "@example.com"
+EMAIL_TOKEN_DIGITS = 8
+
+# 乱数はブロック (ROWS_PER_BLOCK 行) ごとに seed し直す。
+# 任意の行から生成を再開できるため、Range リクエストで途中から配信できる。
+ROWS_PER_BLOCK = 1024
+MAX_GENERATED_ROWS = 100_000_000
+
+
+def _fixed_row_bytes():
+    """ID列以外の1行あたりのバイト長"""
+    name = len((FAMILY_NAMES[0] + GIVEN_NAMES[0]).encode(CSV_ENCODING))
+    email = EMAIL_TOKEN_DIGITS + len(EMAIL_DOMAIN.encode(CSV_ENCODING))
+    dept = len(DEPARTMENTS[0].encode(CSV_ENCODING))
+    separators = len(CSV_HEADER) - 1 + len(CSV_NEWLINE)
+    return name + email + dept + separators
+
+
+def header_line():
+    return ",".join(CSV_HEADER) + CSV_NEWLINE
+
+
+def _id_digits_total(rows):
+    """ID 1..rows の10進桁数の合計"""
+    total = 0
+    digits = 1
+    low = 1
+    while low <= rows:
+        high = min(rows, low * 10 - 1)
+        total += (high - low + 1) * digits
+        digits += 1
+        low *= 10
+    return total
+
+
+def generated_csv_length(rows):
+    """generate_csv(rows, seed) が出力する総バイト数 (seed には依存しない)"""
+    return row_offset(rows + 1)
+
+
+def row_offset(row_id):
+    """ID=row_id の行がCSV先頭から何バイト目に始まるか"""
+    return (len(header_line().encode(CSV_ENCODING))
+            + _id_digits_total(row_id - 1)
+            + (row_id - 1) * _fixed_row_bytes())
+
+
+def _row_at_offset(offset, rows):
+    """offset バイト目を含む行のIDを返す (ヘッダー以降の offset を前提とする)"""
+    low, high = 1, rows
+    while low < high:
+        mid = (low + high + 1) // 2
+        if row_offset(mid) <= offset:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _block_rng(seed, block):
+    return random.Random(f"{seed}:{block}")
+
+
+def _iter_row_bits(rows, seed, first_row=1):
+    """(ID, 乱数ビット列) を first_row から順に返す"""
+    block = (first_row - 1) // ROWS_PER_BLOCK
+    rng = _block_rng(seed, block)
+    # ブロック途中から始める場合は、先行する行の分だけ乱数を読み捨てる
+    for _ in range((first_row - 1) % ROWS_PER_BLOCK):
+        rng.getrandbits(41)
+    for row_id in range(first_row, rows + 1):
+        if (row_id - 1) % ROWS_PER_BLOCK == 0 and row_id != first_row:
+            rng = _block_rng(seed, (row_id - 1) // ROWS_PER_BLOCK)
+        yield row_id, rng.getrandbits(41)
+
+
+def iter_rows(rows, seed):
+    """(ID, 名前, メールアドレス, 部署) のタプルを1行ずつ返す"""
+    for row_id, bits in _iter_row_bits(rows, seed):
+        name = FAMILY_NAMES[bits & 7] + GIVEN_NAMES[(bits >> 3) & 7]
+        dept = DEPARTMENTS[(bits >> 6) & 7]
+        email = f"{bits >> 9:0{EMAIL_TOKEN_DIGITS}x}{EMAIL_DOMAIN}"
+        yield row_id, name, email, dept
+
+
+def _iter_row_chunks(rows, seed, first_row):
+    """first_row 以降の行を ROWS_PER_BLOCK 行単位のバイト列にまとめて返す"""
+    # names[bits & 63] == FAMILY_NAMES[bits & 7] + GIVEN_NAMES[(bits >> 3) & 7]
+    names = [FAMILY_NAMES[i & 7] + GIVEN_NAMES[i >> 3] for i in range(64)]
+    lines = []
+    for row_id, bits in _iter_row_bits(rows, seed, first_row):
+        lines.append(
+            f"{row_id},{names[bits & 63]},{bits >> 9:0{EMAIL_TOKEN_DIGITS}x}{EMAIL_DOMAIN},"
+            f"{DEPARTMENTS[(bits >> 6) & 7]}{CSV_NEWLINE}"
+        )
+        if row_id % ROWS_PER_BLOCK == 0:
+            yield "".join(lines).encode(CSV_ENCODING)
+            lines.clear()
+    if lines:
+        yield "".join(lines).encode(CSV_ENCODING)
+
+
+def generate_csv(rows, seed, start=0, end=None):
+    """CSV本体のうち [start, end) バイトをブロック単位のバイト列で返すジェネレーター
+
+    出力は header_line() + iter_rows() と同じ内容で、start を含む行から生成を始める。
+    """
+    total = generated_csv_length(rows)
+    end = total if end is None else min(end, total)
+    if start >= end:
+        return
+    header = header_line().encode(CSV_ENCODING)
+    if start < len(header):
+        yield header[start:end]
+        start = len(header)
+        if start >= end:
+            return
+
+    first_row = _row_at_offset(start, rows)
+    skip = start - row_offset(first_row)
+    remaining = end - start
+    for chunk in _iter_row_chunks(rows, seed, first_row):
+        if skip:
+            chunk = chunk[skip:]
+            skip = 0
+        if len(chunk) >= remaining:
+            yield chunk[:remaining]
+            return
+        remaining -= len(chunk)
+        yield chunk
@@ -0,0 +1,106 @@
+"""
+UTF-8 のCSVを配信時に別のエンコーディングへ変換する (チャンク単位のストリーミング)
+
+static/sample.csv や生成CSVは UTF-8 で持っているが、IE モードの既存利用者は cp932 を前提にしている。
+ファイル全体を事前に変換するとディスクもメモリも倍必要になるため、配信する本文のチャンクを
+インクリメンタルデコーダー / エンコーダーに通して順に変換する
+(チャンク境界でマルチバイト文字が分かれても、続きのチャンクと合わせて変換される)。
+
+- utf-8     : 変換しない (元のバイト列をそのまま返す)
+- utf-8-sig : 先頭に BOM を付けるだけで、本文は変換しない
+- cp932     : UTF-8 → cp932 に変換する。変換後のサイズは事前に分からない
+
+cp932 で表せない文字の扱いは errors (codecs のエラーハンドラー名) で決める。
+strict は表せない文字が出た時点で例外を送出する。応答ヘッダーは送信済みのため、
+クライアントには途中で切れた応答として届く (Content-Length が無いので、切断で検出する)。
+"""
+
+import codecs
+
+SOURCE_ENCODING = "utf-8"
+ENCODINGS = ("utf-8", "utf-8-sig", "cp932")
+# cp932 で表せない文字の扱い (codecs のエラーハンドラー名)
+ERROR_POLICIES = ("strict", "replace", "xmlcharrefreplace", "backslashreplace", "ignore")
+DEFAULT_ERRORS = "replace"
+# 1回に変換する入力・まとめて返す出力の上限バイト数
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# Content-Type の charset に出す名前
+CHARSETS = {"utf-8": "utf-8", "utf-8-sig": "utf-8", "cp932": "Shift_JIS"}
+
+
+def is_passthrough(encoding):
+    """本文を変換せずに返せる (Range / 圧縮 / Content-Length がそのまま使える) か"""
+    return encoding == SOURCE_ENCODING
+
+
+def prefix(encoding):
+    """本文の前に付けるバイト列 (utf-8-sig の BOM)"""
+    return codecs.BOM_UTF8 if encoding == "utf-8-sig" else b""
+
+
+def encoded_length(encoding, length):
+    """変換後のバイト数。変換しないと分からない場合 (length=None を含む) は None"""
+    if length is not None and encoding in ("utf-8", "utf-8-sig"):
+        return len(prefix(encoding)) + length
+    return None
+
+
+def _slices(chunk, size):
+    for pos in range(0, len(chunk), size):
+        yield chunk[pos:pos + size]
+
+
+def transcode(chunks, encoding, errors=DEFAULT_ERRORS, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    UTF-8 のバイト列のイテラブル chunks を encoding に変換しながら返すジェネレーター
+
+    入力は buffer_size ずつ変換し、出力は buffer_size 以上たまったところで返す
+    (1回に返すチャンクも buffer_size 以下)。chunks に close() があれば最後に呼ぶ。
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"未対応のエンコーディングです: {encoding}")
+    if errors not in ERROR_POLICIES:
+        raise ValueError(f"未対応のエラー処理です: {errors}")
+    try:
+        head = prefix(encoding)
+        if head:
+            yield head
+        if encoding in ("utf-8", "utf-8-sig"):
+            yield from chunks
+            return
+
+        decoder = codecs.getincrementaldecoder(SOURCE_ENCODING)()
+        encoder = codecs.getincrementalencoder(encoding)(errors)
+        pending = []
+        pending_size = 0
+        for chunk in chunks:
+            for piece in _slices(chunk, buffer_size):
+                data = encoder.encode(decoder.decode(piece))
+                if not data:
+                    continue
+                pending.append(data)
+                pending_size += len(data)
+                if pending_size >= buffer_size:
+                    out = b"".join(pending)
+                    pending.clear()
+                    pending_size = 0
+                    yield from _slices(out, buffer_size)
+        pending.append(encoder.encode(decoder.decode(b"", final=True), final=True))
+        out = b"".join(pending)
+        if out:
+            yield from _slices(out, buffer_size)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def iter_file(path, read_size=DEFAULT_BUFFER_SIZE):
+    """path を read_size ずつ読むジェネレーター (変換の入力用)"""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                break
+            yield chunk
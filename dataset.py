@@ -0,0 +1,190 @@
+"""
+SQLite に置いた社員テーブルをCSVとしてストリーミング出力する (実システムの「検索結果のエクスポート」相当)
+
+static/sample.csv と同じ列 (ID, 名前, メールアドレス, 部署) のテーブル employees に
+csv_export.iter_rows(rows, seed) の決定的な行を投入しておき、配信時は
+カーソルから fetchmany で batch_size 行ずつ取り出して CSV に書く。
+結果が何行でも保持するのは1バッチ分だけなので、メモリは行数によらず一定になる。
+
+部署での絞り込みは (department, id) の索引を使う (全件走査にならない)。
+絞り込みなしの出力は csv_export.generate_csv(rows, seed) と同じバイト列になる。
+
+投入は初回の要求時 (またはコマンドラインの seed) に1回だけ行い、
+投入済みの (rows, seed) を meta テーブルに記録する。
+
+使い方:
+    python dataset.py seed --db dataset.sqlite3 --rows 1000000
+    python dataset.py export --db dataset.sqlite3 --department 営業部 > out.csv
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+import threading
+
+import csv_export
+
+DEFAULT_ROWS = 10_000
+DEFAULT_BATCH_SIZE = 2000
+SEED_BATCH_SIZE = 50_000
+COLUMNS = ("id", "name", "email", "department")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    department TEXT NOT NULL
+);
+"""
+# 投入後に作る (索引を張ったまま大量に INSERT すると遅いため)
+_INDEX = "CREATE INDEX IF NOT EXISTS employees_department ON employees (department, id)"
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def seeded_as(conn):
+    """投入済みの (rows, seed)。未投入なら None"""
+    meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('rows', 'seed')"))
+    if len(meta) != 2:
+        return None
+    return int(meta["rows"]), int(meta["seed"])
+
+
+def seed(conn, rows, seed=0, batch_size=SEED_BATCH_SIZE):
+    """employees を csv_export.iter_rows(rows, seed) の内容で作り直す"""
+    conn.execute("PRAGMA synchronous = OFF")
+    with conn:
+        conn.execute("DELETE FROM meta")
+        conn.execute("DROP INDEX IF EXISTS employees_department")
+        conn.execute("DELETE FROM employees")
+        batch = []
+        for row in csv_export.iter_rows(rows, seed):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT INTO employees VALUES (?, ?, ?, ?)", batch)
+                batch.clear()
+        if batch:
+            conn.executemany("INSERT INTO employees VALUES (?, ?, ?, ?)", batch)
+        conn.execute(_INDEX)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [("rows", str(rows)), ("seed", str(seed))])
+    conn.execute("PRAGMA synchronous = FULL")
+    conn.execute("ANALYZE")
+
+
+def _query(department, limit):
+    sql = f"SELECT {', '.join(COLUMNS)} FROM employees"
+    params = []
+    if department is not None:
+        sql += " WHERE department = ?"
+        params.append(department)
+    # LIMIT -1 は無制限
+    sql += " ORDER BY id LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    return sql, params
+
+
+def iter_csv(conn, department=None, limit=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    検索結果を CSV のバイト列 (ヘッダー + batch_size 行ごと) で返すジェネレーター
+
+    カーソルは fetchmany で進めるだけなので、結果の全件をメモリに載せることはない。
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator=csv_export.CSV_NEWLINE)
+    yield csv_export.header_line().encode(csv_export.CSV_ENCODING)
+    cursor = conn.execute(*_query(department, limit))
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            writer.writerows(batch)
+            yield buf.getvalue().encode(csv_export.CSV_ENCODING)
+            buf.seek(0)
+            buf.truncate()
+    finally:
+        cursor.close()
+
+
+class Dataset:
+    """
+    配信用のデータソース (DB ファイルと投入する行数)。要求ごとに接続を開いて閉じる
+
+    rows=None なら投入済みの内容をそのまま使う (未投入なら DEFAULT_ROWS 行を投入する)。
+    """
+
+    def __init__(self, path, rows=DEFAULT_ROWS, seed=0, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.rows = rows
+        self.seed = seed
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def ensure_seeded(self):
+        """(rows, seed) が投入済みでなければ投入する (プロセス内で1回だけ確認する)"""
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = connect(self.path)
+            try:
+                current = seeded_as(conn)
+                if self.rows is None and current is not None:
+                    self.rows, self.seed = current
+                elif current != (self.rows or DEFAULT_ROWS, self.seed):
+                    self.rows = self.rows or DEFAULT_ROWS
+                    seed(conn, self.rows, self.seed)
+            finally:
+                conn.close()
+            self._ready = True
+
+    def export(self, department=None, limit=None):
+        """CSV のバイト列を返すジェネレーター (接続は出力し終えた / 中断された時点で閉じる)"""
+        self.ensure_seeded()
+        # 応答本文は別スレッドで読まれることがあるため、接続を生成したスレッドに縛らない
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            yield from iter_csv(conn, department, limit, self.batch_size)
+        finally:
+            conn.close()
+
+    @property
+    def etag(self):
+        """投入内容の版 (ensure_seeded() の後で使う)"""
+        return f"ds-{self.rows}-{self.seed}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite データソースの投入 / CSV 出力")
+    parser.add_argument("command", choices=["seed", "export"])
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--rows", type=int,
+                        help=f"投入する行数 (省略時は投入済みの内容を使い、未投入なら {DEFAULT_ROWS} 行)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--department")
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    dataset = Dataset(args.db, args.rows, args.seed)
+    if args.command == "seed":
+        dataset.ensure_seeded()
+        return
+    for chunk in dataset.export(args.department, args.limit):
+        sys.stdout.buffer.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
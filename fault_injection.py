@@ -0,0 +1,214 @@
+"""
+配信への遅延・帯域制限・障害の注入 (ダウンロード完了検知やタイムアウトの検証用)
+
+ルート (request.path の fnmatch パターン) ごとに次を設定できる。
+
+- rate             : 転送速度の上限 (バイト/秒。"512KB" / "2MB" のような文字列も可)
+- first_byte_delay : 応答ヘッダー・本文の送信を始めるまでの秒数
+- stall_after / stall_sec : stall_after バイト送ったところで stall_sec 秒止まる
+- drop_after       : drop_after バイト送ったところで接続を切る (Content-Length より短く終わる。
+                     0 なら応答ヘッダーを送る前に失敗し、WSGI サーバーが 500 を返す)
+- render_delay     : テンプレート描画 (HTML ページ) の応答を遅らせる秒数
+- probability      : この設定を適用するリクエストの割合 (0〜1、既定 1)
+
+設定は {"rules": [{"route": "/download/csv*", "rate": "512KB", ...}, ...]} 形式の JSON で、
+先に一致したルールを使う。環境変数 IEMODE_DL_FAULTS (JSON 文字列または JSON ファイルのパス)、
+serve.py の --faults、実行中の PUT /faults のいずれかで指定する
+(PUT /faults はそのリクエストを受けたプロセスだけに反映される)。
+"""
+
+import fnmatch
+import json
+import os
+import random
+import re
+import threading
+import time
+
+DEFAULT_CHUNK_SIZE = 16 * 1024
+ENV_VAR = "IEMODE_DL_FAULTS"
+
+_RATE_RE = re.compile(r"^\s*([\d.]+)\s*([KMG]?)B?\s*(?:/s)?\s*$", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+class InjectedDrop(ConnectionAbortedError):
+    """drop_after による切断 (WSGI サーバーはここで接続を閉じる)"""
+
+
+def parse_rate(value):
+    """512 / "512KB" / "2MB/s" をバイト/秒に変換する (None はそのまま)"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    m = _RATE_RE.match(str(value))
+    if m is None:
+        raise ValueError(f"転送速度の指定が不正です: {value}")
+    return float(m.group(1)) * _RATE_UNITS[m.group(2).upper()]
+
+
+class FaultRule:
+    """1ルート分の注入設定"""
+
+    FIELDS = ("route", "rate", "first_byte_delay", "stall_after", "stall_sec", "drop_after",
+              "render_delay", "probability", "chunk_size")
+
+    def __init__(self, route, rate=None, first_byte_delay=0.0, stall_after=None, stall_sec=0.0,
+                 drop_after=None, render_delay=0.0, probability=1.0,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.route = route
+        self.rate = parse_rate(rate)
+        self.first_byte_delay = float(first_byte_delay)
+        self.stall_after = stall_after
+        self.stall_sec = float(stall_sec)
+        self.drop_after = drop_after
+        self.render_delay = float(render_delay)
+        self.probability = float(probability)
+        self.chunk_size = int(chunk_size)
+        if self.rate is not None and self.rate <= 0:
+            raise ValueError(f"rate は正の値で指定してください: {rate}")
+
+    @classmethod
+    def from_dict(cls, data):
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"未知の設定項目: {sorted(unknown)}")
+        if "route" not in data:
+            raise ValueError("route を指定してください")
+        return cls(**data)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def matches(self, path):
+        return fnmatch.fnmatchcase(path, self.route)
+
+    def affects_body(self):
+        return (self.rate is not None or self.first_byte_delay > 0
+                or self.stall_after is not None or self.drop_after is not None)
+
+
+def load_config(source):
+    """JSON 文字列・JSON ファイルのパス・dict のいずれかからルールのリストを作る"""
+    if isinstance(source, str):
+        if os.path.exists(source):
+            with open(source, encoding="utf-8") as f:
+                source = json.load(f)
+        else:
+            source = json.loads(source)
+    rules = source.get("rules", []) if isinstance(source, dict) else source
+    return [FaultRule.from_dict(r) for r in rules]
+
+
+class FaultInjector:
+    """Flask アプリの応答に FaultRule を適用する"""
+
+    def __init__(self, rules=None, rng=None, sleep=time.sleep, clock=time.monotonic):
+        self._rules = list(rules or [])
+        self._lock = threading.Lock()
+        self._rng = rng or random.Random()
+        self._sleep = sleep
+        self._clock = clock
+        self.counts = {"matched": 0, "throttled_bytes": 0, "stalls": 0, "drops": 0,
+                       "render_delays": 0}
+
+    @property
+    def rules(self):
+        with self._lock:
+            return list(self._rules)
+
+    def configure(self, rules):
+        with self._lock:
+            self._rules = list(rules)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, rules=[r.to_dict() for r in self._rules])
+
+    def select(self, path):
+        """path に適用するルールを返す (確率で外れた場合・一致しない場合は None)"""
+        for rule in self.rules:
+            if rule.matches(path):
+                if rule.probability < 1 and self._rng.random() >= rule.probability:
+                    return None
+                self._count("matched")
+                return rule
+        return None
+
+    def delay_render(self):
+        """処理中のリクエストに選ばれたルールの render_delay だけ待つ (テンプレート描画用)"""
+        from flask import g
+        rule = g.get("fault_rule")
+        if rule is not None and rule.render_delay > 0:
+            self._count("render_delays")
+            self._sleep(rule.render_delay)
+
+    def wrap_body(self, rule, body):
+        """本文のイテラブル body に遅延・帯域制限・停止・切断を加えたジェネレーターを返す"""
+        try:
+            if rule.first_byte_delay > 0:
+                self._sleep(rule.first_byte_delay)
+            started = self._clock()
+            sent = 0
+            stalled = False
+            for data in body:
+                for pos in range(0, len(data), rule.chunk_size):
+                    chunk = data[pos:pos + rule.chunk_size]
+                    if rule.drop_after is not None and sent + len(chunk) >= rule.drop_after:
+                        head = chunk[:max(rule.drop_after - sent, 0)]
+                        if head:
+                            yield head
+                        self._count("drops")
+                        raise InjectedDrop(f"{rule.route}: {rule.drop_after} バイトで切断")
+                    if (not stalled and rule.stall_after is not None
+                            and sent + len(chunk) > rule.stall_after):
+                        split = max(rule.stall_after - sent, 0)
+                        if split:
+                            yield chunk[:split]
+                            sent += split
+                        stalled = True
+                        self._count("stalls")
+                        self._sleep(rule.stall_sec)
+                        # 停止した時間は帯域制限の計算に含めない
+                        started += rule.stall_sec
+                        chunk = chunk[split:]
+                    yield chunk
+                    sent += len(chunk)
+                    if rule.rate is not None:
+                        self._count("throttled_bytes", len(chunk))
+                        ahead = sent / rule.rate - (self._clock() - started)
+                        if ahead > 0:
+                            self._sleep(ahead)
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+
+    def install(self, app):
+        """app の全リクエストに適用する (before_request で選んだルールを after_request で使う)"""
+        from flask import g, request
+
+        @app.before_request
+        def _select_fault():
+            g.fault_rule = self.select(request.path)
+
+        @app.after_request
+        def _apply_fault(response):
+            rule = g.pop("fault_rule", None)
+            if (rule is None or not rule.affects_body() or request.method == "HEAD"
+                    or response.status_code in (204, 304)):
+                return response
+            response.response = self.wrap_body(rule, response.response)
+            response.direct_passthrough = False
+            return response
+
+        return self
+
+
+def from_environ():
+    """環境変数 IEMODE_DL_FAULTS から FaultInjector を作る (未設定ならルールなし)"""
+    source = os.environ.get(ENV_VAR)
+    return FaultInjector(load_config(source) if source else [])
@@ -0,0 +1,285 @@
+"""
+配信ファイルの ETag / 圧縮済みバリアントのキャッシュ
+
+ファイル (またはテンプレート) の版 = (パス, mtime_ns, サイズ) ごとに
+- 強い ETag (内容の SHA-256)
+- gzip / brotli に圧縮した本体
+を1回だけ作り、メモリ (LRU, 上限バイト数) と任意のディスクディレクトリに保持する。
+mtime かサイズが変わると別の版として扱い、古い版のエントリは破棄する。
+
+brotli は任意依存。インストールされていなければ gzip のみ提供する。
+"""
+
+import collections
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024
+# これより大きいファイルは圧縮バリアントを作らず、そのまま配信する
+DEFAULT_MAX_COMPRESS_SOURCE_BYTES = 32 * 1024 * 1024
+HASH_READ_SIZE = 1024 * 1024
+
+ENCODING_SUFFIX = {"gzip": "gz", "br": "br"}
+# 書き込み中の一時ファイルの拡張子。これより古い一時ファイルは中断の残骸とみなして削除する
+TEMP_SUFFIX = ".tmp"
+STALE_TEMP_SEC = 60 * 60
+
+
+def available_encodings():
+    """サーバーが提供できる Content-Encoding (優先順)"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        # mtime=0 で出力を決定的にする (ETag を版ごとに固定するため)
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if encoding == "br":
+        if brotli is None:
+            raise ValueError("brotli がインストールされていません")
+        return brotli.compress(data)
+    raise ValueError(f"未対応のエンコーディング: {encoding}")
+
+
+def file_version(path):
+    """(mtime_ns, size) を返す"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_READ_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CacheEntry:
+    """ある版のファイル/テンプレートに対応するキャッシュ項目"""
+
+    def __init__(self, path, version, sha256, body=None):
+        self.path = path
+        self.version = version
+        self.sha256 = sha256
+        # テンプレートは描画結果を保持する。ファイルは None (都度ディスクから配信)
+        self.body = body
+
+    @property
+    def etag(self):
+        return self.sha256[:32]
+
+    @property
+    def size(self):
+        return len(self.body) if self.body is not None else self.version[1]
+
+    @property
+    def last_modified(self):
+        return self.version[0] / 1e9
+
+    def variant_etag(self, encoding):
+        if encoding == "identity":
+            return self.etag
+        return f"{self.etag}-{ENCODING_SUFFIX[encoding]}"
+
+
+class VariantCache:
+    """
+    ETag と圧縮済みバリアントを版ごとに保持する LRU キャッシュ
+
+    ヒット・ミスはエントリ (ETag) とバリアント (圧縮済みの本体) で別々に数える。
+    圧縮して返す応答1回は entry() と variant() の両方を通るため、合算すると二重に数えてしまう。
+    """
+
+    def __init__(self, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES, disk_dir=None,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES,
+                 max_compress_source_bytes=DEFAULT_MAX_COMPRESS_SOURCE_BYTES):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_compress_source_bytes = max_compress_source_bytes
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._variants = collections.OrderedDict()
+        self._memory_bytes = 0
+        self.entry_hits = 0
+        self.entry_misses = 0
+        self.variant_hits = 0
+        self.variant_misses = 0
+        self.disk_hits = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entry_hits": self.entry_hits,
+                "entry_misses": self.entry_misses,
+                "variant_hits": self.variant_hits,
+                "variant_misses": self.variant_misses,
+                "disk_hits": self.disk_hits,
+                "entries": len(self._entries),
+                "variants": len(self._variants),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def entry(self, path, render=None):
+        """
+        path の現在の版に対応する CacheEntry を返す。(エントリ, キャッシュヒットしたか) のタプル
+
+        render を渡した場合 (テンプレート) は描画結果のバイト列を本体として保持する。
+        """
+        version = file_version(path)
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached.version == version:
+                self.entry_hits += 1
+                return cached, True
+            self.entry_misses += 1
+            if cached is not None:
+                self._drop_variants(path)
+
+        if render is not None:
+            body = render()
+            entry = CacheEntry(path, version, hashlib.sha256(body).hexdigest(), body)
+        else:
+            entry = CacheEntry(path, version, sha256_file(path))
+        with self._lock:
+            self._entries[path] = entry
+        return entry, False
+
+    def can_compress(self, entry):
+        return entry.size <= self.max_compress_source_bytes
+
+    def variant(self, entry, encoding):
+        """
+        圧縮済みバリアントを返す。(本体, キャッシュヒットしたか) のタプル
+        """
+        key = (entry.path, entry.version, encoding)
+        with self._lock:
+            data = self._variants.get(key)
+            if data is not None:
+                self._variants.move_to_end(key)
+                self.variant_hits += 1
+                return data, True
+
+        data = self._load_disk(entry, encoding)
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+            hit = True
+        else:
+            source = entry.body
+            if source is None:
+                with open(entry.path, "rb") as f:
+                    source = f.read()
+            data = compress(source, encoding)
+            self._store_disk(entry, encoding, data)
+            with self._lock:
+                self.variant_misses += 1
+            hit = False
+
+        with self._lock:
+            if key not in self._variants:
+                self._variants[key] = data
+                self._memory_bytes += len(data)
+                self._evict_memory()
+        return data, hit
+
+    def _drop_variants(self, path):
+        for key in [k for k in self._variants if k[0] == path]:
+            self._memory_bytes -= len(self._variants.pop(key))
+
+    def _evict_memory(self):
+        while self._memory_bytes > self.max_memory_bytes and self._variants:
+            _, data = self._variants.popitem(last=False)
+            self._memory_bytes -= len(data)
+
+    def _disk_prefix(self, path):
+        return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+
+    def _disk_path(self, entry, encoding):
+        mtime_ns, size = entry.version
+        name = f"{self._disk_prefix(entry.path)}-{mtime_ns}-{size}.{ENCODING_SUFFIX[encoding]}"
+        return os.path.join(self.disk_dir, name)
+
+    def _load_disk(self, entry, encoding):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(entry, encoding), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store_disk(self, entry, encoding, data):
+        if not self.disk_dir:
+            return
+        target = self._disk_path(entry, encoding)
+        mtime_ns, size = entry.version
+        prefix = self._disk_prefix(entry.path) + "-"
+        current = f"{prefix}{mtime_ns}-{size}."
+        try:
+            # 同じパスの古い版を削除する
+            # (一時ファイルは他のワーカーが書き込み中のことがあるので残す)
+            for name in os.listdir(self.disk_dir):
+                if (name.startswith(prefix) and not name.startswith(current)
+                        and not name.endswith(TEMP_SUFFIX)):
+                    os.remove(os.path.join(self.disk_dir, name))
+            # 同じディレクトリを共有する gunicorn ワーカーと名前が衝突しないよう mkstemp で作る
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(target) + ".",
+                                       suffix=TEMP_SUFFIX, dir=self.disk_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, target)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            self._evict_disk()
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        files = []
+        now = time.time()
+        for name in os.listdir(self.disk_dir):
+            full = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            if name.endswith(TEMP_SUFFIX):
+                # 書き込み中 (他プロセスを含む) の一時ファイルは消さない。古い残骸だけ掃除する
+                if now - st.st_mtime > STALE_TEMP_SEC:
+                    try:
+                        os.remove(full)
+                    except OSError:
+                        pass
+                continue
+            files.append((st.st_mtime, st.st_size, full))
+        total = sum(size for _, size, _ in files)
+        for _, size, full in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(full)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,99 @@
+"""
+ダウンロード対象ファイルのマニフェスト (サイズ・行数・SHA-256)
+
+クライアントは保存したファイルをマニフェストと照合し、途中で切れた / 壊れたダウンロードを検出する。
+SHA-256 と行数は固定サイズのチャンクを1回読むだけで同時に求め、ファイルの版
+(mtime_ns, サイズ) が変わるまでキャッシュする。生成CSV は (rows, seed) ごとに
+生成結果をストリーミングでハッシュし、件数上限付きの LRU に保持する。
+
+行数はヘッダー行を除いたデータ行の数 (最終行に改行が無くても1行と数える)。
+クライアント側 (automation/file_digest.py) と同じ content_digest.StreamingDigest で数える。
+"""
+
+import collections
+import threading
+
+import content_digest
+import csv_export
+import csv_transcode
+import http_cache
+
+READ_SIZE = http_cache.HASH_READ_SIZE
+DEFAULT_MAX_GENERATED = 32
+
+
+def summarize_file(path, read_size=READ_SIZE):
+    """ファイルを read_size ずつ読んで {"size", "rows", "sha256"} を返す"""
+    digest = content_digest.StreamingDigest()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.summary()
+
+
+def summarize_chunks(chunks):
+    """バイト列のイテラブル (生成CSV など) から {"size", "rows", "sha256"} を返す"""
+    digest = content_digest.StreamingDigest()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.summary()
+
+
+class ManifestCache:
+    """ファイルの版ごと・生成CSVの (rows, seed) ごとに要約を保持する"""
+
+    def __init__(self, max_generated=DEFAULT_MAX_GENERATED):
+        self.max_generated = max_generated
+        self._lock = threading.Lock()
+        self._files = {}
+        self._generated = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "files": len(self._files),
+                "generated": len(self._generated),
+            }
+
+    def file_entry(self, path):
+        """path の現在の版の要約 ({"size", "rows", "sha256", "mtime"}) を返す"""
+        version = http_cache.file_version(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached[0] == version:
+                self.hits += 1
+                return dict(cached[1])
+            self.misses += 1
+        summary = summarize_file(path)
+        if summary["size"] != version[1]:
+            # 読み込み中に書き換えられた。次の要求で読み直す
+            return dict(summary, mtime=version[0] / 1e9)
+        summary["mtime"] = version[0] / 1e9
+        with self._lock:
+            self._files[path] = (version, summary)
+        return dict(summary)
+
+    def generated_entry(self, rows, seed, encoding=csv_transcode.SOURCE_ENCODING):
+        """csv_export.generate_csv(rows, seed) を encoding で配信したときの要約を返す"""
+        key = (rows, seed, csv_export.ROWS_PER_BLOCK, encoding)
+        with self._lock:
+            cached = self._generated.get(key)
+            if cached is not None:
+                self._generated.move_to_end(key)
+                self.hits += 1
+                return dict(cached)
+            self.misses += 1
+        summary = summarize_chunks(
+            csv_transcode.transcode(csv_export.generate_csv(rows, seed), encoding))
+        with self._lock:
+            self._generated[key] = summary
+            while len(self._generated) > self.max_generated:
+                self._generated.popitem(last=False)
+        return dict(summary)
@@ -0,0 +1,241 @@
+"""
+ルートごとのリクエスト計測と Prometheus テキスト形式での出力 (/metrics)
+
+自動実行が遅くなったときに、サーバー側 (応答に時間がかかっている) とクライアント側
+(ブラウザ操作・保存ダイアログ待ち) のどちらが原因かを切り分けるために使う。
+
+- iemode_dl_http_request_duration_seconds : 応答時間のヒストグラム (本文を送り終えるまで)
+- iemode_dl_http_requests_in_flight       : 処理中 (本文の送信中を含む) のリクエスト数
+- iemode_dl_http_response_bytes_total     : 送信した本文のバイト数
+- iemode_dl_http_requests_total           : ステータスクラス (2xx/3xx/4xx/5xx) ごとの件数
+
+ラベルはエンドポイント名 (login_page, download_csv など) で、どのルートにも一致しない要求は
+"unmatched" にまとめる (パスをそのままラベルにすると種類が際限なく増えるため)。
+
+WSGI ミドルウェアとして app.wsgi_app を包み、本文のイテラブルが close() されたときに記録する。
+ストリーミング配信 (生成CSV・ZIP・帯域制限中の応答) も送り終えるまでの時間と実際に送った
+バイト数になる。計測値はプロセスごとに持つ (gunicorn の複数ワーカーではワーカー単位の値になる)。
+
+1リクエストあたりの処理はロック1回と辞書・bisect の更新だけなので、常時有効にしておける
+(tools/bench_metrics.py で計測できる)。IEMODE_DL_METRICS=0 で無効にできる。
+"""
+
+import bisect
+import os
+import threading
+import time
+
+ENV_VAR = "IEMODE_DL_METRICS"
+PREFIX = "iemode_dl_http"
+# 応答時間ヒストグラムの上限値 (秒)。+Inf は出力時に足す
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+UNMATCHED = "unmatched"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# before_request でエンドポイント名を入れる WSGI environ のキー
+_ENDPOINT_KEY = "iemode_dl.metrics.endpoint"
+
+
+class _RouteStats:
+    """1エンドポイント分の集計"""
+
+    __slots__ = ("buckets", "duration_sum", "count", "in_flight", "bytes_sent", "classes")
+
+    def __init__(self, n_buckets):
+        self.buckets = [0] * (n_buckets + 1)
+        self.duration_sum = 0.0
+        self.count = 0
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.classes = {}
+
+
+class _MeteredBody:
+    """本文のイテラブルを包み、送ったバイト数を数えて close() で記録する"""
+
+    def __init__(self, body, metrics, environ, started, response):
+        self._body = body
+        self._metrics = metrics
+        self._environ = environ
+        self._started = started
+        self._response = response
+        self._sent = 0
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._metrics.observe_response(self._environ, self._response, self._started,
+                                           self._sent)
+
+
+def _observe_on_close(body, metrics, environ, started, response):
+    """
+    wsgi.file_wrapper の本文は包まずに close() だけ差し替える
+
+    包むと gunicorn 等が sendfile (ゼロコピー) を使えなくなるため。送信バイト数は Content-Length。
+    """
+    close = getattr(body, "close", None)
+
+    def _close():
+        try:
+            if close is not None:
+                close()
+        finally:
+            metrics.observe_response(environ, response, started, response.get("length", 0))
+
+    body.close = _close
+    return body
+
+
+class RequestMetrics:
+    """エンドポイントごとのリクエスト計測"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, enabled=True):
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def _route(self, endpoint):
+        stats = self._routes.get(endpoint)
+        if stats is None:
+            stats = self._routes[endpoint] = _RouteStats(len(self.buckets))
+        return stats
+
+    def started(self, endpoint):
+        """endpoint の処理中リクエストを1増やす"""
+        with self._lock:
+            self._route(endpoint).in_flight += 1
+
+    def observe(self, endpoint, status_code, duration, bytes_sent, finished=True):
+        """1リクエスト分を記録する。finished なら started() で増やした処理中の数を戻す"""
+        index = bisect.bisect_left(self.buckets, duration)
+        status_class = f"{status_code // 100}xx"
+        with self._lock:
+            stats = self._route(endpoint)
+            stats.buckets[index] += 1
+            stats.duration_sum += duration
+            stats.count += 1
+            stats.bytes_sent += bytes_sent
+            stats.classes[status_class] = stats.classes.get(status_class, 0) + 1
+            if finished:
+                stats.in_flight -= 1
+
+    def observe_response(self, environ, response, started, bytes_sent):
+        """wrap() した WSGI アプリの1応答分を記録する"""
+        self.observe(environ.get(_ENDPOINT_KEY, UNMATCHED), response.get("status", 500),
+                     time.perf_counter() - started, bytes_sent,
+                     finished=_ENDPOINT_KEY in environ)
+
+    def wrap(self, wsgi_app):
+        """wsgi_app を計測付きの WSGI アプリにして返す"""
+
+        def _metered(environ, start_response):
+            if not self.enabled:
+                return wsgi_app(environ, start_response)
+            started = time.perf_counter()
+            response = {}
+
+            def _start_response(status_line, headers, exc_info=None):
+                response["status"] = int(status_line.split(" ", 1)[0])
+                for name, value in headers:
+                    if name.lower() == "content-length":
+                        response["length"] = int(value)
+                return start_response(status_line, headers, exc_info)
+
+            try:
+                body = wsgi_app(environ, _start_response)
+            except BaseException:
+                self.observe_response(environ, response, started, 0)
+                raise
+            file_wrapper = environ.get("wsgi.file_wrapper")
+            if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+                try:
+                    return _observe_on_close(body, self, environ, started, response)
+                except AttributeError:
+                    # close を差し替えられない実装 (__slots__ 等) は包んで数える
+                    pass
+            return _MeteredBody(body, self, environ, started, response)
+
+        return _metered
+
+    def install(self, app):
+        """app の全ルートを計測する (無効で作った場合は何もしない。enabled は後から切り替えられる)"""
+        if not self.enabled:
+            return self
+        from flask import request
+
+        @app.before_request
+        def _count_in_flight():
+            if not self.enabled:
+                return
+            endpoint = request.endpoint or UNMATCHED
+            request.environ[_ENDPOINT_KEY] = endpoint
+            self.started(endpoint)
+
+        app.wsgi_app = self.wrap(app.wsgi_app)
+        return self
+
+    def snapshot(self):
+        """{エンドポイント: {"buckets", "sum", "count", "in_flight", "bytes", "classes"}}"""
+        with self._lock:
+            return {
+                endpoint: {"buckets": list(s.buckets), "sum": s.duration_sum, "count": s.count,
+                           "in_flight": s.in_flight, "bytes": s.bytes_sent,
+                           "classes": dict(s.classes)}
+                for endpoint, s in self._routes.items()
+            }
+
+    def render(self):
+        """Prometheus テキスト形式 (0.0.4) の文字列を返す"""
+        routes = sorted(self.snapshot().items())
+        lines = [
+            f"# HELP {PREFIX}_request_duration_seconds 応答を送り終えるまでの時間",
+            f"# TYPE {PREFIX}_request_duration_seconds histogram",
+        ]
+        for endpoint, s in routes:
+            label = f'endpoint="{_escape(endpoint)}"'
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s["buckets"]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{PREFIX}_request_duration_seconds_bucket{{{label},le="{le}"}} '
+                             f"{cumulative}")
+            lines.append(f"{PREFIX}_request_duration_seconds_sum{{{label}}} {s['sum']!r}")
+            lines.append(f"{PREFIX}_request_duration_seconds_count{{{label}}} {s['count']}")
+        lines += [f"# HELP {PREFIX}_requests_in_flight 処理中 (本文の送信中を含む) のリクエスト数",
+                  f"# TYPE {PREFIX}_requests_in_flight gauge"]
+        lines += [f'{PREFIX}_requests_in_flight{{endpoint="{_escape(e)}"}} {s["in_flight"]}'
+                  for e, s in routes]
+        lines += [f"# HELP {PREFIX}_response_bytes_total 送信した本文のバイト数",
+                  f"# TYPE {PREFIX}_response_bytes_total counter"]
+        lines += [f'{PREFIX}_response_bytes_total{{endpoint="{_escape(e)}"}} {s["bytes"]}'
+                  for e, s in routes]
+        lines += [f"# HELP {PREFIX}_requests_total ステータスクラスごとの完了したリクエスト数",
+                  f"# TYPE {PREFIX}_requests_total counter"]
+        for endpoint, s in routes:
+            for status_class, n in sorted(s["classes"].items()):
+                lines.append(f'{PREFIX}_requests_total{{endpoint="{_escape(endpoint)}",'
+                             f'code="{status_class}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def from_environ():
+    """環境変数 IEMODE_DL_METRICS から RequestMetrics を作る (既定は有効、"0" で無効)"""
+    return RequestMetrics(enabled=os.environ.get(ENV_VAR, "1") != "0")
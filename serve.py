@@ -0,0 +1,136 @@
+"""
+app.py を本番相当の WSGI サーバーで起動する
+
+- Linux / macOS : gunicorn (gthread ワーカー) … マルチプロセス × マルチスレッド、
+                  keep-alive、静的ファイルの sendfile (ゼロコピー)、SIGTERM で graceful shutdown
+- Windows       : waitress … マルチスレッド、keep-alive (gunicorn は Windows 非対応)
+- werkzeug      : 従来の開発サーバー。--debug はこのバックエンドでのみ有効
+
+gunicorn / waitress は任意依存 (pip install .[serve])。
+
+使い方:
+    python serve.py --workers 4 --threads 8
+    python serve.py --backend werkzeug --debug
+    python serve.py --faults '{"rules": [{"route": "/download/*", "rate": "512KB"}]}'
+"""
+
+import argparse
+import multiprocessing
+import signal
+import sys
+
+import fault_injection
+from app import app, faults
+
+DEFAULT_BIND = "0.0.0.0:5000"
+DEFAULT_THREADS = 8
+DEFAULT_KEEPALIVE_SEC = 5
+DEFAULT_GRACEFUL_TIMEOUT_SEC = 30
+
+
+def default_workers():
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def _split_bind(bind):
+    host, _, port = bind.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+def serve_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class _Application(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    _Application({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "keepalive": args.keepalive,
+        "graceful_timeout": args.graceful_timeout,
+        # send_file の wsgi.file_wrapper を sendfile(2) で返す
+        "sendfile": True,
+        "accesslog": "-" if args.access_log else None,
+    }).run()
+
+
+def serve_waitress(args):
+    from waitress import create_server
+
+    host, port = _split_bind(args.bind)
+    server = create_server(app, host=host, port=port, threads=args.threads,
+                           channel_timeout=max(args.keepalive, 1))
+
+    def _stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _stop)
+    print(f"waitress: http://{host}:{port} (threads={args.threads})")
+    try:
+        server.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.close()
+
+
+def serve_werkzeug(args):
+    host, port = _split_bind(args.bind)
+    app.run(host=host, port=port, debug=args.debug, threaded=True)
+
+
+BACKENDS = {
+    "gunicorn": serve_gunicorn,
+    "waitress": serve_waitress,
+    "werkzeug": serve_werkzeug,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="app.py を WSGI サーバーで起動する")
+    parser.add_argument("--backend", choices=["auto", *BACKENDS], default="auto",
+                        help="auto: Windows は waitress、それ以外は gunicorn")
+    parser.add_argument("--bind", default=DEFAULT_BIND)
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="ワーカープロセス数 (gunicorn のみ)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="ワーカーあたりのスレッド数")
+    parser.add_argument("--keepalive", type=int, default=DEFAULT_KEEPALIVE_SEC,
+                        help="keep-alive 接続のアイドル秒数")
+    parser.add_argument("--graceful-timeout", type=int, default=DEFAULT_GRACEFUL_TIMEOUT_SEC,
+                        help="停止時に処理中リクエストの完了を待つ秒数 (gunicorn のみ)")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--faults",
+                        help="遅延・帯域制限・切断の注入設定 (JSON 文字列または JSON ファイル。"
+                             "fault_injection.py 参照)")
+    parser.add_argument("--debug", action="store_true",
+                        help="Flask デバッグモード (werkzeug バックエンドのみ)")
+    args = parser.parse_args(argv)
+
+    backend = args.backend
+    if backend == "auto":
+        backend = "waitress" if sys.platform == "win32" else "gunicorn"
+    if args.debug and backend != "werkzeug":
+        parser.error("--debug は --backend werkzeug と組み合わせて指定してください")
+    if args.faults:
+        # gunicorn のワーカーは起動後に fork されるので、ここでの設定が全ワーカーに引き継がれる
+        try:
+            faults.configure(fault_injection.load_config(args.faults))
+        except ValueError as e:
+            parser.error(f"--faults: {e}")
+    BACKENDS[backend](args)
+
+
+if __name__ == "__main__":
+    main()
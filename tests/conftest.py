@@ -0,0 +1,30 @@
+"""
+テストから リポジトリ直下のモジュール (app.py など) と automation/ 配下のモジュールを import できるようにする
+
+automation/ のスクリプトは同じディレクトリのモジュールを直接 import する前提なので、
+両方のディレクトリを sys.path に入れる。
+
+共通のフィクスチャ:
+- clock : wait_engine の時刻源を FakeClock にする (テスト後に元へ戻す)
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "automation")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import wait_engine  # noqa: E402
+
+
+@pytest.fixture
+def clock():
+    """wait_engine の時刻源を FakeClock に差し替える (実時間では待たない)"""
+    clk = wait_engine.FakeClock()
+    previous = wait_engine.set_clock(clk)
+    yield clk
+    wait_engine.set_clock(previous)
@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+import auth
+
+SECRET = b"test-secret"
+
+
+class _Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _store(clock, **kwargs):
+    return auth.SessionStore(secret=SECRET, clock=clock, **kwargs)
+
+
+def test_check_password_round_trip():
+    encoded = auth.hash_password("testpass", iterations=1000)
+    assert auth.check_password(encoded, "testpass")
+    assert not auth.check_password(encoded, "wrong")
+
+
+@pytest.mark.parametrize("encoded", [
+    "", "plain", "pbkdf2_sha256$abc$salt$00", "pbkdf2_sha256$0$salt$00",
+    "pbkdf2_sha256$1000$ソルト$00", "pbkdf2_sha256$1000$salt$ハッシュ", "md5$1000$salt$00",
+])
+def test_check_password_rejects_malformed_hash(encoded):
+    assert auth.check_password(encoded, "testpass") is False
+
+
+def test_user_store_caches_verified_password():
+    users = auth.UserStore({"testuser": "testpass"}, iterations=1000)
+    assert users.verify("testuser", "testpass")
+    assert users.verify("testuser", "testpass")
+    assert not users.verify("testuser", "wrong")
+    assert not users.verify("nobody", "testpass")
+    assert users.stats()["verified"] == 1
+    assert users.stats()["cache_hits"] == 1
+    assert users.stats()["failures"] == 2
+
+
+def test_session_expires_ttl_after_issue_even_when_used():
+    clock = _Clock()
+    sessions = _store(clock, ttl=60)
+    session_id = sessions.create("testuser")
+    clock.now += 59
+    assert sessions.get(session_id) == "testuser"
+    clock.now += 1
+    assert sessions.get(session_id) is None
+    assert sessions.stats()["expired"] == 1
+
+
+def test_other_worker_adopts_signed_session_until_same_expiry():
+    clock = _Clock()
+    issuer, other = _store(clock, ttl=60), _store(clock, ttl=60)
+    session_id = issuer.create("テストユーザー")
+    clock.now += 30
+    assert issuer.get(session_id) == "テストユーザー"
+    assert other.get(session_id) == "テストユーザー"
+    assert other.stats()["adopted"] == 1
+    # どちらのワーカーでも発行から ttl 秒で同時に失効する
+    clock.now += 30
+    assert issuer.get(session_id) is None
+    assert other.get(session_id) is None
+    assert _store(clock, ttl=60).get(session_id) is None
+
+
+def test_tampered_or_foreign_session_is_rejected():
+    clock = _Clock()
+    session_id = _store(clock).create("testuser")
+    payload, signature = session_id.rsplit(".", 1)
+    forged = payload.rsplit(".", 1)[0] + ".YWRtaW4." + signature
+    assert _store(clock).get(forged) is None
+    assert auth.SessionStore(secret=b"other", clock=clock).get(session_id) is None
+    assert _store(clock).get("not-a-session") is None
+
+
+def test_evicted_session_is_not_adopted_again():
+    clock = _Clock()
+    sessions = _store(clock, max_sessions=2)
+    first = sessions.create("user1")
+    second = sessions.create("user2")
+    assert sessions.get(first) == "user1"
+    # 最も長く使われていない second を追い出す
+    third = sessions.create("user3")
+    assert sessions.get(second) is None
+    assert sessions.get(first) == "user1"
+    assert sessions.get(third) == "user3"
+    assert len(sessions) == 2
+    stats = sessions.stats()
+    assert stats["evicted"] == 1 and stats["rejected"] == 1 and stats["adopted"] == 0
+
+
+def test_evicted_record_is_dropped_after_expiry():
+    clock = _Clock()
+    sessions = _store(clock, ttl=60, max_sessions=1)
+    sessions.create("user1")
+    sessions.create("user2")
+    clock.now += 61
+    sessions.create("user3")
+    assert sessions._evicted == {}
+    assert len(sessions) == 1
+
+
+@pytest.fixture
+def client():
+    import app
+    app.app.config["TESTING"] = True
+    return app.app.test_client()
+
+
+def test_download_requires_login(client):
+    assert client.get("/download/csv").status_code == 401
+    assert client.get("/download").status_code == 302
+    assert client.get("/download/csv",
+                      headers={"Cookie": f"{auth.SESSION_COOKIE}=forged"}).status_code == 401
+
+
+def test_login_issues_session_cookie(client):
+    import app
+
+    resp = client.post("/login", data={"userid": "testuser", "password": "wrong"})
+    assert resp.status_code == 401
+    assert client.get_cookie(auth.SESSION_COOKIE) is None
+
+    resp = client.post("/login", data={"userid": "testuser", "password": "testpass"})
+    assert resp.status_code == 302
+    assert client.get_cookie(auth.SESSION_COOKIE) is not None
+    assert client.get("/download").status_code == 200
+    resp = client.get("/download/csv")
+    assert resp.status_code == 200
+    with open(os.path.join(app.app.static_folder, "sample.csv"), "rb") as f:
+        assert resp.data == f.read()
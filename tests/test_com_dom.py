@@ -0,0 +1,67 @@
+import pytest
+
+import com_dom
+
+LOC_DOWNLOAD_LINK = (com_dom.CSS_SELECTOR, "a[href*='/download/csv']")
+
+
+def _document(links, selectors_api=True):
+    doc = com_dom.FakeComDocument(selectors_api=selectors_api)
+    doc.add("input", **{"class": "txtUserID"})
+    doc.add("input", **{"class": "txtPassWord", "name": "password"})
+    doc.add("button")
+    for i in range(links):
+        doc.add("a", href=f"/legacy/page/{i}")
+    target = doc.add("a", href="/download/csv")
+    doc.calls = 0
+    return doc, target
+
+
+@pytest.mark.parametrize("locator, css", [
+    ((com_dom.CLASS_NAME, "txtUserID"), ".txtUserID"),
+    ((com_dom.ID, "main"), "#main"),
+    ((com_dom.NAME, "password"), "[name=\"password\"]"),
+    ((com_dom.TAG_NAME, "button"), "button"),
+    (LOC_DOWNLOAD_LINK, "a[href*='/download/csv']"),
+])
+def test_locator_to_css(locator, css):
+    assert com_dom.locator_to_css(locator) == css
+
+
+def test_locator_to_css_rejects_unsafe_values():
+    with pytest.raises(ValueError):
+        com_dom.locator_to_css((com_dom.CLASS_NAME, "a b"))
+    with pytest.raises(ValueError):
+        com_dom.locator_to_css(("xpath", "//a"))
+
+
+@pytest.mark.parametrize("links", [0, 1000])
+def test_find_uses_one_call_regardless_of_page_size(links):
+    doc, target = _document(links)
+    dom = com_dom.DomQuery(doc)
+    assert dom.find(LOC_DOWNLOAD_LINK) is target
+    assert doc.calls == dom.com_calls == 1
+
+
+def test_find_each_and_find_all_call_counts():
+    doc, _ = _document(10)
+    dom = com_dom.DomQuery(doc)
+    user, password, button = dom.find_each((com_dom.CLASS_NAME, "txtUserID"),
+                                           (com_dom.NAME, "password"),
+                                           (com_dom.TAG_NAME, "button"))
+    assert button.tagName == "BUTTON"
+    assert doc.calls == 3
+    # querySelectorAll + length + item(i) ごとに1回
+    assert len(dom.find_all((com_dom.TAG_NAME, "a"))) == 11
+    assert doc.calls == 3 + 1 + 1 + 11
+    assert dom.com_calls == doc.calls
+
+
+def test_fallback_scans_by_tag_without_selectors_api():
+    doc, target = _document(100, selectors_api=False)
+    dom = com_dom.DomQuery(doc)
+    assert dom.find(LOC_DOWNLOAD_LINK) is target
+    # getElementsByTagName + length、要素ごとに item + getAttribute("href")
+    assert doc.calls == 2 + 2 * 101
+    assert dom.find((com_dom.CLASS_NAME, "txtPassWord")) is not None
+    assert dom.find((com_dom.ID, "missing")) is None
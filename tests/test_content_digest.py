@@ -0,0 +1,37 @@
+import hashlib
+
+import pytest
+
+import file_digest
+import manifest
+
+
+@pytest.mark.parametrize("data, rows", [
+    (b"", 0),
+    (b"id,name\n", 0),
+    (b"id,name", 0),
+    (b"id,name\n1,a\n2,b\n", 2),
+    # 最終行に改行が無くても1行と数える
+    (b"id,name\n1,a\n2,b", 2),
+])
+def test_manifest_and_client_digest_agree(tmp_path, data, rows):
+    path = tmp_path / "sample.csv"
+    path.write_bytes(data)
+    expected = {"size": len(data), "rows": rows, "sha256": hashlib.sha256(data).hexdigest()}
+
+    assert manifest.summarize_file(str(path), read_size=3) == expected
+    assert file_digest.digest_file(str(path), chunk_size=5).summary() == expected
+    assert file_digest.digest_file(str(path), use_mmap=True).summary() == expected
+    assert file_digest.compare(file_digest.digest_file(str(path)), expected) == []
+
+
+def test_incremental_digest_matches_manifest(tmp_path):
+    path = tmp_path / "sample.csv"
+    partial = tmp_path / "sample.csv.partial"
+    digest = file_digest.IncrementalFileDigest(str(path))
+    partial.write_bytes(b"id,name\n1,")
+    digest.poll()
+    with open(partial, "ab") as f:
+        f.write(b"a\n2,b")
+    partial.rename(path)
+    assert digest.finish().summary() == manifest.summarize_file(str(path))
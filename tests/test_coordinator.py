@@ -0,0 +1,61 @@
+import pytest
+
+import coordinator
+
+
+def test_expired_lease_is_requeued_and_old_lease_rejected(clock):
+    queue = coordinator.JobQueue(lease_sec=30, clock=clock)
+    job = queue.submit("http", {"base_url": "http://localhost:5000"})
+    first = queue.lease("host-a")
+    assert first["id"] == job.id and first["lease_sec"] == 30
+
+    clock.advance(30)
+    second = queue.lease("host-b")
+    assert second["id"] == job.id
+    assert second["attempts"] == 2
+    assert second["history"] == [{"attempt": 1, "worker": "host-a", "outcome": "lost"}]
+    # 回収済みのリースからの報告は拒否する
+    with pytest.raises(coordinator.LeaseError):
+        queue.complete(job.id, first["lease_id"], {"ok": True})
+    done = queue.complete(job.id, second["lease_id"], {"ok": True})
+    assert done["state"] == "done"
+    assert queue.stats()["workers"]["host-a"]["lost"] == 1
+
+
+def test_heartbeat_extends_lease(clock):
+    queue = coordinator.JobQueue(lease_sec=10, clock=clock)
+    job = queue.submit("fake")
+    leased = queue.lease("host-a")
+    for _ in range(3):
+        clock.advance(8)
+        assert queue.heartbeat(job.id, leased["lease_id"], progress="waiting") == 10
+    assert queue.get(job.id)["state"] == "leased"
+    clock.advance(10)
+    queue.reap()
+    assert queue.get(job.id)["state"] == "queued"
+
+
+def test_job_is_lost_after_max_attempts(clock):
+    queue = coordinator.JobQueue(lease_sec=5, max_attempts=2, clock=clock)
+    job = queue.submit("fake")
+    for _ in range(2):
+        assert queue.lease("host-a")["id"] == job.id
+        clock.advance(5)
+    assert queue.lease("host-a") is None
+    assert queue.get(job.id)["state"] == "lost"
+
+
+def test_lease_round_robins_between_queues():
+    queue = coordinator.JobQueue()
+    bulk = [queue.submit("fake", queue="bulk").id for _ in range(3)]
+    small = queue.submit("fake", queue="small").id
+    order = [queue.lease("host-a")["id"] for _ in range(4)]
+    assert order == [bulk[0], small, bulk[1], bulk[2]]
+
+
+def test_lease_filters_by_runner():
+    queue = coordinator.JobQueue()
+    queue.submit("com")
+    http_job = queue.submit("http")
+    assert queue.lease("linux-host", runners=["http", "fake"])["id"] == http_job.id
+    assert queue.lease("linux-host", runners=["http"]) is None
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+import dialog_watcher
+
+
+def _watcher():
+    return dialog_watcher.DialogWatcher(source=dialog_watcher.FakeWindowEventSource()).start()
+
+
+def _notify_rule():
+    return dialog_watcher.DialogRule("win32:#32770:確認", title="確認", class_name="#32770")
+
+
+def test_re_expect_with_new_rule_object_returns_visible_dialog():
+    watcher = _watcher()
+    try:
+        info = watcher.source.open("確認")
+        assert watcher.expect(_notify_rule()).wait(1) == info
+        # 呼び出しのたびに作り直した同名のルールでも、表示中のダイアログをすぐ返す
+        assert watcher.expect(_notify_rule()).wait(1) == info
+        assert watcher.stats()["matched"] == 1
+    finally:
+        watcher.stop()
+
+
+def test_action_runs_once_per_window_and_pairs_with_expect():
+    calls = []
+    done = threading.Event()
+
+    def action(info):
+        calls.append(info.handle)
+        done.set()
+        return "OK"
+
+    watcher = _watcher()
+    try:
+        rule = dialog_watcher.DialogRule("save", title="名前を付けて保存", action=action)
+        expectation = watcher.expect(rule)
+        info = watcher.source.open("名前を付けて保存")
+        assert expectation.wait(1) == "OK"
+        # 同じウィンドウに同名ルールを登録し直しても action は再実行しない
+        watcher.add_rule(dialog_watcher.DialogRule("save", title="名前を付けて保存",
+                                                   action=action))
+        assert calls == [info.handle]
+        watcher.source.open("別のダイアログ")
+        assert calls == [info.handle]
+    finally:
+        watcher.stop()
+
+
+def test_unmatched_expectation_times_out_and_can_be_cancelled():
+    watcher = _watcher()
+    try:
+        expectation = watcher.expect(_notify_rule())
+        with pytest.raises(TimeoutError):
+            expectation.wait(0.01)
+        expectation.cancel()
+        watcher.source.open("確認")
+        assert not expectation.done()
+    finally:
+        watcher.stop()
+
+
+def test_latency_history_is_bounded():
+    watcher = _watcher()
+    try:
+        rule = dialog_watcher.DialogRule("any", class_name="#32770", action=lambda info: None)
+        watcher.add_rule(rule)
+        for _ in range(dialog_watcher.LATENCY_HISTORY + 50):
+            watcher.source.open("x")
+    finally:
+        watcher.stop()
+    assert len(watcher.latencies) == dialog_watcher.LATENCY_HISTORY
+    assert watcher.stats()["matched"] == dialog_watcher.LATENCY_HISTORY + 50
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import download_check
+import file_watch
+
+
+@pytest.fixture
+def watcher(monkeypatch):
+    fake = file_watch.FakeWatcher(real_sleep=False)
+    monkeypatch.setattr(download_check, "DOWNLOAD_WATCH_BACKEND", fake)
+    return fake
+
+
+def test_download_wait_times_out_under_fake_clock(tmp_path, clock, watcher):
+    missing = tmp_path / "missing.csv"
+    with pytest.raises(TimeoutError):
+        download_check.wait_for_download_complete(str(missing), clock.time(), timeout=5)
+    assert clock.time() - 1_000_000.0 == pytest.approx(5)
+    assert watcher.wait_calls
+
+
+def test_download_wait_wakes_on_file_event(tmp_path, clock, watcher):
+    target = tmp_path / "sample.csv"
+    watcher.push(lambda: target.write_bytes(b"id,name\n1,a\n"))
+    assert download_check.wait_for_download_complete(str(target), clock.time(), timeout=5)
+    assert len(watcher.wait_calls) == 1
+
+
+def test_download_wait_follows_partial_rename(tmp_path, clock, watcher):
+    target = tmp_path / "sample.csv"
+    partial = tmp_path / "sample.csv.partial"
+    watcher.push(lambda: partial.write_bytes(b"id,"))
+    watcher.push(lambda: partial.write_bytes(b"id,name\n"))
+    watcher.push(lambda: os.replace(partial, target))
+    assert download_check.wait_for_download_complete(str(target), clock.time(), timeout=30)
+    assert target.read_bytes() == b"id,name\n"
+    assert not partial.exists()
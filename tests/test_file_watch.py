@@ -0,0 +1,48 @@
+import sys
+import threading
+
+import pytest
+
+import file_watch
+
+
+def test_fake_watcher_runs_events_in_order():
+    calls = []
+    watcher = file_watch.FakeWatcher([lambda: calls.append("create"), None], real_sleep=False)
+    watcher.push(lambda: calls.append("rename"))
+    assert watcher.wait(1) is True
+    assert watcher.wait(1) is True
+    assert watcher.wait(1) is True
+    assert watcher.wait(1) is False
+    assert calls == ["create", "rename"]
+    assert watcher.wait_calls == [1, 1, 1, 1]
+
+
+def test_fake_watcher_wakes_on_push_from_another_thread():
+    watcher = file_watch.FakeWatcher()
+    timer = threading.Timer(0.05, watcher.push)
+    timer.start()
+    try:
+        assert watcher.wait(5) is True
+    finally:
+        timer.cancel()
+
+
+def test_create_file_watcher_accepts_instances_and_factories(tmp_path):
+    fake = file_watch.FakeWatcher()
+    assert file_watch.create_file_watcher(str(tmp_path), backend=fake) is fake
+    made = file_watch.create_file_watcher(str(tmp_path), ["a.csv"],
+                                          backend=lambda d, names: file_watch.FakeWatcher())
+    assert isinstance(made, file_watch.FakeWatcher)
+    assert file_watch.create_file_watcher(str(tmp_path), backend="polling").name == "polling"
+    with pytest.raises(ValueError):
+        file_watch.create_file_watcher(str(tmp_path), backend="unknown")
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify は Linux のみ")
+def test_inotify_watcher_filters_by_name(tmp_path):
+    with file_watch.InotifyWatcher(str(tmp_path), ["sample.csv", "sample.csv.partial"]) as w:
+        (tmp_path / "other.txt").write_bytes(b"x")
+        assert w.wait(0.05) is False
+        (tmp_path / "sample.csv.partial").write_bytes(b"x")
+        assert w.wait(1) is True
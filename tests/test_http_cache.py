@@ -0,0 +1,73 @@
+import os
+import time
+
+import http_cache
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_disk_variant_is_reused_by_another_cache(tmp_path):
+    source = tmp_path / "sample.csv"
+    _write(source, b"id,name\n" * 1000)
+    disk_dir = tmp_path / "cache"
+
+    first = http_cache.VariantCache(disk_dir=str(disk_dir))
+    entry, _ = first.entry(str(source))
+    data, hit = first.variant(entry, "gzip")
+    assert not hit
+
+    # 同じディレクトリを共有する別プロセス (ワーカー) 相当
+    second = http_cache.VariantCache(disk_dir=str(disk_dir))
+    entry, _ = second.entry(str(source))
+    assert second.variant(entry, "gzip") == (data, True)
+    assert second.stats()["disk_hits"] == 1
+    assert not [n for n in os.listdir(disk_dir) if n.endswith(http_cache.TEMP_SUFFIX)]
+
+
+def test_eviction_keeps_in_progress_temp_files(tmp_path):
+    source = tmp_path / "sample.csv"
+    _write(source, os.urandom(4096))
+    disk_dir = tmp_path / "cache"
+    disk_dir.mkdir()
+    # 他のワーカーが書き込み中の一時ファイルと、中断で残った古い一時ファイル
+    in_progress = disk_dir / f"other.csv.gz.1234{http_cache.TEMP_SUFFIX}"
+    _write(in_progress, b"x" * 10)
+    stale = disk_dir / f"crashed.csv.gz.5678{http_cache.TEMP_SUFFIX}"
+    _write(stale, b"x" * 10)
+    old = time.time() - http_cache.STALE_TEMP_SEC - 60
+    os.utime(stale, (old, old))
+
+    cache = http_cache.VariantCache(disk_dir=str(disk_dir), max_disk_bytes=1)
+    entry, _ = cache.entry(str(source))
+    cache.variant(entry, "gzip")
+
+    assert in_progress.exists()
+    assert not stale.exists()
+
+
+def test_memory_hits_are_counted_once_per_level(tmp_path):
+    source = tmp_path / "sample.csv"
+    _write(source, b"id,name\n" * 1000)
+    cache = http_cache.VariantCache()
+    for _ in range(3):
+        # 圧縮して返す応答1回分 (エントリとバリアントを1回ずつ引く)
+        entry, _ = cache.entry(str(source))
+        cache.variant(entry, "gzip")
+    cache.entry(str(source))
+    stats = cache.stats()
+    assert (stats["entry_hits"], stats["entry_misses"]) == (3, 1)
+    assert (stats["variant_hits"], stats["variant_misses"]) == (2, 1)
+    assert stats["disk_hits"] == 0
+
+    # ファイルが更新されたら両方ともミスになる
+    _write(source, b"id,name\n" * 1001)
+    os.utime(source, (time.time() + 5, time.time() + 5))
+    entry, hit = cache.entry(str(source))
+    assert not hit
+    assert cache.variant(entry, "gzip")[1] is False
+    stats = cache.stats()
+    assert (stats["entry_misses"], stats["variant_misses"]) == (2, 2)
+    assert stats["variants"] == 1
@@ -0,0 +1,24 @@
+import pytest
+
+import parallel_runner
+
+
+def test_check_runner_args_does_not_create_runner(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("ランナーを作ってはいけない")
+
+    monkeypatch.setattr(parallel_runner.http_fast_test, "HttpSession", fail)
+    parallel_runner.check_runner_args("http", base_url="http://localhost:5000", verify=False)
+    with pytest.raises(TypeError):
+        parallel_runner.check_runner_args("http", bogus=1)
+    with pytest.raises(ValueError):
+        parallel_runner.check_runner_args("nope")
+
+
+def test_run_parallel_fake_runner(tmp_path):
+    report = parallel_runner.run_parallel("fake", 6, concurrency=3, base_dir=str(tmp_path),
+                                          runner_kwargs={"duration": 0})
+    assert report["ok"] == 6 and report["failed"] == 0
+    assert [r["run_id"] for r in report["results"]] == list(range(1, 7))
+    # 成功した実行のダウンロード先は削除する
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,45 @@
+import process_table
+
+
+def test_snapshot_is_reused_within_ttl(clock):
+    table = process_table.FakeProcessTable([("iexplore.exe", "-embedding")], ttl=0.5)
+    assert table.pids("IEXPLORE.EXE") == {1004}
+    table.spawn("iexplore.exe")
+    assert table.pids("iexplore.exe") == {1004}
+    assert table.enumerations == 1
+    clock.advance(0.5)
+    assert table.pids("iexplore.exe") == {1004, 1008}
+    assert table.pids("iexplore.exe", max_age=0) == {1004, 1008}
+    assert table.enumerations == 3
+
+
+def test_find_filters_by_cmdline():
+    table = process_table.FakeProcessTable([("msedge.exe", "--type=renderer"),
+                                            ("msedge.exe", "--ie-mode")])
+    assert [p.pid for p in table.find("msedge.exe", cmdline_contains="ie-mode")] == [1008]
+
+
+def test_tracker_diff_records_only_new_pids(clock):
+    table = process_table.FakeProcessTable([("iexplore.exe", "")], ttl=0)
+    tracker = process_table.PidTracker("iexplore.exe", table=table)
+    before = tracker.snapshot()
+    started = {table.spawn("iexplore.exe"), table.spawn("iexplore.exe")}
+    table.spawn("notepad.exe")
+    assert tracker.track_new(before) == started
+    assert tracker.pids == started
+
+
+def test_cleanup_kills_tracked_pids_in_one_call(clock):
+    table = process_table.FakeProcessTable([("iexplore.exe", "")], kill_delay=0.3)
+    tracker = process_table.PidTracker("iexplore.exe", table=table)
+    before = tracker.snapshot()
+    started = {table.spawn("iexplore.exe"), table.spawn("iexplore.exe")}
+    tracker.track_new(before)
+
+    assert tracker.cleanup(timeout=1) == started
+    assert table.kill_calls == [sorted(started)]
+    # kill_delay 後に一覧から消えるまで待つ (既存のプロセスは残す)
+    assert table.pids("iexplore.exe", max_age=0) == {1004}
+    assert 0.3 <= sum(clock.sleeps) < 1
+    assert tracker.pids == set()
+    assert tracker.cleanup() == set()
@@ -0,0 +1,36 @@
+import run_history
+import scenario_engine
+
+
+def test_size_key_buckets():
+    assert run_history.size_key("wait_download", None) == "wait_download"
+    assert run_history.size_key("wait_download", 0) == "wait_download[<=64KiB]"
+    assert run_history.size_key("wait_download", 64 * 1024 + 1) == "wait_download[<=256KiB]"
+    assert run_history.size_key("wait_download", 3_000_000) == "wait_download[<=4MiB]"
+
+
+def test_download_timeout_is_not_shortened_for_larger_files():
+    history = run_history.RunHistory(":memory:")
+    try:
+        for _ in range(run_history.DEFAULT_MIN_SAMPLES):
+            history.record_run({}, [("wait_download[<=64KiB]", 2.0, True)], status="updated")
+        timeouts = run_history.AdaptiveTimeouts(history)
+        with timeouts.wait("wait_download", 90, size=30_000) as small:
+            pass
+        # sample.csv の履歴しかないサイズ区分は従来どおりの上限を使う
+        with timeouts.wait("wait_download", 90, size=200 * 1024 * 1024) as large:
+            pass
+        assert small.timeout == 4.0
+        assert large.timeout == 90
+        assert [name for name, _, _ in timeouts.take_samples()] == [
+            "wait_download[<=64KiB]", "wait_download[<=256MiB]"]
+    finally:
+        history.close()
+
+
+def test_expected_size_of_file_and_bundle():
+    assert scenario_engine.expected_size(None) is None
+    assert scenario_engine.expected_size({"size": 1234, "rows": 3}) == 1234
+    bundle = {"name": "bundle.zip", "entries": [{"name": "a.csv", "size": 100},
+                                                {"name": "b.csv", "size": 50}]}
+    assert scenario_engine.expected_size(bundle) == 150
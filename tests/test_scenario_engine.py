@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import http_fast_test
+import run_history
+import scenario_engine
+
+
+@pytest.fixture
+def history():
+    store = run_history.enable(":memory:")
+    yield store
+    run_history.disable()
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def _runs(store):
+    with store._lock:
+        return store._conn.execute("SELECT backend, status, ok FROM runs").fetchall()
+
+
+def test_fake_backend_runs_scenario_and_records_history(tmp_path, history):
+    backend = scenario_engine.FakeBackend()
+    result = scenario_engine.run_scenario(backend, save_dir=str(tmp_path))
+    assert result["status"] == "created"
+    assert (tmp_path / scenario_engine.SAVE_FILENAME).read_bytes() == backend.content
+    assert set(result["timings"]) >= {"step_login", "step_save_as",
+                                      "wait_for_download_complete"}
+    assert _runs(history) == [("fake", "created", 1)]
+
+
+def test_fake_backend_wrong_password_is_recorded_as_error(tmp_path, history):
+    backend = scenario_engine.FakeBackend()
+    with pytest.raises(RuntimeError):
+        scenario_engine.run_scenario(backend, save_dir=str(tmp_path), password="wrong")
+    assert _runs(history) == [("fake", "error", 0)]
+
+
+def test_http_backend_runs_through_scenario_engine(tmp_path, history, base_url):
+    expected = http_fast_test.fetch_expected(base_url, http_fast_test.DOWNLOAD_URL_PATH)
+    with http_fast_test.HttpSession(base_url) as session:
+        backend = http_fast_test.HttpBackend(session=session)
+        for _ in range(2):
+            session.clear_cookies()
+            result = scenario_engine.run_scenario(backend, base_url, str(tmp_path),
+                                                  expected=expected)
+            assert result["integrity"]["ok"]
+    assert result["status"] in ("created", "updated")
+    assert [row[0] for row in _runs(history)] == ["http", "http"]
@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+import session_pool
+import wait_engine
+
+
+def _pool(factory, **kwargs):
+    kwargs.setdefault("replenish", False)
+    return session_pool.SessionPool(factory, probe=factory.probe, reset=factory.reset,
+                                    destroy=factory.destroy, **kwargs)
+
+
+def test_session_is_reused_and_reset():
+    factory = session_pool.FakeDriverFactory(initial_url="http://localhost/start")
+    with _pool(factory, size=1) as pool:
+        assert pool.start() == 1
+        for _ in range(3):
+            with pool.session() as driver:
+                driver.get("http://localhost/download")
+                driver.add_cookie({"name": "session", "value": "x"})
+        stats = pool.stats()
+    assert len(factory.drivers) == 1
+    assert stats["created"] == 1 and stats["borrowed"] == 3
+    # 返却のたびに初期URLへ戻し Cookie を消す
+    assert driver.current_url == "http://localhost/start"
+    assert driver.cookies == {}
+
+
+def test_session_is_evicted_after_max_uses():
+    factory = session_pool.FakeDriverFactory()
+    with _pool(factory, size=1, max_uses=2) as pool:
+        for _ in range(3):
+            with pool.session():
+                pass
+        stats = pool.stats()
+    assert len(factory.drivers) == 2
+    assert stats["recycled"] == 1
+    assert factory.drivers[0].alive is False
+
+
+def test_failed_scenario_discards_session():
+    factory = session_pool.FakeDriverFactory()
+    with _pool(factory, size=1) as pool:
+        with pytest.raises(RuntimeError):
+            with pool.session():
+                raise RuntimeError("scenario failed")
+        with pool.session() as driver:
+            assert driver is factory.drivers[1]
+        assert pool.stats()["failures"] == 1
+
+
+def test_unhealthy_session_is_replaced_on_acquire():
+    factory = session_pool.FakeDriverFactory()
+    with _pool(factory, size=1) as pool:
+        pool.start()
+        factory.drivers[0].crash()
+        with pool.session() as driver:
+            assert driver.alive
+        assert pool.stats()["unhealthy"] == 1
+    assert len(factory.drivers) == 2
+
+
+def test_acquire_times_out_when_pool_is_exhausted():
+    factory = session_pool.FakeDriverFactory()
+    with _pool(factory, size=1) as pool:
+        held = pool.acquire()
+        with pytest.raises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        pool.release(held)
+
+
+def test_replenish_starts_replacement_in_background():
+    factory = session_pool.FakeDriverFactory()
+    pool = _pool(factory, size=2, max_uses=1, replenish=True)
+    pool.start()
+    with pool.session():
+        pass
+    # 破棄した1つの代わりがバックグラウンドで補充される
+    wait_engine.wait_until(lambda: pool.stats()["idle"] == 2, timeout=5)
+    pool.close()
+    assert len(factory.drivers) == 3
+    assert pool.stats()["live"] == 0
+    assert not any(d.alive for d in factory.drivers)
+
+
+def test_thread_affine_pool_creates_sessions_on_acquiring_thread():
+    factory = session_pool.FakeDriverFactory()
+    threads = []
+
+    def create():
+        threads.append(threading.get_ident())
+        return factory()
+
+    pool = session_pool.SessionPool(create, size=2, max_uses=1, destroy=factory.destroy,
+                                    thread_affine=True)
+
+    def use():
+        pool.start()
+        for _ in range(3):
+            with pool.session():
+                pass
+        pool.close()
+
+    # COM の STA と同じく、プールを使うスレッドだけで起動・破棄する
+    worker = threading.Thread(target=use)
+    worker.start()
+    worker.join()
+    assert len(threads) == 3
+    assert set(threads) == {worker.ident}
+    assert not any(d.alive for d in factory.drivers)
+
+
+def test_thread_affine_pool_rejects_other_threads():
+    pool = session_pool.SessionPool(session_pool.FakeDriverFactory(), thread_affine=True)
+    pool.start()
+    errors = []
+
+    def borrow():
+        try:
+            pool.acquire(timeout=0)
+        except RuntimeError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=borrow)
+    t.start()
+    t.join()
+    assert len(errors) == 1
+    pool.close()
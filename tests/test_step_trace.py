@@ -0,0 +1,37 @@
+import step_trace
+
+
+def test_spans_are_bounded():
+    tracer = step_trace.Tracer(max_spans=3)
+    for i in range(5):
+        with tracer.span("step", i=i):
+            pass
+    assert [r["attrs"]["i"] for r in tracer.records()] == [2, 3, 4]
+    assert tracer.dropped == 2
+    tracer.reset()
+    assert tracer.records() == [] and tracer.dropped == 0
+
+
+def test_disabled_tracer_keeps_no_spans():
+    tracer = step_trace.Tracer(enabled=False)
+    with tracer.span("outer") as outer:
+        with tracer.span("inner"):
+            tracer.add_sleep(0.5)
+    assert tracer.records() == []
+    assert outer.sleep_sec == 0.5
+    assert tracer.current() is None
+
+
+def test_nested_spans_record_parent_and_sleep(tmp_path):
+    tracer = step_trace.Tracer()
+    with tracer.span("scenario"):
+        with tracer.span("wait"):
+            tracer.add_sleep(0.25)
+            tracer.poll(3)
+    records = {r["name"]: r for r in tracer.records()}
+    assert records["wait"]["parent"] == "scenario"
+    assert records["wait"]["polls"] == 3
+    assert records["scenario"]["sleep_sec"] == 0.25
+    assert tracer.summary()["wait"]["count"] == 1
+    tracer.export_jsonl(str(tmp_path / "t.jsonl"))
+    assert len((tmp_path / "t.jsonl").read_text(encoding="utf-8").splitlines()) == 2
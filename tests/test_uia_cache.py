@@ -0,0 +1,64 @@
+import uia_cache
+
+
+def _save_dialog(desktop):
+    window = desktop.open("名前を付けて保存")
+    window.add(title="ファイル名:", class_name="Edit", control_type="Edit", auto_id="1001")
+    window.add(title="保存(S)", class_name="Button", control_type="Button", auto_id="1")
+    return window
+
+
+def test_descendants_walks_once_and_reads_text_once():
+    desktop = uia_cache.FakeDesktop()
+    window = _save_dialog(desktop)
+    cache = uia_cache.ElementCache(is_alive=desktop.is_alive)
+    for _ in range(3):
+        texts = [e.text for e in cache.descendants(window)]
+    assert texts == ["ファイル名:", "保存(S)"]
+    assert desktop.walks == 1
+    assert desktop.calls == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["walks"]) == (2, 1, 1)
+
+
+def test_find_hits_until_window_closes():
+    desktop = uia_cache.FakeDesktop()
+    window = _save_dialog(desktop)
+    cache = uia_cache.ElementCache(is_alive=desktop.is_alive)
+    button = cache.find(window, auto_id="1", control_type="Button")
+    assert cache.find(window, control_type="Button", auto_id="1") is button
+    assert desktop.walks == 1
+
+    desktop.close(window)
+    reopened = _save_dialog(desktop)
+    cache.find(reopened, auto_id="1", control_type="Button")
+    assert cache.find(window, auto_id="1", control_type="Button") is not None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["walks"]) == (1, 3, 3)
+    assert stats["stale"] == 1
+
+
+def test_find_refetches_hidden_element():
+    desktop = uia_cache.FakeDesktop()
+    window = _save_dialog(desktop)
+    cache = uia_cache.ElementCache(is_alive=desktop.is_alive)
+    old = cache.find(window, auto_id="1")
+    old.visible = False
+    window.add(title="保存(S)", class_name="Button", auto_id="1")
+    assert cache.find(window, auto_id="1") is not old
+    assert cache.stats()["stale"] == 1
+
+
+def test_windows_does_not_cache_empty_results():
+    desktop = uia_cache.FakeDesktop()
+    cache = uia_cache.ElementCache(is_alive=desktop.is_alive)
+    assert cache.windows(desktop, title="名前を付けて保存") == []
+    window = _save_dialog(desktop)
+    assert cache.windows(desktop, title="名前を付けて保存") == [window]
+    assert cache.windows(desktop, title="名前を付けて保存") == [window]
+    assert desktop.walks == 2
+
+    cache.invalidate(window.handle)
+    cache.windows(desktop, title="名前を付けて保存")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (1, 3, 1)
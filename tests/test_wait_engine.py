@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+import wait_engine
+
+
+def test_backoff_grows_to_max_and_resets():
+    backoff = wait_engine.Backoff(initial=0.1, factor=2, max_interval=0.5, jitter=0)
+    assert [backoff.next() for _ in range(5)] == [0.1, 0.2, 0.4, 0.5, 0.5]
+    backoff.reset()
+    assert backoff.next() == 0.1
+    assert backoff.delay(0) == 0.1
+    assert backoff.delay(10) == 0.5
+
+
+def test_backoff_jitter_stays_within_bounds():
+    backoff = wait_engine.Backoff(initial=1.0, factor=1, max_interval=1.0, jitter=0.1,
+                                  rng=random.Random(0))
+    delays = [backoff.next() for _ in range(100)]
+    assert all(0.9 <= d <= 1.1 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_wait_until_returns_when_condition_becomes_true(clock):
+    clock.schedule(1.0, lambda: state.update(ready=True))
+    state = {"ready": False}
+    assert wait_engine.wait_until(lambda: state["ready"], timeout=5, jitter=0)
+    assert 1.0 <= sum(clock.sleeps) < 1.5
+
+
+def test_wait_until_times_out_without_real_sleep(clock):
+    with pytest.raises(TimeoutError):
+        wait_engine.wait_until(lambda: False, timeout=3, jitter=0)
+    assert sum(clock.sleeps) == pytest.approx(3)
+    assert wait_engine.wait_until(lambda: False, timeout=1, raise_on_timeout=False) is None
+
+
+def test_wait_until_evaluates_once_with_zero_timeout(clock):
+    calls = []
+    wait_engine.wait_until(lambda: calls.append(1), timeout=0, raise_on_timeout=False)
+    assert calls == [1]
+
+
+def test_observe_resets_backoff_on_state_change(clock):
+    poller = wait_engine.Poller(10, backoff=wait_engine.Backoff(initial=0.1, jitter=0),
+                                clock=clock)
+    poller.observe("a")
+    poller.sleep()
+    poller.sleep()
+    poller.observe("b")
+    poller.sleep()
+    assert clock.sleeps == [0.1, 0.2, 0.1]
+
+
+def test_poller_sleep_hint_caps_delay(clock):
+    poller = wait_engine.Poller(10, backoff=wait_engine.Backoff(initial=1.0, jitter=0),
+                                clock=clock)
+    poller.sleep(hint=0.25)
+    assert clock.sleeps == [0.25]
+
+
+def test_poller_with_sleeper_advances_fake_clock(clock):
+    waits = []
+    poller = wait_engine.Poller(2, backoff=wait_engine.Backoff(initial=0.5, jitter=0),
+                                clock=clock, sleeper=lambda t: waits.append(t) or False)
+    while poller.poll():
+        poller.sleep()
+    assert clock.monotonic() >= poller.deadline
+    assert sum(waits) == pytest.approx(2)
@@ -0,0 +1,144 @@
+"""
+ログイン (auth.py) のスループットとセッション参照のコスト
+
+- login        : POST /login の資格情報チェック + セッション作成 (プロセス内で直接呼ぶ)
+                 cold   = 毎回 PBKDF2 を計算する (照合済みキャッシュを使わない場合)
+                 cached = 2回目以降のログイン (照合済みキャッシュに当たる)
+- lookup       : --sessions 件のセッションがある状態で、有効なセッションIDを引く µs/回
+                 (ランダムな順で引く。期限の確認と LRU の並べ替えを含む)
+- miss         : 存在しないセッションIDを引く µs/回
+- memory       : tracemalloc で測ったセッション1件あたりのバイト数 (IDの文字列・辞書の枠を含む)
+- http         : --base-url 指定時のみ。起動中の app.py に POST /login → GET /download を
+                 --http-requests 回繰り返した logins/s
+
+使い方:
+    python tools/bench_auth.py --sessions 100000
+    python tools/bench_auth.py --sessions 100000 --base-url http://localhost:5000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import sys
+import time
+import tracemalloc
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth  # noqa: E402
+
+USER_ID = "testuser"
+PASSWORD = "testpass"
+
+
+def _per_sec(n, sec):
+    return round(n / sec) if sec else None
+
+
+def _time_logins(authenticator, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        if authenticator.login(USER_ID, PASSWORD) is None:
+            raise RuntimeError("ログインに失敗しました")
+    return time.perf_counter() - started
+
+
+def bench_login(cold_logins, cached_logins):
+    # verified_cache_size=0 なら照合済みキャッシュに残らず、毎回 PBKDF2 を計算する
+    cold = _time_logins(auth.Authenticator(
+        auth.UserStore({USER_ID: PASSWORD}, verified_cache_size=0), auth.SessionStore()),
+        cold_logins)
+    authenticator = auth.Authenticator(auth.UserStore({USER_ID: PASSWORD}), auth.SessionStore())
+    authenticator.login(USER_ID, PASSWORD)
+    cached = _time_logins(authenticator, cached_logins)
+    return {"cold_per_sec": _per_sec(cold_logins, cold),
+            "cold_ms": round(cold / cold_logins * 1000, 2),
+            "cached_per_sec": _per_sec(cached_logins, cached),
+            "cached_us": round(cached / cached_logins * 1e6, 2)}
+
+
+def bench_lookup(n_sessions, lookups):
+    sessions = auth.SessionStore(max_sessions=n_sessions)
+    ids = [sessions.create(f"user{i % 1000}") for i in range(n_sessions)]
+    order = [random.choice(ids) for _ in range(lookups)]
+    started = time.perf_counter()
+    for session_id in order:
+        sessions.get(session_id)
+    hit = time.perf_counter() - started
+
+    missing = [secrets.token_urlsafe(32) for _ in range(lookups)]
+    started = time.perf_counter()
+    for session_id in missing:
+        sessions.get(session_id)
+    miss = time.perf_counter() - started
+    return {"active": len(sessions), "lookup_us": round(hit / lookups * 1e6, 3),
+            "miss_us": round(miss / lookups * 1e6, 3)}
+
+
+def bench_memory(n_sessions):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = auth.SessionStore(max_sessions=n_sessions)
+        for i in range(n_sessions):
+            sessions.create(f"user{i % 1000}")
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {"sessions": len(sessions), "total_kb": used // 1024,
+            "bytes_per_session": round(used / n_sessions)}
+
+
+def bench_http(base_url, requests):
+    parts = urllib.parse.urlsplit(base_url)
+    form = urllib.parse.urlencode({"userid": USER_ID, "password": PASSWORD})
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    try:
+        started = time.perf_counter()
+        for _ in range(requests):
+            conn.request("POST", "/login", body=form,
+                         headers={"Content-Type": "application/x-www-form-urlencoded"})
+            resp = conn.getresponse()
+            resp.read()
+            cookie = resp.getheader("Set-Cookie", "").split(";", 1)[0]
+            if resp.status not in (302, 303) or not cookie:
+                raise RuntimeError(f"ログインに失敗しました: status={resp.status}")
+            conn.request("GET", "/download", headers={"Cookie": cookie})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"/download が失敗しました: status={resp.status}")
+        total = time.perf_counter() - started
+    finally:
+        conn.close()
+    return {"requests": requests, "logins_per_sec": _per_sec(requests, total),
+            "ms_per_login": round(total / requests * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログインのスループットとセッション参照のコスト")
+    parser.add_argument("--sessions", type=int, default=100_000, help="有効なセッション数")
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--cold-logins", type=int, default=20)
+    parser.add_argument("--cached-logins", type=int, default=100_000)
+    parser.add_argument("--base-url", help="指定すると起動中のサーバーへのログインも測る")
+    parser.add_argument("--http-requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    report = {
+        "iterations": auth.DEFAULT_ITERATIONS,
+        "login": bench_login(args.cold_logins, args.cached_logins),
+        "lookup": bench_lookup(args.sessions, args.lookups),
+        "memory": bench_memory(args.sessions),
+    }
+    if args.base_url:
+        report["http"] = bench_http(args.base_url, args.http_requests)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+バックエンド別のシナリオ所要時間の比較
+
+scenario_engine.run_scenario を同じ条件でバックエンドごとに N 回実行し、
+ステップ別の mean / p50 / p95 (ミリ秒) を横に並べて出力する。
+どのバックエンドでもステップ名は同じなので、最適化の効果をステップ単位で比べられる。
+
+- fake     : どこでも実行できる (--fake-latency で操作ごとの待ち時間を与えられる)
+- http     : Flaskサーバー (app.py) が --base-url で起動していること
+- com / selenium : Windows + IE モードの環境でのみ実行できる
+
+使い方:
+    python tools/bench_backends.py --backends fake http --runs 50 --base-url http://localhost:5000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "automation"))
+
+import scenario_engine  # noqa: E402
+from parallel_runner import percentile  # noqa: E402
+
+
+def _backend_kwargs(name, args):
+    if name == "fake":
+        return {"latency": {op: args.fake_latency for op in
+                            ("navigate", "find", "type", "submit", "click_with_confirm",
+                             "save_as")}}
+    if name == "http":
+        return {"base_url": args.base_url}
+    return {}
+
+
+def run_backend(name, args):
+    save_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    steps = {}
+    totals = []
+    failures = 0
+    try:
+        with scenario_engine.create_backend(name, **_backend_kwargs(name, args)) as backend:
+            for _ in range(args.runs):
+                try:
+                    result = scenario_engine.run_scenario(backend, args.base_url, save_dir)
+                except Exception:
+                    failures += 1
+                    continue
+                if result["status"] in ("missing", "stale"):
+                    failures += 1
+                for step, sec in result["timings"].items():
+                    steps.setdefault(step, []).append(sec)
+                totals.append(sum(result["timings"].values()))
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+    steps["total"] = totals
+    return {
+        "backend": name,
+        "runs": args.runs,
+        "failures": failures,
+        "steps_ms": {step: _stats_ms(values) for step, values in steps.items()},
+    }
+
+
+def _stats_ms(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "mean": sum(values) / len(values) * 1000,
+        "p50": percentile(values, 50) * 1000,
+        "p95": percentile(values, 95) * 1000,
+    }
+
+
+def _print_table(results):
+    names = [r["backend"] for r in results]
+    steps = list(dict.fromkeys(s for r in results for s in r["steps_ms"]))
+    print(f"{'step (mean / p95 ms)':<34}" + "".join(f"{n:>22}" for n in names))
+    for step in steps:
+        cells = []
+        for r in results:
+            stats = r["steps_ms"].get(step)
+            cells.append("-" if stats is None else f"{stats['mean']:.2f} / {stats['p95']:.2f}")
+        print(f"{step:<34}" + "".join(f"{c:>22}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バックエンド別のシナリオ所要時間の比較")
+    parser.add_argument("--backends", nargs="+", default=["fake", "http"],
+                        choices=sorted(scenario_engine.BACKENDS))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--base-url", default=scenario_engine.BASE_URL)
+    parser.add_argument("--fake-latency", type=float, default=0.0,
+                        help="fake バックエンドの操作ごとの待ち時間 (秒)")
+    parser.add_argument("--json", action="store_true", help="表ではなく JSON で出力する")
+    args = parser.parse_args()
+
+    results = [run_backend(name, args) for name in args.backends]
+    if args.json:
+        print(json.dumps({"results": results}, ensure_ascii=False, indent=2))
+    else:
+        _print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+COM DOM 検索の往復回数の比較 (Linux / 疑似 COM ドキュメント)
+
+リンクが --links 件あるページで、ie_mode_test の従来の探し方
+(getElementsByTagName → item(i) → getAttribute("href") を1件ずつ) と
+com_dom.DomQuery (querySelector) の COM 呼び出し回数を比べる。
+--call-ms を指定すると、1回の往復にかかる時間から推定所要時間も出す。
+
+使い方:
+    python tools/bench_com_dom.py --links 5000 --call-ms 0.3
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "automation"))
+
+import com_dom  # noqa: E402
+
+LOC_USER_ID = (com_dom.CLASS_NAME, "txtUserID")
+LOC_PASSWORD = (com_dom.CLASS_NAME, "txtPassWord")
+LOC_LOGIN_BUTTON = (com_dom.TAG_NAME, "button")
+LOC_DOWNLOAD_LINK = (com_dom.CSS_SELECTOR, "a[href*='/download/csv']")
+
+
+def build_document(links, selectors_api=True):
+    doc = com_dom.FakeComDocument(selectors_api=selectors_api)
+    doc.add("input", **{"class": "txtUserID"})
+    doc.add("input", **{"class": "txtPassWord"})
+    doc.add("button")
+    for i in range(links):
+        doc.add("a", href=f"/legacy/page/{i}")
+    doc.add("a", href="/download/csv")
+    doc.calls = 0
+    return doc
+
+
+def legacy(doc):
+    """変更前の ie_mode_test と同じ呼び出し順"""
+    userid_inputs = doc.getElementsByClassName("txtUserID")
+    password_inputs = doc.getElementsByClassName("txtPassWord")
+    if userid_inputs.length == 0 or password_inputs.length == 0:
+        raise RuntimeError("ログインフォームの要素が見つかりません")
+    userid_inputs.item(0)
+    password_inputs.item(0)
+    doc.getElementsByTagName("button").item(0)
+    links = doc.getElementsByTagName("a")
+    for i in range(links.length):
+        href = links.item(i).getAttribute("href")
+        if href and "/download/csv" in str(href):
+            return links.item(i)
+    raise RuntimeError("ダウンロードリンクが見つかりません")
+
+
+def query(doc):
+    dom = com_dom.DomQuery(doc)
+    dom.find_each(LOC_USER_ID, LOC_PASSWORD, LOC_LOGIN_BUTTON)
+    link = dom.find(LOC_DOWNLOAD_LINK)
+    if link is None:
+        raise RuntimeError("ダウンロードリンクが見つかりません")
+    return link
+
+
+def main():
+    parser = argparse.ArgumentParser(description="COM DOM 検索の往復回数の比較")
+    parser.add_argument("--links", type=int, default=5000, help="ページ内のリンク数")
+    parser.add_argument("--call-ms", type=float, default=0.3, help="COM 往復1回あたりの時間 (ms)")
+    args = parser.parse_args()
+
+    results = []
+    for name, func, selectors_api in (("legacy", legacy, True),
+                                      ("query", query, True),
+                                      ("query-fallback", query, False)):
+        doc = build_document(args.links, selectors_api)
+        func(doc)
+        results.append({"mode": name, "com_calls": doc.calls,
+                        "estimated_ms": doc.calls * args.call_ms})
+    print(json.dumps({"links": args.links, "call_ms": args.call_ms, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+コーディネーター + ワーカーエージェントのスケジューリング確認 (Linux / fake ランナー)
+
+コーディネーターと W 個のワーカーエージェントを同じプロセス内で起動し、
+キューごとに件数の偏ったジョブを投入して次を計測する。
+
+- スループット (jobs/min)
+- ワーカー間の公平性 (Jain 指数) とキュー間の公平性 (各キューの最初/最後の完了時刻)
+- 実行途中でワーカーを crash させたときの再試行 (リース切れ → 再割り当て)
+
+使い方:
+    python tools/bench_coordinator.py --workers 8 --slots 2 --jobs 400 300 20 --crash 1
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "automation"))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import coordinator  # noqa: E402
+import worker_agent  # noqa: E402
+
+
+def _queue_timeline(queue, started):
+    """キューごとの最初 / 最後の完了時刻 (ベンチ開始からの秒数)"""
+    out = {}
+    for job in queue.list():
+        if job["finished_at"] is None:
+            continue
+        t = job["finished_at"] - started
+        q = out.setdefault(job["queue"], {"jobs": 0, "first_done_sec": t, "last_done_sec": t})
+        q["jobs"] += 1
+        q["first_done_sec"] = min(q["first_done_sec"], t)
+        q["last_done_sec"] = max(q["last_done_sec"], t)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コーディネーターのスケジューリング確認")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=1, help="ワーカーあたりの同時実行数")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[200, 50, 10],
+                        help="キューごとのジョブ数 (q0 q1 ... の順)")
+    parser.add_argument("--fake-duration", type=float, default=0.02)
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0)
+    parser.add_argument("--lease-sec", type=float, default=1.0)
+    parser.add_argument("--crash", type=int, default=0,
+                        help="実行途中で crash させるワーカー数")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    queue = coordinator.JobQueue(lease_sec=args.lease_sec)
+    server = make_server("127.0.0.1", 0, coordinator.create_app(queue), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    # 大きいキューを先に投入しても、小さいキューが最後まで待たされないことを確認する
+    for i, count in enumerate(args.jobs):
+        for _ in range(count):
+            queue.submit("fake", {"duration": args.fake_duration,
+                                  "failure_rate": args.fake_failure_rate},
+                         {"filename": "sample.csv", "min_bytes": 1}, queue=f"q{i}")
+    total = sum(args.jobs)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_coordinator_")
+    agents = [worker_agent.WorkerAgent(url, f"worker-{i}", ["fake"], args.slots,
+                                       os.path.join(work_dir, f"worker-{i}"), lease_wait=0.5)
+              for i in range(args.workers)]
+    started = time.time()
+    threads = [threading.Thread(target=a.run, kwargs={"idle_exit": 2.0}, daemon=True)
+               for a in agents]
+    for t in threads:
+        t.start()
+
+    crashed = False
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        states = queue.stats()["states"]
+        finished = sum(states.get(s, 0) for s in ("done", "failed", "lost"))
+        if args.crash and not crashed and finished >= total // 3:
+            for agent in agents[:args.crash]:
+                agent.crash()
+            crashed = True
+        if finished >= total:
+            break
+        time.sleep(0.05)
+
+    for agent in agents:
+        agent.stop()
+    for t in threads:
+        t.join(timeout=5)
+    server.shutdown()
+
+    stats = queue.stats()
+    report = {
+        "jobs": total,
+        "workers": args.workers,
+        "slots": args.slots,
+        "states": stats["states"],
+        "retries": stats["retries"],
+        "jobs_per_min": stats["jobs_per_min"],
+        "worker_fairness": stats["worker_fairness"],
+        "queues": _queue_timeline(queue, started),
+        "per_worker": {name: {k: w[k] for k in ("done", "failed", "lost")}
+                       for name, w in sorted(stats["workers"].items())},
+        "abandoned": sum(a.abandoned for a in agents),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
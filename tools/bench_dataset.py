@@ -0,0 +1,123 @@
+"""
+SQLite データソース (dataset.py) からのCSVエクスポートの rows/s と最初の1バイトまでの時間
+
+--sizes の最大行数を投入した DB (それ以上の行数が投入済みならそのまま使う) に対し、
+各行数を limit にしてエクスポートを読み切り、次を測る。
+
+- ttfb_ms     : 要求 (エクスポート開始) から最初のデータ行が届くまで
+- rows_per_sec: 返した行数 / 読み切るまでの秒数
+- peak_kb     : --trace-memory 指定時のみ。tracemalloc で測ったエクスポート中の最大メモリ
+                (行数を増やしても一定であることの確認用。計測自体で遅くなるので別に回す)
+
+--department を付けると部署の索引を使う絞り込みになる (全体の約 1/8 の行が該当する。
+limit が該当行数より多い場合は該当行数で打ち切られる)。
+--base-url を付けると、起動中の app.py の /download/csv/dataset からも受信して測る
+(サーバー側も同じ DB を IEMODE_DL_DATASET_DB で指定しておくこと)。
+
+使い方:
+    python tools/bench_dataset.py --db /tmp/dataset.sqlite3 --sizes 10000 1000000 10000000
+    python tools/bench_dataset.py --db /tmp/dataset.sqlite3 --department 営業部 --trace-memory
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+import tracemalloc
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dataset  # noqa: E402
+
+READ_SIZE = 256 * 1024
+
+
+def _measure(chunks):
+    """(返した行数, 最初のデータ行までの秒数, 全体の秒数)"""
+    started = time.perf_counter()
+    first = None
+    newlines = 0
+    for chunk in chunks:
+        newlines += chunk.count(b"\n")
+        if first is None and newlines > 1:
+            first = time.perf_counter() - started
+    total = time.perf_counter() - started
+    return max(newlines - 1, 0), first if first is not None else total, total
+
+
+def _iter_http(base_url, department, limit):
+    parts = urllib.parse.urlsplit(base_url)
+    params = {"limit": limit}
+    if department:
+        params["department"] = department
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=600)
+    try:
+        conn.request("GET", f"/download/csv/dataset?{urllib.parse.urlencode(params)}")
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise RuntimeError(f"status={resp.status}")
+        while True:
+            chunk = resp.read1(READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        conn.close()
+
+
+def _result(rows, ttfb, total):
+    return {"rows": rows, "ttfb_ms": round(ttfb * 1000, 2), "sec": round(total, 3),
+            "rows_per_sec": round(rows / total) if total else None}
+
+
+def _peak_kb(source, department, limit):
+    tracemalloc.start()
+    try:
+        for _ in source.export(department, limit):
+            pass
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite データソースのCSVエクスポート性能")
+    parser.add_argument("--db", required=True, help="SQLite ファイル (無ければ投入する)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--department", help="部署で絞り込む (例: 営業部)")
+    parser.add_argument("--batch-size", type=int, default=dataset.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--base-url", help="指定すると起動中のサーバーからの受信も測る")
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    # 最大行数以上が投入済みならそのまま使う (投入し直すと 10M 行で数十秒かかる)
+    conn = dataset.connect(args.db)
+    try:
+        current = dataset.seeded_as(conn)
+    finally:
+        conn.close()
+    rows = None if current and current[0] >= max(args.sizes) else max(args.sizes)
+    source = dataset.Dataset(args.db, rows=rows, batch_size=args.batch_size)
+    started = time.perf_counter()
+    source.ensure_seeded()
+    seed_sec = time.perf_counter() - started
+
+    results = []
+    for size in args.sizes:
+        row = {"limit": size,
+               "inproc": _result(*_measure(source.export(args.department, size)))}
+        if args.base_url:
+            row["http"] = _result(*_measure(_iter_http(args.base_url, args.department, size)))
+        if args.trace_memory:
+            row["peak_kb"] = _peak_kb(source, args.department, size)
+        results.append(row)
+    print(json.dumps({"db_rows": source.rows, "seed_sec": round(seed_sec, 1),
+                      "department": args.department, "batch_size": args.batch_size,
+                      "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
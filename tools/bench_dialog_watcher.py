@@ -0,0 +1,171 @@
+"""
+ダイアログ監視の比較 (Linux / 疑似ウィンドウ一覧)
+
+N 種類のダイアログがランダムな時刻に表示される状況で、次の3方式の
+検出遅延 (表示 → 処理開始) と CPU 時間を比べる。
+
+- pollers       : ダイアログごとに1スレッドが wait("visible") 相当のポーリングをする (従来方式)
+- watcher-poll  : dialog_watcher.PollingEventSource による1本の共有ポーリング
+- watcher-event : dialog_watcher.FakeWindowEventSource によるイベント駆動 (SetWinEventHook 相当)
+
+ウィンドウ一覧の取得は、背景ウィンドウ (--background 個) を含めて毎回 WindowInfo を
+作り直すことで EnumWindows + GetWindowText のコストを模擬する。
+
+使い方:
+    python tools/bench_dialog_watcher.py --dialogs 20 --duration 3 --interval 0.09
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "automation"))
+
+import dialog_watcher  # noqa: E402
+from parallel_runner import percentile  # noqa: E402
+
+
+class FakeDesktop:
+    """表示中ウィンドウの一覧 (列挙のたびに WindowInfo を作り直す)"""
+
+    def __init__(self, background):
+        self._lock = threading.Lock()
+        self._windows = {h: ("背景ウィンドウ", "Chrome_WidgetWin_1", 1000 + h)
+                         for h in range(1, background + 1)}
+        self._next = 0x10000
+        self.enumerations = 0
+
+    def open(self, title):
+        with self._lock:
+            self._next += 2
+            self._windows[self._next] = (title, "#32770", 4242)
+            return self._next
+
+    def enumerate(self):
+        with self._lock:
+            self.enumerations += 1
+            items = list(self._windows.items())
+        return [dialog_watcher.WindowInfo(h, t, c, p) for h, (t, c, p) in items]
+
+
+def _schedule(dialogs, duration, seed):
+    rng = random.Random(seed)
+    return sorted((rng.uniform(0.1, duration), f"ダイアログ{i:03d}") for i in range(dialogs))
+
+
+def _open_all(desktop, schedule, opened, open_window=None):
+    started = time.monotonic()
+    for at, title in schedule:
+        delay = started + at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        opened[title] = time.monotonic()
+        if open_window is not None:
+            open_window(title)
+        else:
+            desktop.open(title)
+
+
+def run_pollers(schedule, background, interval):
+    desktop = FakeDesktop(background)
+    opened, handled = {}, {}
+
+    def _poll(title):
+        # pywinauto の wait("visible") と同じく、一致するまで一覧を取り直す
+        while True:
+            if any(w.title == title and w.class_name == "#32770" for w in desktop.enumerate()):
+                handled[title] = time.monotonic()
+                return
+            time.sleep(interval)
+
+    threads = [threading.Thread(target=_poll, args=(title,), daemon=True)
+               for _, title in schedule]
+    cpu0 = time.process_time()
+    for t in threads:
+        t.start()
+    _open_all(desktop, schedule, opened)
+    for t in threads:
+        t.join()
+    return opened, handled, time.process_time() - cpu0, desktop.enumerations
+
+
+def run_watcher(schedule, background, interval, event_driven):
+    desktop = FakeDesktop(background)
+    opened, handled = {}, {}
+    if event_driven:
+        source = dialog_watcher.FakeWindowEventSource()
+    else:
+        source = dialog_watcher.PollingEventSource(interval, enumerate_windows=desktop.enumerate)
+    watcher = dialog_watcher.DialogWatcher(source)
+
+    def _action(info):
+        handled[info.title] = time.monotonic()
+
+    expectations = []
+    for _, title in schedule:
+        rule = dialog_watcher.DialogRule(title, title=title, class_name="#32770",
+                                         action=_action)
+        watcher.add_rule(rule)
+    cpu0 = time.process_time()
+    watcher.start()
+    for _, title in schedule:
+        expectations.append(watcher.expect(title))
+    open_window = source.open if event_driven else None
+    _open_all(desktop, schedule, opened, open_window)
+    for e in expectations:
+        e.wait(10)
+    cpu = time.process_time() - cpu0
+    watcher.stop()
+    return opened, handled, cpu, desktop.enumerations
+
+
+def _summary(name, opened, handled, cpu, enumerations, wall):
+    latencies = sorted(handled[t] - opened[t] for t in opened)
+    return {
+        "mode": name,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "max": latencies[-1] * 1000,
+        },
+        "cpu_sec": cpu,
+        "cpu_pct": cpu / wall * 100,
+        "enumerations": enumerations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダイアログ監視方式の比較")
+    parser.add_argument("--dialogs", type=int, default=20, help="表示するダイアログ数")
+    parser.add_argument("--duration", type=float, default=3.0,
+                        help="ダイアログが表示される期間 (秒)")
+    parser.add_argument("--background", type=int, default=200, help="背景ウィンドウ数")
+    parser.add_argument("--interval", type=float, default=0.09,
+                        help="ポーリング間隔 (pywinauto の既定 retry 間隔と同じ 0.09 秒)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    schedule = _schedule(args.dialogs, args.duration, args.seed)
+    results = []
+    for name, run in (
+            ("pollers", lambda: run_pollers(schedule, args.background, args.interval)),
+            ("watcher-poll", lambda: run_watcher(schedule, args.background, args.interval,
+                                                 event_driven=False)),
+            ("watcher-event", lambda: run_watcher(schedule, args.background, args.interval,
+                                                  event_driven=True))):
+        started = time.monotonic()
+        opened, handled, cpu, enumerations = run()
+        results.append(_summary(name, opened, handled, cpu, enumerations,
+                                time.monotonic() - started))
+    print(json.dumps({"dialogs": args.dialogs, "background": args.background,
+                      "interval": args.interval, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+ダウンロード完了検知 (download_check.wait_for_download_complete) の遅い回線での比較
+
+app.py の障害注入 (PUT /faults) で回線状態を切り替えながら、ブラウザと同じく
+<保存先>.partial に書き込んで完了時にリネームする疑似ダウンローダーと
+wait_for_download_complete を同時に動かし、次を測る。
+
+- detect_ms : ダウンロード完了 (リネーム) から検知までの遅延
+- premature : ダウンロード完了前に「完了」と判定した回数 (誤検知)
+- timeout   : 完了を検知できずにタイムアウトした回数 (切断時はこれが正しい結果)
+
+--write-mode direct では .partial を使わず保存先に直接書き込む
+(.partial が無いと書き込み開始直後に完了と判定される = premature になることを確認できる)。
+
+前提条件:
+- app.py が単一プロセスで起動していること (PUT /faults はそのプロセスにだけ反映される)
+
+使い方:
+    python tools/bench_download_wait.py --base-url http://localhost:5000 --rows 20000 --runs 3
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "automation"))
+
+import download_check  # noqa: E402
+from parallel_runner import percentile  # noqa: E402
+
+ROUTE = "/download/csv/generated"
+READ_SIZE = 64 * 1024
+
+
+def default_profiles(size, stable_sec):
+    """回線状態の一覧 (名前, 注入ルール)。size は配信するCSVのバイト数"""
+    route = {"route": ROUTE}
+    return [
+        ("fast", None),
+        ("512KB/s", dict(route, rate="512KB")),
+        ("first-byte 3s", dict(route, first_byte_delay=3)),
+        (f"stall {stable_sec + 2:g}s", dict(route, rate="1MB", stall_after=size // 2,
+                                            stall_sec=stable_sec + 2)),
+        ("drop", dict(route, rate="1MB", drop_after=size // 2)),
+    ]
+
+
+def _call(base_url, method, path, payload=None):
+    parts = urllib.parse.urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f"{method} {path} に失敗しました: status={resp.status} {data!r}")
+        return json.loads(data) if data else None
+    finally:
+        conn.close()
+
+
+def _download(base_url, path, save_file_path, write_mode, outcome):
+    """ブラウザと同じように保存する。完了時刻 (リネーム直後) を outcome["done_at"] に入れる"""
+    parts = urllib.parse.urlsplit(base_url)
+    target = f"{save_file_path}.partial" if write_mode == "partial" else save_file_path
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    try:
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        expected = int(resp.getheader("Content-Length") or -1)
+        received = 0
+        with open(target, "wb") as f:
+            while True:
+                try:
+                    chunk = resp.read1(READ_SIZE)
+                except (http.client.IncompleteRead, ConnectionError):
+                    break
+                if not chunk:
+                    break
+                f.write(chunk)
+                f.flush()
+                received += len(chunk)
+        if received != expected:
+            # 切断された。ブラウザと同じく .partial を残したままにする
+            outcome["error"] = f"切断: {received}/{expected} bytes"
+            return
+        if write_mode == "partial":
+            os.replace(target, save_file_path)
+        outcome["done_at"] = time.time()
+    except Exception as e:
+        outcome["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        conn.close()
+
+
+def run_once(args, path, work_dir):
+    save_file_path = os.path.join(work_dir, "bench.csv")
+    for p in (save_file_path, f"{save_file_path}.partial"):
+        if os.path.exists(p):
+            os.remove(p)
+    outcome = {}
+    start_time = time.time()
+    t = threading.Thread(target=_download,
+                         args=(args.base_url, path, save_file_path, args.write_mode, outcome))
+    t.start()
+    try:
+        download_check.wait_for_download_complete(save_file_path, start_time,
+                                                  timeout=args.timeout,
+                                                  stable_sec=args.stable_sec)
+        detected_at = time.time()
+        result = "detected"
+    except TimeoutError:
+        detected_at = None
+        result = "timeout"
+    t.join()
+    if result == "detected" and "done_at" not in outcome:
+        result = "premature"
+    elif result == "detected" and detected_at < outcome["done_at"]:
+        result = "premature"
+    return {
+        "result": result,
+        "download_error": outcome.get("error"),
+        "download_sec": outcome["done_at"] - start_time if "done_at" in outcome else None,
+        "detect_ms": ((detected_at - outcome["done_at"]) * 1000
+                      if result == "detected" else None),
+    }
+
+
+def _summary(name, runs):
+    detect = sorted(r["detect_ms"] for r in runs if r["detect_ms"] is not None)
+    download = sorted(r["download_sec"] for r in runs if r["download_sec"] is not None)
+    return {
+        "profile": name,
+        "runs": len(runs),
+        "detected": sum(r["result"] == "detected" for r in runs),
+        "premature": sum(r["result"] == "premature" for r in runs),
+        "timeout": sum(r["result"] == "timeout" for r in runs),
+        "download_sec_p50": percentile(download, 50) if download else None,
+        "detect_ms_p50": percentile(detect, 50) if detect else None,
+        "detect_ms_p95": percentile(detect, 95) if detect else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="遅い回線でのダウンロード完了検知の比較")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--rows", type=int, default=20000, help="生成CSVの行数")
+    parser.add_argument("--runs", type=int, default=3, help="回線状態ごとの実行回数")
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--stable-sec", type=float, default=3)
+    parser.add_argument("--write-mode", choices=["partial", "direct"], default="partial")
+    parser.add_argument("--profiles", help="[[名前, ルール], ...] の JSON (省略時は既定の一覧)")
+    args = parser.parse_args()
+
+    path = f"{ROUTE}?{urllib.parse.urlencode({'rows': args.rows, 'seed': 0})}"
+    size = _call(args.base_url, "GET", f"/manifest{path[len('/download'):]}")["size"]
+    profiles = (json.loads(args.profiles) if args.profiles
+                else default_profiles(size, args.stable_sec))
+    work_dir = tempfile.mkdtemp(prefix="bench_download_wait_")
+    results = []
+    try:
+        for name, rule in profiles:
+            _call(args.base_url, "PUT", "/faults", {"rules": [rule] if rule else []})
+            runs = [run_once(args, path, work_dir) for _ in range(args.runs)]
+            results.append(_summary(name, runs))
+    finally:
+        _call(args.base_url, "DELETE", "/faults")
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps({"size": size, "write_mode": args.write_mode, "stable_sec": args.stable_sec,
+                      "timeout": args.timeout, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+リクエスト計測 (metrics.py) の1リクエストあたりのオーバーヘッド
+
+計測なしで app を読み込んだ後に RequestMetrics を組み込み、enabled を切り替えながら
+app.wsgi_app をプロセス内で直接呼んで各ルートを --requests 回処理する
+(ネットワークとサーバーの揺らぎを除き、Flask + 計測の処理時間だけを比べる)。
+ログインが必要なルートには事前に作ったセッションの Cookie を付け、POST /login には
+正しい資格情報を送る (2回目以降は照合済みキャッシュに当たる)。
+計測なし / ありを交互に --repeat 回ずつ回して最速の値を使い、
+ルートごとの µs/リクエストと差分 (オーバーヘッド) を出す。
+
+使い方:
+    python tools/bench_metrics.py --requests 20000 --repeat 5
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app 読み込み時には組み込まない (下で組み込んで enabled を切り替える)
+os.environ["IEMODE_DL_METRICS"] = "0"
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+import auth  # noqa: E402
+import metrics  # noqa: E402
+from app import app, authenticator  # noqa: E402
+
+LOGIN_FORM = {"userid": "testuser", "password": "testpass"}
+# (ルート名, メソッド, パス, フォーム)
+ROUTES = [
+    ("login_page", "GET", "/login", None),
+    ("login_submit", "POST", "/login", LOGIN_FORM),
+    ("download_page", "GET", "/download", None),
+    ("download_csv", "GET", "/download/csv", None),
+]
+
+
+def _start_response(status, headers, exc_info=None):
+    return None
+
+
+def _run(base_environ, data, requests):
+    """requests 回処理した µs/リクエスト"""
+    started = time.perf_counter()
+    for _ in range(requests):
+        environ = dict(base_environ)
+        environ["wsgi.input"] = io.BytesIO(data)
+        body = app.wsgi_app(environ, _start_response)
+        try:
+            for _ in body:
+                pass
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リクエスト計測のオーバーヘッド")
+    parser.add_argument("--requests", type=int, default=20000, help="1回の計測でのリクエスト数")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    request_metrics = metrics.RequestMetrics().install(app)
+    session_id = authenticator.sessions.create(LOGIN_FORM["userid"])
+    results = []
+    for name, method, path, form in ROUTES:
+        builder = EnvironBuilder(path=path, method=method, data=form,
+                                 headers={"Cookie": f"{auth.SESSION_COOKIE}={session_id}"})
+        base_environ = builder.get_environ()
+        data = base_environ["wsgi.input"].read()
+        off, on = [], []
+        for _ in range(args.repeat):
+            request_metrics.enabled = False
+            off.append(_run(base_environ, data, args.requests))
+            request_metrics.enabled = True
+            on.append(_run(base_environ, data, args.requests))
+        off_us, on_us = min(off), min(on)
+        results.append({"route": name, "off_us": round(off_us, 1), "on_us": round(on_us, 1),
+                        "overhead_us": round(on_us - off_us, 1),
+                        "overhead_pct": round((on_us - off_us) / off_us * 100, 1)})
+    print(json.dumps({"requests": args.requests, "repeat": args.repeat,
+                      "recorded": request_metrics.snapshot()[ROUTES[0][0]]["count"],
+                      "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
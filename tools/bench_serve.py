@@ -0,0 +1,96 @@
+"""
+serve.py の本番モードと開発サーバーのスループット比較
+
+各サーバーを子プロセスで起動し、同じ設定の loadgen を流して結果を並べる。
+
+使い方:
+    python tools/bench_serve.py --users 50 --duration 10
+    python tools/bench_serve.py --backends werkzeug waitress --csv-path "/download/csv/generated?rows=100000"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import loadgen  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(port, timeout=20):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"サーバーが {timeout} 秒以内に起動しませんでした (port={port})")
+
+
+def bench_backend(backend, args):
+    port = _free_port()
+    cmd = [sys.executable, os.path.join(ROOT, "serve.py"), "--backend", backend,
+           "--bind", f"127.0.0.1:{port}", "--threads", str(args.threads)]
+    if backend == "gunicorn":
+        cmd += ["--workers", str(args.workers)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_port(port)
+        load_args = argparse.Namespace(
+            base_url=f"http://127.0.0.1:{port}", users=args.users, ramp_up=0.0,
+            duration=args.duration, iterations=0, think_time=0.0, timeout=30.0,
+            csv_path=args.csv_path,
+        )
+        return asyncio.run(loadgen.run(load_args)).report()
+    finally:
+        # SIGTERM で graceful shutdown させる (Windows では TerminateProcess になる)
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=35)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    default_backends = ["werkzeug", "waitress" if sys.platform == "win32" else "gunicorn"]
+    parser = argparse.ArgumentParser(description="serve.py と開発サーバーの比較ベンチマーク")
+    parser.add_argument("--backends", nargs="+", default=default_backends)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--csv-path", default="/download/csv")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        report = bench_backend(backend, args)
+        results[backend] = report
+        csv = report["routes"].get("GET /download/csv", {})
+        print(f"{backend:10s} {report['throughput_rps']:9.1f} req/s  "
+              f"{report['bytes_per_sec'] / 1e6:8.2f} MB/s  "
+              f"csv p95={csv.get('latency_ms', {}).get('p95') or 0:.1f} ms  "
+              f"errors={sum(r['errors'] for r in report['routes'].values())}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
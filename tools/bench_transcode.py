@@ -0,0 +1,99 @@
+"""
+CSV 配信の文字コード変換 (csv_transcode) のスループット比較
+
+生成CSV (csv_export.generate_csv) を encoding ごとに次の2通りで読み切り、MB/s を並べる。
+
+- inproc : 生成 → 変換をプロセス内で回す (変換そのものの速さ。HTTP を含まない)
+- http   : 起動中の app.py から /download/csv/generated?encoding=... を受信する (--base-url 指定時)
+
+MB/s は送信したバイト数 (変換後) で計算する。utf-8 は変換なしの素通しで、比較の基準になる。
+
+使い方:
+    python tools/bench_transcode.py --rows 500000 --runs 3
+    python tools/bench_transcode.py --rows 500000 --base-url http://localhost:5000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_export  # noqa: E402
+import csv_transcode  # noqa: E402
+
+READ_SIZE = 256 * 1024
+MB = 1024 * 1024
+
+
+def run_inproc(rows, encoding, errors, buffer_size):
+    started = time.perf_counter()
+    size = 0
+    for chunk in csv_transcode.transcode(csv_export.generate_csv(rows, 0), encoding, errors,
+                                         buffer_size):
+        size += len(chunk)
+    return size, time.perf_counter() - started
+
+
+def run_http(base_url, rows, encoding, errors):
+    parts = urllib.parse.urlsplit(base_url)
+    query = urllib.parse.urlencode({"rows": rows, "seed": 0, "encoding": encoding,
+                                    "errors": errors})
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+    try:
+        started = time.perf_counter()
+        conn.request("GET", f"/download/csv/generated?{query}")
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise RuntimeError(f"status={resp.status}")
+        size = 0
+        while True:
+            chunk = resp.read(READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+        return size, time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def _best(samples):
+    """runs 回のうち最速の (バイト数, 秒, MB/s)"""
+    size, sec = min(samples, key=lambda s: s[1])
+    return {"bytes": size, "sec": round(sec, 4), "mb_per_sec": round(size / MB / sec, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV 文字コード変換のスループット比較")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--encodings", nargs="+", default=list(csv_transcode.ENCODINGS),
+                        choices=csv_transcode.ENCODINGS)
+    parser.add_argument("--errors", default=csv_transcode.DEFAULT_ERRORS,
+                        choices=csv_transcode.ERROR_POLICIES)
+    parser.add_argument("--buffer-size", type=int, default=csv_transcode.DEFAULT_BUFFER_SIZE,
+                        help="inproc の変換バッファ (http はサーバー側の設定に従う)")
+    parser.add_argument("--base-url", help="指定すると起動中のサーバーからの受信も測る")
+    args = parser.parse_args()
+
+    results = []
+    for encoding in args.encodings:
+        row = {"encoding": encoding,
+               "transcoded": csv_transcode.encoded_length(encoding, 0) is None}
+        row["inproc"] = _best([run_inproc(args.rows, encoding, args.errors, args.buffer_size)
+                               for _ in range(args.runs)])
+        if args.base_url:
+            row["http"] = _best([run_http(args.base_url, args.rows, encoding, args.errors)
+                                 for _ in range(args.runs)])
+        results.append(row)
+    print(json.dumps({"rows": args.rows, "errors": args.errors,
+                      "buffer_size": args.buffer_size, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Flask スタンドイン (app.py) 向けの asyncio 負荷生成ツール
+
+仮想ユーザー (VU) ごとに keep-alive 接続を1本持ち、次のシナリオを繰り返す。
+
+    GET /login → POST /login (→ リダイレクト先 GET /download) → GET /download/csv
+
+同時実行数・ランプアップ・思考時間 (think time) を指定でき、ルートごとの
+スループット・レイテンシ (p50/p95/p99)・転送量 (bytes/s) を JSON で出力する。
+外部ライブラリは使わない。
+
+使い方:
+    python tools/loadgen.py --base-url http://localhost:5000 --users 200 --ramp-up 10 \\
+        --duration 60 --think-time 0.5 --output result.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+
+USER_ID = "testuser"
+PASSWORD = "testpass"
+READ_SIZE = 256 * 1024
+
+
+class HttpError(Exception):
+    pass
+
+
+class AsyncHttpConnection:
+    """HTTP/1.1 keep-alive の最小クライアント (1接続・逐次リクエスト)"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = {}
+        self._reader = None
+        self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        """(status, ヘッダー dict, 本文バイト数) を返す。本文は読み捨てる"""
+        return await asyncio.wait_for(self._request(method, path, body, headers or {}),
+                                      self.timeout)
+
+    async def _request(self, method, path, body, headers):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 "Connection: keep-alive", f"Content-Length: {len(body)}"]
+        if self.cookies:
+            lines.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            await self.close()
+            raise HttpError("サーバーが接続を閉じました")
+        status = int(status_line.split()[1])
+        resp_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            value = value.strip()
+            if name == "set-cookie":
+                cookie_name, _, rest = value.partition("=")
+                self.cookies[cookie_name.strip()] = rest.split(";", 1)[0]
+            resp_headers[name] = value
+
+        received = await self._read_body(method, status, resp_headers)
+        if resp_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, resp_headers, received
+
+    async def _read_body(self, method, status, headers):
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return 0
+        received = 0
+        if "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining:
+                chunk = await self._reader.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    raise HttpError("本文の途中で切断されました")
+                remaining -= len(chunk)
+                received += len(chunk)
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                await self._reader.readexactly(size + 2)
+                received += size
+        else:
+            while True:
+                chunk = await self._reader.read(READ_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+            await self.close()
+        return received
+
+
+class Stats:
+    """ルートごとのレイテンシ・件数・転送量の集計"""
+
+    def __init__(self):
+        self.routes = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, route, latency, status, received, error=None):
+        r = self.routes.setdefault(route, {"latencies": [], "errors": 0, "bytes": 0,
+                                           "status": {}})
+        r["latencies"].append(latency)
+        r["bytes"] += received
+        key = str(status) if error is None else type(error).__name__
+        r["status"][key] = r["status"].get(key, 0) + 1
+        if error is not None or status >= 400:
+            r["errors"] += 1
+
+    def report(self):
+        duration = (self.finished or time.perf_counter()) - self.started
+        routes = {}
+        total_requests = 0
+        total_bytes = 0
+        for route, r in sorted(self.routes.items()):
+            lat = sorted(r["latencies"])
+            total_requests += len(lat)
+            total_bytes += r["bytes"]
+            routes[route] = {
+                "requests": len(lat),
+                "errors": r["errors"],
+                "status": r["status"],
+                "throughput_rps": len(lat) / duration if duration else 0.0,
+                "bytes": r["bytes"],
+                "bytes_per_sec": r["bytes"] / duration if duration else 0.0,
+                "latency_ms": {
+                    "mean": sum(lat) / len(lat) * 1000 if lat else None,
+                    "p50": percentile(lat, 50) * 1000 if lat else None,
+                    "p95": percentile(lat, 95) * 1000 if lat else None,
+                    "p99": percentile(lat, 99) * 1000 if lat else None,
+                    "max": lat[-1] * 1000 if lat else None,
+                },
+            }
+        return {
+            "duration_sec": duration,
+            "requests": total_requests,
+            "throughput_rps": total_requests / duration if duration else 0.0,
+            "bytes": total_bytes,
+            "bytes_per_sec": total_bytes / duration if duration else 0.0,
+            "routes": routes,
+        }
+
+
+def percentile(sorted_values, pct):
+    """最近傍順位法によるパーセンタイル (sorted_values は昇順ソート済み)"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+async def _timed(stats, conn, route, method, path, body=b"", headers=None):
+    t0 = time.perf_counter()
+    try:
+        status, resp_headers, received = await conn.request(method, path, body, headers)
+    except (OSError, asyncio.TimeoutError, HttpError, ValueError) as e:
+        stats.record(route, time.perf_counter() - t0, 0, 0, error=e)
+        await conn.close()
+        return None, {}
+    stats.record(route, time.perf_counter() - t0, status, received)
+    return status, resp_headers
+
+
+async def virtual_user(index, args, stats, deadline):
+    parts = urllib.parse.urlsplit(args.base_url)
+    conn = AsyncHttpConnection(parts.hostname, parts.port or 80, args.timeout)
+    form = urllib.parse.urlencode({"userid": USER_ID, "password": PASSWORD}).encode("ascii")
+    rng = random.Random(index)
+    iterations = 0
+
+    async def think():
+        if args.think_time:
+            # ±50% のばらつきを付けて VU 間の同期を避ける
+            await asyncio.sleep(args.think_time * rng.uniform(0.5, 1.5))
+
+    try:
+        while time.perf_counter() < deadline:
+            if args.iterations and iterations >= args.iterations:
+                break
+            conn.cookies.clear()
+            await _timed(stats, conn, "GET /login", "GET", "/login")
+            await think()
+            status, headers = await _timed(
+                stats, conn, "POST /login", "POST", "/login", form,
+                {"Content-Type": "application/x-www-form-urlencoded"})
+            if status in (302, 303):
+                location = urllib.parse.urlsplit(headers.get("location", "/download")).path
+                await _timed(stats, conn, f"GET {location}", "GET", location)
+            await think()
+            await _timed(stats, conn, "GET /download/csv", "GET", args.csv_path)
+            await think()
+            iterations += 1
+    finally:
+        await conn.close()
+
+
+async def run(args):
+    stats = Stats()
+    stats.started = time.perf_counter()
+    deadline = stats.started + args.ramp_up + args.duration
+    tasks = []
+    for i in range(args.users):
+        if args.ramp_up and args.users > 1:
+            delay = args.ramp_up * i / (args.users - 1)
+            await asyncio.sleep(max(0.0, stats.started + delay - time.perf_counter()))
+        tasks.append(asyncio.create_task(virtual_user(i, args, stats, deadline)))
+    await asyncio.gather(*tasks)
+    stats.finished = time.perf_counter()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py 向け asyncio 負荷生成ツール")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=10, help="同時仮想ユーザー数")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="全 VU 起動までの秒数")
+    parser.add_argument("--duration", type=float, default=30.0, help="ランプアップ後の実行秒数")
+    parser.add_argument("--iterations", type=int, default=0,
+                        help="VU あたりのシナリオ回数 (0 = duration まで繰り返す)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="ステップ間の平均待ち秒数")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1リクエストのタイムアウト秒数")
+    parser.add_argument("--csv-path", default="/download/csv",
+                        help="ダウンロード対象 (例: /download/csv/generated?rows=100000)")
+    parser.add_argument("--output", help="結果 JSON の出力先 (省略時は標準出力のみ)")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run(args))
+    report = stats.report()
+    report["config"] = {k: v for k, v in vars(args).items() if k != "output"}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+中断・再開ダウンロードの検証クライアント
+
+1. 転送途中 (--cut-at バイト) で接続を切断する
+2. Range: bytes=<受信済みバイト数>- と If-Range: <ETag> で続きを要求する
+3. 連結結果を中断なしの全体ダウンロードとバイト単位で比較する
+
+--base-url を省略した場合は app.py をこのプロセス内でローカル起動して検証する。
+
+使い方:
+    python tools/resume_client.py --path "/download/csv/generated?rows=200000&seed=1"
+    python tools/resume_client.py --base-url http://localhost:5000 --path /download/csv --cut-at 50
+"""
+
+import argparse
+import hashlib
+import http.client
+import os
+import sys
+import threading
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+READ_SIZE = 64 * 1024
+# /download/csv などログインが必要なルート用 (自動実行スクリプトと同じ資格情報)
+USER_ID = "testuser"
+PASSWORD = "testpass"
+
+
+def _connect(base_url):
+    parts = urllib.parse.urlsplit(base_url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+
+
+def login(base_url):
+    """POST /login してセッション Cookie を Cookie ヘッダーの値で返す (発行されなければ None)"""
+    conn = _connect(base_url)
+    try:
+        form = urllib.parse.urlencode({"userid": USER_ID, "password": PASSWORD})
+        conn.request("POST", "/login", body=form,
+                     headers={"Content-Type": "application/x-www-form-urlencoded"})
+        resp = conn.getresponse()
+        resp.read()
+        cookies = [value.split(";", 1)[0] for name, value in resp.getheaders()
+                   if name.lower() == "set-cookie"]
+        return "; ".join(cookies) or None
+    finally:
+        conn.close()
+
+
+def fetch(base_url, path, headers=None, limit=None):
+    """path を取得する。limit を指定した場合はそのバイト数で接続を切断する"""
+    conn = _connect(base_url)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        resp = conn.getresponse()
+        chunks = []
+        received = 0
+        while limit is None or received < limit:
+            size = READ_SIZE if limit is None else min(READ_SIZE, limit - received)
+            data = resp.read(size)
+            if not data:
+                break
+            chunks.append(data)
+            received += len(data)
+        return resp.status, dict(resp.getheaders()), b"".join(chunks)
+    finally:
+        # limit 指定時は残りを読まずにソケットを閉じる (= 転送中の切断)
+        conn.close()
+
+
+def run(base_url, path, cut_at):
+    cookie = login(base_url)
+    base_headers = {"Cookie": cookie} if cookie else {}
+    status, headers, full = fetch(base_url, path, headers=base_headers)
+    if status != 200:
+        raise RuntimeError(f"全体ダウンロードに失敗: status={status}")
+    if headers.get("Accept-Ranges") != "bytes":
+        raise RuntimeError("Accept-Ranges: bytes が返されていません")
+    etag = headers.get("ETag")
+    if cut_at is None:
+        cut_at = len(full) // 2
+    print(f"[OK] 全体: {len(full)} bytes, ETag={etag}")
+
+    _, _, partial = fetch(base_url, path, headers=base_headers, limit=cut_at)
+    print(f"[OK] {len(partial)} bytes 受信後に切断")
+
+    resume_headers = dict(base_headers, Range=f"bytes={len(partial)}-")
+    if etag:
+        resume_headers["If-Range"] = etag
+    status, headers, rest = fetch(base_url, path, headers=resume_headers)
+    if status == 206:
+        print(f"[OK] 206 {headers.get('Content-Range')} ({len(rest)} bytes)")
+        resumed = partial + rest
+    elif status == 200:
+        print("[WARN] 200 が返されたため先頭から再取得")
+        resumed = rest
+    else:
+        raise RuntimeError(f"再開ダウンロードに失敗: status={status}")
+
+    expected = hashlib.sha256(full).hexdigest()
+    actual = hashlib.sha256(resumed).hexdigest()
+    if resumed != full:
+        mismatch = next((i for i, (a, b) in enumerate(zip(resumed, full)) if a != b),
+                        min(len(resumed), len(full)))
+        raise RuntimeError(
+            f"再開結果が一致しません: offset={mismatch}, "
+            f"size={len(resumed)}/{len(full)}, sha256={actual} != {expected}"
+        )
+    print(f"[OK] 再開結果がバイト単位で一致: sha256={actual}")
+
+
+def _start_local_server():
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", help="省略時は app.py をローカル起動する")
+    parser.add_argument("--path", default="/download/csv/generated?rows=100000&seed=1")
+    parser.add_argument("--cut-at", type=int, help="切断するバイト位置 (既定: 全体の半分)")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = _start_local_server()
+    try:
+        run(base_url, args.path, args.cut_at)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
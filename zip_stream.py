@@ -0,0 +1,91 @@
+"""
+複数のCSVを1つの ZIP にまとめてストリーミング配信する
+
+アーカイブ全体をメモリや一時ファイルに作らず、各エントリーの本文を読みながら圧縮して
+書けた分からすぐに返す。書き込み先をシークできないストリームとして zipfile に渡すので、
+各エントリーのサイズと CRC はローカルヘッダーではなく本文の後ろのデータディスクリプターに書かれる
+(展開ツール・zipfile はいずれもこの形式を読める)。
+
+エントリーごとに store (無圧縮) / deflate を選べる。サイズの見込み (size) が 4GiB に近い
+エントリーは ZIP64 で書く。
+"""
+
+import zipfile
+
+COMPRESSIONS = {"store": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED}
+DEFAULT_COMPRESSION = "deflate"
+# 生成データなど更新時刻の無いエントリーに使う時刻 (出力を決定的にするため固定)
+DEFAULT_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class BundleEntry:
+    """
+    ZIP の1エントリー
+
+    chunks() は本文のバイト列のイテラブルを返す関数 (エントリーを書くときに初めて呼ぶ)。
+    size は本文のバイト数の見込み (ZIP64 にするかの判断に使う。不明なら None)。
+    """
+
+    def __init__(self, name, chunks, compression=DEFAULT_COMPRESSION, size=None,
+                 date_time=DEFAULT_DATE_TIME):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"未対応の圧縮方式です: {compression}")
+        self.name = name
+        self.chunks = chunks
+        self.compression = compression
+        self.size = size
+        self.date_time = date_time
+
+    def zip_info(self):
+        info = zipfile.ZipInfo(self.name, date_time=self.date_time)
+        info.compress_type = COMPRESSIONS[self.compression]
+        info.external_attr = 0o644 << 16
+        # zipfile は書き込み開始時の file_size から ZIP64 にするかを決める
+        info.file_size = self.size or 0
+        return info
+
+
+class _StreamSink:
+    """zipfile の書き込み先。書かれたバイト列をためておき、take() で取り出す (シーク不可)"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries):
+    """entries (BundleEntry のリスト) を ZIP にしてバイト列で返すジェネレーター"""
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for entry in entries:
+            # サイズ不明のエントリーは 4GiB を超えても書けるよう ZIP64 にしておく
+            with zf.open(entry.zip_info(), "w", force_zip64=entry.size is None) as dest:
+                chunks = entry.chunks()
+                try:
+                    for chunk in chunks:
+                        dest.write(chunk)
+                        data = sink.take()
+                        if data:
+                            yield data
+                finally:
+                    close = getattr(chunks, "close", None)
+                    if close is not None:
+                        close()
+            data = sink.take()
+            if data:
+                yield data
+    # 最後にセントラルディレクトリ
+    data = sink.take()
+    if data:
+        yield data